@@ -2,14 +2,17 @@ import React, { useEffect, useState } from 'react';
 import { LineChart, Line, XAxis, YAxis, CartesianGrid, Tooltip, ResponsiveContainer, ReferenceLine } from 'recharts';
 import axios from 'axios';
 
-export default function SignalChart({ signalId, baseline }) {
+export default function SignalChart({ signalId, districtId, baseline }) {
     const [data, setData] = useState([]);
     const [loading, setLoading] = useState(true);
 
     useEffect(() => {
         const fetchData = async () => {
             try {
-                const res = await axios.get(`http://localhost:8000/signals/${signalId}/history`);
+                // Signal IDs are per district shard
+                const res = await axios.get(`http://localhost:8000/signals/${signalId}/history`, {
+                    params: { district_id: districtId }
+                });
                 // Format date for chart
                 const formatted = res.data.map(d => ({
                     ...d,
@@ -23,7 +26,7 @@ export default function SignalChart({ signalId, baseline }) {
             }
         };
         fetchData();
-    }, [signalId]);
+    }, [signalId, districtId]);
 
     if (loading) return <div className="h-48 flex items-center justify-center text-xs text-slate-400">Loading trend...</div>;
 
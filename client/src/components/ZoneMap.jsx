@@ -1,5 +1,6 @@
-import React from 'react';
-import { MapContainer, TileLayer, CircleMarker, Circle, Popup, Tooltip } from 'react-leaflet';
+import React, { useState, useEffect, useCallback } from 'react';
+import axios from 'axios';
+import { MapContainer, TileLayer, CircleMarker, Circle, Polygon, Popup, Tooltip, useMapEvents } from 'react-leaflet';
 import 'leaflet/dist/leaflet.css';
 
 // Hardcoded Hospital Locations (Demo)
@@ -38,7 +39,37 @@ const getColorForDisease = (disease) => {
     return `hsl(${h}, 70%, 50%)`;
 };
 
+const RISK_COLORS = { High: '#ef4444', Medium: '#f59e0b', Low: '#10b981' };
+
+// Fetches the outlines of the zones in view (simplified for the zoom) whenever the map settles
+function ViewportZones({ onLoad }) {
+    const load = useCallback(async (map) => {
+        const b = map.getBounds();
+        const bbox = [b.getWest(), b.getSouth(), b.getEast(), b.getNorth()].map(v => v.toFixed(5)).join(',');
+        try {
+            const res = await axios.get('http://localhost:8000/zones/geometry', { params: { bbox, zoom: map.getZoom() } });
+            onLoad(res.data.zones);
+        } catch (e) {
+            console.error("Failed to load zone outlines", e);
+        }
+    }, [onLoad]);
+
+    const map = useMapEvents({ moveend: () => load(map) });
+    useEffect(() => { load(map); }, [load, map]);
+    return null;
+}
+
+// GeoJSON is [lng, lat]; Leaflet wants [lat, lng]
+const toLatLngs = (geometry) => geometry.coordinates.map(polygon => polygon.map(ring => ring.map(([lng, lat]) => [lat, lng])));
+
 export default function ZoneMap({ signals, forecasts, onSelectZone }) {
+    const [outlines, setOutlines] = useState({}); // { zone_id: zone } for the current viewport only
+    const [centroids, setCentroids] = useState({}); // { zone_id: zone } kept across pans, so markers don't jump
+    const handleOutlines = useCallback((zones) => {
+        const byId = Object.fromEntries(zones.map(z => [z.id, z]));
+        setOutlines(byId);
+        setCentroids(prev => ({ ...prev, ...byId }));
+    }, []);
 
     return (
         <div className="h-[600px] w-full rounded-xl overflow-hidden bg-slate-100 relative shadow-inner">
@@ -54,6 +85,22 @@ export default function ZoneMap({ signals, forecasts, onSelectZone }) {
                     attribution='&copy; CARTO'
                 />
 
+                <ViewportZones onLoad={handleOutlines} />
+
+                {/* Zone outlines in view, shaded by the pipeline's latest risk */}
+                {Object.values(outlines).filter(z => z.geometry).map(z => (
+                    <Polygon
+                        key={`outline-${z.id}`}
+                        positions={toLatLngs(z.geometry)}
+                        pathOptions={{
+                            color: RISK_COLORS[z.risk_level] || '#64748b',
+                            weight: 1,
+                            fillOpacity: 0.05 + (z.intensity || 0) * 0.3
+                        }}
+                        eventHandlers={{ click: () => onSelectZone && onSelectZone(z.id, z.name) }}
+                    />
+                ))}
+
                 {/* Dynamic Markers based on Forecast Data (since IDs might have changed) */}
                 {Object.keys(forecasts).map((zoneId, idx) => {
                     const zId = parseInt(zoneId);
@@ -69,8 +116,11 @@ export default function ZoneMap({ signals, forecasts, onSelectZone }) {
                         { lat: 18.5100, lng: 73.9100, name: "East Zone" }
                     ];
 
-                    // Modulo to pick a location if we list more zones than locations
-                    const loc = LOCATIONS[idx % LOCATIONS.length];
+                    // Zones with an outline sit at its centroid; otherwise pick a demo location
+                    const outline = centroids[zId];
+                    const loc = outline
+                        ? { lat: outline.centroid[1], lng: outline.centroid[0], name: outline.name }
+                        : LOCATIONS[idx % LOCATIONS.length];
                     const activeSignals = signals.filter(s => s.zone_id === zId && s.status !== 'Resolved');
 
                     // Find Dominant Disease (Highest Intensity)
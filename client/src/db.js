@@ -6,9 +6,22 @@ db.version(1).stores({
     reports: '++id, date, syndrome, status' // status: 'pending' | 'synced'
 });
 
+// v2: every report carries a client-generated idempotency key for /sync
+db.version(2).stores({
+    reports: '++id, &key, date, syndrome, status'
+}).upgrade(tx => tx.table('reports').toCollection().modify(report => {
+    if (!report.key) report.key = newReportKey();
+}));
+
+export function newReportKey() {
+    if (crypto.randomUUID) return crypto.randomUUID();
+    return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
 export const saveReport = async (report) => {
     await db.reports.add({
         ...report,
+        key: newReportKey(),
         status: 'pending',
         timestamp: new Date().toISOString()
     });
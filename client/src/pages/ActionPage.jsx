@@ -26,6 +26,33 @@ export default function ActionPage() {
     const filteredSignals = signals.filter(s =>
         filter === 'Pending' ? s.status !== 'Resolved' : s.status === 'Resolved'
     );
+    const unacknowledged = filteredSignals.filter(s => s.status === 'Pending');
+
+    // One request per district instead of one per signal (signal IDs are per district)
+    const acknowledgeAll = async () => {
+        try {
+            const byDistrict = {};
+            unacknowledged.forEach(s => {
+                const district = s.zone?.district_id ?? 0;
+                (byDistrict[district] = byDistrict[district] || []).push(s);
+            });
+            const responses = await Promise.all(Object.entries(byDistrict).map(([district_id, list]) =>
+                axios.post('http://localhost:8000/signals/actions/bulk', {
+                    actions: list.map(s => ({
+                        signal_id: s.id,
+                        status: 'Investigating',
+                        notes: 'DHO acknowledged signal (bulk).'
+                    }))
+                }, { params: { district_id } })
+            ));
+            const results = responses.flatMap(res => res.data);
+            const failed = results.filter(r => !r.ok).length;
+            fetchSignals();
+            alert(failed ? `Acknowledged with ${failed} failure(s)` : `Acknowledged ${results.length} signals`);
+        } catch (err) {
+            alert("Error logging actions");
+        }
+    };
 
     return (
         <div className="min-h-screen bg-slate-50 flex flex-col">
@@ -41,6 +68,15 @@ export default function ActionPage() {
                     </div>
                 </div>
 
+                {filter === 'Pending' && unacknowledged.length > 1 && (
+                    <button
+                        onClick={acknowledgeAll}
+                        className="px-4 py-2 text-sm font-medium text-slate-600 hover:text-slate-900 hover:bg-slate-50 rounded-lg border border-slate-200 transition-colors"
+                    >
+                        Acknowledge All ({unacknowledged.length})
+                    </button>
+                )}
+
                 <div className="flex space-x-1 bg-slate-100 p-1 rounded-lg">
                     {['Pending', 'Resolved'].map(f => (
                         <button
@@ -93,7 +129,7 @@ function SignalCard({ signal, refresh }) {
             await axios.post(`http://localhost:8000/signals/${signal.id}/action`, {
                 status,
                 notes
-            });
+            }, { params: { district_id: signal.zone?.district_id ?? 0 } });
             // Optimistic update or refresh
             refresh();
             alert("Action Logged");
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from 'react';
-import { db } from '../db';
+import { db, newReportKey } from '../db';
 import { Wifi, WifiOff, Save, RefreshCw, Calendar, Check, AlertCircle, Activity } from 'lucide-react';
 import axios from 'axios';
 
@@ -87,6 +87,7 @@ export default function CollectPage({ onReportSubmitted }) {
                 const count = parseInt(countStr);
                 if (count && count > 0) {
                     records.push({
+                        key: newReportKey(),
                         date: selectedDate,
                         syndrome,
                         count,
@@ -133,35 +134,47 @@ export default function CollectPage({ onReportSubmitted }) {
         }
     };
 
+    // gzip the sync body where the browser supports it (2G links)
+    const encodeSyncBody = async (payload) => {
+        const json = JSON.stringify(payload);
+        if (typeof CompressionStream === 'undefined') {
+            return { body: json, headers: { 'Content-Type': 'application/json' } };
+        }
+        const stream = new Blob([json]).stream().pipeThrough(new CompressionStream('gzip'));
+        const body = await new Response(stream).arrayBuffer();
+        return { body, headers: { 'Content-Type': 'application/json', 'Content-Encoding': 'gzip' } };
+    };
+
     const syncData = async () => {
         try {
             const pending = await db.reports.where('status').equals('pending').toArray();
             if (pending.length === 0) return;
 
-            // Simple Batch Upload Logic
-            // In a real app, we'd use a bulk endpoint. Here we reuse the loop for compatibility.
-            let syncedIds = [];
-
-            // Group by "Request" to minimize calls? Or just loop. 
-            // Previous code looped. Let's stick to that for safety unless slow.
-            // Actually, let's try to be smart - if we have many, user wants speed.
-            // But main.py legacy_report takes one report. So loop is necessary unless we upgrade backend.
-
-            for (const report of pending) {
-                // Use the saved hospitalId, or default to 1 if missing (legacy records)
-                const targetId = report.hospitalId || 1;
-                await axios.post(`http://localhost:8000/facilities/${targetId}/report`, {
+            // One request for everything pending; the server deduplicates by key,
+            // so a sync interrupted mid-flight is simply sent again.
+            const { body, headers } = await encodeSyncBody({
+                cursor: Number(localStorage.getItem('syncCursor')) || null,
+                reports: pending.map(report => ({
+                    key: report.key,
+                    // Use the saved hospitalId, or default to 1 if missing (legacy records)
+                    hospital_id: report.hospitalId || 1,
                     date: report.date,
                     syndrome: report.syndrome,
                     count: report.count,
-                    age_group: report.ageGroup || "Adult",
-                    patient_zone: report.zone || "North-1"
-                });
-                syncedIds.push(report.id);
-            }
+                    age_group: report.ageGroup || "Adult"
+                }))
+            });
+            const res = await axios.post('http://localhost:8000/sync', body, { headers });
+
+            // Acks are one character per report: a = accepted, d = already had it, r = rejected
+            const { acks, cursor } = res.data;
+            const syncedIds = pending.filter((_, i) => acks[i] === 'a' || acks[i] === 'd').map(r => r.id);
+            const rejectedIds = pending.filter((_, i) => acks[i] === 'r').map(r => r.id);
 
             // Update Status
             await db.reports.where('id').anyOf(syncedIds).modify({ status: 'synced' });
+            await db.reports.where('id').anyOf(rejectedIds).modify({ status: 'rejected' });
+            if (cursor != null) localStorage.setItem('syncCursor', String(cursor));
 
             setLastSyncTime(new Date());
             await updatePendingCount();
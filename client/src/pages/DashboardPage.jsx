@@ -396,6 +396,7 @@ function SignalCard({ signal, forecast, refresh }) {
     const [breakdown, setBreakdown] = useState(null);
     const [showInsight, setShowInsight] = useState(false);
     const isHigh = signal.severity === 'High';
+    const signalParams = { district_id: signal.zone?.district_id ?? 0 }; // Signal IDs are per district shard
 
     // Calculate Time Left
     const deadline = new Date(signal.sla_deadline);
@@ -406,7 +407,7 @@ function SignalCard({ signal, forecast, refresh }) {
     // Fetch Breakdown on Expand
     useEffect(() => {
         if (expanded && !breakdown) {
-            axios.get(`http://localhost:8000/signals/${signal.id}/breakdown`)
+            axios.get(`http://localhost:8000/signals/${signal.id}/breakdown`, { params: signalParams })
                 .then(res => setBreakdown(res.data))
                 .catch(err => console.error(err));
         }
@@ -414,7 +415,7 @@ function SignalCard({ signal, forecast, refresh }) {
 
     const handleAction = async (status, notes) => {
         try {
-            await axios.post(`http://localhost:8000/signals/${signal.id}/action`, { status, notes });
+            await axios.post(`http://localhost:8000/signals/${signal.id}/action`, { status, notes }, { params: signalParams });
             refresh();
         } catch (err) { alert("Error logging action"); }
     };
@@ -541,7 +542,7 @@ function SignalCard({ signal, forecast, refresh }) {
                                         <h4 className="text-xs font-bold text-slate-400 uppercase tracking-wider mb-2 flex items-center">
                                             <BarChart2 size={14} className="mr-1" /> 14-Day Trend
                                         </h4>
-                                        <SignalChart signalId={signal.id} baseline={signal.baseline} />
+                                        <SignalChart signalId={signal.id} districtId={signal.zone?.district_id ?? 0} baseline={signal.baseline} />
                                     </div>
 
                                     {/* Take Action */}
@@ -8,6 +8,8 @@ export default function DiffusionPage({ onBack }) {
     const [zones, setZones] = useState([]);
     const [timelineData, setTimelineData] = useState({}); // { "YYYY-MM-DD": [ { zone_id, value, type } ] }
     const [dates, setDates] = useState([]);
+    const [forecastDays, setForecastDays] = useState(7);
+    const [simulation, setSimulation] = useState({}); // Server-side spread over the zone graph, by date
 
     // Playback State
     const [isPlaying, setIsPlaying] = useState(false);
@@ -20,22 +22,14 @@ export default function DiffusionPage({ onBack }) {
 
     const playInterval = useRef(null);
 
-    // 1. Data Fetching
+    // 1. Data Fetching (one request: server-side zone x day x syndrome cube)
     useEffect(() => {
         const fetchAll = async () => {
             try {
-                const zRes = await axios.get('http://localhost:8000/zones');
-                setZones(zRes.data);
-
-                // Fetch detail forecasts for ALL zones
-                const allRes = await Promise.all(
-                    zRes.data.map(async (z) => {
-                        const res = await axios.get(`http://localhost:8000/zones/${z.id}/forecast?days=7&include_history=true`);
-                        return { zone_id: z.id, data: res.data };
-                    })
-                );
-
-                processData(allRes);
+                const res = await axios.get('http://localhost:8000/analysis/timecube?horizon=7&compress=true');
+                setZones(res.data.zones.map((id, i) => ({ id, name: res.data.zone_names[i] })));
+
+                processData(res.data);
                 setLoading(false);
             } catch (e) {
                 console.error("Diffusion Load Failed", e);
@@ -45,49 +39,49 @@ export default function DiffusionPage({ onBack }) {
         fetchAll();
     }, []);
 
-    // 2. Data Processing (Pivot to Time-Series)
-    const processData = (zoneDataList) => {
-        const timeline = {};
-        const diseaseSet = new Set();
-
-        zoneDataList.forEach(({ zone_id, data }) => {
-            // data is Array of DiseaseForecast objects
-            data.forEach(diseaseForecast => {
-                diseaseSet.add(diseaseForecast.disease);
-                const disease = diseaseForecast.disease;
-
-                // Process History
-                diseaseForecast.history.forEach(pt => {
-                    // Safe date parsing
-                    const dateStr = pt.date ? pt.date.split('T')[0] : "UNKNOWN";
-                    if (!timeline[dateStr]) timeline[dateStr] = [];
-                    timeline[dateStr].push({
-                        zone_id,
-                        disease,
-                        value: pt.value,
-                        type: 'HISTORY'
-                    });
-                });
+    // Base64 (little-endian) matrix -> typed array
+    const decodeMatrix = (b64, TypedArray) => {
+        const bin = atob(b64);
+        const bytes = new Uint8Array(bin.length);
+        for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+        return new TypedArray(bytes.buffer);
+    };
 
-                // Process Forecast
-                diseaseForecast.forecast.forEach(pt => {
-                    const dateStr = pt.date ? pt.date.split('T')[0] : "UNKNOWN";
-                    if (!timeline[dateStr]) timeline[dateStr] = [];
+    // 2. Data Processing (Pivot cube to Time-Series)
+    const processData = (cube) => {
+        const timeline = {};
+        const counts = decodeMatrix(cube.counts, Int32Array);
+        const forecast = decodeMatrix(cube.forecast, Float32Array);
+        const nSyn = cube.syndromes.length;
+        const start = new Date(cube.start + 'T00:00:00Z');
+
+        const dateAt = (offset) => {
+            const d = new Date(start);
+            d.setUTCDate(d.getUTCDate() + offset);
+            return d.toISOString().split('T')[0];
+        };
 
-                    // Avoid dupes if history/forecast overlap on "Today"
-                    // Prefer Actuals (History) if available
-                    const existing = timeline[dateStr].find(e => e.zone_id === zone_id && e.disease === disease);
-                    if (!existing) {
+        // Layout is [zone][day][syndrome]
+        const addFrames = (matrix, nDays, dayOffset, type) => {
+            for (let t = 0; t < nDays; t++) {
+                const dateStr = dateAt(dayOffset + t);
+                if (!timeline[dateStr]) timeline[dateStr] = [];
+                cube.zones.forEach((zone_id, z) => {
+                    cube.syndromes.forEach((disease, s) => {
                         timeline[dateStr].push({
                             zone_id,
                             disease,
-                            value: pt.value,
-                            type: 'FORECAST'
+                            value: Math.round(matrix[(z * nDays + t) * nSyn + s] * 10) / 10,
+                            type
                         });
-                    }
+                    });
                 });
-            });
-        });
+            }
+        };
+
+        addFrames(counts, cube.history_days, 0, 'HISTORY');
+        addFrames(forecast, cube.forecast_days, cube.history_days, 'FORECAST');
+        setForecastDays(cube.forecast_days);
 
         // Sort Dates
         const sortedDates = Object.keys(timeline).sort();
@@ -95,7 +89,7 @@ export default function DiffusionPage({ onBack }) {
         setTimelineData(timeline);
         setDates(sortedDates);
 
-        const diseases = Array.from(diseaseSet).sort();
+        const diseases = [...cube.syndromes].sort();
         setAvailableDiseases(diseases);
 
         // Auto-select a valid disease if current selection is invalid
@@ -127,6 +121,36 @@ export default function DiffusionPage({ onBack }) {
         }
     }, [selectedDisease, dates, timelineData]);
 
+    // Future frames: simulated spread of the selected disease across neighbouring zones
+    useEffect(() => {
+        if (!selectedDisease || forecastDays === 0) return;
+        let cancelled = false;
+        axios.post('http://localhost:8000/analysis/diffusion', { syndrome: selectedDisease, days: forecastDays })
+            .then(res => {
+                if (cancelled) return;
+                const frames = decodeMatrix(res.data.scenarios[0].frames, Float32Array);
+                const nZones = res.data.zones.length;
+                const start = new Date(res.data.as_of + 'T00:00:00Z');
+                const byDate = {};
+                for (let d = 0; d < res.data.days; d++) {
+                    const day = new Date(start);
+                    day.setUTCDate(day.getUTCDate() + d + 1);
+                    byDate[day.toISOString().split('T')[0]] = res.data.zones.map((zone_id, z) => ({
+                        zone_id,
+                        disease: selectedDisease,
+                        value: Math.round(frames[d * nZones + z] * 10) / 10,
+                        type: 'FORECAST'
+                    }));
+                }
+                setSimulation(byDate);
+            })
+            .catch(e => {
+                console.error("Diffusion simulation failed", e);
+                if (!cancelled) setSimulation({});
+            });
+        return () => { cancelled = true; };
+    }, [selectedDisease, forecastDays]);
+
     // 3. Playback Logic
     useEffect(() => {
         if (isPlaying) {
@@ -149,11 +173,13 @@ export default function DiffusionPage({ onBack }) {
     const currentFrameData = useMemo(() => {
         if (dates.length === 0) return [];
         const dateKey = dates[currentIndex];
+        const simulated = (simulation[dateKey] || []).filter(p => p.disease === selectedDisease);
+        if (simulated.length > 0) return simulated;
         const rawPoints = timelineData[dateKey] || [];
 
         // Filter by selected disease
         return rawPoints.filter(p => p.disease === selectedDisease);
-    }, [currentIndex, dates, timelineData, selectedDisease]);
+    }, [currentIndex, dates, timelineData, selectedDisease, simulation]);
 
     const currentDate = dates[currentIndex];
     const isFuture = currentFrameData.some(p => p.type === 'FORECAST');
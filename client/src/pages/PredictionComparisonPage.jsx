@@ -8,6 +8,7 @@ export default function PredictionComparisonPage({ onBack }) {
     const [signals, setSignals] = useState([]);
     const [forecasts, setForecasts] = useState({});
     const [zones, setZones] = useState([]);
+    const [accuracy, setAccuracy] = useState([]);
 
     useEffect(() => {
         const fetchData = async () => {
@@ -36,6 +37,17 @@ export default function PredictionComparisonPage({ onBack }) {
                 }));
 
                 setForecasts(forecastMap);
+
+                // Model accuracy (scored by the server; backtest until live forecasts have been scored)
+                try {
+                    let accRes = await axios.get('http://localhost:8000/analysis/forecast-accuracy?source=live');
+                    if (accRes.data.by_syndrome.length === 0) {
+                        accRes = await axios.get('http://localhost:8000/analysis/forecast-accuracy?source=backtest');
+                    }
+                    setAccuracy(accRes.data.by_syndrome.filter(row => row.horizon === 7));
+                } catch (e) {
+                    console.error("Failed to load forecast accuracy", e);
+                }
                 setLoading(false);
             } catch (e) {
                 console.error("Comparison Data Load Failed", e);
@@ -115,6 +127,26 @@ export default function PredictionComparisonPage({ onBack }) {
                             <div className="w-3 h-3 rounded-full bg-indigo-500 opacity-20 border border-indigo-600"></div>
                             <span className="font-bold text-indigo-900">Projected Spread Area</span>
                         </div>
+                        {accuracy.length > 0 && (
+                            <table className="w-full mt-3 pt-3 border-t border-slate-200">
+                                <thead>
+                                    <tr className="text-slate-400 uppercase text-[10px]">
+                                        <th className="text-left font-bold">+7 Day Accuracy</th>
+                                        <th className="text-right font-bold">MAE</th>
+                                        <th className="text-right font-bold">In Range</th>
+                                    </tr>
+                                </thead>
+                                <tbody>
+                                    {accuracy.map(row => (
+                                        <tr key={row.syndrome}>
+                                            <td className="text-slate-700">{row.syndrome}</td>
+                                            <td className="text-right">{row.mae}</td>
+                                            <td className="text-right">{Math.round(row.coverage * 100)}%</td>
+                                        </tr>
+                                    ))}
+                                </tbody>
+                            </table>
+                        )}
                     </div>
                 </div>
 
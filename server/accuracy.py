@@ -0,0 +1,267 @@
+"""
+Forecast accuracy per (zone, syndrome, horizon).
+
+Two sources fill forecast_accuracy, one row of running sums per cell:
+
+- live: the pipeline's materialised forecasts (pipeline.py) are scored once
+  their day is over. score() reads the actual counts for every unscored
+  forecast day, stores the actual on the forecast row and adds the errors
+  to the cell, so each day is counted once however often it runs.
+- backtest: a rolling-origin replay over history. From every origin day it
+  fits the last FIT_DAYS + 1 days (as the pipeline does) and predicts the
+  next `horizon` days. All series are fitted together per origin with
+  forecasting.forecast_batch, which matches Forecaster exactly.
+
+Cells hold sums (n, absolute error, percentage error over days with visits,
+days inside the bounds), so cells merge by addition across runs and
+shards. metrics() turns them into MAE, MAPE and coverage.
+
+A full backtest takes minutes, so the admin endpoint runs it on a
+background thread (start_backtest) and reports progress from backtest_run.
+"""
+import argparse
+import logging
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models, database, migrations, forecasting, timeseries
+
+logger = logging.getLogger(__name__)
+
+# Params
+SOURCES = ("live", "backtest")
+SCORE_LAG_DAYS = 1  # A forecast day is scored once it is this many days in the past
+RETAIN_DAYS = 90  # Scored forecasts are kept this long after their fit
+FIT_DAYS = 30  # Matches pipeline.FIT_DAYS
+HORIZON = 7
+MAX_HORIZON = 30
+BACKTEST_DAYS = 365
+MAX_BACKTEST_DAYS = 3 * 365
+SUMS = ("n", "abs_error", "pct_error", "pct_n", "covered")
+
+
+# --- Accumulators ---
+
+def _add(cells: Dict[tuple, Dict], key: tuple, d: date, value: float, lower: float, upper: float, actual: int):
+    cell = cells.get(key)
+    if cell is None:
+        cell = cells[key] = {"n": 0, "abs_error": 0.0, "pct_error": 0.0, "pct_n": 0, "covered": 0, "last_date": d}
+    error = abs(value - actual)
+    cell["n"] += 1
+    cell["abs_error"] += error
+    if actual > 0:
+        cell["pct_error"] += error / actual
+        cell["pct_n"] += 1
+    if lower <= actual <= upper:
+        cell["covered"] += 1
+    cell["last_date"] = max(cell["last_date"], d)
+
+
+def _upsert(db: Session, cells: Dict[tuple, Dict]):
+    """Adds cells keyed (source, zone_id, syndrome, horizon) to the stored sums."""
+    rows = [{"source": src, "zone_id": z, "syndrome": s, "horizon": h, **cell}
+            for (src, z, s, h), cell in cells.items()]
+    table = models.ForecastAccuracy.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        set_ = {name: table.c[name] + stmt.excluded[name] for name in SUMS}
+        set_["last_date"] = func.max(table.c.last_date, stmt.excluded.last_date) if dialect == "sqlite" \
+            else func.greatest(table.c.last_date, stmt.excluded.last_date)
+        stmt = stmt.on_conflict_do_update(index_elements=["source", "zone_id", "syndrome", "horizon"], set_=set_)
+        db.execute(stmt, rows)
+        return
+
+    # Portable fallback
+    for row in rows:
+        existing = db.query(models.ForecastAccuracy).filter_by(
+            source=row["source"], zone_id=row["zone_id"], syndrome=row["syndrome"], horizon=row["horizon"]).first()
+        if existing:
+            for name in SUMS:
+                setattr(existing, name, getattr(existing, name) + row[name])
+            existing.last_date = max(existing.last_date, row["last_date"])
+        else:
+            db.add(models.ForecastAccuracy(**row))
+
+
+def _actuals(db: Session, start: date, end: date, zone_ids: Optional[List[int]] = None) -> Dict[tuple, int]:
+    return {(z, s, d): n for z, s, d, n in timeseries.zone_daily_counts(db, start, end, zone_ids)}
+
+
+# --- Live Scoring ---
+
+def score(db: Session, today: Optional[date] = None) -> Dict:
+    """Scores materialised forecasts whose day has passed; prunes old scored ones."""
+    today = today or date.today()
+    last_day = today - timedelta(days=SCORE_LAG_DAYS)
+    f = models.Forecast
+    pending = db.query(f.id, f.as_of, f.zone_id, f.syndrome, f.date, f.value, f.lower_bound, f.upper_bound)\
+        .filter(f.actual.is_(None), f.date <= last_day).all()
+
+    scored = 0
+    if pending:
+        actuals = _actuals(db, min(p.date for p in pending), last_day, sorted({p.zone_id for p in pending}))
+        cells: Dict[tuple, Dict] = {}
+        updates = []
+        for p in pending:
+            actual = actuals.get((p.zone_id, p.syndrome, p.date), 0)
+            _add(cells, ("live", p.zone_id, p.syndrome, (p.date - p.as_of).days),
+                 p.date, p.value, p.lower_bound, p.upper_bound, actual)
+            updates.append({"id": p.id, "actual": actual})
+        db.execute(update(models.Forecast), updates)
+        _upsert(db, cells)
+        scored = len(updates)
+
+    pruned = db.execute(delete(f).where(f.actual.isnot(None), f.as_of < today - timedelta(days=RETAIN_DAYS))).rowcount
+    db.commit()
+    return {"scored": scored, "pruned": pruned}
+
+
+# --- Backtest ---
+
+def backtest(db: Session, days: int = BACKTEST_DAYS, horizon: int = HORIZON, fit_days: int = FIT_DAYS,
+             end: Optional[date] = None) -> Dict:
+    """
+    Replaces the backtest cells with a rolling-origin evaluation of the last
+    `days` days (origins end - days .. end - 1, actuals through end).
+    """
+    if not 1 <= days <= MAX_BACKTEST_DAYS or not 1 <= horizon <= MAX_HORIZON or fit_days < 1:
+        raise ValueError(f"days must be 1-{MAX_BACKTEST_DAYS}, horizon 1-{MAX_HORIZON} and fit_days at least 1")
+    started = time.monotonic()
+    end = end or date.today() - timedelta(days=SCORE_LAG_DAYS)
+    first_origin = end - timedelta(days=days)
+    start = first_origin - timedelta(days=fit_days)
+    length = (end - start).days + 1
+
+    values: Dict[tuple, List[int]] = {}
+    for z, s, d, n in timeseries.zone_daily_counts(db, start, end):
+        if z is not None:
+            values.setdefault((z, s), [0] * length)[(d - start).days] = n
+    keys = sorted(values)
+    series = [values[k] for k in keys]
+
+    cells: Dict[tuple, Dict] = {}
+    scored = 0
+    for o in range(fit_days, length - 1):  # Index of the origin day (the last fitted day)
+        active = [j for j, v in enumerate(series) if any(v[o - fit_days:o + 1])]  # As the pipeline picks pairs
+        if not active:
+            continue
+        steps = min(horizon, length - 1 - o)
+        fits = forecasting.forecast_batch([series[j][o - fit_days:o + 1] for j in active], days=steps)
+        d = start + timedelta(days=o)
+        for j, fit in zip(active, fits):
+            z, s = keys[j]
+            for p in fit["predictions"]:
+                h = p["day"]
+                _add(cells, ("backtest", z, s, h), d + timedelta(days=h),
+                     p["value"], p["lower_bound"], p["upper_bound"], series[j][o + h])
+                scored += 1
+
+    db.execute(delete(models.ForecastAccuracy).where(models.ForecastAccuracy.source == "backtest"))
+    if cells:
+        _upsert(db, cells)
+    db.commit()
+    return {"origins": days, "series": len(keys), "forecasts_scored": scored,
+            "duration_s": round(time.monotonic() - started, 3)}
+
+
+# --- Background Runs ---
+
+_backtest_lock = threading.Lock()
+backtest_run = {"state": "idle", "days": None, "horizon": None, "started_at": None, "duration_s": None,
+                "result": None, "error": None}
+
+
+def start_backtest(fn: Callable[[], object], days: int, horizon: int) -> bool:
+    """Runs fn (a backtest) on a daemon thread; False if one is already running."""
+    if not _backtest_lock.acquire(blocking=False):
+        return False
+    backtest_run.update(state="running", days=days, horizon=horizon, duration_s=None, result=None, error=None,
+                        started_at=datetime.now().isoformat(timespec="seconds"))
+    threading.Thread(target=_run_backtest, args=(fn,), name="backtest", daemon=True).start()
+    return True
+
+
+def _run_backtest(fn: Callable[[], object]):
+    started = time.monotonic()
+    try:
+        result = fn()
+        backtest_run.update(state="done", result=result)
+    except Exception as e:
+        logger.exception("Backtest failed")
+        backtest_run.update(state="failed", error=repr(e))
+    finally:
+        backtest_run["duration_s"] = round(time.monotonic() - started, 3)
+        _backtest_lock.release()
+
+
+# --- Reading ---
+
+def cells(db: Session, source: str = "live", zone_id: Optional[int] = None,
+          syndrome: Optional[str] = None) -> List[Dict]:
+    """Stored sums for a source, as dicts (mergeable across shards by adding)."""
+    if source not in SOURCES:
+        raise ValueError(f"Unknown source {source!r}; use {', '.join(SOURCES)}")
+    a = models.ForecastAccuracy
+    q = db.query(a).filter(a.source == source)
+    if zone_id is not None:
+        q = q.filter(a.zone_id == zone_id)
+    if syndrome is not None:
+        q = q.filter(a.syndrome == syndrome)
+    return [{"zone_id": r.zone_id, "syndrome": r.syndrome, "horizon": r.horizon, "last_date": r.last_date,
+             **{name: getattr(r, name) for name in SUMS}} for r in q]
+
+
+def metrics(cell: Dict) -> Dict:
+    """MAE, MAPE (%, over days with visits) and interval coverage of a cell's sums."""
+    n = cell["n"]
+    return {
+        "n": n,
+        "mae": round(cell["abs_error"] / n, 3) if n else None,
+        "mape": round(100 * cell["pct_error"] / cell["pct_n"], 1) if cell["pct_n"] else None,
+        "coverage": round(cell["covered"] / n, 3) if n else None,
+    }
+
+
+def table(rows: List[Dict]) -> Dict:
+    """Per-cell metrics plus a per-(syndrome, horizon) rollup over zones."""
+    by_syndrome: Dict[tuple, Dict] = {}
+    for r in rows:
+        total = by_syndrome.setdefault((r["syndrome"], r["horizon"]), {name: 0 for name in SUMS})
+        for name in SUMS:
+            total[name] += r[name]
+    return {
+        "cells": [{"zone_id": r["zone_id"], "syndrome": r["syndrome"], "horizon": r["horizon"],
+                   "last_date": r["last_date"], **metrics(r)}
+                  for r in sorted(rows, key=lambda r: (r["zone_id"], r["syndrome"], r["horizon"]))],
+        "by_syndrome": [{"syndrome": s, "horizon": h, **metrics(total)}
+                        for (s, h), total in sorted(by_syndrome.items())],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the forecaster")
+    parser.add_argument("--days", type=int, default=BACKTEST_DAYS, help="Forecast origins to replay")
+    parser.add_argument("--horizon", type=int, default=HORIZON)
+    args = parser.parse_args()
+
+    migrations.upgrade(database.engine)
+    db = database.SessionLocal()
+    try:
+        result = backtest(db, args.days, args.horizon)
+        print(f"Scored {result['forecasts_scored']} forecasts for {result['series']} series "
+              f"over {result['origins']} origins in {result['duration_s']}s")
+        for row in table(cells(db, "backtest"))["by_syndrome"]:
+            mape = "n/a" if row["mape"] is None else f"{row['mape']}%"
+            print(f"  {row['syndrome']:<18} h={row['horizon']}  MAE {row['mae']}  MAPE {mape}  "
+                  f"coverage {row['coverage']}")
+    finally:
+        db.close()
@@ -0,0 +1,304 @@
+"""
+Admission control: priority classes, concurrency limits and deadlines.
+
+During an outbreak, ingest and dashboard traffic spike together, and a few
+expensive analytics calls can take every worker thread from /ingest/batch.
+AdmissionMiddleware (pure ASGI) gives each request a class from its route
+template:
+
+- ingest: /ingest/*, POST /sync. Can use any of CAPACITY slots, and
+  INGEST_RESERVED of them are kept for it alone.
+- interactive: everything not listed (zones, signals, actions).
+- analytics: /analysis/*, zone forecasts, /cube. Limited to
+  ANALYTICS_LIMIT slots, and cut off once ANALYTICS_DEADLINE_S has passed.
+- export: /export/*. Streams can run for many minutes and a deadline
+  would cut them off after the 200 has gone out, so they have none;
+  EXPORT_LIMIT slots bound them instead.
+- control: /admin/*, /metrics. Never limited, so operators can see an
+  overload while it happens.
+
+A request without a free slot waits up to its class's queue_wait_s, and no
+class takes a slot while a higher-priority class is waiting. After that it
+is shed. A GET answered successfully before is served from a stale copy
+(Warning: 110, X-Admission: stale); otherwise the response is 503 with
+Retry-After.
+
+Deadlines are cooperative. Sync endpoints run in worker threads, which can't
+be interrupted, so check() raises DeadlineExceeded at safe points: before
+every SQL statement (instrument_engine) and inside the long Python loops
+that call it. The middleware turns that into the same stale-or-503
+response.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from sqlalchemy import event
+from starlette.routing import Match
+
+# Params
+ENABLED = os.getenv("ADMISSION_ENABLED", "1") not in ("0", "false", "no")
+CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "40"))  # Starlette's threadpool runs 40 sync endpoints at once
+INGEST_RESERVED = int(os.getenv("ADMISSION_INGEST_RESERVED", "8"))
+ANALYTICS_LIMIT = int(os.getenv("ADMISSION_ANALYTICS_LIMIT", "6"))
+ANALYTICS_DEADLINE_S = float(os.getenv("ADMISSION_ANALYTICS_DEADLINE_S", "30"))
+EXPORT_LIMIT = int(os.getenv("ADMISSION_EXPORT_LIMIT", "2"))
+POLL_S = 0.01
+STALE_CACHE_SIZE = 128
+STALE_MAX_AGE_S = 900  # Older copies are not worth serving; shed with 503 instead
+STALE_MAX_BYTES = 2 * 1024 * 1024
+
+CLASSES = {  # In priority order
+    "control": {"queue_wait_s": 0.0, "deadline_s": None, "retry_after_s": 1},
+    "ingest": {"queue_wait_s": 5.0, "deadline_s": None, "retry_after_s": 1},
+    "interactive": {"queue_wait_s": 2.0, "deadline_s": None, "retry_after_s": 2},
+    "analytics": {"queue_wait_s": 1.0, "deadline_s": ANALYTICS_DEADLINE_S, "retry_after_s": 10},
+    "export": {"queue_wait_s": 1.0, "deadline_s": None, "retry_after_s": 30},
+}
+CLASS_LIMITS = {"analytics": ANALYTICS_LIMIT, "export": EXPORT_LIMIT}  # Slots a class may hold at once
+ROUTE_CLASSES = [  # (method or None for any, template prefix, class); first match wins
+    (None, "/admin", "control"),
+    (None, "/metrics", "control"),
+    (None, "/ingest", "ingest"),
+    ("POST", "/sync", "ingest"),
+    (None, "/analysis", "analytics"),
+    (None, "/zones/{zone_id}/forecast", "analytics"),
+    (None, "/cube", "analytics"),
+    (None, "/export", "export"),
+]
+DEFAULT_CLASS = "interactive"
+
+stats = {name: {"admitted": 0, "shed": 0, "stale_served": 0, "deadline_exceeded": 0, "in_flight": 0, "waiting": 0}
+         for name in CLASSES}
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed; raised by check() at a safe point."""
+
+
+# --- Deadlines ---
+
+_deadline: ContextVar[Optional[float]] = ContextVar("admission_deadline", default=None)
+
+
+def deadline() -> Optional[float]:
+    """The current request's deadline (time.monotonic()), or None."""
+    return _deadline.get()
+
+
+@contextmanager
+def bound(at: Optional[float]):
+    """Applies a deadline in this context, e.g. in a pool thread working for a request."""
+    token = _deadline.set(at)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def check():
+    """Raises DeadlineExceeded if the current request is past its deadline."""
+    at = _deadline.get()
+    if at is not None and time.monotonic() > at:
+        raise DeadlineExceeded()
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    check()
+
+
+def instrument_engine(engine):
+    """Checks the request deadline before each SQL statement (no-op when ADMISSION_ENABLED=0)."""
+    if ENABLED:
+        event.listen(engine, "before_cursor_execute", _before_execute)
+
+
+# --- Slots ---
+
+_lock = threading.Lock()  # TestClient and multiple event loops can admit from different threads
+
+
+def classify(method: str, template: Optional[str]) -> str:
+    if template is not None:
+        for m, prefix, name in ROUTE_CLASSES:
+            if (m is None or m == method) and template.startswith(prefix):
+                return name
+    return DEFAULT_CLASS
+
+
+def _try_acquire(name: str) -> bool:
+    with _lock:
+        if name == "control":
+            stats[name]["in_flight"] += 1
+            return True
+        ranks = list(CLASSES)
+        if any(stats[c]["waiting"] for c in ranks[1:ranks.index(name)]):
+            return False  # A higher-priority class is queued
+        total = sum(stats[c]["in_flight"] for c in ranks[1:])
+        shared = total - stats["ingest"]["in_flight"]
+        if total >= CAPACITY:
+            return False
+        if name != "ingest" and shared >= CAPACITY - INGEST_RESERVED:
+            return False
+        if name in CLASS_LIMITS and stats[name]["in_flight"] >= CLASS_LIMITS[name]:
+            return False
+        stats[name]["in_flight"] += 1
+        return True
+
+
+def _release(name: str):
+    with _lock:
+        stats[name]["in_flight"] -= 1
+
+
+async def _acquire(name: str) -> bool:
+    if _try_acquire(name):
+        return True
+    give_up = time.monotonic() + CLASSES[name]["queue_wait_s"]
+    with _lock:
+        stats[name]["waiting"] += 1
+    try:
+        while time.monotonic() < give_up:
+            await asyncio.sleep(POLL_S)
+            if _try_acquire(name):
+                return True
+        return False
+    finally:
+        with _lock:
+            stats[name]["waiting"] -= 1
+
+
+# --- Stale Copies ---
+
+_stale_lock = threading.Lock()
+_stale: "OrderedDict[tuple, tuple]" = OrderedDict()  # (path, query) -> (stored_at, status, headers, body)
+
+
+def _stale_get(key: tuple) -> Optional[tuple]:
+    with _stale_lock:
+        entry = _stale.get(key)
+        if entry is None or time.monotonic() - entry[0] > STALE_MAX_AGE_S:
+            return None
+        _stale.move_to_end(key)
+        return entry
+
+
+def _stale_put(key: tuple, status: int, headers: list, body: bytes):
+    with _stale_lock:
+        _stale[key] = (time.monotonic(), status, headers, body)
+        _stale.move_to_end(key)
+        while len(_stale) > STALE_CACHE_SIZE:
+            _stale.popitem(last=False)
+
+
+def clear_stale():
+    with _stale_lock:
+        _stale.clear()
+
+
+# --- Middleware ---
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the class limits, deadlines and shedding above."""
+
+    def __init__(self, app, router):
+        self.app = app
+        self.router = router
+
+    def _route(self, scope):
+        for route in self.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        if route is not None:
+            scope["route"] = route  # So requests shed here keep their template in /metrics
+        name = classify(scope["method"], getattr(route, "path", None))
+        key = (scope["path"], scope.get("query_string", b"")) if scope["method"] == "GET" else None
+
+        if not await _acquire(name):
+            with _lock:
+                stats[name]["shed"] += 1
+            await self._shed(name, key, send)
+            return
+
+        with _lock:
+            stats[name]["admitted"] += 1
+        deadline_s = CLASSES[name]["deadline_s"]
+        token = _deadline.set(time.monotonic() + deadline_s if deadline_s else None)
+        started = [False]
+        captured = {"status": None, "headers": None, "body": [], "size": 0}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                started[0] = True
+                captured["status"], captured["headers"] = message["status"], message.get("headers", [])
+            elif message["type"] == "http.response.body" and captured["size"] <= STALE_MAX_BYTES:
+                captured["body"].append(message.get("body", b""))
+                captured["size"] += len(captured["body"][-1])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper if key is not None and name == "analytics" else send)
+        except DeadlineExceeded:
+            with _lock:
+                stats[name]["deadline_exceeded"] += 1
+            if started[0]:
+                raise
+            await self._shed(name, key, send)
+            return
+        finally:
+            _deadline.reset(token)
+            _release(name)
+
+        if captured["status"] == 200 and captured["size"] <= STALE_MAX_BYTES:
+            _stale_put(key, 200, captured["headers"], b"".join(captured["body"]))
+
+    async def _shed(self, name: str, key: Optional[tuple], send):
+        entry = _stale_get(key) if key is not None else None
+        if entry is not None:
+            with _lock:
+                stats[name]["stale_served"] += 1
+            stored_at, status, headers, body = entry
+            age = int(time.monotonic() - stored_at)
+            headers = [h for h in headers if h[0].lower() != b"content-length"] + [
+                (b"content-length", str(len(body)).encode()),
+                (b"age", str(age).encode()),
+                (b"warning", b'110 - "Response is Stale"'),
+                (b"x-admission", b"stale"),
+            ]
+            await send({"type": "http.response.start", "status": status, "headers": headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        body = b'{"detail":"Server overloaded, retry later"}'
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(CLASSES[name]["retry_after_s"]).encode()),
+            (b"x-admission", b"shed"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def summary() -> Dict:
+    with _lock:
+        return {
+            "config": {"enabled": ENABLED, "capacity": CAPACITY, "ingest_reserved": INGEST_RESERVED,
+                       "analytics_limit": ANALYTICS_LIMIT, "analytics_deadline_s": ANALYTICS_DEADLINE_S,
+                       "export_limit": EXPORT_LIMIT},
+            "classes": {name: dict(s) for name, s in stats.items()},
+            "stale_entries": len(_stale),
+        }
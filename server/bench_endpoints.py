@@ -0,0 +1,361 @@
+"""
+Endpoint benchmark suite.
+
+Runs main.app in-process (TestClient) against generated databases at
+several scale tiers and records, per endpoint:
+- p50 / p95 / max latency (ms)
+- SQL statements per request (median and max, counted on the engine)
+
+Ingest runs with a non-autostarting LogApplier, so its numbers cover the
+request only; applying the log (insert + detection) is measured as the
+separate "ingest apply" stage, and signal detection on its own as the
+"detection" stage. Analytics deadlines (admission.py) are lifted for the
+run, so slow tiers are measured in full instead of being shed or served
+stale; the large tier caps its iterations (max_iterations) for the same
+reason.
+
+Tier data comes from synthetic_data.py with a fixed seed. Tier databases
+are cached under bench_data/ (rebuilt when the data no longer ends
+yesterday) and copied to a scratch file per run, so ingest never mutates
+the cache.
+
+Results go to a JSON report. With --budgets, any endpoint whose p95
+exceeds its budget (plus --tolerance) or whose SQL count exceeds its
+budget is a regression, and the run exits with status 1. SQL counts are
+deterministic; latency budgets (bench_budgets.json) were taken on the
+reference box and should be re-baselined on new hardware.
+
+    python bench_endpoints.py --tiers small,medium --budgets bench_budgets.json
+"""
+import argparse
+import gzip
+import json
+import math
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+import models, admission, migrations, ingest_log, signal_engine, synthetic_data, zone_geometry
+from main import app, get_db, get_session_factories
+
+# Params
+TIERS = {
+    "tiny":   {"zones": 3,    "days": 60},
+    "small":  {"zones": 10,   "days": 365},
+    "medium": {"zones": 200,  "days": 365},
+    "large":  {"zones": 2000, "days": 3 * 365, "max_iterations": 5},  # Analytics take seconds to a minute here
+}
+DEFAULT_TIERS = "small,medium"
+HOSPITALS_PER_ZONE = 2
+SYNDROMES = ["Fever", "Respiratory Issue", "Diarrhea"]
+SIGNAL_ZONES = 5  # Zones given a seeded surge signal (history/breakdown targets)
+ITERATIONS = 20
+WARMUP = 2
+TOLERANCE = 0.25  # Allowed p95 slack over budget
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_data")
+OUTBREAK_EVERY_ZONES = 20  # One injected outbreak per this many zones
+TIER_FORMAT = 5  # Bump when cached tier DBs need rebuilding (2: visit cube, 3: dimension keys, 4: pyramid, 5: outlines)
+WARD_STEP_DEG = 0.01  # Ward outlines: 32-vertex circles on the synthetic grid
+WARD_VERTICES = 32
+VIEWPORT_WARDS = 10  # Map viewport width/height in wards
+BULK_ACTIONS = 50
+SYNC_REPORTS = 20
+
+
+# --- Tier Databases ---
+
+def _engine(path: str):
+    return create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+
+
+def build_tier_db(path: str, zones: int, days: int, end: date, seed: int = 0):
+    """Synthetic tier data (grid zones, seasonal counts, a few outbreaks) plus seeded surge signals."""
+    engine = _engine(path)
+    dataset = synthetic_data.SyntheticDataset(zones, HOSPITALS_PER_ZONE, SYNDROMES, years=days / 365, end=end,
+                                              seed=seed, outbreaks=max(1, zones // OUTBREAK_EVERY_ZONES))
+    synthetic_data.load_into_db(dataset, engine, reset=True)
+
+    db = sessionmaker(bind=engine)()
+    try:
+        for z in range(1, min(zones, SIGNAL_ZONES) + 1):
+            signal_engine.save_signal(db, z, end, "Fever", 40, 8, "Disease Surge", "High", "High",
+                                      "Benchmark surge")
+        width = max(1, int(math.sqrt(zones)))  # Same layout as synthetic_data.grid_edges
+        for i in range(zones):
+            lng, lat = 73.7 + WARD_STEP_DEG * (i % width), 18.4 + WARD_STEP_DEG * (i // width)
+            r, step = WARD_STEP_DEG * 0.45, 2 * math.pi / WARD_VERTICES
+            ring = [[lng + r * math.cos(step * k), lat + r * math.sin(step * k)] for k in range(WARD_VERTICES)]
+            zone_geometry.set_geometry(db, i + 1, {"type": "Polygon", "coordinates": [ring]})
+    finally:
+        db.close()
+    engine.dispose()
+
+
+def tier_db(name: str, end: date, rebuild: bool = False) -> str:
+    """Path of the cached DB for a tier, (re)built if missing or stale."""
+    tier = TIERS[name]
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f"{name}.db")
+    meta_path = path + ".json"
+    meta = {"zones": tier["zones"], "days": tier["days"], "end": end.isoformat(), "format": TIER_FORMAT}
+
+    if not rebuild and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == meta:
+                return path
+
+    print(f"Building tier '{name}' ({tier['zones']} zones, {tier['days']} days)...", file=sys.stderr)
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    build_tier_db(tmp, tier["zones"], tier["days"], end)
+    os.replace(tmp, path)
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+    return path
+
+
+# --- Measurement ---
+
+class StatementCounter:
+    """Counts SQL statements executed on an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        self._lock = threading.Lock()
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[k]
+
+
+def _summarise(latencies: List[float], statements: List[int]) -> Dict:
+    return {
+        "n": len(latencies),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p95_ms": round(_percentile(latencies, 95), 2),
+        "max_ms": round(max(latencies), 2),
+        "sql_median": int(statistics.median(statements)),
+        "sql_max": max(statements),
+    }
+
+
+def _measure(fn: Callable[[int], None], counter: StatementCounter, iterations: int, warmup: int,
+             setup: Optional[Callable[[int], None]] = None) -> Dict:
+    """setup(i), if given, runs before each timed call and is not measured."""
+    latencies, statements = [], []
+    for i in range(warmup + iterations):
+        if setup is not None:
+            setup(i)
+        before = counter.count
+        t0 = time.perf_counter()
+        fn(i)
+        elapsed = (time.perf_counter() - t0) * 1000
+        if i >= warmup:
+            latencies.append(elapsed)
+            statements.append(counter.count - before)
+    return _summarise(latencies, statements)
+
+
+def _request(client: TestClient, method: str, url: str, expect: int = 200, **kwargs):
+    res = client.request(method, url, **kwargs)
+    if res.status_code != expect:
+        raise RuntimeError(f"{method} {url} -> {res.status_code}: {res.text[:200]}")
+    return res
+
+
+# --- Suite ---
+
+def run_tier(name: str, iterations: int = ITERATIONS, warmup: int = WARMUP, rebuild: bool = False) -> Dict:
+    today = date.today()
+    yesterday = today - timedelta(days=1)
+    cached = tier_db(name, yesterday, rebuild)
+    iterations = min(iterations, TIERS[name].get("max_iterations", iterations))
+
+    scratch = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    path = os.path.join(scratch, "bench.db")
+    shutil.copyfile(cached, path)
+    engine = _engine(path)
+    migrations.upgrade(engine)  # Cached tiers pick up new indexes, as a deployment would on restart
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    counter = StatementCounter(engine)
+
+    db = Session()
+    zone_ids = [z for (z,) in db.query(models.Zone.id).order_by(models.Zone.id).all()]
+    hospital_ids = [h for (h,) in db.query(models.Hospital.id).order_by(models.Hospital.id).all()]
+    signal_ids = [s for (s,) in db.query(models.Signal.id).order_by(models.Signal.id).all()]
+    db.close()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    log = ingest_log.IngestLog(os.path.join(scratch, "ingest_log"))
+    applier = ingest_log.LogApplier(log, session_factory=Session, autostart=False)
+    original = ingest_log.log, ingest_log.applier
+    ingest_log.log, ingest_log.applier = log, applier
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factories] = lambda: [Session]
+    deadline_s = admission.CLASSES["analytics"]["deadline_s"]
+    admission.CLASSES["analytics"]["deadline_s"] = None  # Measure the whole request, not a shed or stale copy
+    client = TestClient(app)
+
+    def ingest(i):
+        _request(client, "POST", "/ingest/batch", expect=202, json={
+            "hospital_id": hospital_ids[i % len(hospital_ids)],
+            "visits": [{"date": str(today), "syndrome": s, "count": 3, "age_group": "16-50"} for s in SYNDROMES]
+        })
+
+    def detection(i):
+        db = Session()
+        try:
+            hospital = db.get(models.Hospital, hospital_ids[i % len(hospital_ids)])
+            signal_engine.detect_signals_for_hospital(db, hospital, yesterday)
+        finally:
+            db.close()
+
+    def sync(i):
+        body = {"hospital_id": hospital_ids[i % len(hospital_ids)], "reports": [
+            {"key": f"bench-{name}-{i}-{k}", "date": str(yesterday - timedelta(days=k)), "syndrome": SYNDROMES[k % 3],
+             "count": 2, "age_group": "16-50"} for k in range(SYNC_REPORTS)]}
+        _request(client, "POST", "/sync", content=gzip.compress(json.dumps(body).encode()),
+                 headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+
+    def bulk_actions(i):
+        _request(client, "POST", "/signals/actions/bulk", json={"actions": [
+            {"signal_id": signal_ids[(i + k) % len(signal_ids)], "status": "Acknowledged", "notes": "Benchmark"}
+            for k in range(BULK_ACTIONS)]})
+
+    def diffusion(i):  # A new scenario each time, so the result cache doesn't answer
+        _request(client, "POST", "/analysis/diffusion", json={"syndrome": "Fever", "days": 14,
+                                                              "scenarios": [{"beta": 0.2 + 0.001 * i}]})
+
+    width = max(1, int(math.sqrt(len(zone_ids))))
+
+    def viewport(i):  # Pans one ward per request, as a user dragging the map would
+        x0 = 73.7 + WARD_STEP_DEG * ((i % max(1, width - VIEWPORT_WARDS + 1)) - 0.5)
+        y0 = 18.4 - WARD_STEP_DEG * 0.5
+        span = WARD_STEP_DEG * VIEWPORT_WARDS
+        return f"/zones/geometry?bbox={x0},{y0},{x0 + span},{y0 + span}&zoom=14"
+
+    def get(url: Callable[[int], str]):
+        return lambda i: _request(client, "GET", url(i)), None
+
+    signal = lambda i: signal_ids[i % len(signal_ids)]
+    month_ago = lambda i: yesterday - timedelta(days=30 + i)  # A new cube slice each time
+    cases = {
+        "GET /zones": get(lambda i: "/zones"),
+        "GET /signals": get(lambda i: "/signals"),
+        "GET /signals/{id}/history": get(lambda i: f"/signals/{signal(i)}/history"),
+        "GET /signals/{id}/breakdown": get(lambda i: f"/signals/{signal(i)}/breakdown"),
+        "GET /zones/{id}/forecast": get(lambda i: f"/zones/{zone_ids[i % len(zone_ids)]}/forecast"),
+        "GET /analysis/summary": get(lambda i: "/analysis/summary"),
+        "GET /analysis/timecube": get(lambda i: "/analysis/timecube?compress=true"),
+        "GET /analysis/forecast-accuracy": get(lambda i: "/analysis/forecast-accuracy"),
+        "POST /analysis/diffusion": (diffusion, None),
+        "GET /cube": get(lambda i: f"/cube?syndrome=Fever&group_by=zone_id&start={month_ago(i)}"),
+        "GET /export/visits": get(lambda i: f"/export/visits?format=ndjson&zone_id={zone_ids[i % len(zone_ids)]}"
+                                            f"&start={month_ago(i)}"),
+        "GET /zones/geometry": get(viewport),
+        "POST /signals/actions/bulk": (bulk_actions, None),
+        "POST /sync": (sync, None),
+        "POST /ingest/batch": (ingest, None),
+        "ingest apply": (lambda i: applier.apply_pending(), ingest),  # Insert + detection for one batch
+        "detection": (detection, None),
+    }
+
+    results = {}
+    try:
+        for case, (fn, setup) in cases.items():
+            results[case] = _measure(fn, counter, iterations, warmup, setup)
+            print(f"  {name:>6} {case:<36} p50 {results[case]['p50_ms']:>9.2f}ms  "
+                  f"p95 {results[case]['p95_ms']:>9.2f}ms  sql {results[case]['sql_max']}", file=sys.stderr)
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        app.dependency_overrides.pop(get_session_factories, None)
+        admission.CLASSES["analytics"]["deadline_s"] = deadline_s
+        ingest_log.log, ingest_log.applier = original
+        engine.dispose()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {"zones": len(zone_ids), "days": TIERS[name]["days"], "iterations": iterations, "endpoints": results}
+
+
+def check_budgets(report: Dict, budgets: Dict, tolerance: float = TOLERANCE) -> List[str]:
+    """Returns a description of every budget regression in the report."""
+    regressions = []
+    for tier, endpoints in budgets.items():
+        measured = report["tiers"].get(tier)
+        if measured is None:
+            continue
+        for case, budget in endpoints.items():
+            result = measured["endpoints"].get(case)
+            if result is None:
+                continue
+            if "p95_ms" in budget and result["p95_ms"] > budget["p95_ms"] * (1 + tolerance):
+                regressions.append(f"{tier} {case}: p95 {result['p95_ms']}ms > budget {budget['p95_ms']}ms")
+            if "sql" in budget and result["sql_max"] > budget["sql"]:
+                regressions.append(f"{tier} {case}: {result['sql_max']} SQL statements > budget {budget['sql']}")
+    return regressions
+
+
+def run_suite(tiers: List[str], iterations: int = ITERATIONS, warmup: int = WARMUP,
+              budgets: Optional[Dict] = None, tolerance: float = TOLERANCE, rebuild: bool = False) -> Dict:
+    report = {"date": date.today().isoformat(), "iterations": iterations, "tiers": {}}
+    for name in tiers:
+        report["tiers"][name] = run_tier(name, iterations, warmup, rebuild)
+    report["regressions"] = check_budgets(report, budgets or {}, tolerance)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Endpoint latency / query-count benchmarks")
+    parser.add_argument("--tiers", default=DEFAULT_TIERS, help=f"Comma-separated, from: {', '.join(TIERS)}")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--warmup", type=int, default=WARMUP)
+    parser.add_argument("--budgets", default=None, help="JSON file: {tier: {endpoint: {p95_ms, sql}}}")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Allowed p95 slack (0.25 = +25%%)")
+    parser.add_argument("--report", default="bench_report.json")
+    parser.add_argument("--rebuild", action="store_true", help="Regenerate cached tier databases")
+    args = parser.parse_args()
+
+    budgets = None
+    if args.budgets:
+        with open(args.budgets) as f:
+            budgets = json.load(f)
+
+    tiers = [t.strip() for t in args.tiers.split(",") if t.strip()]
+    unknown = [t for t in tiers if t not in TIERS]
+    if unknown:
+        parser.error(f"Unknown tier(s): {', '.join(unknown)}")
+
+    report = run_suite(tiers, args.iterations, args.warmup, budgets, args.tolerance, args.rebuild)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+
+    if report["regressions"]:
+        print("BUDGET REGRESSIONS:")
+        for r in report["regressions"]:
+            print(f" >> {r}")
+        sys.exit(1)
@@ -0,0 +1,305 @@
+"""
+Space-time cluster scan over the zone adjacency graph.
+
+Per-zone thresholds (signal_engine.check_disease_surge) miss surges that
+are spread thinly across neighbouring wards. This stage scans connected
+groups of zones and recent time windows for excess counts, in the style
+of an expectation-based Poisson space-time scan statistic:
+
+- Candidate clusters: for every zone, the zone plus its nearest graph
+  neighbours in BFS order, up to MAX_CLUSTER_ZONES (so every candidate is
+  connected and enumeration is bounded by the adjacency graph).
+- Candidate windows: the last 1..MAX_WINDOW_DAYS days up to the scan date.
+- Expected counts: each zone's mean daily count over the rest of the
+  STUDY_DAYS period.
+- Score: Poisson log-likelihood ratio C*ln(C/E) + E - C when C > E.
+- Significance: Monte Carlo. Counts are resampled from the expectations
+  and the maximum score over all candidates is recorded per replication;
+  p = (1 + #replications scoring >= observed) / (R + 1). Replications run
+  in parallel across a process pool, and stop early (with fewer
+  replications) once the time budget is spent; each cluster reports the
+  replications actually run, and its signal says when the run was cut.
+
+Significant, non-overlapping clusters are stored as "Spatial Cluster"
+signals on their centre zone. Run nightly: python cluster_scan.py
+"""
+import argparse
+import math
+import os
+import random
+import time
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+import models, migrations, sharding, signal_engine, spatial_config, timeseries
+
+# Params
+STUDY_DAYS = 30
+MAX_WINDOW_DAYS = 7
+MAX_CLUSTER_ZONES = 8
+REPLICATIONS = 999
+CHUNK_REPLICATIONS = 50  # Replications per pool task
+TIME_BUDGET_S = 15 * 60  # Nightly budget for the whole run
+ALPHA = 0.05
+MIN_EXPECTED_PER_DAY = 0.1  # Keeps the score finite for zones with no history
+SIGNAL_TYPE = "Spatial Cluster"
+
+
+# --- Core (pure functions, picklable for the process pool) ---
+
+def sample_poisson(rng: random.Random, lam: float) -> int:
+    """Knuth's method for small means, normal approximation above 30."""
+    if lam <= 0:
+        return 0
+    if lam > 30:
+        return max(0, int(round(rng.gauss(lam, math.sqrt(lam)))))
+    limit, k, p = math.exp(-lam), 0, 1.0
+    while True:
+        p *= rng.random()
+        if p <= limit:
+            return k
+        k += 1
+
+
+def build_candidates(graph: spatial_config.ZoneGraph, zone_ids: Sequence[int], max_zones: int) -> List[List[int]]:
+    """For each zone (by position in zone_ids): itself then BFS neighbours, capped at max_zones."""
+    position = {z: i for i, z in enumerate(zone_ids)}
+    candidates = []
+    for z in zone_ids:
+        order, seen, frontier = [z], {z}, [z]
+        while frontier and len(order) < max_zones:
+            nxt = []
+            for f in frontier:
+                for n in sorted(graph.neighbors(f)):
+                    if n not in seen and n in position:
+                        seen.add(n)
+                        nxt.append(n)
+            order.extend(nxt[:max_zones - len(order)])
+            frontier = nxt
+        candidates.append([position[n] for n in order])
+    return candidates
+
+
+def window_sums(daily: Sequence[Sequence[float]], max_window: int) -> List[List[float]]:
+    """daily[z] = last max_window days (oldest first) -> sums[z][w-1] = total of the last w days."""
+    sums = []
+    for row in daily:
+        acc, out = 0.0, []
+        for v in reversed(row[-max_window:]):
+            acc += v
+            out.append(acc)
+        sums.append(out)
+    return sums
+
+
+def scan(candidates: List[List[int]], observed_sums: List[List[float]], expected_sums: List[List[float]],
+         best_only: bool = False):
+    """
+    Scores every (candidate prefix, window). Returns the max score when
+    best_only, otherwise a list of (llr, centre, size, window, C, E).
+    """
+    best = 0.0
+    hits = []
+    n_windows = len(expected_sums[0]) if expected_sums else 0
+    for centre, order in enumerate(candidates):
+        c_acc = [0.0] * n_windows
+        e_acc = [0.0] * n_windows
+        for size, z in enumerate(order, start=1):
+            obs_z, exp_z = observed_sums[z], expected_sums[z]
+            for w in range(n_windows):
+                c_acc[w] += obs_z[w]
+                e_acc[w] += exp_z[w]
+                c, e = c_acc[w], e_acc[w]
+                if c <= e:
+                    continue
+                llr = c * math.log(c / e) + e - c  # Poisson log-likelihood ratio
+                if best_only:
+                    if llr > best:
+                        best = llr
+                else:
+                    hits.append((llr, centre, size, w + 1, c, e))
+    return best if best_only else hits
+
+
+def simulate_max_llr(candidates, expected_daily, expected_sums, replications: int, seed: int) -> List[float]:
+    """Monte Carlo replications under the null; returns the max score of each."""
+    rng = random.Random(seed)
+    max_window = len(expected_daily[0]) if expected_daily else 0
+    results = []
+    for _ in range(replications):
+        simulated = [[sample_poisson(rng, lam) for lam in row] for row in expected_daily]
+        results.append(scan(candidates, window_sums(simulated, max_window), expected_sums, best_only=True))
+    return results
+
+
+def _simulate_chunk(args):
+    return simulate_max_llr(*args)
+
+
+def scan_syndrome(counts: List[List[int]], candidates: List[List[int]], max_window: int = MAX_WINDOW_DAYS,
+                  replications: int = REPLICATIONS, pool: Optional[ProcessPoolExecutor] = None,
+                  time_budget_s: Optional[float] = None, seed: int = 0, alpha: float = ALPHA) -> List[Dict]:
+    """
+    counts[z]: daily counts for the study period (oldest first), one row per zone.
+    Returns significant non-overlapping clusters, strongest first.
+    """
+    if not counts or len(counts[0]) <= max_window:
+        return []
+
+    # Expectation per zone from the days before the scan windows
+    expected_daily = []
+    for row in counts:
+        history = row[:-max_window]
+        mean = sum(history) / len(history)
+        expected_daily.append([max(mean, MIN_EXPECTED_PER_DAY)] * max_window)
+    expected_sums = window_sums(expected_daily, max_window)
+    observed_sums = window_sums(counts, max_window)
+
+    hits = scan(candidates, observed_sums, expected_sums)
+    if not hits:
+        return []
+    hits.sort(reverse=True)
+
+    # Monte Carlo null distribution of the maximum score
+    started = time.monotonic()
+    null_max = []
+    chunks = [
+        (candidates, expected_daily, expected_sums, min(CHUNK_REPLICATIONS, replications - i), seed + i)
+        for i in range(0, replications, CHUNK_REPLICATIONS)
+    ]
+    if pool is None:
+        for chunk in chunks:
+            null_max.extend(_simulate_chunk(chunk))
+            if time_budget_s is not None and time.monotonic() - started > time_budget_s:
+                break
+    else:
+        pending = {pool.submit(_simulate_chunk, chunk) for chunk in chunks}
+        while pending:
+            timeout = None if time_budget_s is None else max(0.0, time_budget_s - (time.monotonic() - started))
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for f in done:
+                null_max.extend(f.result())
+            if not done:  # Budget spent: keep what finished
+                for f in pending:
+                    f.cancel()
+                break
+
+    if not null_max:
+        return []
+    null_max.sort()
+
+    # Report significant clusters that don't overlap a stronger one
+    clusters, covered = [], set()
+    for llr, centre, size, window, c, e in hits:
+        members = candidates[centre][:size]
+        if covered.intersection(members):
+            continue
+        exceed = len(null_max) - bisect_left(null_max, llr)
+        p_value = (1 + exceed) / (len(null_max) + 1)
+        if p_value > alpha:
+            break  # Hits are sorted by score, so the rest are weaker
+        covered.update(members)
+        clusters.append({
+            "centre": centre, "members": members, "window_days": window,
+            "observed": c, "expected": e, "llr": llr, "p_value": p_value,
+            "replications": len(null_max), "replications_requested": replications
+        })
+    return clusters
+
+
+# --- DB Stage ---
+
+def run_cluster_scan(db: Session, target_date: date = None, replications: int = REPLICATIONS,
+                     workers: Optional[int] = None, time_budget_s: float = TIME_BUDGET_S,
+                     save: bool = True) -> List[Dict]:
+    """
+    Scans every syndrome reported in the study period ending on target_date
+    and stores significant clusters as "Spatial Cluster" signals.
+    """
+    target_date = target_date or date.today()
+    start_date = target_date - timedelta(days=STUDY_DAYS - 1)
+
+    rows = timeseries.zone_daily_counts(db, start_date, target_date)
+
+    graph = spatial_config.get_graph(db)
+    zone_ids = sorted({z for (z,) in db.query(models.Zone.id).all()} | set(graph.zone_ids))
+    position = {z: i for i, z in enumerate(zone_ids)}
+    candidates = build_candidates(graph, zone_ids, MAX_CLUSTER_ZONES)
+
+    series: Dict[str, List[List[int]]] = {}
+    for zone_id, syndrome, d, total in rows:
+        if zone_id not in position or not syndrome:
+            continue
+        matrix = series.setdefault(syndrome, [[0] * STUDY_DAYS for _ in zone_ids])
+        matrix[position[zone_id]][(d - start_date).days] += total
+
+    started = time.monotonic()
+    found = []
+    workers = workers if workers is not None else (os.cpu_count() or 1)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for i, syndrome in enumerate(sorted(series)):
+            # Share whatever budget is left across the remaining syndromes
+            remaining = time_budget_s - (time.monotonic() - started)
+            budget = max(0.0, remaining) / (len(series) - i)
+            for cluster in scan_syndrome(series[syndrome], candidates, replications=replications,
+                                         pool=pool, time_budget_s=budget, seed=i * 1000003):
+                cluster["syndrome"] = syndrome
+                cluster["zone_id"] = zone_ids[cluster["centre"]]
+                cluster["zone_ids"] = [zone_ids[m] for m in cluster["members"]]
+                found.append(cluster)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if save:
+        for cluster in found:
+            _save_cluster(db, target_date, cluster)
+    return found
+
+
+def _save_cluster(db: Session, target_date: date, cluster: Dict):
+    observed, expected = int(cluster["observed"]), cluster["expected"]
+    ratio = observed / expected if expected else 0
+    p_value = cluster["p_value"]
+
+    severity = "High" if ratio > 3 or (p_value <= 0.01 and ratio > 2) else "Medium"
+    confidence = "High" if p_value <= 0.01 else "Medium"
+    zones = ", ".join(str(z) for z in cluster["zone_ids"])
+    run, requested = cluster["replications"], cluster["replications_requested"]
+    replications = f"{run} replications"
+    if run < requested:
+        replications = f"{run} of {requested} replications, time budget spent"
+    explanation = (f"{cluster['syndrome']} cluster across zones {zones}: {observed} cases in the last "
+                   f"{cluster['window_days']} day(s) vs {expected:.1f} expected ({ratio:.1f}x), "
+                   f"p={p_value:.3f} ({replications}).")
+
+    signal_engine.save_signal(db, cluster["zone_id"], target_date, cluster["syndrome"], observed, int(expected),
+                              SIGNAL_TYPE, severity, confidence, explanation)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Nightly space-time cluster scan")
+    parser.add_argument("--date", type=date.fromisoformat, default=None, help="Scan end date (default: today)")
+    parser.add_argument("--replications", type=int, default=REPLICATIONS)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--budget", type=float, default=TIME_BUDGET_S, help="Time budget in seconds")
+    args = parser.parse_args()
+
+    for shard in sharding.router.shards():  # Every district database
+        migrations.upgrade(shard.engine)
+        db = shard.session_factory()
+        try:
+            t0 = time.monotonic()
+            clusters = run_cluster_scan(db, args.date, args.replications, args.workers, args.budget)
+            print(f"[{shard.key}] Scan finished in {time.monotonic() - t0:.1f}s: "
+                  f"{len(clusters)} significant cluster(s)")
+            for c in clusters:
+                print(f" >> {c['syndrome']}: zones {c['zone_ids']} last {c['window_days']}d "
+                      f"{int(c['observed'])} vs {c['expected']:.1f} (p={c['p_value']:.3f})")
+        finally:
+            db.close()
@@ -0,0 +1,169 @@
+"""
+Cold-data compaction for visit_events.
+
+Detection looks back BASELINE_DAYS (14) and forecasts 30 days, but raw
+per-hospital, per-age-group rows are kept forever. This job moves rows
+older than the horizon into visit_daily_rollups, one row per
+(date, hospital, syndrome):
+
+1. Select the oldest BATCH_SIZE raw rows before the cutoff (date index).
+2. Optionally append them to gzip NDJSON archives (one file per month,
+   fsynced before the delete; rows carry their id, so a batch re-archived
+   after a failed commit can be de-duplicated).
+3. In one transaction, add their counts to the rollups (upsert) and delete
+   them, so every total is in exactly one of the two tables at any time.
+
+Range queries read both tables through timeseries.daily_visits(), so
+history endpoints return the same totals across the boundary. The hot
+paths (detection, per-zone forecasts, the summary) only read the last
+MIN_HORIZON_DAYS, which the horizon may not go below.
+"""
+import argparse
+import gzip
+import json
+import os
+import time
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models, database, migrations, scheduler, sharding
+
+# Params
+MIN_HORIZON_DAYS = 32  # Longest raw-table lookback (forecast window + today) plus one
+HORIZON_DAYS = max(MIN_HORIZON_DAYS, int(os.getenv("COMPACTION_HORIZON_DAYS", "90")))
+ARCHIVE_DIR = os.getenv("COMPACTION_ARCHIVE_DIR") or None  # Unset = no archive
+BATCH_SIZE = int(os.getenv("COMPACTION_BATCH", "5000"))
+INTERVAL_S = float(os.getenv("COMPACTION_INTERVAL_S", str(6 * 3600)))
+
+stats = {
+    "runs": 0,
+    "rows_compacted_total": 0,
+    "last_rows_compacted": 0,
+    "last_batches": 0,
+    "last_cutoff": None,
+    "last_duration_s": 0.0,
+}
+
+
+def _upsert_rollups(db: Session, totals: Dict[tuple, int]):
+    """Adds counts to visit_daily_rollups, creating rows as needed."""
+    rows = [{"date": d, "hospital_id": h, "syndrome": s, "count": c} for (d, h, s), c in totals.items()]
+    table = models.VisitDailyRollup.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["date", "hospital_id", "syndrome"],
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Portable fallback
+    for row in rows:
+        existing = db.query(models.VisitDailyRollup).filter_by(
+            date=row["date"], hospital_id=row["hospital_id"], syndrome=row["syndrome"]).first()
+        if existing:
+            existing.count += row["count"]
+        else:
+            db.add(models.VisitDailyRollup(**row))
+
+
+def _archive(archive_dir: str, rows: List) -> None:
+    """Appends raw rows to per-month gzip NDJSON files and fsyncs them."""
+    os.makedirs(archive_dir, exist_ok=True)
+    by_month: Dict[str, List[str]] = {}
+    for r in rows:
+        by_month.setdefault(r.date.strftime("%Y-%m"), []).append(json.dumps({
+            "id": r.id, "date": r.date.isoformat(), "hospital_id": r.hospital_id, "syndrome": r.syndrome,
+            "count": r.count, "age_group": r.age_group,
+            "created_at": r.created_at.isoformat() if r.created_at else None,
+        }))
+    for month, lines in by_month.items():
+        path = os.path.join(archive_dir, f"visit_events-{month}.ndjson.gz")
+        with open(path, "ab") as f:
+            f.write(gzip.compress(("\n".join(lines) + "\n").encode("utf-8")))  # One gzip member per batch
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def compact(db: Session, horizon_days: int = HORIZON_DAYS, archive_dir: Optional[str] = ARCHIVE_DIR,
+            batch_size: int = BATCH_SIZE, today: date = None, max_batches: Optional[int] = None) -> Dict:
+    """Compacts raw visits dated before today - horizon_days."""
+    if horizon_days < MIN_HORIZON_DAYS:
+        raise ValueError(f"Horizon must be at least {MIN_HORIZON_DAYS} days")
+    started = time.monotonic()
+    cutoff = (today or date.today()) - timedelta(days=horizon_days)
+    compacted, batches = 0, 0
+
+    while max_batches is None or batches < max_batches:
+        rows = db.query(models.VisitEvent)\
+            .filter(models.VisitEvent.date < cutoff)\
+            .order_by(models.VisitEvent.date, models.VisitEvent.id)\
+            .limit(batch_size)\
+            .all()
+        if not rows:
+            break
+
+        if archive_dir:
+            _archive(archive_dir, rows)
+
+        totals: Dict[tuple, int] = {}
+        for r in rows:
+            key = (r.date, r.hospital_id, r.syndrome)
+            totals[key] = totals.get(key, 0) + (r.count or 0)
+        _upsert_rollups(db, totals)
+        db.execute(delete(models.VisitEvent).where(models.VisitEvent.id.in_([r.id for r in rows])))
+        db.commit()
+        db.expunge_all()
+
+        compacted += len(rows)
+        batches += 1
+        if len(rows) < batch_size:
+            break
+
+    duration = time.monotonic() - started
+    stats["runs"] += 1
+    stats["rows_compacted_total"] += compacted
+    stats["last_rows_compacted"] = compacted
+    stats["last_batches"] = batches
+    stats["last_cutoff"] = cutoff.isoformat()
+    stats["last_duration_s"] = round(duration, 3)
+    return {"compacted": compacted, "batches": batches, "cutoff": cutoff.isoformat()}
+
+
+def _run_compaction():
+    results = []
+    for shard in sharding.router.shards():  # Every district database
+        db = shard.session_factory()
+        try:
+            results.append(compact(db))
+        finally:
+            db.close()
+    return results[0] if len(results) == 1 else results
+
+
+job = scheduler.PeriodicJob("compaction", INTERVAL_S, _run_compaction)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Roll old visit_events rows into daily rollups")
+    parser.add_argument("--horizon", type=int, default=HORIZON_DAYS, help="Keep raw rows for this many days")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR, help="Write compacted rows here as gzip NDJSON")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    migrations.upgrade(database.engine)
+    db = database.SessionLocal()
+    try:
+        result = compact(db, args.horizon, args.archive_dir, args.batch)
+        print(f"Compacted {result['compacted']} rows before {result['cutoff']} "
+              f"in {result['batches']} batch(es), {stats['last_duration_s']}s")
+    finally:
+        db.close()
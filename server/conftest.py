@@ -0,0 +1,38 @@
+"""
+Points the app at scratch storage before main is imported, so a test run
+never writes to the committed caresignal.db or ./ingest_log. The scratch
+database starts as a copy of caresignal.db and is upgraded here, as the
+app's startup hook would (most tests use TestClient without starting the
+app). Set DATABASE_URL / INGEST_LOG_DIR to use your own.
+
+Tests that need their own small, seeded database get an empty one from
+scratch_db(), upgraded the same way.
+"""
+import os
+import shutil
+import tempfile
+
+_root = tempfile.mkdtemp(prefix="caresignal-test-")
+if "DATABASE_URL" not in os.environ:
+    _path = os.path.join(_root, "caresignal.db")
+    _committed = os.path.join(os.path.dirname(os.path.abspath(__file__)), "caresignal.db")
+    if os.path.exists(_committed):
+        shutil.copyfile(_committed, _path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{_path}"
+os.environ.setdefault("INGEST_LOG_DIR", os.path.join(_root, "ingest_log"))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import migrations, sharding  # After the environment is set
+
+for _shard in sharding.router.shards():
+    migrations.upgrade(_shard.engine)
+
+
+def scratch_db(name: str = "scratch") -> sessionmaker:
+    """A new, empty SQLite database under the scratch dir, migrated like the app's; returns its session factory."""
+    path = os.path.join(tempfile.mkdtemp(dir=_root), f"{name}.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
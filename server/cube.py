@@ -0,0 +1,242 @@
+"""
+Pre-aggregated visit cube over (date, zone, hospital, syndrome, age group).
+
+visit_cube keeps one row per (date, hospital, syndrome, age group), with the
+hospital's zone copied onto it, so any slice ("Diarrhea in 0-5s across the
+district this week", "Fever by age group per day in zone 3") is a single
+GROUP BY over a table much smaller than visit_events. Age-group detail also
+survives compaction, which drops it from the rollups.
+
+Maintenance:
+- The ingestion applier calls add_visits() in the transaction that inserts
+  the visits (an upsert of summed counts), so the cube never diverges from
+  what was applied.
+- Bulk loaders (seed.py, synthetic_data.py) call rebuild(), which recomputes
+  the cube from visit_events and visit_daily_rollups. Compacted days have
+  no age group and count as "Unknown".
+- ensure_built() rebuilds at startup when the cube is empty but visits
+  exist (databases created before the cube).
+
+query() answers a slice: filters on any dimension plus a date range,
+grouped by any subset of DIMENSIONS. Dropping a dimension rolls it up,
+adding one drills down, and no dimensions gives the grand total. Recent
+slices are kept in an LRU bounded by total cells, keyed by the database
+and a generation bumped after each cube write; CACHE_TTL_S bounds how
+stale a slice can be when another process wrote the cube.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, literal, select, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+from dimensions import AgeGroupKey, UNKNOWN_AGE_GROUP
+
+# Params
+DIMENSIONS = ("date", "zone_id", "hospital_id", "syndrome", "age_group")
+CACHE_MAX_CELLS = 200_000  # Cells held across all cached slices
+CACHE_MAX_SLICE_CELLS = 20_000  # Larger slices aren't cached
+CACHE_TTL_S = 30.0
+
+_generation = 0
+_cache_lock = threading.Lock()
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, result)
+_cached_cells = 0
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def invalidate():
+    """Starts a new cache generation; call after committing cube changes."""
+    global _generation
+    with _cache_lock:
+        _generation += 1
+
+
+# --- Maintenance ---
+
+def _upsert(db: Session, cells: Dict[tuple, int], zones: Dict[int, int]):
+    rows = [{"date": d, "zone_id": zones.get(h), "hospital_id": h, "syndrome": s, "age_group": a, "count": c}
+            for (d, h, s, a), c in cells.items()]
+    table = models.VisitCube.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["date", "hospital_id", "syndrome", "age_group"],
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Portable fallback
+    for row in rows:
+        existing = db.query(models.VisitCube).filter_by(
+            date=row["date"], hospital_id=row["hospital_id"], syndrome=row["syndrome"],
+            age_group=row["age_group"]).first()
+        if existing:
+            existing.count += row["count"]
+        else:
+            db.add(models.VisitCube(**row))
+
+
+def add_visits(db: Session, rows: List[Dict]) -> Dict[int, int]:
+    """
+    Adds visit rows (date, hospital_id, syndrome, age_group, count); the caller
+    commits, then invalidate()s. Returns the hospital -> zone map it looked up.
+    """
+    cells: Dict[tuple, int] = {}
+    for r in rows:
+        key = (r["date"], r["hospital_id"], r["syndrome"], r.get("age_group") or UNKNOWN_AGE_GROUP)
+        cells[key] = cells.get(key, 0) + (r["count"] or 0)
+    if not cells:
+        return {}
+    hospital_ids = list({h for _, h, _, _ in cells})
+    zones = dict(db.query(models.Hospital.id, models.Hospital.zone_id).filter(models.Hospital.id.in_(hospital_ids)))
+    _upsert(db, cells, zones)
+    return zones
+
+
+def rebuild(db: Session):
+    """Recomputes the whole cube from raw and compacted visits (one INSERT ... SELECT)."""
+    raw, rollup = models.VisitEvent, models.VisitDailyRollup
+    unknown = literal(UNKNOWN_AGE_GROUP, AgeGroupKey())
+    source = union_all(
+        select(raw.date, raw.hospital_id, raw.syndrome,
+               func.coalesce(raw.age_group, unknown).label("age_group"), raw.count),
+        select(rollup.date, rollup.hospital_id, rollup.syndrome,
+               unknown.label("age_group"), rollup.count),
+    ).subquery("visits")
+    grouped = select(source.c.date, models.Hospital.zone_id, source.c.hospital_id, source.c.syndrome,
+                     source.c.age_group, func.sum(source.c.count))\
+        .join(models.Hospital, models.Hospital.id == source.c.hospital_id)\
+        .group_by(source.c.date, models.Hospital.zone_id, source.c.hospital_id, source.c.syndrome,
+                  source.c.age_group)
+
+    table = models.VisitCube.__table__
+    db.execute(delete(table))
+    db.execute(table.insert().from_select(
+        ["date", "zone_id", "hospital_id", "syndrome", "age_group", "count"], grouped))
+    db.commit()
+    invalidate()
+
+
+def ensure_built(db: Session) -> bool:
+    """Rebuilds an empty cube over existing visits. Returns True if it did."""
+    if db.query(models.VisitCube.id).first() is not None:
+        return False
+    if db.query(models.VisitEvent.id).first() is None and db.query(models.VisitDailyRollup.id).first() is None:
+        return False
+    rebuild(db)
+    return True
+
+
+# --- Slicing ---
+
+def query(db: Session, group_by: Sequence[str] = (), filters: Optional[Dict[str, Sequence]] = None,
+          start: Optional[date] = None, end: Optional[date] = None, district_id: Optional[int] = None) -> Dict:
+    """
+    Sums visits over a slice of the cube.
+    group_by: Dimensions to keep (subset of DIMENSIONS); the rest are rolled up.
+    filters: Dimension -> allowed values.
+    district_id: Restrict to zones of one district.
+    """
+    group_by = list(dict.fromkeys(group_by))
+    filters = {dim: list(values) for dim, values in (filters or {}).items() if values}
+    for dim in list(group_by) + list(filters):
+        if dim not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension {dim!r}; use one of {', '.join(DIMENSIONS)}")
+
+    # The generation is read before the query runs: a result computed across an invalidate() is
+    # stored under the old generation, where nothing will read it
+    key = (str(db.get_bind().url), tuple(group_by), tuple(sorted((d, tuple(sorted(map(str, v))))
+                                                                   for d, v in filters.items())),
+           start, end, district_id, _generation)
+    cached = _cache_get(key)
+    if cached is not None:
+        return cached
+
+    c = models.VisitCube
+    columns = [getattr(c, dim) for dim in group_by]
+    q = db.query(*columns, func.sum(c.count))
+    for dim, values in filters.items():
+        q = q.filter(getattr(c, dim).in_(values))
+    if start is not None:
+        q = q.filter(c.date >= start)
+    if end is not None:
+        q = q.filter(c.date <= end)
+    if district_id is not None:
+        q = q.filter(c.zone_id.in_(select(models.Zone.id).where(models.Zone.district_id == district_id)))
+    if columns:
+        q = q.group_by(*columns)
+
+    cells = []
+    for row in sorted(q.all(), key=lambda row: _cell_order(row[:-1])):  # In SQL, syndromes and age groups sort by key
+        if row[-1] is None:
+            continue  # Grand total over an empty slice
+        cell = dict(zip(group_by, row[:-1]))
+        cell["count"] = row[-1]
+        cells.append(cell)
+    result = {"group_by": group_by, "cells": cells, "total": sum(cell["count"] for cell in cells)}
+    _cache_put(key, result)
+    return result
+
+
+def merge(results: List[Dict]) -> Dict:
+    """Combines query() results for the same slice from several shards."""
+    group_by = results[0]["group_by"] if results else []
+    totals: Dict[tuple, int] = {}
+    for result in results:
+        for cell in result["cells"]:
+            key = tuple(cell[dim] for dim in group_by)
+            totals[key] = totals.get(key, 0) + cell["count"]
+    ordered = sorted(totals.items(), key=lambda kv: _cell_order(kv[0]))
+    cells = [{**dict(zip(group_by, key)), "count": count} for key, count in ordered]
+    return {"group_by": group_by, "cells": cells, "total": sum(totals.values())}
+
+
+def _cell_order(values: Sequence) -> tuple:
+    return tuple((v is None, v) for v in values)
+
+
+# --- Slice Cache ---
+
+def _cache_get(key: tuple) -> Optional[Dict]:
+    """key ends with the generation it was computed under."""
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > CACHE_TTL_S:
+            cache_stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        cache_stats["hits"] += 1
+        return entry[1]
+
+
+def _cache_put(key: tuple, result: Dict):
+    global _cached_cells
+    size = len(result["cells"]) + 1
+    if size > CACHE_MAX_SLICE_CELLS:
+        return
+    with _cache_lock:
+        if key[-1] != _generation or key in _cache:
+            return  # Invalidated while the query ran, or already stored
+        _cache[key] = (time.monotonic(), result)
+        _cached_cells += size
+        while _cached_cells > CACHE_MAX_CELLS:  # Oldest first; stale generations age out the same way
+            _, (_, evicted) = _cache.popitem(last=False)
+            _cached_cells -= len(evicted["cells"]) + 1
+            cache_stats["evictions"] += 1
+
+
+def clear_cache():
+    global _cached_cells
+    with _cache_lock:
+        _cache.clear()
+        _cached_cells = 0
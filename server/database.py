@@ -3,20 +3,26 @@ from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
 
+import admission, metrics
+
 load_dotenv()
 
 # Default to SQLite for MVP ease-of-run, but support Postgres
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./caresignal.db")
 
-# Postgres requires psycopg2 driver in URL usually, handled by driver installation
-# If using sqlite, check_same_thread needed
-connect_args = {}
-if "sqlite" in DATABASE_URL:
-    connect_args = {"check_same_thread": False}
+def make_engine(url: str):
+    # Postgres requires psycopg2 driver in URL usually, handled by driver installation
+    # If using sqlite, check_same_thread needed
+    connect_args = {}
+    if "sqlite" in url:
+        connect_args = {"check_same_thread": False}
+
+    engine = create_engine(url, connect_args=connect_args)
+    metrics.instrument_engine(engine) # Per-route SQL counts/timings for /metrics
+    admission.instrument_engine(engine) # Analytics requests stop at their deadline
+    return engine
 
-engine = create_engine(
-    DATABASE_URL, connect_args=connect_args
-)
+engine = make_engine(DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
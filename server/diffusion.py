@@ -0,0 +1,304 @@
+"""
+Diffusion simulation over the zone adjacency graph.
+
+DiffusionPage animated spread by interpolating each zone's own forecast, so
+nothing ever moved between wards. This engine steps a state vector over
+the graph for N days, for a batch of scenarios at once:
+
+- sir: a metapopulation SIR model. Each zone has S/I/R compartments
+  (population POPULATION unless the scenario sets one), seeded from recent
+  visits: I from the last 1/gamma days, R from earlier in the HISTORY_DAYS
+  window. A zone's force of infection mixes its own prevalence with the mean
+  prevalence of its neighbours (weight `coupling`). Frames are daily new
+  infections.
+- intensity: forecast intensity (forecasting.calculate_intensity of each
+  zone's day-1 forecast) blended with the neighbours' mean each day and
+  scaled by `growth`, capped at 1. Frames are intensities.
+
+State is dense (one array per compartment, one slot per zone) and the graph
+is the 1-hop CSR of spatial_config.ZoneGraph re-indexed to the zone axis.
+Each shard is simulated over its own graph (merge() combines them).
+Batches of at least POOL_MIN_SCENARIOS scenarios are split across a process
+pool. Results are cached per scenario, keyed by the data version (database,
+ingest seq, graph, day) and the scenario parameters.
+"""
+import base64
+import os
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy.orm import Session
+
+import models, forecasting, ingest_log, spatial_config, timeseries
+
+# Params
+MODELS = ("sir", "intensity")
+HISTORY_DAYS = 31  # Seeding window (30 days + today, as the forecasts use)
+MAX_DAYS = 90
+MAX_SCENARIOS = 64
+POPULATION = 10000  # Default people per zone for the SIR model
+DEFAULTS = {"model": "sir", "beta": 0.3, "gamma": 1 / 7, "coupling": 0.2, "population": POPULATION, "growth": 1.0}
+WORKERS = int(os.getenv("DIFFUSION_WORKERS", str(min(4, os.cpu_count() or 1))))
+POOL_MIN_SCENARIOS = 4  # Smaller batches run inline (pool dispatch costs more than they take)
+CACHE_SIZE = 256  # Scenario results held
+CACHE_TTL_S = 300.0  # Bounds staleness from writes that bypass the ingest log
+
+cache_stats = {"hits": 0, "misses": 0}
+
+
+# --- Core (pure functions, picklable for the process pool) ---
+
+def csr_for(graph: spatial_config.ZoneGraph, zone_ids: Sequence[int]) -> Tuple[array, array]:
+    """graph's 1-hop CSR with rows and columns as positions in zone_ids (zones off the axis dropped)."""
+    position = {z: i for i, z in enumerate(zone_ids)}
+    indptr, indices = array('i', [0]), array('i')
+    for z in zone_ids:
+        indices.extend(sorted(position[n] for n in graph.neighbors(z) if n in position))
+        indptr.append(len(indices))
+    return indptr, indices
+
+
+def _mix(indptr: array, indices: array, x: array, coupling: float) -> array:
+    """(1 - coupling) * x[i] + coupling * mean of x over i's neighbours (x[i] itself if it has none)."""
+    out = array('d', x)
+    for i in range(len(x)):
+        lo, hi = indptr[i], indptr[i + 1]
+        if hi > lo:
+            nbr = 0.0
+            for k in range(lo, hi):
+                nbr += x[indices[k]]
+            out[i] = (1 - coupling) * x[i] + coupling * nbr / (hi - lo)
+    return out
+
+
+def simulate(indptr: array, indices: array, history: List[List[int]], intensity: List[float],
+             scenario: Dict, days: int) -> array:
+    """Runs one scenario; returns float32 frames, day-major ([day][zone])."""
+    n = len(history)
+    frames = array('f')
+    coupling = scenario["coupling"]
+
+    if scenario["model"] == "intensity":
+        x = array('d', intensity)
+        for _ in range(days):
+            x = _mix(indptr, indices, x, coupling)
+            for i in range(n):
+                x[i] = min(1.0, x[i] * scenario["growth"])
+            frames.fromlist(x.tolist())
+        return frames
+
+    beta, gamma, population = scenario["beta"], scenario["gamma"], float(scenario["population"])
+    infectious_days = max(1, round(1 / gamma))
+    I = array('d', (float(sum(row[-infectious_days:])) for row in history))
+    R = array('d', (float(sum(row[:-infectious_days])) for row in history))
+    S = array('d', (max(0.0, population - I[i] - R[i]) for i in range(n)))
+    for _ in range(days):
+        prevalence = _mix(indptr, indices, array('d', (v / population for v in I)), coupling)
+        new = array('d', bytes(8 * n))
+        for i in range(n):
+            infected = min(S[i], beta * S[i] * prevalence[i])
+            recovered = gamma * I[i]
+            S[i] -= infected
+            I[i] += infected - recovered
+            R[i] += recovered
+            new[i] = infected
+        frames.fromlist(new.tolist())
+    return frames
+
+
+def _simulate_chunk(args):
+    indptr, indices, history, intensity, scenarios, days = args
+    return [simulate(indptr, indices, history, intensity, s, days).tobytes() for s in scenarios]
+
+
+# --- Scenarios ---
+
+def normalise(scenario: Dict) -> Dict:
+    """Fills defaults and validates one scenario's parameters."""
+    s = {**DEFAULTS, **{k: v for k, v in scenario.items() if v is not None}}
+    unknown = set(s) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown scenario parameter(s): {', '.join(sorted(unknown))}")
+    if s["model"] not in MODELS:
+        raise ValueError(f"Unknown model {s['model']!r}; use {', '.join(MODELS)}")
+    if not 0 <= s["coupling"] <= 1 or s["beta"] < 0 or not 0 < s["gamma"] <= 1:
+        raise ValueError("coupling must be 0-1, beta non-negative and gamma in (0, 1]")
+    if s["population"] <= 0 or s["growth"] < 0:
+        raise ValueError("population must be positive and growth non-negative")
+    return s
+
+
+def _scenario_key(s: Dict) -> tuple:
+    if s["model"] == "intensity":
+        return ("intensity", s["coupling"], s["growth"])
+    return ("sir", s["beta"], s["gamma"], s["coupling"], s["population"])
+
+
+# --- Pool and Cache ---
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_cache_lock = threading.Lock()
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # key -> (stored_at, frames bytes)
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers)
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def _cache_get(key: tuple) -> Optional[bytes]:
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None or time.monotonic() - entry[0] > CACHE_TTL_S:
+            cache_stats["misses"] += 1
+            return None
+        _cache.move_to_end(key)
+        cache_stats["hits"] += 1
+        return entry[1]
+
+
+def _cache_put(key: tuple, frames: bytes):
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), frames)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# --- DB Stage ---
+
+def _data_version(db: Session, graph: spatial_config.ZoneGraph, zone_ids: List[int], as_of: date) -> tuple:
+    checkpoint = db.get(models.IngestCheckpoint, ingest_log.CHECKPOINT_NAME)
+    edges = zlib.crc32(graph.zone_ids.tobytes() + graph.indptr.tobytes() + graph.indices.tobytes())
+    return (str(db.get_bind().url), checkpoint.last_seq if checkpoint else 0, edges,
+            zlib.crc32(array('i', zone_ids).tobytes()), as_of)
+
+
+def run(db: Session, syndrome: str, scenarios: List[Dict], days: int = 14, as_of: Optional[date] = None,
+        workers: Optional[int] = None) -> Dict:
+    """
+    Simulates `days` days after as_of for each scenario. Returns the zone axis
+    and, per scenario, its parameters, float32 frames ([day][zone]) and whether
+    they came from the cache.
+    """
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"days must be 1-{MAX_DAYS}")
+    if not 1 <= len(scenarios) <= MAX_SCENARIOS:
+        raise ValueError(f"Send 1-{MAX_SCENARIOS} scenarios")
+    scenarios = [normalise(s) for s in scenarios]
+    as_of = as_of or date.today()
+
+    graph = spatial_config.get_graph(db)
+    zone_ids = sorted({z for (z,) in db.query(models.Zone.id)} | set(graph.zone_ids))
+    version = _data_version(db, graph, zone_ids, as_of) + (syndrome, days)
+
+    results: List[Optional[bytes]] = []
+    for s in scenarios:
+        results.append(_cache_get(version + _scenario_key(s)))
+    cached = [r is not None for r in results]
+    todo = [i for i, r in enumerate(results) if r is None]
+
+    if todo:
+        # Dense inputs: history rows per zone and day-1 forecast intensity
+        start = as_of - timedelta(days=HISTORY_DAYS - 1)
+        position = {z: i for i, z in enumerate(zone_ids)}
+        history = [[0] * HISTORY_DAYS for _ in zone_ids]
+        for z, _, d, total in timeseries.zone_daily_counts(db, start, as_of, syndromes=[syndrome]):
+            if z in position:
+                history[position[z]][(d - start).days] += total
+        intensity = [0.0] * len(zone_ids)
+        if any(s["model"] == "intensity" for s in scenarios):
+            for i, fit in enumerate(forecasting.forecast_batch(history, days=1)):
+                first = fit["predictions"][0]["value"] if fit["predictions"] else 0
+                intensity[i] = forecasting.calculate_intensity(first, max(history[i]))
+        indptr, indices = csr_for(graph, zone_ids)
+
+        batch = [scenarios[i] for i in todo]
+        workers = WORKERS if workers is None else workers
+        pool = _get_pool(workers) if workers > 1 and len(batch) >= POOL_MIN_SCENARIOS else None
+        if pool is None:
+            frames = _simulate_chunk((indptr, indices, history, intensity, batch, days))
+        else:
+            size = -(-len(batch) // workers)
+            chunks = [(indptr, indices, history, intensity, batch[i:i + size], days)
+                      for i in range(0, len(batch), size)]
+            frames = [f for chunk in pool.map(_simulate_chunk, chunks) for f in chunk]
+        for i, f in zip(todo, frames):
+            results[i] = f
+            _cache_put(version + _scenario_key(scenarios[i]), f)
+
+    out = []
+    for s, raw, hit in zip(scenarios, results, cached):
+        frames = array('f')
+        frames.frombytes(raw)
+        out.append({"params": s, "frames": frames, "cached": hit, **_peak(frames, len(zone_ids), days)})
+    return {"syndrome": syndrome, "as_of": as_of.isoformat(), "days": days, "zones": zone_ids,
+            "layout": ["day", "zone"], "scenarios": out}
+
+
+def _peak(frames: array, n_zones: int, days: int) -> Dict:
+    totals = [sum(frames[d * n_zones:(d + 1) * n_zones]) for d in range(days)]
+    peak = max(range(days), key=lambda d: totals[d]) if totals else 0
+    return {"peak_day": peak + 1, "peak_total": round(totals[peak], 2) if totals else 0.0}
+
+
+def merge(results: List[Dict]) -> Dict:
+    """
+    Combines run() results from several shards. Adjacency never crosses a
+    shard, so each shard's simulation is independent; frames are re-laid
+    out on the union of the zone axes.
+    """
+    if len(results) == 1:
+        return results[0]
+    days = results[0]["days"]
+    zones = sorted(((z, r, i) for r in results for i, z in enumerate(r["zones"])), key=lambda e: e[0])
+    scenarios = []
+    for k, first in enumerate(results[0]["scenarios"]):
+        frames = array('f', bytes(4 * days * len(zones)))
+        for d in range(days):
+            for j, (_, r, i) in enumerate(zones):
+                frames[d * len(zones) + j] = r["scenarios"][k]["frames"][d * len(r["zones"]) + i]
+        scenarios.append({"params": first["params"], "frames": frames,
+                          "cached": all(r["scenarios"][k]["cached"] for r in results),
+                          **_peak(frames, len(zones), days)})
+    return {**results[0], "zones": [z for z, _, _ in zones], "scenarios": scenarios}
+
+
+def encode(result: Dict, encoding: str = "b64") -> Dict:
+    """Replaces each scenario's frames with base64 (little-endian float32) or a flat list."""
+    scenarios = []
+    for scenario in result["scenarios"]:
+        frames = scenario["frames"]
+        if encoding == "json":
+            encoded = [round(v, 3) for v in frames]
+        else:
+            if sys.byteorder != "little":
+                frames = array('f', frames)
+                frames.byteswap()
+            encoded = base64.b64encode(frames.tobytes()).decode("ascii")
+        scenarios.append({**scenario, "frames": encoded})
+    return {**result, "scenarios": scenarios, "encoding": encoding, "dtype": "float32"}
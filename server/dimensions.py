@@ -0,0 +1,225 @@
+"""
+Dictionary-encoded syndrome and age-group dimensions.
+
+visit_events, visit_daily_rollups, visit_cube and signals store syndrome and
+age group as integer keys into the syndromes / age_groups tables instead of
+repeating the name on every row, so their indexes, GROUP BYs and DISTINCTs
+compare integers rather than strings.
+
+Keys are derived from the name (31-bit CRC-32), so encoding needs no database
+round trip and every shard assigns the same key to the same name; two names
+that collide are rejected when interned. The SyndromeKey / AgeGroupKey column
+types translate at the SQLAlchemy boundary, so models, filters and the API
+keep using names. Only names that are interned or read from a dimension
+table are remembered; a name bound in a filter is encoded without being
+cached, so it can neither grow the cache nor claim a key.
+
+Interning: before an INSERT or UPDATE that writes a dimension column, names
+not yet known to be committed in that database are added to the dimension
+table on the same connection, so they commit or roll back with the rows that
+use them. Writers that bypass SQLAlchemy (the driver-level executemany in
+synthetic_data.py) call intern() themselves. Decoding reads an in-process
+key -> name cache, reloaded from the known databases on a miss (a name first
+written by another process).
+"""
+import logging
+import threading
+import weakref
+import zlib
+from typing import Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import Integer, Table, event, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import Pool
+from sqlalchemy.sql import Insert, Update
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.types import TypeDecorator
+
+logger = logging.getLogger(__name__)
+
+# Params
+UNKNOWN_AGE_GROUP = "Unknown"
+_PENDING = "dimensions.pending"  # conn.info key: names interned in the open transaction
+
+_engines: "weakref.WeakSet[Engine]" = weakref.WeakSet()  # Where to look up names on a decode miss
+
+
+def key_for(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8")) & 0x7FFFFFFF
+
+
+class Dimension:
+    def __init__(self, name: str, preseed: Iterable[str] = ()):
+        self.name = name
+        self.table: Optional[Table] = None
+        self.preseed = list(preseed)
+        self._names: Dict[int, str] = {}  # key -> name
+        self._stored: Dict[str, Set[str]] = {}  # database URL -> names committed there
+        self._lock = threading.Lock()
+
+    def attach(self, table: Table):
+        """Binds the dimension to its table (called from models.py)."""
+        self.table = table
+        event.listen(table, "after_create", self._created)
+
+    # --- Encoding ---
+
+    def encode(self, name: str) -> int:
+        """The key for `name`. Doesn't remember it: query filters bind arbitrary strings."""
+        key = key_for(name)
+        known = self._names.get(key)
+        if known is not None and known != name:
+            raise ValueError(f"{self.name}: {name!r} and {known!r} share the key {key}")
+        return key
+
+    def _remember(self, names: Iterable[str]):
+        with self._lock:
+            for name in names:
+                key = key_for(name)
+                known = self._names.setdefault(key, name)
+                if known != name:
+                    raise ValueError(f"{self.name}: {name!r} and {known!r} share the key {key}")
+
+    def decode(self, key: int) -> str:
+        name = self._names.get(key)
+        if name is None:
+            self._load()
+            name = self._names.get(key)
+            if name is None:
+                raise LookupError(f"{self.name}: no name for key {key}")
+        return name
+
+    def _load(self):
+        for engine in list(_engines):
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(select(self.table.c.id, self.table.c.name)).all()
+            except SQLAlchemyError:
+                logger.exception("Could not load %s from %s", self.table.name, engine.url)
+                continue
+            with self._lock:
+                for key, name in rows:
+                    self._names.setdefault(key, name)
+
+    # --- Interning ---
+
+    def intern(self, conn: Connection, names: Iterable[str]):
+        """Adds any of `names` missing from this database's dimension table, in conn's transaction."""
+        url = str(conn.engine.url)
+        stored = self._stored.get(url, ())
+        pending = {p for dim, _, batch in conn.info.get(_PENDING, ()) if dim is self for p in batch}
+        new = {n for n in names if n is not None and n not in stored and n not in pending}
+        if not new:
+            return
+
+        keys = {n: self.encode(n) for n in new}
+        table = self.table
+        existing = dict(conn.execute(select(table.c.id, table.c.name).where(table.c.id.in_(list(keys.values())))).all())
+        for name, key in keys.items():
+            if existing.get(key, name) != name:
+                raise ValueError(f"{self.name}: {name!r} and {existing[key]!r} share the key {key}")
+        self._remember(new)  # Only written names claim a key (also rejects two new names that collide)
+        missing = [{"id": key, "name": name} for name, key in keys.items() if key not in existing]
+        if missing:
+            dialect = conn.dialect.name
+            if dialect in ("sqlite", "postgresql"):
+                insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+                conn.execute(insert(table).on_conflict_do_nothing(index_elements=["id"]), missing)
+            else:
+                conn.execute(table.insert(), missing)
+            conn.info.setdefault(_PENDING, []).append((self, url, [m["name"] for m in missing]))
+        if existing:
+            self._mark_stored(url, existing.values())
+
+    def _mark_stored(self, url: str, names: Iterable[str]):
+        with self._lock:
+            self._stored.setdefault(url, set()).update(names)
+
+    def _created(self, table: Table, conn: Connection, **kw):
+        # A new (or recreated) table holds nothing this process may remember about that URL
+        with self._lock:
+            self._stored.pop(str(conn.engine.url), None)
+        if self.preseed:
+            self.intern(conn, self.preseed)
+
+
+SYNDROMES = Dimension("syndrome")
+AGE_GROUPS = Dimension("age_group", preseed=[UNKNOWN_AGE_GROUP])
+
+
+# --- Column Types ---
+
+class DimensionKey(TypeDecorator):
+    impl = Integer
+    cache_ok = True
+    dimension: Dimension = None
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else self.dimension.encode(value)
+
+    def process_literal_param(self, value, dialect):
+        return "NULL" if value is None else str(self.dimension.encode(value))
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else self.dimension.decode(value)
+
+
+class SyndromeKey(DimensionKey):
+    cache_ok = True
+    dimension = SYNDROMES
+
+
+class AgeGroupKey(DimensionKey):
+    cache_ok = True
+    dimension = AGE_GROUPS
+
+
+# --- Connection Events ---
+
+_columns_by_table: Dict[Table, List] = {}
+
+
+def _dimension_columns(table) -> List:
+    columns = _columns_by_table.get(table)
+    if columns is None:
+        columns = [(c.key, c.type.dimension) for c in getattr(table, "columns", ())
+                   if isinstance(c.type, DimensionKey)]
+        _columns_by_table[table] = columns
+    return columns
+
+
+@event.listens_for(Engine, "before_execute")
+def _intern_written(conn, clauseelement, multiparams, params, execution_options):
+    _engines.add(conn.engine)
+    if not isinstance(clauseelement, (Insert, Update)):
+        return
+    columns = _dimension_columns(clauseelement.table)
+    if not columns:
+        return
+    rows = list(multiparams) or [params]
+    values = {getattr(c, "key", c): v.value for c, v in (clauseelement._values or {}).items()
+              if isinstance(v, BindParameter)}  # .values(syndrome=...)
+    for key, dimension in columns:
+        names = {row[key] for row in rows if row and key in row}
+        if key in values:
+            names.add(values[key])
+        if names:
+            dimension.intern(conn, names)
+
+
+@event.listens_for(Engine, "commit")
+def _promote_pending(conn):
+    for dimension, url, names in conn.info.pop(_PENDING, ()):
+        dimension._mark_stored(url, names)
+
+
+@event.listens_for(Engine, "rollback")
+def _drop_pending(conn):
+    conn.info.pop(_PENDING, None)
+
+
+@event.listens_for(Pool, "reset")
+def _drop_pending_on_reset(dbapi_connection, connection_record, reset_state):
+    connection_record.info.pop(_PENDING, None)
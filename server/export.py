@@ -0,0 +1,138 @@
+"""
+Streaming CSV / NDJSON exports of visits, signals and actions.
+
+Exports can cover months of data, so nothing is materialised: each export
+is a Core SELECT executed with stream_results + yield_per (a server-side
+cursor on Postgres; SQLite steps its cursor lazily anyway), encoded a
+partition at a time and handed to StreamingResponse as a generator. The
+generator opens its own session, because the request's session is closed
+once the endpoint returns, before the body has been streamed.
+
+Visits include compacted days (visit_daily_rollups, source="rollup", with
+no age group or row id) followed by raw rows, each in date order. An
+export spanning several shards streams them one after another, in that
+order per shard.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import literal, null, select
+
+import models
+
+# Params
+YIELD_PER = 2000  # Rows fetched (and encoded) per chunk
+FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+class ExportFilters:
+    def __init__(self, zone_id: Optional[int] = None, syndrome: Optional[str] = None,
+                 start: Optional[date] = None, end: Optional[date] = None, district_id: Optional[int] = None):
+        self.zone_id = zone_id
+        self.district_id = district_id
+        self.syndrome = syndrome if syndrome and syndrome != "ALL" else None
+        self.start = start
+        self.end = end
+
+
+def _visit_queries(f: ExportFilters) -> List:
+    queries = []
+    for table, source in ((models.VisitDailyRollup, "rollup"), (models.VisitEvent, "raw")):
+        raw = table is models.VisitEvent
+        q = select(
+            table.id if raw else null().label("id"),
+            table.date, models.Hospital.zone_id, table.hospital_id, table.syndrome,
+            table.age_group if raw else null().label("age_group"),
+            table.count, literal(source).label("source"),
+        ).join(models.Hospital, models.Hospital.id == table.hospital_id)
+        if f.zone_id is not None:
+            q = q.where(models.Hospital.zone_id == f.zone_id)
+        if f.district_id is not None:
+            q = q.join(models.Zone, models.Zone.id == models.Hospital.zone_id)\
+                .where(models.Zone.district_id == f.district_id)
+        if f.syndrome:
+            q = q.where(table.syndrome == f.syndrome)
+        if f.start:
+            q = q.where(table.date >= f.start)
+        if f.end:
+            q = q.where(table.date <= f.end)
+        queries.append(q.order_by(table.date, table.id))
+    return queries
+
+
+def _signal_queries(f: ExportFilters) -> List:
+    s = models.Signal
+    q = select(s.id, s.date, s.zone_id, s.syndrome, s.signal_type, s.is_spike, s.value, s.baseline,
+               s.severity, s.confidence, s.status, s.assigned_to, s.sla_deadline, s.explanation)
+    if f.zone_id is not None:
+        q = q.where(s.zone_id == f.zone_id)
+    if f.district_id is not None:
+        q = q.join(models.Zone, models.Zone.id == s.zone_id).where(models.Zone.district_id == f.district_id)
+    if f.syndrome:
+        q = q.where(s.syndrome == f.syndrome)
+    if f.start:
+        q = q.where(s.date >= f.start)
+    if f.end:
+        q = q.where(s.date <= f.end)
+    return [q.order_by(s.date, s.id)]
+
+
+def _action_queries(f: ExportFilters) -> List:
+    a, s = models.Action, models.Signal
+    q = select(a.id, a.signal_id, s.zone_id, s.syndrome, s.date.label("signal_date"), a.status, a.notes,
+               a.updated_at).join(s, s.id == a.signal_id)
+    if f.zone_id is not None:
+        q = q.where(s.zone_id == f.zone_id)
+    if f.district_id is not None:
+        q = q.join(models.Zone, models.Zone.id == s.zone_id).where(models.Zone.district_id == f.district_id)
+    if f.syndrome:
+        q = q.where(s.syndrome == f.syndrome)
+    # Date range applies to when the action was recorded
+    if f.start:
+        q = q.where(a.updated_at >= datetime.combine(f.start, time.min))
+    if f.end:
+        q = q.where(a.updated_at < datetime.combine(f.end + timedelta(days=1), time.min))
+    return [q.order_by(a.updated_at, a.id)]
+
+
+DATASETS: Dict[str, Callable[[ExportFilters], List]] = {
+    "visits": _visit_queries,
+    "signals": _signal_queries,
+    "actions": _action_queries,
+}
+
+
+def _value(v):
+    if isinstance(v, (date, datetime)):
+        return v.isoformat()
+    return v
+
+
+def _encode(columns: List[str], rows, fmt: str) -> str:
+    if fmt == "ndjson":
+        return "".join(json.dumps(dict(zip(columns, map(_value, row)))) + "\n" for row in rows)
+    buf = io.StringIO()
+    csv.writer(buf).writerows([["" if v is None else _value(v) for v in row] for row in rows])
+    return buf.getvalue()
+
+
+def stream_export(session_factories: List[Callable], dataset: str, fmt: str, filters: ExportFilters,
+                  yield_per: int = YIELD_PER) -> Iterator[str]:
+    """Yields the encoded export a chunk at a time (CSV header first), one shard after another."""
+    queries = DATASETS[dataset](filters)
+    columns = [c.name for c in queries[0].selected_columns]
+    if fmt == "csv":
+        yield _encode(columns, [columns], "csv")
+
+    for session_factory in session_factories:
+        db = session_factory()
+        try:
+            for q in queries:
+                result = db.execute(q.execution_options(stream_results=True, yield_per=yield_per))
+                for partition in result.partitions():
+                    yield _encode(columns, partition, fmt)
+        finally:
+            db.close()
@@ -1,6 +1,8 @@
-from typing import List, Tuple, Dict
+from typing import List, Sequence, Tuple, Dict
 import math
 
+import metrics
+
 class Forecaster:
     def __init__(self, alpha: float = 0.5, beta: float = 0.3, phi: float = 0.9):
         """
@@ -18,10 +20,11 @@ class Forecaster:
         self.resid_std = 0.0 # Standard deviation of residuals
         self.history = []
 
-    def fit(self, data: List[int]):
+    @metrics.timed("forecast.fit")
+    def fit(self, data: Sequence[int]):
         """
         Fits the model to the provided historical data.
-        data: List of integers (daily counts), ordered from oldest to newest.
+        data: Daily counts, oldest to newest (a list, or a series_store view).
         """
         if not data:
             return
@@ -70,6 +73,7 @@ class Forecaster:
             # Fallback if not enough data
             self.resid_std = self.level * 0.1 # 10% heuristic
 
+    @metrics.timed("forecast.predict")
     def predict(self, days: int = 7) -> List[Dict[str, float]]:
         """
         Predicts future values for 'days' steps.
@@ -195,3 +199,65 @@ def calculate_intensity(forecast_val: float, historical_max: float) -> float:
     intensity = forecast_val / denom
     
     return float(min(1.0, max(0.0, intensity)))
+
+@metrics.timed("forecast.batch")
+def forecast_batch(series: List[List[int]], days: int = 7, alpha: float = 0.5, beta: float = 0.3,
+                   phi: float = 0.9) -> List[Dict]:
+    """
+    Fits and forecasts many equal-length series in one pass over the time
+    axis (same maths and output as Forecaster.fit/predict, which it matches
+    exactly). The damping sums are computed once for the whole batch.
+    Returns one dict per series: { 'level', 'trend', 'predictions': [...] }.
+    """
+    if not series:
+        return []
+    n = len(series[0])
+    if any(len(s) != n for s in series):
+        raise ValueError("forecast_batch needs equal-length series")
+    if n == 0:
+        return [{"level": 0.0, "trend": 0.0, "predictions": []} for _ in series]
+
+    k = len(series)
+    if n == 1:
+        levels = [float(s[0]) for s in series]
+        trends = [0.0] * k
+        stds = [0.0] * k
+    else:
+        levels = [float(s[1]) for s in series]
+        trends = [float(s[1] - s[0]) for s in series]
+        residuals = [[] for _ in range(k)]
+        for i in range(2, n):
+            for j in range(k):
+                value = float(series[j][i])
+                last_level, last_trend = levels[j], trends[j]
+                pred = last_level + (phi * last_trend)
+                residuals[j].append(value - pred)
+                levels[j] = (alpha * value) + ((1 - alpha) * pred)
+                trends[j] = (beta * (levels[j] - last_level)) + ((1 - beta) * phi * last_trend)
+
+        stds = []
+        for j in range(k):
+            res = residuals[j]
+            if len(res) > 1:
+                mean_res = sum(res) / len(res)
+                stds.append(math.sqrt(sum((x - mean_res) ** 2 for x in res) / (len(res) - 1)))
+            else:
+                stds.append(levels[j] * 0.1)
+
+    damping = [sum([phi**i for i in range(1, h+1)]) for h in range(1, days + 1)]
+    roots = [math.sqrt(h) for h in range(1, days + 1)]
+
+    results = []
+    for j in range(k):
+        predictions = []
+        for h in range(1, days + 1):
+            forecast_val = max(0.0, levels[j] + (trends[j] * damping[h - 1]))
+            margin = 1.96 * stds[j] * roots[h - 1]
+            predictions.append({
+                "day": h,
+                "value": round(forecast_val, 1),
+                "lower_bound": round(max(0.0, forecast_val - margin), 1),
+                "upper_bound": round(forecast_val + margin, 1)
+            })
+        results.append({"level": levels[j], "trend": trends[j], "predictions": predictions})
+    return results
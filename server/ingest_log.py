@@ -0,0 +1,581 @@
+"""
+Append-only ingestion log.
+
+/ingest/batch appends each batch as one newline-delimited JSON record
+({"seq": 42, "ts": ..., "visits": [...]}) and returns as soon as the
+record is fsynced, so a hospital's upload is durable even while the
+database is slow or being migrated. Concurrent appends share fsyncs via
+ingest_queue's group commit.
+
+A background LogApplier replays records into visit_events. The highest
+applied seq is stored in ingest_checkpoints in the same transaction as the
+rows (with a compare-and-set), so replay is idempotent and resumes from
+the checkpoint after a crash. Rows uploaded through /sync carry a client
+idempotency key; the applier stores the keys in sync_keys in that same
+transaction and skips rows whose key is already there (see sync.py). The
+visit cube (cube.py) and the weekly/monthly aggregates (pyramid.py) are
+updated in that transaction too, as is each touched zone's latest seq
+(zone_ingest_seqs, which tells the precompute pipeline what is stale); the
+shared series store (series_store.py), when enabled, right after the commit.
+Signal detection also runs after the commit and keeps its own checkpoint
+(DETECTION_CHECKPOINT_NAME), so records committed just before a crash are
+detected on the next pass.
+
+A batch that fails is retried one record at a time. A record that fails
+QUARANTINE_AFTER times on its own is stored in ingest_quarantine with the
+error, and the checkpoint moves past it so later uploads aren't blocked
+(counted in LogApplier.stats, see /admin/ingest/stats). Database outages
+(OperationalError) never quarantine anything.
+
+On disk the log is a directory of segments named after their first seq
+(000000000001.ndjson, ...). Fully applied segments are deleted; the
+newest segment is always kept so seqs never restart. Readers remember
+where each record they returned ends (a small seq -> byte offset cache),
+so the next batch seeks there instead of re-parsing the segment.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import models, database, signal_engine, ingest_queue, sync, cube, pyramid, series_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Params
+LOG_DIR = os.getenv("INGEST_LOG_DIR", "./ingest_log")
+SEGMENT_BYTES = int(os.getenv("INGEST_LOG_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+APPLY_BATCH = 500  # Records per apply transaction
+APPLY_POLL_S = 1.0
+CHECKPOINT_NAME = "visit_events"
+DETECTION_CHECKPOINT_NAME = "signal_detection"  # Detection runs after the commit, so it has its own
+QUARANTINE_AFTER = 3  # Failed attempts before a record is set aside in ingest_quarantine
+SEGMENT_SUFFIX = ".ndjson"
+CURSOR_CACHE = 2048  # Read positions remembered (seq -> where the next record starts)
+
+
+class IngestLog:
+    def __init__(self, directory: str = LOG_DIR, segment_bytes: int = SEGMENT_BYTES):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.queue = ingest_queue.GroupCommitQueue(writer=self._append_group)
+
+        self._mutex = threading.Lock()
+        self._last_seq = 0
+        self._segment = None  # (first_seq, path) of the segment being appended to
+        self._size = -1  # Size we believe the current segment has; -1 = unknown
+        self._cursors: "OrderedDict[int, Tuple[int, int]]" = OrderedDict()  # seq -> (segment first_seq, offset)
+        self._cursor_lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, rows: List[Dict]) -> int:
+        """Durably appends one batch of visit rows. Returns its sequence number."""
+        return self.queue.submit(rows)
+
+    def durable_seq(self) -> int:
+        """Highest seq whose record has been fsynced (by any process)."""
+        with self._locked():
+            return self._last_seq
+
+    def reserve_through(self, seq: int):
+        """
+        Makes sure new records are numbered after `seq`. Used when the
+        checkpoint is ahead of the log (e.g. the log directory was wiped),
+        so fresh appends aren't mistaken for already-applied ones.
+        """
+        with self._locked():
+            if self._last_seq >= seq:
+                return
+            path = self._segment_path(seq + 1)
+            open(path, "ab").close()
+            self._fsync_dir()
+            self._segment, self._size = (seq + 1, path), 0
+            self._last_seq = seq
+        with self._cursor_lock:
+            self._cursors.clear()
+
+    # --- Writing ---
+
+    def _append_group(self, batches: List[List[Dict]]) -> List[int]:
+        with self._locked():
+            first_seq = self._last_seq + 1
+            lines = []
+            for i, rows in enumerate(batches):
+                record = {"seq": first_seq + i, "ts": round(time.time(), 3), "visits": rows}
+                lines.append(json.dumps(record, default=str, separators=(",", ":")) + "\n")
+            data = "".join(lines).encode("utf-8")
+
+            if self._segment is None or (self._size > 0 and self._size + len(data) > self.segment_bytes):
+                self._segment = (first_seq, self._segment_path(first_seq))
+                self._size = 0
+
+            try:
+                with open(self._segment[1], "ab") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self._size == 0:
+                    self._fsync_dir()  # Make the new segment's directory entry durable
+            except OSError:
+                # The bytes may have reached the file even though fsync failed; the queue
+                # retries this group under new seqs, so cut the segment back first
+                self._truncate_tail(self._size)
+                raise
+
+            self._size += len(data)
+            self._last_seq = first_seq + len(batches) - 1
+            return list(range(first_seq, self._last_seq + 1))
+
+    def _truncate_tail(self, size: int):
+        try:
+            with open(self._segment[1], "r+b") as f:
+                f.truncate(size)
+                os.fsync(f.fileno())
+        except OSError as e:
+            self._size = -1  # Rescan the tail on the next append
+            raise ingest_queue.WriteAborted(f"Could not roll back a failed append to {self._segment[1]}") from e
+
+    def _locked(self):
+        return _LogLock(self)
+
+    def _sync_tail(self):
+        """
+        Re-reads the newest segment if it changed under us (another process
+        appended, or a write failed). Drops a torn trailing record left by a
+        crash mid-write; that append was never acknowledged.
+        """
+        segments = self._segments()
+        if not segments:
+            self._segment, self._size = None, -1
+            return
+
+        first_seq, path = segments[-1]
+        size = os.path.getsize(path)
+        if self._segment == (first_seq, path) and size == self._size:
+            return
+
+        with open(path, "rb") as f:
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(path, "r+b") as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+
+        last_seq = first_seq - 1
+        tail = data[:end].rstrip(b"\n")
+        if tail:
+            last_seq = json.loads(tail[tail.rfind(b"\n") + 1:])["seq"]
+
+        self._segment, self._size = (first_seq, path), end
+        self._last_seq = max(self._last_seq, last_seq)
+
+    # --- Reading ---
+
+    def read_from(self, after_seq: int, limit: int, up_to: Optional[int] = None) -> Iterator[Dict]:
+        """Yields up to `limit` records with after_seq < seq <= up_to, in order."""
+        segments = self._segments()
+        cursor = self._cursor_for(after_seq, {first_seq for first_seq, _ in segments})
+        emitted = 0
+        for i, (first_seq, path) in enumerate(segments):
+            next_first = segments[i + 1][0] if i + 1 < len(segments) else None
+            if next_first is not None and next_first <= after_seq + 1:
+                continue  # Segment fully applied
+            if cursor is not None and first_seq < cursor[0]:
+                continue  # Before the remembered position
+            offset = cursor[1] if cursor is not None and first_seq == cursor[0] else 0
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                continue  # Truncated concurrently
+            with f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        return  # Record still being written
+                    offset += len(line)
+                    record = json.loads(line)
+                    if record["seq"] <= after_seq:
+                        continue
+                    if up_to is not None and record["seq"] > up_to:
+                        return
+                    self._remember(record["seq"], first_seq, offset)
+                    yield record
+                    emitted += 1
+                    if emitted >= limit:
+                        return
+
+    def _cursor_for(self, after_seq: int, live_segments) -> Optional[Tuple[int, int]]:
+        """Where to start reading for after_seq: the closest remembered position at or before it."""
+        with self._cursor_lock:
+            best = None
+            for seq, position in self._cursors.items():
+                if seq <= after_seq and position[0] in live_segments and (best is None or seq > best[0]):
+                    best = (seq, position)
+        return best[1] if best is not None else None
+
+    def _remember(self, seq: int, first_seq: int, offset: int):
+        with self._cursor_lock:
+            self._cursors[seq] = (first_seq, offset)
+            self._cursors.move_to_end(seq)
+            while len(self._cursors) > CURSOR_CACHE:
+                self._cursors.popitem(last=False)
+
+    def truncate_before(self, applied_seq: int):
+        """Deletes segments whose records are all <= applied_seq (never the newest)."""
+        segments = self._segments()
+        for (first_seq, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first <= applied_seq + 1:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    # --- Helpers ---
+
+    def _segments(self):
+        names = [n for n in os.listdir(self.directory) if n.endswith(SEGMENT_SUFFIX)]
+        return sorted((int(n[:-len(SEGMENT_SUFFIX)]), os.path.join(self.directory, n)) for n in names)
+
+    def _segment_path(self, first_seq: int) -> str:
+        return os.path.join(self.directory, f"{first_seq:012d}{SEGMENT_SUFFIX}")
+
+    def _fsync_dir(self):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class _LogLock:
+    """In-process mutex plus an flock so several uvicorn workers can share one log."""
+
+    def __init__(self, log: IngestLog):
+        self.log = log
+        self.fd = None
+
+    def __enter__(self):
+        self.log._mutex.acquire()
+        try:
+            if fcntl is not None:
+                self.fd = os.open(os.path.join(self.log.directory, ".lock"), os.O_RDWR | os.O_CREAT)
+                fcntl.flock(self.fd, fcntl.LOCK_EX)
+            self.log._sync_tail()
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)  # Releases the flock
+            self.fd = None
+        self.log._mutex.release()
+
+
+class LogApplier:
+    def __init__(self, log: IngestLog, session_factory=None, batch_size: int = APPLY_BATCH,
+                 poll_interval: float = APPLY_POLL_S, autostart: bool = True):
+        """
+        session_factory: Callable returning a Session (defaults to database.SessionLocal).
+        batch_size: Log records applied per transaction.
+        poll_interval: How often to look for records appended by other processes.
+        autostart: Start the background thread on notify(); when False, records
+                   are only applied by explicit apply_pending() calls (benchmarks).
+        """
+        self.log = log
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.autostart = autostart
+
+        self.applied_seq = 0
+        self.stats = {"applied": 0, "failed_attempts": 0, "quarantined": 0}
+        self._failures: Dict[int, int] = {}  # seq -> failed attempts applying that record alone
+        self._wake = threading.Event()
+        self._applied = threading.Condition()
+        self._thread = None
+        self._apply_lock = threading.Lock()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ingest-log-applier", daemon=True)
+            self._thread.start()
+
+    def notify(self):
+        """Wakes the applier after an append."""
+        if self.autostart:
+            self.start()
+        self._wake.set()
+
+    def wait_for(self, seq: int, timeout: float = 30) -> bool:
+        """Blocks until `seq` has been applied to the database."""
+        self.notify()
+        deadline = time.monotonic() + timeout
+        with self._applied:
+            while self.applied_seq < seq:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._applied.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                while self.apply_pending():
+                    pass
+            except Exception:
+                logger.exception("Ingest log apply failed; will retry")
+                time.sleep(self.poll_interval)
+
+    def apply_pending(self) -> int:
+        """Applies the next batch of log records. Returns the number applied."""
+        with self._apply_lock:
+            factory = self.session_factory or database.SessionLocal
+            db = factory()
+            try:
+                applied = self._apply_batch(db)
+            finally:
+                db.close()
+        return applied
+
+    def _apply_batch(self, db) -> int:
+        start_seq = self._checkpoint(db)
+        durable_seq = self.log.durable_seq()
+        if durable_seq < start_seq:
+            logger.warning("Ingest log is behind its checkpoint (%s < %s); renumbering", durable_seq, start_seq)
+            self.log.reserve_through(start_seq)
+        self._catch_up_detection(db, start_seq)
+
+        records = list(self.log.read_from(start_seq, self.batch_size, up_to=durable_seq))
+        if not records:
+            self._mark_applied(start_seq)
+            return 0
+
+        try:
+            return self._apply_records(db, start_seq, records)
+        except OperationalError:
+            raise  # Database unavailable: the whole batch is retried later
+        except Exception:
+            if len(records) == 1:
+                return self._quarantine_or_raise(db, start_seq, records[0])
+
+        # Some record in the batch is bad: apply one at a time so the others aren't held up behind it
+        applied = 0
+        for record in records:
+            try:
+                n = self._apply_records(db, start_seq, [record])
+            except OperationalError:
+                raise
+            except Exception:
+                n = self._quarantine_or_raise(db, start_seq, record)
+            if n == 0:
+                break  # Another applier moved the checkpoint
+            start_seq = record["seq"]
+            applied += n
+        return applied
+
+    def _apply_records(self, db, start_seq: int, records: List[Dict]) -> int:
+        """Applies records (start_seq < seq) in one transaction. Returns the number applied."""
+        end_seq = records[-1]["seq"]
+        zones = {}
+        try:
+            rows = []
+            for record in records:
+                for v in record["visits"]:
+                    row = {**v, "date": date.fromisoformat(v["date"])}
+                    key = row.pop("key", None)  # Set on /sync rows
+                    rows.append((key and {"key": key, "hospital_id": row["hospital_id"], "seq": record["seq"]}, row))
+            rows, keys = self._drop_known_keys(db, rows)
+
+            if rows:
+                db.execute(insert(models.VisitEvent), rows)
+                zones = cube.add_visits(db, rows)
+                pyramid.add_visits(db, rows, zones)
+                self._mark_zones(db, set(zones.values()), end_seq)
+            if keys:
+                db.execute(insert(models.SyncKey), keys)
+            if not self._advance(db, start_seq, end_seq):
+                db.rollback()
+                return 0
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        for record in records:
+            self._failures.pop(record["seq"], None)
+        self.stats["applied"] += len(records)
+        cube.invalidate()
+        self._update_series_store(db, rows, zones, start_seq, end_seq)
+        self._detect(db, records)
+        self._set_detected(db, end_seq)
+        self._mark_applied(end_seq)
+        self.log.truncate_before(end_seq)
+        return len(records)
+
+    def _quarantine_or_raise(self, db, start_seq: int, record: Dict) -> int:
+        """
+        Called while handling a record's apply failure. Re-raises (the record is
+        retried) until it has failed QUARANTINE_AFTER times, then stores it in
+        ingest_quarantine and moves the checkpoint past it.
+        """
+        seq = record["seq"]
+        error = sys.exc_info()[1]
+        self.stats["failed_attempts"] += 1
+        self._failures[seq] = self._failures.get(seq, 0) + 1
+        if self._failures[seq] < QUARANTINE_AFTER:
+            raise
+
+        try:
+            db.add(models.IngestQuarantine(seq=seq, record=json.dumps(record, separators=(",", ":")),
+                                           error=repr(error)))
+            if not self._advance(db, start_seq, seq):
+                db.rollback()
+                return 0
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        logger.error("Ingest log record %s quarantined after %s failed attempts: %r", seq, self._failures[seq], error)
+        self._failures.pop(seq, None)
+        self.stats["quarantined"] += 1
+        self._mark_applied(seq)
+        return 1
+
+    def _advance(self, db, from_seq: int, to_seq: int) -> bool:
+        """Compare-and-set of the apply checkpoint: False if another applier moved it."""
+        return db.execute(
+            update(models.IngestCheckpoint)
+            .where(models.IngestCheckpoint.name == CHECKPOINT_NAME)
+            .where(models.IngestCheckpoint.last_seq == from_seq)
+            .values(last_seq=to_seq)
+        ).rowcount == 1
+
+    def _mark_zones(self, db, zone_ids, seq: int):
+        """Records seq as the latest change to each zone (the pipeline recomputes those)."""
+        rows = [{"zone_id": z, "last_seq": seq} for z in sorted(z for z in zone_ids if z is not None)]
+        if not rows:
+            return
+        table = models.ZoneIngestSeq.__table__
+        dialect = db.get_bind().dialect.name
+
+        if dialect in ("sqlite", "postgresql"):
+            insert_ = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            stmt = insert_(table)
+            stmt = stmt.on_conflict_do_update(index_elements=["zone_id"], set_={"last_seq": stmt.excluded.last_seq})
+            db.execute(stmt, rows)
+            return
+
+        # Portable fallback
+        for row in rows:
+            db.merge(models.ZoneIngestSeq(**row))
+
+    def _update_series_store(self, db, rows: List[Dict], zones: Dict[int, int], start_seq: int, end_seq: int):
+        """Patches the shared daily-counts store before detection reads it (if one is registered)."""
+        store = series_store.store_for(db)
+        if store is None:
+            return
+        try:
+            store.apply(db, rows, zones, start_seq, end_seq)
+        except Exception:
+            # The rows are committed; the store catches up with a rebuild on the next batch
+            logger.exception("Series store update failed after seq %s", end_seq)
+
+    def _drop_known_keys(self, db, rows: List[tuple]):
+        """Skips synced rows whose idempotency key is already stored (or repeated in this batch)."""
+        stored = sync.known_keys(db, {k["key"] for k, _ in rows if k})
+        kept, keys, fresh = [], [], set()
+        for key, row in rows:
+            if key:
+                if key["key"] in stored or key["key"] in fresh:
+                    continue
+                fresh.add(key["key"])
+                keys.append(key)
+            kept.append(row)
+        return kept, keys
+
+    def _checkpoint(self, db, name: str = CHECKPOINT_NAME, initial: int = 0) -> int:
+        checkpoint = db.get(models.IngestCheckpoint, name)
+        if checkpoint is None:
+            try:
+                db.add(models.IngestCheckpoint(name=name, last_seq=initial))
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+            checkpoint = db.get(models.IngestCheckpoint, name)
+        return checkpoint.last_seq
+
+    def _set_detected(self, db, seq: int):
+        db.execute(update(models.IngestCheckpoint)
+                   .where(models.IngestCheckpoint.name == DETECTION_CHECKPOINT_NAME)
+                   .where(models.IngestCheckpoint.last_seq < seq)
+                   .values(last_seq=seq))
+        db.commit()
+
+    def _catch_up_detection(self, db, applied_seq: int):
+        """Re-runs detection for records committed before a crash cut it short (detection is idempotent)."""
+        # Databases from before this checkpoint start from the applied seq rather than replaying history
+        detected = self._checkpoint(db, DETECTION_CHECKPOINT_NAME, initial=applied_seq)
+        while detected < applied_seq:
+            records = list(self.log.read_from(detected, self.batch_size, up_to=applied_seq))
+            if not records:
+                break  # Not in the log any more
+            self._detect(db, records)
+            detected = records[-1]["seq"]
+            self._set_detected(db, detected)
+        if detected < applied_seq:
+            self._set_detected(db, applied_seq)
+
+    def _detect(self, db, records: List[Dict]):
+        """Signal detection once per (zone, day) touched by the applied records."""
+        targets = {}
+        for record in records:
+            for v in record["visits"]:  # A sync can span several days and hospitals
+                try:
+                    targets.setdefault(v["hospital_id"], set()).add(date.fromisoformat(v["date"]))
+                except (KeyError, TypeError, ValueError):
+                    continue  # Part of a quarantined record
+
+        seen = set()
+        hospitals = db.query(models.Hospital).filter(models.Hospital.id.in_(list(targets))).all()
+        for hospital in hospitals:
+            for d in sorted(targets[hospital.id]):
+                if (hospital.zone_id, d) in seen:
+                    continue
+                seen.add((hospital.zone_id, d))
+                try:
+                    signal_engine.detect_signals_for_hospital(db, hospital, d)
+                except Exception:
+                    db.rollback()
+                    logger.exception("Signal detection failed for zone %s on %s", hospital.zone_id, d)
+
+    def _mark_applied(self, seq: int):
+        with self._applied:
+            self.applied_seq = max(self.applied_seq, seq)
+            self._applied.notify_all()
+
+
+log = IngestLog()
+applier = LogApplier(log)
@@ -0,0 +1,164 @@
+"""
+Group-commit write queue for visit ingestion.
+
+Concurrent hospitals posting batches used to pay one commit (fsync) each
+and contend for SQLite's single write lock. Requests now hand their rows
+to a single writer thread, which collects everything that arrives within
+a short window (or until the group is full) and persists it with one
+flush. Each caller blocks until the flush holding its rows is durable.
+A caller still queued after SUBMIT_TIMEOUT_S withdraws its rows and gets
+SubmitTimeout, so nothing is written behind its back and a retry can't
+store them twice; once its group is being written it waits for the
+outcome.
+
+The ingestion log (ingest_log.py) uses this to batch its fsyncs. A writer
+that fails with a transient error (OSError, OperationalError) must leave
+nothing behind, since the group is written again on retry; one that can't
+undo a partial write raises WriteAborted, which is never retried.
+"""
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy.exc import OperationalError
+
+# Params
+MAX_GROUP_ROWS = int(os.getenv("INGEST_GROUP_MAX_ROWS", "5000"))  # Size trigger
+MAX_GROUP_WAIT_MS = float(os.getenv("INGEST_GROUP_WAIT_MS", "5"))  # Time trigger
+SUBMIT_TIMEOUT_S = 30
+WRITE_RETRIES = 3
+
+
+class WriteAborted(Exception):
+    """The writer failed and could not undo a partial write; retrying could duplicate it."""
+
+
+class SubmitTimeout(TimeoutError):
+    """The rows waited SUBMIT_TIMEOUT_S without being picked up and were withdrawn: nothing was written."""
+
+
+class _Pending:
+    """One request's rows waiting for its group to become durable."""
+    __slots__ = ("rows", "done", "error", "result")
+
+    def __init__(self, rows: List[Dict]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.error = None
+        self.result = None
+
+
+class GroupCommitQueue:
+    def __init__(self, writer: Callable[[List[List[Dict]]], List[Any]],
+                 max_rows: int = MAX_GROUP_ROWS, max_wait_ms: float = MAX_GROUP_WAIT_MS):
+        """
+        writer: Persists a group (one list of rows per request) durably and
+                returns one result per request.
+        max_rows: Flush as soon as this many rows are waiting.
+        max_wait_ms: Otherwise flush once the oldest request has waited this long.
+        """
+        self.writer = writer
+        self.max_rows = max_rows
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._cond = threading.Condition()
+        self._pending: List[_Pending] = []
+        self._pending_rows = 0
+        self._thread = None
+
+        # Counters (exposed for load tests / ops)
+        self.stats = {"groups": 0, "requests": 0, "rows": 0}
+
+    def submit(self, rows: List[Dict]):
+        """
+        Queues rows (dicts of column values) and blocks until they are
+        durable. Returns the writer's result for this request.
+        """
+        item = _Pending(rows)
+        with self._cond:
+            self._ensure_started()
+            self._pending.append(item)
+            self._pending_rows += len(rows)
+            self._cond.notify()
+
+        if not item.done.wait(SUBMIT_TIMEOUT_S):
+            with self._cond:
+                if item in self._pending:
+                    self._pending.remove(item)
+                    self._pending_rows -= len(item.rows)
+                    raise SubmitTimeout("Group commit queue is backed up; nothing was written")
+            item.done.wait()  # Its group is being written (bounded by WRITE_RETRIES): report the outcome
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    # --- Writer Thread ---
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="ingest-group-commit", daemon=True)
+            self._thread.start()
+
+    def _next_group(self) -> List[_Pending]:
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            # Let the group fill up until either trigger fires
+            deadline = time.monotonic() + self.max_wait
+            while self._pending_rows < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            group, size = [], 0
+            while self._pending and (not group or size + len(self._pending[0].rows) <= self.max_rows):
+                item = self._pending.pop(0)
+                group.append(item)
+                size += len(item.rows)
+            self._pending_rows -= size
+            return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            if not group:  # Everything waiting was withdrawn by timed-out callers
+                continue
+            try:
+                results = self._flush_with_retry([item.rows for item in group])
+                for item, result in zip(group, results):
+                    item.result = result
+                self._count(group)
+            except (OSError, OperationalError, WriteAborted) as e:
+                # Out of retries (or unsafe to retry): the storage is failing, not the rows
+                for item in group:
+                    item.error = e
+            except Exception:
+                # Isolate the bad request(s) so one malformed batch
+                # doesn't fail everybody else in the group.
+                for item in group:
+                    try:
+                        item.result = self.writer([item.rows])[0]
+                        self._count([item])
+                    except Exception as e:
+                        item.error = e
+            for item in group:
+                item.done.set()
+
+    def _count(self, group: List[_Pending]):
+        self.stats["groups"] += 1
+        self.stats["requests"] += len(group)
+        self.stats["rows"] += sum(len(item.rows) for item in group)
+
+    def _flush_with_retry(self, batches: List[List[Dict]]) -> List[Any]:
+        # Lock contention / I/O hiccups are transient;
+        # retry the whole group rather than splitting it up.
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return self.writer(batches)
+            except (OSError, OperationalError):
+                if attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(0.05 * (2 ** attempt))
@@ -1,17 +1,23 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import func, case, insert, update
 from typing import List, Optional
 from datetime import date, timedelta
+import gzip
+import heapq
+import json
+import os
 
-import models, schemas, database
-
-# Create tables
-models.Base.metadata.create_all(bind=database.engine)
+import models, schemas, database, migrations, metrics, profiling, sharding, admission
 
 app = FastAPI(title="CareSignal API", description="District-level healthcare early warning system")
+# Must be set before any route is declared: endpoints are wrapped so profiling runs in their thread
+app.router.route_class = profiling.ProfiledRoute
 
+# Innermost, so shed responses still get CORS headers and are counted in /metrics
+app.add_middleware(admission.AdmissionMiddleware, router=app.router)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -19,6 +25,15 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+@app.on_event("startup")
+def upgrade_schemas():
+    # Registered first, so it runs before the hooks below. Create tables (and add any new
+    # columns/indexes to existing ones) in every shard; `python migrations.py` does the same.
+    for shard in sharding.router.shards():
+        migrations.upgrade(shard.engine)
 
 def get_db():
     db = database.SessionLocal()
@@ -27,60 +42,213 @@ def get_db():
     finally:
         db.close()
 
+def get_zone_db(zone_id: int, db: Session = Depends(get_db)):
+    """Session on the shard holding the zone."""
+    with sharding.router.session(sharding.router.for_zone(zone_id), db) as shard_db:
+        yield shard_db
+
+def get_signal_db(district_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Signal IDs are per shard, so once districts are sharded clients must pass
+    the signal's zone.district_id (0 for a zone outside any district).
+    """
+    if district_id is None and sharding.router.enabled:
+        raise HTTPException(status_code=400, detail="district_id is required: signal IDs are per district")
+    with sharding.router.session(sharding.router.for_district(district_id), db) as shard_db:
+        yield shard_db
+
 @app.get("/")
 def read_root():
     return {"message": "CareSignal Backend Operational v2"}
 
-import signal_engine
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Prometheus scrape endpoint: per-route requests/latency/SQL and stage timings."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+import ingest_log
+import ingest_queue
+
+import spatial_config
+import zone_geometry
+import sla_escalation
+import notifications
+import compaction
+import cube
+import pyramid
+import series_store
+
+@app.on_event("startup")
+def open_series_stores():
+    # Shared mmap of daily counts per shard, for multi-worker deployments (opt-in)
+    if not series_store.STORE_DIR:
+        return
+    for shard in sharding.router.shards():
+        store = series_store.SeriesStore(os.path.join(series_store.STORE_DIR, shard.key))
+        series_store.register(shard.engine, store)
+        db = shard.session_factory()
+        try:
+            store.ensure_current(db)
+        finally:
+            db.close()
+
+@app.on_event("startup")
+def start_ingest_applier():
+    # Replays anything logged but not yet applied (e.g. before a crash); one applier per shard
+    for shard in sharding.router.shards():
+        shard.ingest()[1].start()
+
+@app.on_event("startup")
+def start_sla_escalation():
+    sla_escalation.job.start()
+
+@app.on_event("startup")
+def start_notifications():
+    notifications.job.start()
+
+@app.on_event("startup")
+def start_compaction():
+    compaction.job.start()
+
+@app.on_event("startup")
+def start_pipeline():
+    pipeline.job.start()
+
+@app.on_event("startup")
+def build_visit_cube():
+    # Databases created before the cube (or the aggregate pyramid) get it built once from their visits
+    for shard in sharding.router.shards():
+        db = shard.session_factory()
+        try:
+            cube.ensure_built(db)
+            pyramid.ensure_built(db)
+        finally:
+            db.close()
+
+@app.on_event("shutdown")
+def stop_diffusion_pool():
+    diffusion.shutdown()
+
+@app.on_event("startup")
+def load_zone_graph():
+    for shard in sharding.router.shards():
+        db = shard.session_factory()
+        try:
+            spatial_config.seed_default_adjacency(db)
+            spatial_config.get_graph(db)
+            zone_geometry.seed_default_geometry(db)
+        finally:
+            db.close()
 
 # --- Ingestion ---
 
 @app.get("/zones", response_model=List[schemas.Zone])
 def get_zones(db: Session = Depends(get_db)):
-    """Get all zones."""
-    return db.query(models.Zone).all()
+    """Get all zones (of every district)."""
+    per_shard = sharding.router.fan_out(lambda shard_db: shard_db.query(models.Zone).all(), default_db=db)
+    return [zone for zones in per_shard for zone in zones]
 
-@app.post("/ingest/batch", status_code=status.HTTP_201_CREATED)
+@app.get("/zones/geometry")
+def get_zone_geometry(bbox: str, zoom: int = 12, db: Session = Depends(get_db)):
+    """
+    Zones intersecting the viewport bbox (min_lng,min_lat,max_lng,max_lat), all
+    districts: outlines simplified for the zoom, centroids, and the latest
+    risk level and intensity from the pipeline.
+    """
+    try:
+        box = zone_geometry.parse_bbox(bbox)
+        parts = sharding.router.fan_out(lambda shard_db: zone_geometry.viewport(shard_db, box, zoom), default_db=db)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    as_of = [p["risk_as_of"] for p in parts if p["risk_as_of"] is not None]
+    return {**parts[0], "risk_as_of": max(as_of) if as_of else None,
+            "zones": sorted((z for p in parts for z in p["zones"]), key=lambda z: z["id"])}
+
+@app.put("/zones/{zone_id}/geometry")
+def set_zone_geometry(zone_id: int, body: schemas.ZoneGeometry, db: Session = Depends(get_zone_db)):
+    """Replaces a zone's outline (GeoJSON Polygon or MultiPolygon)."""
+    if not db.get(models.Zone, zone_id):
+        raise HTTPException(status_code=404, detail="Zone ID not found")
+    try:
+        row = zone_geometry.set_geometry(db, zone_id, body.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"zone_id": zone_id, "bbox": [row.min_lng, row.min_lat, row.max_lng, row.max_lat],
+            "centroid": [row.centroid_lng, row.centroid_lat]}
+
+@app.get("/zones/{zone_id}/neighbors", response_model=List[int])
+def get_zone_neighbors(zone_id: int, hops: int = 1, db: Session = Depends(get_zone_db)):
+    """Adjacent zone IDs (hops=2 includes neighbours of neighbours)."""
+    return spatial_config.get_neighbors(zone_id, hops, db)
+
+@app.put("/zones/{zone_id}/neighbors", response_model=List[int])
+def set_zone_neighbors(zone_id: int, body: schemas.ZoneNeighbors, db: Session = Depends(get_zone_db)):
+    """Replaces a zone's adjacency list (edges are stored in both directions)."""
+    ids = set(body.neighbor_ids) | {zone_id}
+    found = db.query(func.count(models.Zone.id)).filter(models.Zone.id.in_(ids)).scalar()
+    if found != len(ids):
+        raise HTTPException(status_code=404, detail="Zone ID not found")
+    
+    spatial_config.set_neighbors(db, zone_id, body.neighbor_ids)
+    return spatial_config.get_neighbors(zone_id, 1, db)
+
+@app.post("/ingest/batch", status_code=status.HTTP_202_ACCEPTED)
 def ingest_batch_visits(batch: schemas.BatchVisitCreate, db: Session = Depends(get_db)):
     """Accepts a batch of offline visits from a hospital."""
-    
-    hospital = db.query(models.Hospital).filter(models.Hospital.id == batch.hospital_id).first()
+    shard = sharding.router.for_hospital(batch.hospital_id)
+    with sharding.router.session(shard, db) as shard_db:
+        hospital = shard_db.query(models.Hospital).filter(models.Hospital.id == batch.hospital_id).first()
     if not hospital:
         # Auto-create for MVP demo if not exists? No, better to error or seed.
         # Let's error to be strict like a real system
         raise HTTPException(status_code=404, detail="Hospital ID not found")
     
-    created_count = 0
-    for v in batch.visits:
-        db_visit = models.VisitEvent(
-            date=v.date,
-            syndrome=v.syndrome,
-            count=v.count,
-            age_group=v.age_group,
-            hospital_id=batch.hospital_id
-        )
-        db.add(db_visit)
-        created_count += 1
+    rows = [
+        {
+            "date": v.date,
+            "syndrome": v.syndrome,
+            "count": v.count,
+            "age_group": v.age_group,
+            "hospital_id": batch.hospital_id
+        }
+        for v in batch.visits
+    ]
     
-    db.commit()
+    if not rows:
+        return {"status": "accepted", "inserted": 0, "seq": None}
     
-    # Trigger Signal Detection (Sync for MVP, Async in Prod)
-    signal_engine.detect_signals_for_hospital(db, hospital, batch.visits[0].date if batch.visits else date.today())
+    # Durable once fsynced to the shard's ingestion log; its applier writes
+    # visit_events and runs signal detection in the background.
+    log, applier = shard.ingest()
+    seq = _append_or_503(log, rows)
+    applier.notify()
     
-    return {"status": "success", "inserted": created_count}
+    return {"status": "accepted", "inserted": len(rows), "seq": seq}
+
+def _append_or_503(log: ingest_log.IngestLog, rows: List[dict]) -> int:
+    """Append to the ingestion log; a submit that timed out before being written is safe to retry."""
+    try:
+        return log.append(rows)
+    except ingest_queue.SubmitTimeout as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
 
 # --- Dashboard & Actions ---
 
 @app.get("/signals", response_model=List[schemas.Signal])
 def get_signals(spike_only: bool = False, db: Session = Depends(get_db)):
-    """Get all signals, optionally filtered by 'is_spike'."""
-    q = db.query(models.Signal)
-    if spike_only:
-        q = q.filter(models.Signal.is_spike == True)
-    return q.order_by(models.Signal.date.desc()).all()
+    """Get all signals (of every district), optionally filtered by 'is_spike'."""
+    def shard_signals(shard_db: Session):
+        # Eager-load what the response serialises: shard sessions close before serialisation
+        q = shard_db.query(models.Signal).options(joinedload(models.Signal.zone), selectinload(models.Signal.actions))
+        if spike_only:
+            q = q.filter(models.Signal.is_spike == True)
+        return q.order_by(models.Signal.date.desc()).all()
+
+    per_shard = sharding.router.fan_out(shard_signals, default_db=db)
+    return list(heapq.merge(*per_shard, key=lambda s: s.date, reverse=True))
 
 @app.post("/signals/{signal_id}/action", response_model=schemas.Action)
-def log_action(signal_id: int, action: schemas.ActionCreate, db: Session = Depends(get_db)):
+def log_action(signal_id: int, action: schemas.ActionCreate, db: Session = Depends(get_signal_db)):
     """DHO logs an action on a signal."""
     db_signal = db.query(models.Signal).filter(models.Signal.id == signal_id).first()
     if not db_signal:
@@ -100,69 +268,195 @@ def log_action(signal_id: int, action: schemas.ActionCreate, db: Session = Depen
     db.refresh(db_action)
     return db_action
 
+MAX_BULK_ACTIONS = 1000
+
+@app.post("/signals/actions/bulk", response_model=List[schemas.BulkActionResult])
+def log_actions_bulk(body: schemas.BulkActionRequest, db: Session = Depends(get_signal_db)):
+    """
+    Logs many actions in one transaction (e.g. acknowledging a flood of signals).
+    Returns one outcome per entry, in order; unknown signal IDs are reported, not fatal.
+    """
+    if len(body.actions) > MAX_BULK_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_ACTIONS} actions per request")
+    
+    # 1. Validate all IDs in one query
+    ids = {a.signal_id for a in body.actions}
+    existing = {r[0] for r in db.query(models.Signal.id).filter(models.Signal.id.in_(ids)).all()} if ids else set()
+    valid = [a for a in body.actions if a.signal_id in existing]
+    
+    action_ids = []
+    if valid:
+        # 2. Insert all Action rows
+        action_ids = db.scalars(
+            insert(models.Action).returning(models.Action.id, sort_by_parameter_order=True),
+            [{"signal_id": a.signal_id, "status": a.status, "notes": a.notes} for a in valid]
+        ).all()
+        
+        # 3. Update all signal statuses (last entry per signal wins, as if logged in order)
+        latest = {a.signal_id: a.status for a in valid}
+        db.execute(
+            update(models.Signal)
+            .where(models.Signal.id.in_(list(latest)))
+            .values(status=case(latest, value=models.Signal.id))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+    
+    results, inserted = [], iter(action_ids)
+    for a in body.actions:
+        if a.signal_id in existing:
+            results.append(schemas.BulkActionResult(signal_id=a.signal_id, ok=True, action_id=next(inserted)))
+        else:
+            results.append(schemas.BulkActionResult(signal_id=a.signal_id, ok=False, error="Signal not found"))
+    return results
+
+@app.get("/admin/sla/stats")
+def get_sla_stats():
+    """Escalation sweep lag/throughput and scheduler state."""
+    return {**sla_escalation.stats, "job": sla_escalation.job.stats}
+
+@app.get("/admin/admission/stats")
+def get_admission_stats():
+    """Per-class slots in use, queued, admitted, shed and past their deadline."""
+    return admission.summary()
+
+@app.get("/admin/notifications/stats")
+def get_notification_stats():
+    """Deliveries by status across shards, dispatcher totals and scheduler state."""
+    queue = {}
+    for shard in sharding.router.shards():
+        db = shard.session_factory()
+        try:
+            for status, n in notifications.queue_stats(db).items():
+                queue[status] = queue.get(status, 0) + n
+        finally:
+            db.close()
+    return {**notifications.stats, "queue": queue, "job": notifications.job.stats}
+
+@app.get("/admin/ingest/stats")
+def get_ingest_stats():
+    """Per-shard log applier progress, failed attempts and quarantined records."""
+    shards = {}
+    for shard in sharding.router.shards():
+        log, applier = shard.ingest()
+        db = shard.session_factory()
+        try:
+            quarantine = db.query(func.count(models.IngestQuarantine.seq)).scalar()
+        finally:
+            db.close()
+        shards[shard.key] = {**applier.stats, "applied_seq": applier.applied_seq,
+                             "durable_seq": log.durable_seq(), "quarantine_rows": quarantine}
+    return {"shards": shards}
+
+@app.get("/admin/compaction/stats")
+def get_compaction_stats():
+    """Rows moved from visit_events into daily rollups, and scheduler state."""
+    return {**compaction.stats, "horizon_days": compaction.HORIZON_DAYS, "job": compaction.job.stats}
+
+@app.get("/admin/pipeline/stats")
+def get_pipeline_stats():
+    """Precompute runs (stages redone on the last one) and scheduler state."""
+    return {**pipeline.stats, "job": pipeline.job.stats}
+
+# --- Profiling (admin: X-Admin-Token) ---
+
+@app.get("/admin/profiling", dependencies=[Depends(profiling.require_admin)])
+def get_profiling():
+    """Profiler config and per-route counts of profiled requests/samples."""
+    return profiling.summary()
+
+@app.put("/admin/profiling", dependencies=[Depends(profiling.require_admin)])
+def update_profiling(update: schemas.ProfilingConfigUpdate):
+    try:
+        return profiling.update_config(update.sample_rate, update.routes, update.mode, update.interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/admin/profiling", dependencies=[Depends(profiling.require_admin)])
+def reset_profiling():
+    profiling.reset()
+    return {"status": "reset"}
+
+@app.get("/admin/profiling/collapsed", response_class=PlainTextResponse,
+         dependencies=[Depends(profiling.require_admin)])
+def get_collapsed_stacks(route: Optional[str] = None):
+    """Sampler stacks in collapsed format (flamegraph.pl / speedscope)."""
+    return PlainTextResponse(profiling.collapsed_stacks(route))
+
+@app.get("/admin/profiling/pstats", dependencies=[Depends(profiling.require_admin)])
+def get_pstats(route: str):
+    """cProfile stats merged over a route's profiled requests (pstats dump)."""
+    dump = profiling.pstats_dump(route)
+    if dump is None:
+        raise HTTPException(status_code=404, detail="No cProfile data for this route")
+    filename = route.strip("/").replace("/", "_").replace("{", "").replace("}", "") or "root"
+    return Response(content=dump, media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.pstats"'})
+
 @app.get("/signals/{signal_id}/history")
-def get_signal_history(signal_id: int, days: int = 14, db: Session = Depends(get_db)):
-    """Fetch 14-day aggregate history for the syndrome/zone associated with this signal."""
+def get_signal_history(signal_id: int, response: Response, days: int = Query(14, ge=1, le=pyramid.MAX_RANGE_DAYS),
+                       granularity: str = "auto", max_points: int = pyramid.MAX_POINTS,
+                       db: Session = Depends(get_signal_db)):
+    """
+    Aggregate history for the syndrome/zone associated with this signal, over
+    the `days` before it. granularity: day, week, month, or auto (the finest
+    level with at most max_points points); the level is echoed in X-Granularity.
+    """
     signal = db.query(models.Signal).filter(models.Signal.id == signal_id).first()
     if not signal:
         raise HTTPException(status_code=404, detail="Signal not found")
         
     start_date = signal.date - timedelta(days=days)
     end_date = signal.date
+    try:
+        level = pyramid.choose_level(start_date, end_date, granularity, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Query daily aggregates for this zone + syndrome
-    history = []
+    # Aggregates for this zone (+ syndrome) at that level, in one query
+    syndromes = None if signal.syndrome == "ALL" else [signal.syndrome]
+    totals = {}
+    for by_period in pyramid.series(db, [signal.zone_id], start_date, end_date, level, syndromes).values():
+        for d, total in by_period.items():
+            totals[d] = totals.get(d, 0) + total
     
-    # We want to fill missing dates with 0, so we iterate
-    current = start_date
-    while current <= end_date:
-        count = db.query(func.sum(models.VisitEvent.count))\
-            .join(models.Hospital)\
-            .filter(models.Hospital.zone_id == signal.zone_id)\
-            .filter(models.VisitEvent.date == current)
-            
-        if signal.syndrome != "ALL":
-             count = count.filter(models.VisitEvent.syndrome == signal.syndrome)
-             
-        val = count.scalar() or 0
-        history.append({"date": current, "count": val})
-        current += timedelta(days=1)
-        
-    return history
+    # Fill missing periods with 0
+    response.headers["X-Granularity"] = level
+    return [{"date": d, "count": totals.get(d, 0)} for d in pyramid.periods(level, start_date, end_date)]
 
 @app.get("/signals/{signal_id}/breakdown")
-def get_signal_breakdown(signal_id: int, db: Session = Depends(get_db)):
+def get_signal_breakdown(signal_id: int, db: Session = Depends(get_signal_db)):
     """
-    Returns the contributing factors (Hospitals) for a signal.
+    Returns the contributing factors (hospitals and age groups) for a signal.
     """
     signal = db.query(models.Signal).filter(models.Signal.id == signal_id).first()
     if not signal:
         raise HTTPException(status_code=404, detail="Signal not found")
 
-    # contributing hospitals
-    # For this zone, date, syndrome, get counts per hospital
-    q = db.query(models.Hospital.name, func.sum(models.VisitEvent.count))\
-        .join(models.VisitEvent)\
-        .filter(models.VisitEvent.date == signal.date)\
-        .filter(models.Hospital.zone_id == signal.zone_id)\
-        .group_by(models.Hospital.name)
-        
-    if signal.syndrome != "ALL":
-        q = q.filter(models.VisitEvent.syndrome == signal.syndrome)
-        
-    results = q.all() # [(HospA, 20), (HospB, 5)]
+    # Contributing hospitals and age groups for this zone, date and syndrome, from the cube
+    syndromes = None if signal.syndrome == "ALL" else [signal.syndrome]
+    cells = cube.query(db, ["hospital_id", "age_group"], {"zone_id": [signal.zone_id], "syndrome": syndromes},
+                       signal.date, signal.date)["cells"]
+    by_hospital, by_age = {}, {}
+    for cell in cells:
+        by_hospital[cell["hospital_id"]] = by_hospital.get(cell["hospital_id"], 0) + cell["count"]
+        by_age[cell["age_group"]] = by_age.get(cell["age_group"], 0) + cell["count"]
+    names = dict(db.query(models.Hospital.id, models.Hospital.name).filter(models.Hospital.id.in_(list(by_hospital))))
     
     # Format nicely
-    breakdown = [{"hospital": r[0], "count": r[1]} for r in results]
+    breakdown = [{"hospital": names.get(h, "Unknown"), "count": n} for h, n in by_hospital.items()]
+    age_groups = [{"age_group": a, "count": n} for a, n in by_age.items()]
     # Sort by count desc
     breakdown.sort(key=lambda x: x['count'], reverse=True)
+    age_groups.sort(key=lambda x: x['count'], reverse=True)
     
     return {
         "breakdown": breakdown,
-        "summary": _generate_plain_language_summary(signal, breakdown)
+        "age_groups": age_groups,
+        "summary": _generate_plain_language_summary(signal, breakdown, age_groups)
     }
 
-def _generate_plain_language_summary(signal, breakdown):
+def _generate_plain_language_summary(signal, breakdown, age_groups=()):
     hosp_name = breakdown[0]['hospital'] if breakdown else "Unknown"
     hosp_count = breakdown[0]['count'] if breakdown else 0
     percent_contribution = int((hosp_count / signal.value) * 100) if signal.value > 0 else 0
@@ -175,6 +469,11 @@ def _generate_plain_language_summary(signal, breakdown):
     else:
         multiplier = int(signal.value / signal.baseline) if signal.baseline > 0 else 0
         txt += f"This represents a {multiplier}x increase over the 14-day average."
+    
+    known = [a for a in age_groups if a["age_group"] not in (cube.UNKNOWN_AGE_GROUP, "Mixed")]
+    if known and signal.value > 0:
+        top = known[0]
+        txt += f" The {top['age_group']} age group accounts for {int(top['count'] / signal.value * 100)}% of cases."
         
     return txt
 
@@ -190,24 +489,145 @@ def legacy_report(facility_id: int, report: schemas.VisitEventCreate, db: Sessio
     )
     return ingest_batch_visits(batch, db)
 
-# --- Forecasting ---
-import forecasting
+# --- Delta Sync (offline clients) ---
+import sync
 
-@app.get("/analysis/summary")
-def get_analysis_summary(db: Session = Depends(get_db)):
+async def read_sync_batch(request: Request) -> schemas.SyncBatch:
+    """Inflates and parses the sync body (async: it streams the raw, possibly gzipped, body)."""
+    try:
+        raw = await sync.read_body(request.stream(), request.headers.get("content-length"))
+        body = sync.decode_body(raw, request.headers.get("content-encoding"))
+        return schemas.SyncBatch.model_validate(body)
+    except sync.BodyTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _sync_applied(db: Session, cursor: Optional[int]) -> bool:
+    checkpoint = db.get(models.IngestCheckpoint, ingest_log.CHECKPOINT_NAME)
+    return cursor is None or (checkpoint is not None and checkpoint.last_seq >= cursor)
+
+def _sync_shard(hospital_id: Optional[int]) -> sharding.Shard:
+    return sharding.router.for_hospital(hospital_id) if hospital_id is not None else sharding.router.default
+
+@app.post("/sync")
+def sync_reports(batch: schemas.SyncBatch = Depends(read_sync_batch), db: Session = Depends(get_db)):
     """
-    Returns disease-specific predictive insights.
+    Uploads every pending report of an offline client in one (gzip) request.
+    Returns one ack per report ("a" accepted, "d" duplicate, "r" rejected)
+    and a cursor to poll with GET /sync until the reports are applied.
     """
+    # A sync goes to one shard (the client's facility); reports for hospitals
+    # in other districts aren't found there and are rejected.
+    hospital_id = batch.hospital_id
+    if hospital_id is None and batch.reports and isinstance(batch.reports[0], dict):
+        hospital_id = batch.reports[0].get("hospital_id")
+    shard = _sync_shard(hospital_id if isinstance(hospital_id, int) else None)
+    with sharding.router.session(shard, db) as shard_db:
+        acks, rows = sync.prepare(shard_db, batch.reports, batch.hospital_id)
+        cursor = batch.cursor
+        if rows:
+            # One log record per sync, so detection runs once per (zone, day) it touches
+            log, applier = shard.ingest()
+            cursor = _append_or_503(log, rows)
+            applier.notify()
+        return {"acks": acks, "cursor": cursor, "applied": _sync_applied(shard_db, cursor)}
+
+@app.get("/sync")
+def get_sync_status(cursor: int, hospital_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """Whether everything up to the cursor has reached the database (and detection)."""
+    with sharding.router.session(_sync_shard(hospital_id), db) as shard_db:
+        return {"cursor": cursor, "applied": _sync_applied(shard_db, cursor)}
+
+# --- Visit Cube (drill-down / roll-up) ---
+
+@app.get("/cube")
+def get_cube_slice(group_by: List[str] = Query([]), zone_id: List[int] = Query([]), hospital_id: List[int] = Query([]),
+                   syndrome: List[str] = Query([]), age_group: List[str] = Query([]),
+                   start: Optional[date] = None, end: Optional[date] = None, district_id: Optional[int] = None,
+                   db: Session = Depends(get_db)):
+    """
+    Visit totals for any slice of (date, zone_id, hospital_id, syndrome, age_group),
+    e.g. ?syndrome=Diarrhea&age_group=0-5&start=...&district_id=1&group_by=zone_id.
+    Repeat a filter to allow several values; omit group_by for the grand total.
+    """
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    filters = {"zone_id": zone_id, "hospital_id": hospital_id, "syndrome": syndrome, "age_group": age_group}
+    slice_of = lambda shard_db: cube.query(shard_db, group_by, filters, start, end, district_id)
+    try:
+        if district_id is not None:
+            with sharding.router.session(sharding.router.for_district(district_id), db) as shard_db:
+                return slice_of(shard_db)
+        return cube.merge(sharding.router.fan_out(slice_of, default_db=db))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# --- Export ---
+import export
+
+def get_session_factories(zone_id: Optional[int] = None, district_id: Optional[int] = None):
+    """
+    Streaming responses outlive the request session, so they open their own:
+    on the zone's or district's shard, otherwise on every shard in turn.
+    """
+    if zone_id is not None:
+        return [sharding.router.for_zone(zone_id).session_factory]
+    if district_id is not None:
+        return [sharding.router.for_district(district_id).session_factory]
+    return [shard.session_factory for shard in sharding.router.shards()]
+
+@app.get("/export/{dataset}")
+def export_data(dataset: str, format: str = "csv", zone_id: Optional[int] = None, syndrome: Optional[str] = None,
+                start: Optional[date] = None, end: Optional[date] = None, district_id: Optional[int] = None,
+                session_factories=Depends(get_session_factories)):
+    """
+    Streams visits, signals or actions as CSV or NDJSON, filtered by zone,
+    district, syndrome and date range. Without zone_id or district_id every
+    district is exported, one after another. Memory stays flat regardless
+    of the range.
+    """
+    if dataset not in export.DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset; use one of {', '.join(export.DATASETS)}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    
+    filters = export.ExportFilters(zone_id, syndrome, start, end, district_id)
+    filename = f"caresignal-{dataset}-{start or 'all'}-{end or date.today()}.{format}"
+    return StreamingResponse(
+        export.stream_export(session_factories, dataset, format, filters),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# --- Forecasting ---
+import timecube
+import pipeline
+import accuracy
+import diffusion
+
+def _summarize_shard(db: Session) -> dict:
+    """Per-shard partial of /analysis/summary (merged across districts by the endpoint)."""
     zones = db.query(models.Zone).all()
     today = date.today()
     start_date = today - timedelta(days=30)
-    
+
+    # Zones without new data since the pipeline's last run are read from it
+    stored = pipeline.materialised_summary(db, today)
+    stored_rows, live_zones = stored if stored is not None else ({}, None)
+
     # 1. Fetch all recent data with Zone info
     # Tuple: (VisitEvent, zone_id)
-    results = db.query(models.VisitEvent, models.Hospital.zone_id)\
-                .join(models.Hospital)\
-                .filter(models.VisitEvent.date >= start_date)\
-                .all()
+    results = []
+    if live_zones is None or live_zones:
+        q = db.query(models.VisitEvent, models.Hospital.zone_id)\
+                    .join(models.Hospital)\
+                    .filter(models.VisitEvent.date >= start_date)
+        if live_zones is not None:
+            q = q.filter(models.Hospital.zone_id.in_(live_zones))
+        results = q.all()
     
     # Organize by Zone -> Disease -> List of (date, count)
     data_map = {} # { zone_id: { disease: { date: count } } }
@@ -225,32 +645,42 @@ def get_analysis_summary(db: Session = Depends(get_db)):
     
     # 2. Analyze
     for z in zones:
-        z_data = data_map.get(z.id, {})
-        
-        for disease, dates_map in z_data.items():
-            # Convert to list sorted by date
-            sorted_dates = sorted(dates_map.items())
-            counts = [val for _, val in sorted_dates]
-            
-            # Need at least a few points
-            if len(counts) < 3:
+        admission.check()  # Stops here once the request is past its deadline
+        if live_zones is not None and z.id not in live_zones:
+            analysed = stored_rows.get(z.id, [])
+        else:
+            # Avg Future vs Avg History over the days each disease was reported (needs a few points)
+            analysed = [(disease, *pipeline.summary_view(dates_map))
+                        for disease, dates_map in sorted(data_map.get(z.id, {}).items())]
+
+        for disease, trend, high_risk in analysed:
+            if trend is None:
                 continue
-                
-            # Forecast
-            f = forecasting.Forecaster()
-            f.fit(counts)
-            preds = f.predict(days=7)
-            
-            # Avg Future vs Avg History
-            avg_pred = sum([p['value'] for p in preds]) / len(preds)
-            avg_hist = sum(counts) / len(counts) if counts else 1
-            
-            trends.append(forecasting.explain_trend(f.trend, f.level))
+            trends.append(trend)
             
             # Risk Threshold
-            if avg_pred > avg_hist * 1.5 and avg_pred > 5: # Lowered threshold for demo sensitivity
+            if high_risk:
                 high_risk_diseases[disease] = high_risk_diseases.get(disease, 0) + 1
                 high_risk_zone_ids.add(z.id)
+
+    return {"high_risk_diseases": high_risk_diseases, "high_risk_zone_ids": high_risk_zone_ids,
+            "trends": trends, "zones": len(zones)}
+
+@app.get("/analysis/summary")
+def get_analysis_summary(db: Session = Depends(get_db)):
+    """
+    Returns disease-specific predictive insights (all districts; shards are analysed concurrently).
+    """
+    high_risk_diseases = {}
+    high_risk_zone_ids = set()
+    trends = []
+    zone_count = 0
+    for part in sharding.router.fan_out(_summarize_shard, default_db=db):
+        for disease, n in part["high_risk_diseases"].items():
+            high_risk_diseases[disease] = high_risk_diseases.get(disease, 0) + n
+        high_risk_zone_ids |= part["high_risk_zone_ids"]
+        trends += part["trends"]
+        zone_count += part["zones"]
             
     # Determine Dominant Trend
     from collections import Counter
@@ -262,16 +692,114 @@ def get_analysis_summary(db: Session = Depends(get_db)):
         "total_high_risk_zones": len(high_risk_zone_ids),
         "dominant_trend": "Increasing" if "Increasing" in dominant_trend else "Stable",
         "detailed_trend": dominant_trend,
-        "reliability_score": "High" if len(zones) > 0 else "Low"
+        "reliability_score": "High" if zone_count > 0 else "Low"
     }
+
+@app.get("/analysis/forecast-accuracy")
+def get_forecast_accuracy(source: str = "live", zone_id: Optional[int] = None, syndrome: Optional[str] = None,
+                          db: Session = Depends(get_db)):
+    """
+    Forecast MAE, MAPE and interval coverage per (zone, syndrome, horizon), plus
+    per-syndrome totals. source=live scores the pipeline's forecasts; source=backtest
+    is the last rolling-origin backtest.
+    """
+    if source not in accuracy.SOURCES:
+        raise HTTPException(status_code=400, detail=f"Unknown source {source!r}")
+    rows = []
+    for part in sharding.router.fan_out(lambda s: accuracy.cells(s, source, zone_id, syndrome), default_db=db):
+        rows += part  # Zones belong to one district, so shards never share a cell
+    return {"source": source, **accuracy.table(rows)}
+
+@app.post("/admin/forecast-accuracy/backtest", status_code=status.HTTP_202_ACCEPTED,
+          dependencies=[Depends(profiling.require_admin)])
+def run_forecast_backtest(days: int = Query(accuracy.BACKTEST_DAYS, ge=1, le=accuracy.MAX_BACKTEST_DAYS),
+                          horizon: int = Query(accuracy.HORIZON, ge=1, le=accuracy.MAX_HORIZON)):
+    """
+    Starts replaying the forecaster over the last `days` days in every district
+    (replaces the backtest table) in the background; poll the GET for its state.
+    """
+    run = lambda: sharding.router.fan_out(lambda s: accuracy.backtest(s, days, horizon))
+    if not accuracy.start_backtest(run, days, horizon):
+        raise HTTPException(status_code=409, detail="A backtest is already running")
+    return dict(accuracy.backtest_run)
+
+@app.get("/admin/forecast-accuracy/backtest", dependencies=[Depends(profiling.require_admin)])
+def get_forecast_backtest():
+    """State of the last backtest started from the admin endpoint, with its per-shard results."""
+    return dict(accuracy.backtest_run)
+
+@app.get("/analysis/timecube")
+def get_time_cube(start: Optional[date] = None, end: Optional[date] = None, horizon: int = 7,
+                  syndrome: Optional[str] = None, encoding: str = "b64", compress: bool = False,
+                  district_id: Optional[int] = None, db: Session = Depends(get_db)):
+    """
+    Dense zone x day x syndrome matrix of counts plus forecast values and
+    intensities, for map playback in one request. Defaults to the last 30 days.
+    Covers every district unless district_id is given.
+    compress=true gzips the body (Content-Encoding: gzip).
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+    if start > end or (end - start).days >= timecube.MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    if encoding not in ("b64", "json") or not 0 <= horizon <= 30:
+        raise HTTPException(status_code=400, detail="Invalid encoding or horizon")
+    
+    syndromes = [syndrome] if syndrome and syndrome != "ALL" else None
+    build = lambda shard_db: timecube.build_time_cube(shard_db, start, end, horizon, syndromes)
+    if district_id is not None:
+        with sharding.router.session(sharding.router.for_district(district_id), db) as shard_db:
+            cube = build(shard_db)
+    else:
+        cube = timecube.merge(sharding.router.fan_out(build, default_db=db))
+    body = json.dumps(timecube.encode_cube(cube, encoding), separators=(",", ":")).encode("utf-8")
+    
+    if compress:
+        return Response(content=gzip.compress(body), media_type="application/json",
+                        headers={"Content-Encoding": "gzip"})
+    return Response(content=body, media_type="application/json")
+
+@app.post("/analysis/diffusion")
+def simulate_diffusion(body: schemas.DiffusionRequest, db: Session = Depends(get_db)):
+    """
+    Simulates spread across the zone graph for body.days days, once per
+    scenario (SIR compartments or forecast intensity; see diffusion.py).
+    Frames are float32 [day][zone] per scenario, over every district unless
+    body.district_id is given.
+    """
+    if body.encoding not in ("b64", "json"):
+        raise HTTPException(status_code=400, detail="Invalid encoding")
+    scenarios = [s.model_dump() for s in body.scenarios]
+    simulate = lambda shard_db: diffusion.run(shard_db, body.syndrome, scenarios, body.days)
+    try:
+        if body.district_id is not None:
+            with sharding.router.session(sharding.router.for_district(body.district_id), db) as shard_db:
+                result = simulate(shard_db)
+        else:
+            result = diffusion.merge(sharding.router.fan_out(simulate, default_db=db))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return diffusion.encode(result, body.encoding)
+
 @app.get("/zones/{zone_id}/forecast", response_model=List[schemas.DiseaseForecast])
-def get_zone_forecast(zone_id: int, days: int = 7, syndrome: str = None, db: Session = Depends(get_db)):
+def get_zone_forecast(zone_id: int, response: Response, days: int = Query(7, ge=1, le=pipeline.MAX_FORECAST_DAYS),
+                      syndrome: str = None, history_days: int = Query(30, ge=1, le=pyramid.MAX_RANGE_DAYS),
+                      granularity: str = "auto", max_points: int = pyramid.MAX_POINTS,
+                      db: Session = Depends(get_zone_db)):
     """
     Get 7-day forecast for a zone.
     Returns a list of forecasts, one per active disease (or specific disease if requested).
+    The model is fitted on the last 30 days; the returned history covers
+    history_days at `granularity` (see get_signal_history).
     """
     today = date.today()
     start_date = today - timedelta(days=30)
+    history_start = today - timedelta(days=history_days)
+    try:
+        level = pyramid.choose_level(history_start, today, granularity, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    response.headers["X-Granularity"] = level
     
     # 1. Determine Syndromes to Forecast
     target_syndromes = []
@@ -284,105 +812,72 @@ def get_zone_forecast(zone_id: int, days: int = 7, syndrome: str = None, db: Ses
             .filter(models.Hospital.zone_id == zone_id)\
             .filter(models.VisitEvent.date >= start_date)\
             .all()
-        target_syndromes = [r[0] for r in results]
+        target_syndromes = sorted(r[0] for r in results)
 
     # If no data found, return empty
     if not target_syndromes:
         return []
 
     forecasts_list = []
-    
-    import spatial_config
-    neighbors = spatial_config.get_neighbors(zone_id)
+
+    # Fits and risk precomputed by the pipeline, unless data arrived since its last run
+    stored = pipeline.materialised_forecasts(db, zone_id, today, target_syndromes) \
+        if days == pipeline.FORECAST_DAYS else None
+    response.headers["X-Forecast-Source"] = "materialised" if stored is not None else "live"
+
+    # Spatial risk for all syndromes at once (one query over the neighbour set)
+    spatial_risk = spatial_config.assess_neighbor_risk(db, zone_id, target_syndromes, today) \
+        if stored is None else None
+
+    # 2. Fetch History for all syndromes at once: daily for the fit (zero-copy from the shared
+    #    series store when it covers the window), plus the requested level if coarser
+    daily_start = min(start_date, history_start) if level == "day" else start_date
+    snap = series_store.snapshot_for(db)
+    if snap is not None and snap.covers(daily_start, today):
+        daily = {s: snap.series(zone_id, s, daily_start, today) for s in target_syndromes}
+    else:
+        by_day = pyramid.series(db, [zone_id], daily_start, today, "day", target_syndromes)
+        daily = {s: [by_day.get(s, {}).get(d, 0) for d in pyramid.periods("day", daily_start, today)]
+                 for s in target_syndromes}
+    shown = None if level == "day" else pyramid.series(db, [zone_id], history_start, today, level, target_syndromes)
 
     for s_name in target_syndromes:
-        # 2. Fetch History per Syndrome
-        query = db.query(models.VisitEvent.date, func.sum(models.VisitEvent.count))\
-                .join(models.Hospital)\
-                .filter(models.Hospital.zone_id == zone_id)\
-                .filter(models.VisitEvent.date >= start_date)\
-                .filter(models.VisitEvent.syndrome == s_name)
-                
-        results = query.group_by(models.VisitEvent.date).order_by(models.VisitEvent.date).all()
-        data_map = {r[0]: r[1] for r in results}
-        
-        history_values = []
-        history_points = []
-        
-        current = start_date
-        max_hist_val = 0
-        
-        while current <= today:
-            val = data_map.get(current, 0)
-            history_values.append(val)
-            if val > max_hist_val: max_hist_val = val
-            
-            history_points.append(schemas.ForecastPoint(
-                date=current, value=float(val), lower_bound=float(val), upper_bound=float(val)
-            ))
-            current += timedelta(days=1)
-            
-        # 3. Run Forecast
-        f = forecasting.Forecaster()
-        f.fit(history_values)
-        raw_preds = f.predict(days=days)
-        
-        forecast_points = []
-        avg_predicted = 0
-        if raw_preds:
-            for p in raw_preds:
-                p_date = today + timedelta(days=p['day'])
-                forecast_points.append(schemas.ForecastPoint(
-                    date=p_date,
-                    value=p['value'],
-                    lower_bound=p['lower_bound'],
-                    upper_bound=p['upper_bound']
-                ))
-            avg_predicted = sum([p['value'] for p in raw_preds]) / len(raw_preds)
-
-        # 4. Assess Spatial Risk (Per Disease)
-        spatial_risk_level = "Low"
-        spatial_reason = None
-        
-        if neighbors:
-            cutoff = today - timedelta(days=3)
-            # Check neighbors for THIS syndrome
-            neighbor_signals = db.query(models.Signal)\
-                .filter(models.Signal.zone_id.in_(neighbors))\
-                .filter(models.Signal.date >= cutoff)\
-                .filter(models.Signal.syndrome == s_name)\
-                .all()
-                
-            for s in neighbor_signals:
-                if s.severity == "High":
-                    spatial_risk_level = "High"
-                    spatial_reason = f"High severity {s_name} surge in neighboring Zone {s.zone_id}"
-                    break
-                elif s.severity == "Medium" and spatial_risk_level == "Low":
-                    spatial_risk_level = "Medium"
-                    spatial_reason = f"{s_name} surge in neighboring Zone {s.zone_id}"
-
-        # 5. Final Metrics
-        baseline = sum(history_values[-14:]) / 14 if len(history_values) >= 14 else 0
-        risk_level = forecasting.assess_risk(avg_predicted, baseline, spatial_risk_level)
-        intensity = forecasting.calculate_intensity(raw_preds[0]['value'] if raw_preds else 0, max_hist_val)
-        
-        trend_desc = forecasting.explain_trend(f.trend, f.level)
-        guidance = forecasting.generate_operational_guidance(
-            raw_preds[0]['value'] if raw_preds else 0, 
-            risk_level, 
-            trend_desc
-        )
+        values = daily[s_name]
+        history_values = values[(start_date - daily_start).days:]
+
+        if shown is None:
+            points = zip(pyramid.periods("day", history_start, today), values[(history_start - daily_start).days:])
+        else:
+            shown_map = shown.get(s_name, {})
+            points = ((p, shown_map.get(p, 0)) for p in pyramid.periods(level, history_start, today))
+        history_points = [schemas.ForecastPoint(date=p, value=float(v), lower_bound=float(v), upper_bound=float(v))
+                          for p, v in points]
+
+        # 3. Run Forecast and assess risk (or read the pipeline's)
+        if stored is not None:
+            result = stored[s_name]
+            forecast_points = [schemas.ForecastPoint(**p) for p in result["forecast"]]
+            trend_desc = result["trend"]
+        else:
+            admission.check()
+            raw_preds, trend_desc = pipeline.fit(history_values, days)
+            forecast_points = [schemas.ForecastPoint(
+                date=today + timedelta(days=p['day']),
+                value=p['value'],
+                lower_bound=p['lower_bound'],
+                upper_bound=p['upper_bound']
+            ) for p in raw_preds]
+            result = pipeline.assess(s_name, history_values, raw_preds, trend_desc, spatial_risk[s_name])
 
         forecasts_list.append(schemas.DiseaseForecast(
             disease=s_name,
-            risk_level=risk_level,
-            risk_reason=spatial_reason if spatial_reason else f"Based on {s_name} trends",
-            intensity=intensity,
+            risk_level=result["risk_level"],
+            risk_reason=result["risk_reason"],
+            intensity=result["intensity"],
             trend=trend_desc.split(' (')[0], # Just the short text
             history=history_points,
             forecast=forecast_points,
-            guidance=guidance
+            guidance=result["guidance"]
         ))
         
     return forecasts_list
@@ -0,0 +1,306 @@
+"""
+Request, SQL and stage metrics in Prometheus text format (GET /metrics).
+
+- MetricsMiddleware (pure ASGI) times each request and tags it with the
+  matched route template, so /zones/1/forecast and /zones/2/forecast share
+  one series.
+- instrument_engine() hooks SQLAlchemy cursor events. Statements run inside
+  a request are charged to that request (found through a contextvar, which
+  Starlette copies into the threadpool running sync endpoints); anything
+  else (applier, scheduled jobs) is charged to the "background" route.
+- timed(stage) / stage_timer(stage) time detection and forecasting stages.
+
+Overhead per statement is two perf_counter calls and a list append on the
+request's own object; shared state is locked once per request. Statements
+are only fingerprinted (literals and IN-lists collapsed) when they make a
+route's slowest-N list.
+"""
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+# Params
+ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "no")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SLOW_STATEMENTS_PER_ROUTE = 5
+FINGERPRINT_CHARS = 200
+BACKGROUND_ROUTE = "background"
+UNMATCHED_ROUTE = "unmatched"  # 404s etc.; raw paths would explode label cardinality
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last slot = +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests: Dict[str, int] = {}  # status -> count
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.sql_total = 0
+        self.db_seconds = 0.0
+        self.slowest: List[Tuple[float, str]] = []  # (seconds, fingerprint), slowest first
+
+
+class _RequestMetrics:
+    """Per-request accumulator (only touched by the request's own threads)."""
+    __slots__ = ("statements", "db_seconds", "slow")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slow: List[Tuple[float, str]] = []  # Raw statements, at most SLOW_STATEMENTS_PER_ROUTE
+
+
+_current: ContextVar[Optional[_RequestMetrics]] = ContextVar("request_metrics", default=None)
+_lock = threading.Lock()
+_routes: Dict[Tuple[str, str], RouteStats] = {}
+_stages: Dict[str, Histogram] = {}
+_fingerprints: Dict[str, str] = {}
+
+
+# --- SQL ---
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+))+\s*\)")
+_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Statement with literals and bound-parameter lists collapsed, whitespace normalised."""
+    fp = _fingerprints.get(statement)
+    if fp is None:
+        fp = _SPACE.sub(" ", statement).strip()
+        fp = _LITERAL.sub("?", fp)
+        fp = _IN_LIST.sub("(...)", fp)[:FINGERPRINT_CHARS]
+        if len(_fingerprints) < 10000:
+            _fingerprints[statement] = fp
+    return fp
+
+
+def _keep_slowest(slow: List[Tuple[float, str]], seconds: float, statement: str):
+    if len(slow) < SLOW_STATEMENTS_PER_ROUTE:
+        slow.append((seconds, statement))
+    elif seconds > slow[-1][0]:
+        slow[-1] = (seconds, statement)
+    else:
+        return
+    slow.sort(key=lambda s: s[0], reverse=True)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the statement's own context: a statement that fails (or is
+    # stopped by admission's deadline check) leaves nothing behind.
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    current = _current.get()
+    if current is not None:
+        current.statements += 1
+        current.db_seconds += seconds
+        _keep_slowest(current.slow, seconds, statement)
+    else:
+        _record(BACKGROUND_ROUTE, "-", None, None, 1, seconds, [(seconds, statement)])
+
+
+def instrument_engine(engine):
+    """Attach SQL counters/timers to an engine (no-op when METRICS_ENABLED=0)."""
+    if not ENABLED:
+        return
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+
+
+# --- Aggregation ---
+
+def _record(route: str, method: str, status: Optional[int], latency: Optional[float],
+            statements: int, db_seconds: float, slow: List[Tuple[float, str]]):
+    with _lock:
+        stats = _routes.get((route, method))
+        if stats is None:
+            stats = _routes[(route, method)] = RouteStats()
+        if status is not None:
+            stats.requests[str(status)] = stats.requests.get(str(status), 0) + 1
+            stats.latency.observe(latency)
+            stats.statements.observe(statements)
+        stats.sql_total += statements
+        stats.db_seconds += db_seconds
+        for seconds, statement in slow:
+            if len(stats.slowest) >= SLOW_STATEMENTS_PER_ROUTE and seconds <= stats.slowest[-1][0]:
+                break  # slow is sorted, so the rest are faster too
+            merged = {fp: secs for secs, fp in stats.slowest}
+            fp = fingerprint(statement)
+            merged[fp] = max(seconds, merged.get(fp, 0.0))
+            stats.slowest = sorted(((secs, fp) for fp, secs in merged.items()), reverse=True)[:SLOW_STATEMENTS_PER_ROUTE]
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status and SQL usage."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        current = _RequestMetrics()
+        token = _current.set(current)
+        status_code = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            latency = time.perf_counter() - started
+            _current.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or UNMATCHED_ROUTE
+            _record(path, scope["method"], status_code[0], latency,
+                    current.statements, current.db_seconds, current.slow)
+
+
+# --- Stage Timers ---
+
+def observe_stage(stage: str, seconds: float):
+    with _lock:
+        hist = _stages.get(stage)
+        if hist is None:
+            hist = _stages[stage] = Histogram(LATENCY_BUCKETS)
+        hist.observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def timed(stage: str):
+    """Decorator form of stage_timer."""
+    def decorator(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe_stage(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+# --- Exposition ---
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", " ")
+
+
+def _histogram_lines(name: str, labels: str, hist: Histogram) -> List[str]:
+    lines, cumulative = [], 0
+    for bound, count in zip(list(hist.buckets) + ["+Inf"], hist.counts):
+        cumulative += count
+        le = bound if bound == "+Inf" else f"{bound:g}"
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {hist.sum:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {hist.count}")
+    return lines
+
+
+def render() -> str:
+    """All metrics in Prometheus text exposition format (0.0.4)."""
+    with _lock:
+        routes = sorted(_routes.items())
+        stages = sorted(_stages.items())
+
+        out = [
+            "# HELP caresignal_http_requests_total HTTP requests by route template and status.",
+            "# TYPE caresignal_http_requests_total counter",
+        ]
+        for (route, method), s in routes:
+            for status_code, count in sorted(s.requests.items()):
+                out.append(f'caresignal_http_requests_total{{route="{_label(route)}",method="{method}",'
+                           f'status="{status_code}"}} {count}')
+
+        out += ["# HELP caresignal_http_request_duration_seconds Request latency.",
+                "# TYPE caresignal_http_request_duration_seconds histogram"]
+        for (route, method), s in routes:
+            if s.latency.count:
+                out += _histogram_lines("caresignal_http_request_duration_seconds",
+                                        f'route="{_label(route)}",method="{method}"', s.latency)
+
+        out += ["# HELP caresignal_http_request_sql_statements SQL statements per request.",
+                "# TYPE caresignal_http_request_sql_statements histogram"]
+        for (route, method), s in routes:
+            if s.statements.count:
+                out += _histogram_lines("caresignal_http_request_sql_statements",
+                                        f'route="{_label(route)}",method="{method}"', s.statements)
+
+        out += ["# HELP caresignal_sql_statements_total SQL statements by route (background = outside requests).",
+                "# TYPE caresignal_sql_statements_total counter"]
+        for (route, method), s in routes:
+            out.append(f'caresignal_sql_statements_total{{route="{_label(route)}",method="{method}"}} {s.sql_total}')
+
+        out += ["# HELP caresignal_sql_seconds_total Time spent executing SQL by route.",
+                "# TYPE caresignal_sql_seconds_total counter"]
+        for (route, method), s in routes:
+            out.append(f'caresignal_sql_seconds_total{{route="{_label(route)}",method="{method}"}} {s.db_seconds:.6f}')
+
+        out += ["# HELP caresignal_sql_slowest_seconds Slowest statements seen per route (by fingerprint).",
+                "# TYPE caresignal_sql_slowest_seconds gauge"]
+        for (route, method), s in routes:
+            for seconds, fp in s.slowest:
+                out.append(f'caresignal_sql_slowest_seconds{{route="{_label(route)}",method="{method}",'
+                           f'statement="{_label(fp)}"}} {seconds:.6f}')
+
+        out += ["# HELP caresignal_stage_duration_seconds Detection and forecasting stage timings.",
+                "# TYPE caresignal_stage_duration_seconds histogram"]
+        for stage, hist in stages:
+            out += _histogram_lines("caresignal_stage_duration_seconds", f'stage="{_label(stage)}"', hist)
+
+    return "\n".join(out) + "\n"
+
+
+def reset():
+    """Clears all collected metrics (tests)."""
+    with _lock:
+        _routes.clear()
+        _stages.clear()
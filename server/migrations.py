@@ -0,0 +1,113 @@
+"""
+Schema upgrades for existing databases.
+
+create_all() only creates missing tables; it never adds columns or indexes
+to a table that already exists. upgrade() runs create_all and then adds
+any column or index declared on the models that the live database is
+missing, so deployments pick up schema additions on restart.
+
+It also re-encodes syndrome / age-group columns written as text before
+they were dictionary-encoded (see dimensions.py): the names are interned
+and each column is rewritten as its integer key. SQLite cannot change a
+column's type, so there the table is copied into a new one created from
+the model; elsewhere a key column is added, filled and renamed over the
+old one.
+"""
+from sqlalchemy import Integer, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.schema import AddConstraint, CreateTable, UniqueConstraint
+
+import models
+from dimensions import DimensionKey
+
+
+def upgrade(engine: Engine):
+    models.Base.metadata.create_all(bind=engine)
+
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in existing]
+        if missing:
+            with engine.begin() as conn:
+                for column in missing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+    encode_dimensions(engine)
+
+    for table in models.Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+
+# --- Dimension Encoding ---
+
+def _text_dimension_columns(engine: Engine, table) -> list:
+    live = {c["name"]: c["type"] for c in inspect(engine).get_columns(table.name)}
+    return [c for c in table.columns
+            if isinstance(c.type, DimensionKey) and c.name in live and not isinstance(live[c.name], Integer)]
+
+
+def encode_dimensions(engine: Engine) -> int:
+    """Rewrites text dimension columns as integer keys; returns the number of tables changed."""
+    changed = 0
+    for table in models.Base.metadata.sorted_tables:
+        columns = _text_dimension_columns(engine, table)
+        if not columns:
+            continue
+        with engine.begin() as conn:
+            for column in columns:
+                names = conn.execute(text(f"SELECT DISTINCT {column.name} FROM {table.name} "
+                                          f"WHERE {column.name} IS NOT NULL")).scalars()
+                column.type.dimension.intern(conn, list(names))
+            if engine.dialect.name == "sqlite":
+                _rebuild_sqlite_table(conn, table, columns)
+            else:
+                _replace_columns(conn, table, columns)
+        changed += 1
+    return changed
+
+
+def _lookup(column, source: str) -> str:
+    dim = column.type.dimension.table.name
+    return f"(SELECT id FROM {dim} WHERE name = {source}.{column.name})"
+
+
+def _rebuild_sqlite_table(conn: Connection, table, columns: list):
+    live = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    names = [c.name for c in table.columns if c.name in live]
+    encoded = {c.name for c in columns}
+    select_list = ", ".join(_lookup(table.c[n], table.name) if n in encoded else n for n in names)
+    tmp = f"{table.name}__encoded"
+
+    ddl = str(CreateTable(table).compile(dialect=conn.dialect))
+    conn.exec_driver_sql(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE {tmp} ", 1))
+    conn.execute(text(f"INSERT INTO {tmp} ({', '.join(names)}) SELECT {select_list} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))  # Drops its indexes too; recreated below
+    conn.execute(text(f"ALTER TABLE {tmp} RENAME TO {table.name}"))
+    for index in table.indexes:
+        index.create(bind=conn)
+
+
+def _replace_columns(conn: Connection, table, columns: list):
+    for column in columns:
+        tmp = f"{column.name}__key"
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {tmp} INTEGER"))
+        conn.execute(text(f"UPDATE {table.name} SET {tmp} = {_lookup(column, table.name)}"))
+        conn.execute(text(f"ALTER TABLE {table.name} DROP COLUMN {column.name}"))  # And indexes/constraints on it
+        conn.execute(text(f"ALTER TABLE {table.name} RENAME COLUMN {tmp} TO {column.name}"))
+    names = {c.name for c in columns}
+    for constraint in table.constraints:
+        if isinstance(constraint, UniqueConstraint) and names & {c.name for c in constraint.columns}:
+            conn.execute(AddConstraint(constraint))
+    for index in table.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+
+if __name__ == "__main__":
+    import sharding
+
+    for shard in sharding.router.shards():
+        upgrade(shard.engine)
+        print(f"Upgraded {shard.key}: {shard.engine.url}")
@@ -1,17 +1,57 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, DateTime, Boolean, Text, UniqueConstraint
+from sqlalchemy import Column, Integer, Float, String, Date, ForeignKey, DateTime, Boolean, Text, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
+from dimensions import SYNDROMES, AGE_GROUPS, SyndromeKey, AgeGroupKey
+
+class Syndrome(Base):
+    __tablename__ = "syndromes"
+    id = Column(Integer, primary_key=True, index=True, autoincrement=False) # dimensions.key_for(name)
+    name = Column(String, unique=True) # "Fever"
+
+class AgeGroup(Base):
+    __tablename__ = "age_groups"
+    id = Column(Integer, primary_key=True, index=True, autoincrement=False)
+    name = Column(String, unique=True) # "0-5"
+
+SYNDROMES.attach(Syndrome.__table__)
+AGE_GROUPS.attach(AgeGroup.__table__)
+
+class District(Base):
+    __tablename__ = "districts"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, unique=True) # e.g., "Pune"
 
 class Zone(Base):
     __tablename__ = "zones"
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, unique=True, index=True) # e.g., "North Ward"
+    district_id = Column(Integer, ForeignKey("districts.id"), index=True) # Picks the shard (see sharding.py)
     
     hospitals = relationship("Hospital", back_populates="zone")
     signals = relationship("Signal", back_populates="zone")
     responsibilities = relationship("Responsibility", back_populates="zone")
 
+class ZoneAdjacency(Base):
+    __tablename__ = "zone_adjacency"
+    __table_args__ = (
+        UniqueConstraint('zone_id', 'neighbor_id', name='uq_zone_adjacency'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    zone_id = Column(Integer, ForeignKey("zones.id"), index=True)
+    neighbor_id = Column(Integer, ForeignKey("zones.id")) # Stored in both directions
+
+class ZoneGeometry(Base):
+    __tablename__ = "zone_geometries"
+    zone_id = Column(Integer, ForeignKey("zones.id"), primary_key=True)
+    geojson = Column(Text) # GeoJSON Polygon/MultiPolygon geometry, lng/lat (see zone_geometry.py)
+    min_lng = Column(Float)
+    min_lat = Column(Float)
+    max_lng = Column(Float)
+    max_lat = Column(Float)
+    centroid_lng = Column(Float)
+    centroid_lat = Column(Float)
+
 class Hospital(Base):
     __tablename__ = "hospitals"
     id = Column(Integer, primary_key=True, index=True)
@@ -24,25 +64,68 @@ class Hospital(Base):
 
 class VisitEvent(Base):
     __tablename__ = "visit_events"
+    __table_args__ = (
+        Index('ix_visit_events_syndrome_date', 'syndrome', 'date'), # Syndrome-filtered date ranges
+    )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, index=True)
     hospital_id = Column(Integer, ForeignKey("hospitals.id"))
-    syndrome = Column(String, index=True) # "Fever"
+    syndrome = Column(SyndromeKey, index=True) # "Fever" (stored as its syndromes.id)
     count = Column(Integer)
-    age_group = Column(String)
+    age_group = Column(AgeGroupKey)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     hospital = relationship("Hospital", back_populates="visits")
 
+class VisitDailyRollup(Base):
+    __tablename__ = "visit_daily_rollups"
+    __table_args__ = (
+        UniqueConstraint('date', 'hospital_id', 'syndrome', name='uq_visit_rollup_date_hospital_syndrome'),
+        Index('ix_visit_daily_rollups_syndrome_date', 'syndrome', 'date'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, index=True)
+    hospital_id = Column(Integer, ForeignKey("hospitals.id"))
+    syndrome = Column(SyndromeKey)
+    count = Column(Integer) # Sum over age groups of compacted visit_events rows
+
+class VisitCube(Base):
+    __tablename__ = "visit_cube"
+    __table_args__ = (
+        UniqueConstraint('date', 'hospital_id', 'syndrome', 'age_group', name='uq_visit_cube_cell'),
+        Index('ix_visit_cube_syndrome_date', 'syndrome', 'date'),
+        Index('ix_visit_cube_zone_date', 'zone_id', 'date'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    date = Column(Date, index=True)
+    zone_id = Column(Integer, ForeignKey("zones.id")) # Hospital's zone, denormalised for slicing
+    hospital_id = Column(Integer, ForeignKey("hospitals.id"))
+    syndrome = Column(SyndromeKey)
+    age_group = Column(AgeGroupKey) # "Unknown" when not reported (or compacted before the cube existed)
+    count = Column(Integer)
+
+class VisitAggregate(Base):
+    __tablename__ = "visit_aggregates"
+    __table_args__ = (
+        UniqueConstraint('level', 'zone_id', 'syndrome', 'period_start', name='uq_visit_aggregate_bucket'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    level = Column(String) # "week" or "month" (see pyramid.py)
+    period_start = Column(Date) # Monday / first of the month
+    zone_id = Column(Integer, ForeignKey("zones.id"))
+    syndrome = Column(SyndromeKey)
+    count = Column(Integer)
+
 class Signal(Base):
     __tablename__ = "signals"
     __table_args__ = (
         UniqueConstraint('zone_id', 'signal_type', 'syndrome', 'date', name='uq_signal_zone_type_syndrome_date'),
+        Index('ix_signals_status_sla_deadline', 'status', 'sla_deadline'), # SLA escalation sweeps
     )
     id = Column(Integer, primary_key=True, index=True)
     date = Column(Date, index=True)
     zone_id = Column(Integer, ForeignKey("zones.id"))
-    syndrome = Column(String) # Can be "ALL" for OPD Load
+    syndrome = Column(SyndromeKey) # Can be "ALL" for OPD Load
     
     # Analysis Data
     is_spike = Column(Boolean, default=False)
@@ -82,3 +165,124 @@ class Responsibility(Base):
     contact = Column(String) 
 
     zone = relationship("Zone", back_populates="responsibilities")
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    id = Column(Integer, primary_key=True, index=True)
+    signal_id = Column(Integer, ForeignKey("signals.id"))
+    kind = Column(String, default="new") # What happened to the signal
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    dispatched = Column(Boolean, default=False, index=True) # Fanned out to notification_deliveries
+
+    signal = relationship("Signal")
+
+class NotificationDelivery(Base):
+    __tablename__ = "notification_deliveries"
+    __table_args__ = (
+        UniqueConstraint('signal_id', 'recipient', 'kind', name='uq_delivery_signal_recipient'),
+        Index('ix_deliveries_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    outbox_id = Column(Integer, ForeignKey("notification_outbox.id"))
+    signal_id = Column(Integer, ForeignKey("signals.id"))
+    kind = Column(String)
+    recipient = Column(String) # Responsibility.contact
+    role = Column(String) # "DHO", "MO"
+    channel = Column(String) # Transport name, e.g. "email", "sms" (see notifications.py)
+    status = Column(String, default="pending") # "pending", "sent", "failed"
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime)
+    claimed_by = Column(String) # Dispatcher holding the row while it sends
+    claimed_at = Column(DateTime)
+    last_error = Column(Text)
+    sent_at = Column(DateTime)
+
+class SyncKey(Base):
+    __tablename__ = "sync_keys"
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, unique=True, index=True) # Client-generated idempotency key (one per report)
+    hospital_id = Column(Integer, ForeignKey("hospitals.id"))
+    seq = Column(Integer) # Ingestion-log record that carried it
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class ZoneIngestSeq(Base):
+    __tablename__ = "zone_ingest_seqs"
+    zone_id = Column(Integer, ForeignKey("zones.id"), primary_key=True)
+    last_seq = Column(Integer, default=0) # Newest ingestion-log record with visits in this zone
+
+class PipelineCheckpoint(Base):
+    __tablename__ = "pipeline_checkpoints"
+    stage = Column(String, primary_key=True) # "rollups", "detection", ... (see pipeline.STAGES)
+    as_of = Column(Date) # Day the stage last completed for
+    source_seq = Column(Integer, default=0) # Ingest checkpoint when it started
+    finished_at = Column(DateTime)
+
+class Forecast(Base):
+    __tablename__ = "forecasts"
+    __table_args__ = (
+        UniqueConstraint('as_of', 'zone_id', 'syndrome', 'date', name='uq_forecast_point'),
+        Index('ix_forecasts_zone_as_of', 'zone_id', 'as_of'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    as_of = Column(Date) # Day the model was fitted (history through this day)
+    zone_id = Column(Integer, ForeignKey("zones.id"))
+    syndrome = Column(SyndromeKey)
+    date = Column(Date) # Forecast day (as_of + 1 ...)
+    value = Column(Float)
+    lower_bound = Column(Float)
+    upper_bound = Column(Float)
+    trend = Column(String) # forecasting.explain_trend() of the fit
+    actual = Column(Integer, nullable=True) # Observed count, once scored (accuracy.py)
+
+class ForecastAccuracy(Base):
+    __tablename__ = "forecast_accuracy"
+    __table_args__ = (
+        UniqueConstraint('source', 'zone_id', 'syndrome', 'horizon', name='uq_forecast_accuracy'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String) # "live" (scored pipeline forecasts) or "backtest"
+    zone_id = Column(Integer, ForeignKey("zones.id"))
+    syndrome = Column(SyndromeKey)
+    horizon = Column(Integer) # Days ahead of the fit
+    # Running sums; the metrics are ratios of these (see accuracy.metrics)
+    n = Column(Integer, default=0)
+    abs_error = Column(Float, default=0.0)
+    pct_error = Column(Float, default=0.0) # Sum of |error| / actual over days with actual > 0
+    pct_n = Column(Integer, default=0)
+    covered = Column(Integer, default=0) # Actuals inside the forecast's bounds
+    last_date = Column(Date) # Latest day scored
+
+class ZoneRisk(Base):
+    __tablename__ = "zone_risks"
+    __table_args__ = (
+        UniqueConstraint('as_of', 'zone_id', 'syndrome', name='uq_zone_risk'),
+        Index('ix_zone_risks_zone_as_of', 'zone_id', 'as_of'),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    as_of = Column(Date)
+    zone_id = Column(Integer, ForeignKey("zones.id"))
+    syndrome = Column(SyndromeKey)
+    risk_level = Column(String) # forecasting.assess_risk()
+    risk_reason = Column(String)
+    intensity = Column(Float) # 0.0 to 1.0
+    guidance = Column(Text) # JSON list of strings
+    summary_trend = Column(String) # /analysis/summary's view (None: too few points)
+    summary_high_risk = Column(Boolean, default=False)
+
+class IngestCheckpoint(Base):
+    __tablename__ = "ingest_checkpoints"
+    name = Column(String, primary_key=True) # Consumer name, e.g. "visit_events"
+    last_seq = Column(Integer, default=0) # Highest ingestion-log sequence applied
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class TableVersion(Base):
+    __tablename__ = "table_versions"
+    name = Column(String, primary_key=True) # Cached table, e.g. "zone_adjacency"
+    version = Column(Integer, default=0) # Bumped by every writer, so caches in other workers notice edits
+
+class IngestQuarantine(Base):
+    __tablename__ = "ingest_quarantine"
+    seq = Column(Integer, primary_key=True, autoincrement=False) # Log record skipped by the applier
+    record = Column(Text) # The record as logged (JSON)
+    error = Column(Text)
+    quarantined_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,329 @@
+"""
+Notifications to each zone's responsible officers.
+
+save_signal adds a notification_outbox row in the transaction that creates
+the signal, so a notification exists exactly when the signal does and
+detection pays one INSERT for it. Everything else happens on this
+dispatcher's thread:
+
+1. Fan-out: each outbox row becomes one notification_deliveries row per
+   Responsibility contact in the signal's zone (DHO, MO, ...). The unique
+   (signal, recipient, kind) key drops duplicates, e.g. when two
+   dispatchers fan out the same row.
+2. Delivery: due rows are claimed (claimed_by), grouped per recipient and
+   sent as one message listing all of that recipient's signals. Failures
+   are retried with exponential backoff up to MAX_ATTEMPTS, then marked
+   failed. A claim older than CLAIM_TIMEOUT_S is taken over, so a pass
+   with slow sends renews its claim every CLAIM_RENEW_S and stops if
+   another dispatcher has taken any of its rows.
+
+Delivery is at-least-once: each recipient's rows are committed right after
+their message goes out, so a crash between the send and that commit
+re-sends the message once the claim expires.
+
+Transports are pluggable: register(channel, transport) with any object
+that has send(recipient, subject, body). A contact's channel follows from
+its format (email address or phone number). Rows for a channel with no
+transport stay pending until one is registered. Configuration comes from
+the environment: NOTIFY_SMTP_HOST sends email through SMTP, and
+NOTIFY_FILE_DIR writes every message to .eml files instead (a local
+stand-in for testing).
+"""
+import os
+import re
+import smtplib
+import time
+import uuid
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Dict, List, Optional, Protocol
+
+from sqlalchemy import func, insert, or_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models, scheduler, sharding
+
+# Params
+INTERVAL_S = float(os.getenv("NOTIFY_INTERVAL_S", "30"))
+BATCH_SIZE = 500
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_S = 60  # Retry n waits BACKOFF_BASE_S * 2^(n-1), capped
+BACKOFF_MAX_S = 6 * 3600
+CLAIM_TIMEOUT_S = 300  # Claims older than this (a dispatcher died mid-send) are taken over
+CLAIM_RENEW_S = CLAIM_TIMEOUT_S / 3  # A pass still sending re-stamps its claim this often
+SMTP_HOST = os.getenv("NOTIFY_SMTP_HOST", "")
+SMTP_PORT = int(os.getenv("NOTIFY_SMTP_PORT", "25"))
+SENDER = os.getenv("NOTIFY_FROM", "caresignal@localhost")
+FILE_DIR = os.getenv("NOTIFY_FILE_DIR", "")
+
+stats = {
+    "runs": 0,
+    "fanned_out_total": 0,
+    "sent_total": 0,
+    "retried_total": 0,
+    "failed_total": 0,
+    "last_sent": 0,
+    "last_duration_s": 0.0,
+}
+
+
+# --- Transports ---
+
+class Transport(Protocol):
+    def send(self, recipient: str, subject: str, body: str) -> None:
+        """Delivers one message or raises."""
+
+
+class SmtpTransport:
+    def __init__(self, host: str, port: int = 25, sender: str = SENDER, timeout_s: float = 10.0):
+        self.host, self.port, self.sender, self.timeout_s = host, port, sender, timeout_s
+
+    def send(self, recipient: str, subject: str, body: str) -> None:
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout_s) as smtp:
+            smtp.send_message(_email(self.sender, recipient, subject, body))
+
+
+class FileTransport:
+    """Writes each message to `directory` as an .eml file."""
+
+    def __init__(self, directory: str, sender: str = SENDER):
+        self.directory, self.sender = directory, sender
+        os.makedirs(directory, exist_ok=True)
+
+    def send(self, recipient: str, subject: str, body: str) -> None:
+        name = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}.eml"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(bytes(_email(self.sender, recipient, subject, body)))
+        os.replace(path + ".tmp", path)
+
+
+def _email(sender: str, recipient: str, subject: str, body: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"], msg["To"], msg["Subject"] = sender, recipient, subject
+    msg.set_content(body)
+    return msg
+
+
+CHANNELS = ("email", "sms")
+_PHONE = re.compile(r"^\+?[\d\s\-()]{7,}$")
+_transports: Dict[str, Transport] = {}
+
+
+def register(channel: str, transport: Optional[Transport]):
+    """Delivers `channel` through `transport` (None unregisters)."""
+    if transport is None:
+        _transports.pop(channel, None)
+    else:
+        _transports[channel] = transport
+
+
+def configure_from_env():
+    if SMTP_HOST:
+        register("email", SmtpTransport(SMTP_HOST, SMTP_PORT))
+    if FILE_DIR:
+        stand_in = FileTransport(FILE_DIR)
+        for channel in CHANNELS:
+            register(channel, stand_in)
+
+
+def channel_for(contact: Optional[str]) -> Optional[str]:
+    """Channel for a Responsibility.contact: "email" or "sms" (None if unroutable)."""
+    contact = (contact or "").strip()
+    if "@" in contact:
+        return "email"
+    if _PHONE.match(contact):
+        return "sms"
+    return None
+
+
+# --- Fan-out ---
+
+def _insert_deliveries(db: Session, rows: List[Dict]):
+    table = models.NotificationDelivery.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert_ = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        db.execute(insert_(table).on_conflict_do_nothing(index_elements=["signal_id", "recipient", "kind"]), rows)
+        return
+
+    # Portable fallback
+    for row in rows:
+        exists = db.query(models.NotificationDelivery.id).filter_by(
+            signal_id=row["signal_id"], recipient=row["recipient"], kind=row["kind"]).first()
+        if not exists:
+            db.execute(insert(table), [row])
+
+
+def fan_out(db: Session, now: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> int:
+    """Expands undispatched outbox rows into per-recipient deliveries. Returns outbox rows handled."""
+    now = now or datetime.now()
+    handled = 0
+    while True:
+        batch = db.query(models.NotificationOutbox.id, models.NotificationOutbox.signal_id,
+                         models.NotificationOutbox.kind, models.Signal.zone_id)\
+            .join(models.Signal, models.Signal.id == models.NotificationOutbox.signal_id)\
+            .filter(models.NotificationOutbox.dispatched.is_(False))\
+            .order_by(models.NotificationOutbox.id)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            return handled
+
+        contacts: Dict[int, List] = {}
+        for r in db.query(models.Responsibility).filter(
+                models.Responsibility.zone_id.in_({zone_id for _, _, _, zone_id in batch})):
+            contacts.setdefault(r.zone_id, []).append(r)
+        rows = []
+        for outbox_id, signal_id, kind, zone_id in batch:
+            for r in contacts.get(zone_id, []):
+                channel = channel_for(r.contact)
+                if channel is not None:
+                    rows.append({"outbox_id": outbox_id, "signal_id": signal_id, "kind": kind,
+                                 "recipient": r.contact.strip(), "role": r.role, "channel": channel,
+                                 "status": "pending", "attempts": 0, "next_attempt_at": now})
+        if rows:
+            _insert_deliveries(db, rows)
+        db.execute(update(models.NotificationOutbox)
+                   .where(models.NotificationOutbox.id.in_([b[0] for b in batch]))
+                   .values(dispatched=True))
+        db.commit()
+        handled += len(batch)
+        stats["fanned_out_total"] += len(batch)
+        if len(batch) < batch_size:
+            return handled
+
+
+# --- Delivery ---
+
+def backoff(attempts: int) -> timedelta:
+    """Wait before the retry that follows `attempts` failed attempts."""
+    return timedelta(seconds=min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** max(0, attempts - 1)))
+
+
+def _render(signals: List[models.Signal], zones: Dict[int, str]) -> tuple:
+    first = signals[0]
+    if len(signals) == 1:
+        subject = f"[CareSignal] {first.severity} {first.signal_type}: {first.syndrome} in {zones.get(first.zone_id)}"
+    else:
+        subject = f"[CareSignal] {len(signals)} new signals"
+    lines = [f"- {s.date} {zones.get(s.zone_id, f'Zone {s.zone_id}')}: {s.severity} {s.signal_type} "
+             f"({s.syndrome}, {s.value} vs baseline {s.baseline}). {s.explanation or ''}".rstrip()
+             for s in signals]
+    return subject, "New signals need your attention:\n\n" + "\n".join(lines) + "\n"
+
+
+def _renew_claim(db: Session, token: str, ids: List[int], at: datetime) -> bool:
+    """Re-stamps the claim on ids; if another dispatcher took any of them, releases the rest and returns False."""
+    d = models.NotificationDelivery
+    renewed = db.execute(update(d).where(d.id.in_(ids), d.claimed_by == token).values(claimed_at=at),
+                         execution_options={"synchronize_session": False}).rowcount
+    if renewed != len(ids):
+        db.execute(update(d).where(d.claimed_by == token).values(claimed_by=None, claimed_at=None),
+                   execution_options={"synchronize_session": False})
+    db.commit()
+    return renewed == len(ids)
+
+
+def deliver(db: Session, now: Optional[datetime] = None, batch_size: int = BATCH_SIZE) -> Dict:
+    """Sends due deliveries, one message per recipient. Returns counts for this pass."""
+    now = now or datetime.now()
+    d = models.NotificationDelivery
+    if not _transports:
+        return {"sent": 0, "retried": 0, "failed": 0}
+
+    # Claim a batch (the guard keeps a concurrent dispatcher from taking the same rows)
+    token = uuid.uuid4().hex
+    started = time.monotonic()
+    due = db.query(d.id).filter(d.status == "pending", d.next_attempt_at <= now, d.channel.in_(list(_transports)))\
+        .filter(or_(d.claimed_by.is_(None), d.claimed_at < now - timedelta(seconds=CLAIM_TIMEOUT_S)))\
+        .order_by(d.next_attempt_at, d.id).limit(batch_size)
+    db.execute(update(d).where(d.id.in_(due.scalar_subquery()))
+               .where(or_(d.claimed_by.is_(None), d.claimed_at < now - timedelta(seconds=CLAIM_TIMEOUT_S)))
+               .values(claimed_by=token, claimed_at=now), execution_options={"synchronize_session": False})
+    db.commit()
+    claimed = db.query(d).filter(d.claimed_by == token).all()
+    if not claimed:
+        return {"sent": 0, "retried": 0, "failed": 0}
+
+    signals = {s.id: s for s in db.query(models.Signal).filter(models.Signal.id.in_({c.signal_id for c in claimed}))}
+    zones = dict(db.query(models.Zone.id, models.Zone.name)
+                 .filter(models.Zone.id.in_({s.zone_id for s in signals.values()})).all())
+
+    groups: Dict[tuple, List] = {}
+    for c in claimed:
+        groups.setdefault((c.channel, c.recipient), []).append(c)
+
+    sent = retried = failed = 0
+    unsent = [c.id for rows in groups.values() for c in rows]  # Read now, before commits expire the rows
+    renewed = started
+    for (channel, recipient), rows in groups.items():
+        if time.monotonic() - renewed > CLAIM_RENEW_S:
+            if not _renew_claim(db, token, unsent, now + timedelta(seconds=time.monotonic() - started)):
+                break  # Taken over: the rest were released for the next pass
+            renewed = time.monotonic()
+        unsent = unsent[len(rows):]
+        # One line per signal, however many deliveries name it
+        listed = [signals[sid] for sid in dict.fromkeys(c.signal_id for c in rows) if sid in signals]
+        error = None
+        if listed:
+            try:
+                _transports[channel].send(recipient, *_render(listed, zones))
+            except Exception as e:
+                error = repr(e)
+        for c in rows:
+            c.claimed_by = c.claimed_at = None
+            c.attempts += 1
+            if error is None:
+                c.status, c.sent_at, c.last_error = "sent", datetime.now(), None
+                sent += 1
+            elif c.attempts >= MAX_ATTEMPTS:
+                c.status, c.last_error = "failed", error
+                failed += 1
+            else:
+                c.next_attempt_at, c.last_error = now + backoff(c.attempts), error
+                retried += 1
+        db.commit()  # Per recipient: a crash before this re-sends only this message
+
+    stats["sent_total"] += sent
+    stats["retried_total"] += retried
+    stats["failed_total"] += failed
+    return {"sent": sent, "retried": retried, "failed": failed}
+
+
+def dispatch(db: Session, now: Optional[datetime] = None) -> Dict:
+    """One dispatcher pass: fan out new outbox rows, then deliver everything due."""
+    started = time.monotonic()
+    fanned = fan_out(db, now)
+    result = deliver(db, now)
+
+    stats["runs"] += 1
+    stats["last_sent"] = result["sent"]
+    stats["last_duration_s"] = round(time.monotonic() - started, 3)
+    return {"fanned_out": fanned, **result}
+
+
+def queue_stats(db: Session) -> Dict[str, int]:
+    """Deliveries by status, plus outbox rows not yet fanned out."""
+    counts = dict(db.query(models.NotificationDelivery.status, func.count(models.NotificationDelivery.id))
+                  .group_by(models.NotificationDelivery.status).all())
+    counts["undispatched"] = db.query(func.count(models.NotificationOutbox.id))\
+        .filter(models.NotificationOutbox.dispatched.is_(False)).scalar()
+    return counts
+
+
+def _run_dispatch():
+    results = []
+    for shard in sharding.router.shards():  # Every district database
+        db = shard.session_factory()
+        try:
+            results.append(dispatch(db))
+        finally:
+            db.close()
+    return results[0] if len(results) == 1 else results
+
+
+configure_from_env()
+job = scheduler.PeriodicJob("notifications", INTERVAL_S, _run_dispatch)
@@ -0,0 +1,374 @@
+"""
+Nightly precompute pipeline for forecasts and risk.
+
+Forecasts, risk levels, intensity scores and guidance used to be computed
+on every /zones/{id}/forecast and /analysis/summary request. This job runs
+four stages in dependency order for one as-of day (today):
+
+1. rollups    Compaction pass: finalises rollups for days past the horizon.
+2. detection  Detection for the previous day(s), per zone.
+3. forecasts  Fits every active (zone, syndrome) on its last FIT_DAYS and
+              stores FORECAST_DAYS of predictions in `forecasts`.
+4. risk       Risk level, intensity and guidance from those forecasts, plus
+              the summary's trend view, into `zone_risks`.
+5. accuracy   Scores earlier runs' forecasts against what happened
+              (accuracy.py).
+
+Each stage records a checkpoint: the as-of day it completed and the ingest
+seq when it started. A rerun skips stages that are done for the day and
+whose inputs have not changed. Forecasts and risk are redone only for zones
+that received data since (zone_ingest_seqs, kept by the ingestion applier),
+so the hourly job is cheap after the first run of the day. A failed stage
+stops the run; the next run resumes there.
+
+Endpoints serve the materialised rows when the stages are done for today
+and no data has arrived for the zone (or, for risk, its neighbours) since.
+Otherwise they compute live, as before.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+
+import models, migrations, accuracy, compaction, forecasting, ingest_log, scheduler, sharding, signal_engine, spatial_config, timeseries
+
+logger = logging.getLogger(__name__)
+
+# Params
+INTERVAL_S = float(os.getenv("PIPELINE_INTERVAL_S", "3600"))
+FIT_DAYS = 30  # History window: as_of - FIT_DAYS .. as_of
+FORECAST_DAYS = 7  # Materialised horizon (the forecast endpoint's default)
+MAX_FORECAST_DAYS = 90  # Longest horizon the forecast endpoint extrapolates
+DETECTION_CATCHUP_DAYS = 7  # Missed days re-detected after downtime
+SUMMARY_MIN_POINTS = 3
+
+STAGES = (
+    ("rollups", ()),
+    ("detection", ("rollups",)),
+    ("forecasts", ("detection",)),
+    ("risk", ("forecasts",)),
+    ("accuracy", ("rollups",)),
+)
+DATA_STAGES = ("forecasts", "risk")  # Redone per zone when new visits arrive
+
+stats = {
+    "runs": 0,
+    "last_as_of": None,
+    "last_stages_run": [],
+    "last_duration_s": 0.0,
+}
+
+
+# --- Shared Computation (also used live by main.py) ---
+
+def fit(values: Sequence[int], days: int = FORECAST_DAYS) -> Tuple[List[Dict], str]:
+    """(predictions, trend description) for a daily series, oldest first."""
+    f = forecasting.Forecaster()
+    f.fit(values)
+    return f.predict(days=days), forecasting.explain_trend(f.trend, f.level)
+
+
+def assess(syndrome: str, values: Sequence[int], preds: List[Dict], trend_desc: str,
+           spatial: Tuple[str, Optional[str]]) -> Dict:
+    """Risk level, intensity and guidance for one syndrome's fit."""
+    spatial_level, spatial_reason = spatial
+    avg_predicted = sum(p["value"] for p in preds) / len(preds) if preds else 0
+    first = preds[0]["value"] if preds else 0
+    baseline = sum(values[-14:]) / 14 if len(values) >= 14 else 0
+    risk_level = forecasting.assess_risk(avg_predicted, baseline, spatial_level)
+    return {
+        "risk_level": risk_level,
+        "risk_reason": spatial_reason if spatial_reason else f"Based on {syndrome} trends",
+        "intensity": forecasting.calculate_intensity(first, max(values, default=0)),
+        "guidance": forecasting.generate_operational_guidance(first, risk_level, trend_desc),
+    }
+
+
+def summary_view(counts_by_date: Dict[date, int]) -> Tuple[Optional[str], bool]:
+    """/analysis/summary's (trend, high risk) for the days a syndrome was reported."""
+    counts = [n for _, n in sorted(counts_by_date.items())]
+    if len(counts) < SUMMARY_MIN_POINTS:
+        return None, False
+    preds, trend_desc = fit(counts, days=7)
+    avg_pred = sum(p["value"] for p in preds) / len(preds)
+    avg_hist = sum(counts) / len(counts) if counts else 1
+    return trend_desc, avg_pred > avg_hist * 1.5 and avg_pred > 5  # Lowered threshold for demo sensitivity
+
+
+# --- Freshness ---
+
+def _ingest_seq(db: Session) -> int:
+    checkpoint = db.get(models.IngestCheckpoint, ingest_log.CHECKPOINT_NAME)
+    return checkpoint.last_seq if checkpoint else 0
+
+
+def dirty_zones(db: Session, since_seq: int, zone_ids: Optional[List[int]] = None) -> Set[int]:
+    """Zones that received visits after ingest seq since_seq."""
+    q = db.query(models.ZoneIngestSeq.zone_id).filter(models.ZoneIngestSeq.last_seq > since_seq)
+    if zone_ids is not None:
+        q = q.filter(models.ZoneIngestSeq.zone_id.in_(zone_ids))
+    return {z for (z,) in q}
+
+
+def _done_for(db: Session, as_of: date) -> Optional[int]:
+    """Ingest seq the materialised rows reflect, if forecasts and risk are done for as_of."""
+    checkpoints = db.query(models.PipelineCheckpoint)\
+        .filter(models.PipelineCheckpoint.stage.in_(DATA_STAGES)).all()
+    if len(checkpoints) != len(DATA_STAGES) or any(cp.as_of != as_of for cp in checkpoints):
+        return None
+    return min(cp.source_seq for cp in checkpoints)
+
+
+def materialised_forecasts(db: Session, zone_id: int, as_of: date, syndromes: List[str]) -> Optional[Dict[str, Dict]]:
+    """
+    syndrome -> {"forecast": [...], "trend", "risk_level", "risk_reason", "intensity", "guidance"}
+    from the last run, or None when it doesn't cover the request.
+    """
+    seq = _done_for(db, as_of)
+    if seq is None:
+        return None
+    if dirty_zones(db, seq, [zone_id] + spatial_config.get_neighbors(zone_id, spatial_config.SPATIAL_RISK_HOPS, db)):
+        return None  # New visits here (or signals next door) since the run
+
+    risks = db.query(models.ZoneRisk)\
+        .filter(models.ZoneRisk.as_of == as_of, models.ZoneRisk.zone_id == zone_id)\
+        .filter(models.ZoneRisk.syndrome.in_(syndromes)).all()
+    if len(risks) != len(set(syndromes)):
+        return None
+    out = {r.syndrome: {"forecast": [], "trend": None, "risk_level": r.risk_level, "risk_reason": r.risk_reason,
+                        "intensity": r.intensity, "guidance": json.loads(r.guidance or "[]")} for r in risks}
+    points = db.query(models.Forecast)\
+        .filter(models.Forecast.as_of == as_of, models.Forecast.zone_id == zone_id)\
+        .filter(models.Forecast.syndrome.in_(syndromes))\
+        .order_by(models.Forecast.date).all()
+    for p in points:
+        out[p.syndrome]["trend"] = p.trend
+        out[p.syndrome]["forecast"].append({"date": p.date, "value": p.value,
+                                            "lower_bound": p.lower_bound, "upper_bound": p.upper_bound})
+    return out
+
+
+def materialised_summary(db: Session, as_of: date) -> Optional[Tuple[Dict[int, List[tuple]], Set[int]]]:
+    """
+    ({zone: [(syndrome, trend, high risk)]} from the last run, zones to compute live),
+    or None without a run for as_of.
+    """
+    seq = _done_for(db, as_of)
+    if seq is None:
+        return None
+    live = dirty_zones(db, seq)
+    by_zone: Dict[int, List[tuple]] = {}
+    rows = db.query(models.ZoneRisk.zone_id, models.ZoneRisk.syndrome, models.ZoneRisk.summary_trend,
+                    models.ZoneRisk.summary_high_risk)\
+        .filter(models.ZoneRisk.as_of == as_of, models.ZoneRisk.summary_trend.isnot(None))
+    for zone_id, syndrome, trend, high_risk in rows:
+        if zone_id not in live:
+            by_zone.setdefault(zone_id, []).append((syndrome, trend, high_risk))
+    return {z: sorted(analysed) for z, analysed in by_zone.items()}, live
+
+
+# --- Stages ---
+
+def _active_pairs(db: Session, as_of: date, zone_ids: Optional[List[int]]) -> Dict[int, List[str]]:
+    """zone -> syndromes reported in its last FIT_DAYS (as the forecast endpoint discovers them)."""
+    q = db.query(models.Hospital.zone_id, models.VisitEvent.syndrome).distinct()\
+        .join(models.Hospital)\
+        .filter(models.VisitEvent.date >= as_of - timedelta(days=FIT_DAYS), models.VisitEvent.date <= as_of)
+    if zone_ids is not None:
+        q = q.filter(models.Hospital.zone_id.in_(zone_ids))
+    pairs: Dict[int, List[str]] = {}
+    for zone_id, syndrome in q:
+        if zone_id is not None:
+            pairs.setdefault(zone_id, []).append(syndrome)
+    return {z: sorted(s) for z, s in pairs.items()}
+
+
+def _daily_values(db: Session, as_of: date, zone_ids: Optional[List[int]]) -> Dict[tuple, List[int]]:
+    start = as_of - timedelta(days=FIT_DAYS)
+    values: Dict[tuple, List[int]] = {}
+    for z, s, d, total in timeseries.zone_daily_counts(db, start, as_of, zone_ids):
+        values.setdefault((z, s), [0] * (FIT_DAYS + 1))[(d - start).days] = total
+    return values
+
+
+def _stage_rollups(db: Session, as_of: date, since_seq: Optional[int], previous: Optional[date]) -> Dict:
+    return compaction.compact(db)
+
+
+def _stage_detection(db: Session, as_of: date, since_seq: Optional[int], previous: Optional[date]) -> Dict:
+    first = as_of - timedelta(days=1)
+    if previous is not None and previous < as_of:
+        first = max(previous, as_of - timedelta(days=DETECTION_CATCHUP_DAYS))  # Days missed while down
+    hospitals = {}
+    for hospital in db.query(models.Hospital).filter(models.Hospital.zone_id.isnot(None)).order_by(models.Hospital.id):
+        hospitals.setdefault(hospital.zone_id, hospital)  # Detection is per zone; any hospital of it will do
+
+    days = [first + timedelta(days=i) for i in range((as_of - first).days)]
+    for d in days:
+        for hospital in hospitals.values():
+            signal_engine.detect_signals_for_hospital(db, hospital, d)
+    return {"days": [d.isoformat() for d in days], "zones": len(hospitals)}
+
+
+def _stage_forecasts(db: Session, as_of: date, since_seq: Optional[int], previous: Optional[date]) -> Dict:
+    zone_ids = sorted(dirty_zones(db, since_seq)) if since_seq is not None else None
+    pairs = _active_pairs(db, as_of, zone_ids)
+    values = _daily_values(db, as_of, zone_ids)
+
+    rows = []
+    for zone_id, syndromes in pairs.items():
+        for syndrome in syndromes:
+            preds, trend_desc = fit(values.get((zone_id, syndrome), [0] * (FIT_DAYS + 1)))
+            rows += [{"as_of": as_of, "zone_id": zone_id, "syndrome": syndrome,
+                      "date": as_of + timedelta(days=p["day"]), "value": p["value"],
+                      "lower_bound": p["lower_bound"], "upper_bound": p["upper_bound"], "trend": trend_desc}
+                     for p in preds]
+
+    stale = delete(models.Forecast).where(models.Forecast.as_of == as_of)
+    if zone_ids is not None:
+        stale = stale.where(models.Forecast.zone_id.in_(zone_ids))
+    db.execute(stale)
+    if rows:
+        db.execute(insert(models.Forecast), rows)
+    db.commit()
+    return {"zones": len(pairs), "pairs": sum(len(s) for s in pairs.values()), "points": len(rows)}
+
+
+def _stage_risk(db: Session, as_of: date, since_seq: Optional[int], previous: Optional[date]) -> Dict:
+    if since_seq is not None:
+        # Neighbours of zones with new data may have a new spatial risk too
+        changed = dirty_zones(db, since_seq)
+        zone_ids = sorted(changed | {n for z in changed
+                                     for n in spatial_config.get_neighbors(z, spatial_config.SPATIAL_RISK_HOPS, db)})
+    else:
+        zone_ids = None
+    values = _daily_values(db, as_of, zone_ids)
+
+    forecasts: Dict[tuple, Dict] = {}
+    q = db.query(models.Forecast).filter(models.Forecast.as_of == as_of).order_by(models.Forecast.date)
+    if zone_ids is not None:
+        q = q.filter(models.Forecast.zone_id.in_(zone_ids))
+    for p in q:
+        entry = forecasts.setdefault((p.zone_id, p.syndrome), {"preds": [], "trend": p.trend})
+        entry["preds"].append({"value": p.value})
+
+    # The summary's view: raw visits on the days they were reported
+    reported: Dict[tuple, Dict[date, int]] = {}
+    q = db.query(models.Hospital.zone_id, models.VisitEvent.syndrome, models.VisitEvent.date,
+                 func.sum(models.VisitEvent.count))\
+        .join(models.Hospital)\
+        .filter(models.VisitEvent.date >= as_of - timedelta(days=FIT_DAYS), models.VisitEvent.date <= as_of)
+    if zone_ids is not None:
+        q = q.filter(models.Hospital.zone_id.in_(zone_ids))
+    for z, s, d, total in q.group_by(models.Hospital.zone_id, models.VisitEvent.syndrome, models.VisitEvent.date):
+        reported.setdefault((z, s), {})[d] = total or 0
+
+    by_zone: Dict[int, List[str]] = {}
+    for zone_id, syndrome in forecasts:
+        by_zone.setdefault(zone_id, []).append(syndrome)
+    rows = []
+    for zone_id, syndromes in by_zone.items():
+        spatial = spatial_config.assess_neighbor_risk(db, zone_id, syndromes, as_of)
+        for syndrome in syndromes:
+            entry = forecasts[(zone_id, syndrome)]
+            risk = assess(syndrome, values.get((zone_id, syndrome), [0] * (FIT_DAYS + 1)), entry["preds"],
+                          entry["trend"], spatial[syndrome])
+            summary_trend, summary_high_risk = summary_view(reported.get((zone_id, syndrome), {}))
+            rows.append({"as_of": as_of, "zone_id": zone_id, "syndrome": syndrome,
+                         "risk_level": risk["risk_level"], "risk_reason": risk["risk_reason"],
+                         "intensity": risk["intensity"], "guidance": json.dumps(risk["guidance"]),
+                         "summary_trend": summary_trend, "summary_high_risk": summary_high_risk})
+
+    stale = delete(models.ZoneRisk).where(models.ZoneRisk.as_of == as_of)
+    if zone_ids is not None:
+        stale = stale.where(models.ZoneRisk.zone_id.in_(zone_ids))
+    db.execute(stale)
+    if rows:
+        db.execute(insert(models.ZoneRisk), rows)
+    db.commit()
+    return {"zones": len(by_zone), "pairs": len(rows)}
+
+
+def _stage_accuracy(db: Session, as_of: date, since_seq: Optional[int], previous: Optional[date]) -> Dict:
+    return accuracy.score(db, as_of)
+
+
+_STAGE_FNS = {"rollups": _stage_rollups, "detection": _stage_detection,
+              "forecasts": _stage_forecasts, "risk": _stage_risk, "accuracy": _stage_accuracy}
+
+
+# --- Runner ---
+
+def run(db: Session, as_of: Optional[date] = None, force: bool = False) -> Dict:
+    """Runs the stages that are not yet done for as_of (all of them with force). Returns per-stage results."""
+    started = time.monotonic()
+    as_of = as_of or date.today()
+    results: Dict[str, object] = {}
+    finished: Dict[str, datetime] = {}
+    full: Set[str] = set()  # Stages recomputed from scratch this run
+    for stage, deps in STAGES:
+        cp = db.get(models.PipelineCheckpoint, stage)
+        same_day = cp is not None and cp.as_of == as_of and not force
+        if same_day and all(finished[d] <= cp.finished_at for d in deps) \
+                and (stage not in DATA_STAGES or not dirty_zones(db, cp.source_seq)):
+            results[stage] = "up to date"
+            finished[stage] = cp.finished_at
+            continue
+
+        # Zones with new visits only, unless it is a new day or an input was rebuilt
+        incremental = same_day and stage in DATA_STAGES and not full.intersection(deps)
+        seq = _ingest_seq(db)
+        results[stage] = _STAGE_FNS[stage](db, as_of, cp.source_seq if incremental else None,
+                                           cp.as_of if cp else None)
+        if not incremental:
+            full.add(stage)
+        if cp is None:
+            cp = models.PipelineCheckpoint(stage=stage)
+            db.add(cp)
+        cp.as_of, cp.source_seq, cp.finished_at = as_of, seq, datetime.now()
+        db.commit()
+        finished[stage] = cp.finished_at
+
+    stats["runs"] += 1
+    stats["last_as_of"] = as_of.isoformat()
+    stats["last_stages_run"] = [s for s, r in results.items() if r != "up to date"]
+    stats["last_duration_s"] = round(time.monotonic() - started, 3)
+    return {"as_of": as_of.isoformat(), "stages": results}
+
+
+def _run_pipeline():
+    results = []
+    for shard in sharding.router.shards():  # Every district database
+        db = shard.session_factory()
+        try:
+            results.append(run(db))
+        finally:
+            db.close()
+    return results[0] if len(results) == 1 else results
+
+
+job = scheduler.PeriodicJob("pipeline", INTERVAL_S, _run_pipeline)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute forecasts and risk for a day")
+    parser.add_argument("--as-of", type=date.fromisoformat, default=None, help="Day to compute (default today)")
+    parser.add_argument("--force", action="store_true", help="Rerun every stage from scratch")
+    args = parser.parse_args()
+
+    for shard in sharding.router.shards():  # Every district database
+        migrations.upgrade(shard.engine)
+        db = shard.session_factory()
+        try:
+            result = run(db, args.as_of, args.force)
+            print(f"[{shard.key}] Pipeline for {result['as_of']} in {stats['last_duration_s']}s")
+            for stage, outcome in result["stages"].items():
+                print(f"  {stage}: {outcome}")
+        finally:
+            db.close()
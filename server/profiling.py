@@ -0,0 +1,290 @@
+"""
+On-demand profiling of live requests (admin only).
+
+A request is profiled when any of these hold:
+- it was sampled (config sample_rate, 0 = off),
+- its route template is in config routes,
+- it carries "X-Profile: 1" together with a valid X-Admin-Token.
+
+ProfiledRoute (installed as app.router.route_class before the routes are
+declared) wraps each endpoint so profiling runs in the thread that executes
+it: sync endpoints run in Starlette's threadpool, where a profiler enabled
+in the middleware would see nothing. ProfilingMiddleware makes the
+per-request decision and passes it down in a contextvar.
+
+Modes:
+- "sampler": a single daemon thread snapshots the stacks of the threads
+  currently running profiled endpoints every interval_ms
+  (sys._current_frames). Cheap enough to leave at a low sample rate.
+  Aggregated per route as collapsed stacks ("a;b;c count"), which
+  flamegraph.pl / speedscope read directly.
+- "cprofile": deterministic cProfile per request, merged per route into a
+  pstats.Stats; downloaded as a standard .pstats dump (snakeviz, pstats).
+  Only one cProfile can be active per process (enabling a second raises
+  on Python 3.12+), so a request profiled while another is falls back to
+  the sampler.
+
+Everything is in memory and reset with DELETE /admin/profiling.
+"""
+import cProfile
+import hmac
+import inspect
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, List, Optional
+
+from fastapi import Header, HTTPException
+from fastapi.routing import APIRoute
+
+# Params
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Admin endpoints are disabled when unset
+PROFILE_HEADER = "x-profile"
+MODES = ("sampler", "cprofile")
+MAX_STACKS_PER_ROUTE = 5000
+MAX_STACK_DEPTH = 128
+TRUNCATED_STACK = "[truncated]"
+
+config = {
+    "sample_rate": float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+    "routes": [],
+    "mode": os.getenv("PROFILE_MODE", "sampler"),
+    "interval_ms": 5.0,
+}
+
+_requested: ContextVar[bool] = ContextVar("profile_requested", default=False)
+_lock = threading.Lock()
+_collapsed: Dict[str, Dict[str, int]] = {}  # route -> {stack: samples}
+_pstats: Dict[str, pstats.Stats] = {}  # route -> merged cProfile stats
+_profiled: Dict[str, int] = {}  # route -> profiled requests
+_cprofile_lock = threading.Lock()  # Held while a cProfile is enabled
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency for admin endpoints."""
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+# --- Sampler ---
+
+class Sampler:
+    """Samples the stacks of registered threads on one background thread."""
+
+    def __init__(self):
+        self._active: Dict[int, str] = {}  # thread id -> route
+        self._wake = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def register(self, thread_id: int, route: str):
+        self._active[thread_id] = route
+        self._ensure_running()
+        self._wake.set()
+
+    def unregister(self, thread_id: int):
+        self._active.pop(thread_id, None)
+
+    def _ensure_running(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.clear()
+                if not self._active:  # Re-check: register() may have run before clear()
+                    self._wake.wait()
+            time.sleep(config["interval_ms"] / 1000)
+            active = dict(self._active)
+            if not active:
+                continue
+            frames = sys._current_frames()
+            for thread_id, route in active.items():
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    _add_sample(route, collapse(frame))
+
+
+def collapse(frame) -> str:
+    """Root-first 'module:function' frames joined by ';'."""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _add_sample(route: str, stack: str):
+    with _lock:
+        stacks = _collapsed.setdefault(route, {})
+        if stack not in stacks and len(stacks) >= MAX_STACKS_PER_ROUTE:
+            stack = TRUNCATED_STACK
+        stacks[stack] = stacks.get(stack, 0) + 1
+
+
+sampler = Sampler()
+
+
+# --- Request Hooks ---
+
+class ProfilingMiddleware:
+    """Decides per request whether to profile (sampling or admin header)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        requested = config["sample_rate"] > 0 and random.random() < config["sample_rate"]
+        if not requested:
+            headers = dict(scope.get("headers") or [])
+            if headers.get(PROFILE_HEADER.encode()) == b"1":
+                token = headers.get(b"x-admin-token")
+                requested = is_admin(token.decode("latin-1") if token else None)
+
+        token = _requested.set(requested)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _requested.reset(token)
+
+
+def _should_profile(route: str) -> bool:
+    return _requested.get() or route in config["routes"]
+
+
+def _start(route: str):
+    with _lock:
+        _profiled[route] = _profiled.get(route, 0) + 1
+    if config["mode"] == "cprofile" and _cprofile_lock.acquire(blocking=False):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+            return profile
+        except ValueError:  # Some other profiler is active (Python 3.12+)
+            _cprofile_lock.release()
+    sampler.register(threading.get_ident(), route)
+    return None
+
+
+def _stop(route: str, profile: Optional[cProfile.Profile]):
+    if profile is None:
+        sampler.unregister(threading.get_ident())
+        return
+    profile.disable()
+    _cprofile_lock.release()
+    profile.create_stats()
+    with _lock:
+        if route in _pstats:
+            _pstats[route].add(profile)
+        else:
+            _pstats[route] = pstats.Stats(profile)
+
+
+def wrap_endpoint(endpoint, route: str):
+    """Wraps an endpoint (keeping its signature for FastAPI) to profile where it runs."""
+    if inspect.iscoroutinefunction(endpoint):
+        @wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            if not _should_profile(route):
+                return await endpoint(*args, **kwargs)
+            profile = _start(route)
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                _stop(route, profile)
+        return async_wrapper
+
+    @wraps(endpoint)
+    def wrapper(*args, **kwargs):
+        if not _should_profile(route):
+            return endpoint(*args, **kwargs)
+        profile = _start(route)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            _stop(route, profile)
+    return wrapper
+
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, wrap_endpoint(endpoint, path), **kwargs)
+
+
+# --- Results ---
+
+def summary() -> Dict:
+    with _lock:
+        return {
+            "config": dict(config),
+            "routes": {
+                route: {
+                    "profiled_requests": count,
+                    "samples": sum(_collapsed.get(route, {}).values()),
+                    "cprofile": route in _pstats,
+                }
+                for route, count in sorted(_profiled.items())
+            },
+        }
+
+
+def update_config(sample_rate: Optional[float] = None, routes: Optional[List[str]] = None,
+                  mode: Optional[str] = None, interval_ms: Optional[float] = None) -> Dict:
+    if sample_rate is not None:
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        config["sample_rate"] = sample_rate
+    if routes is not None:
+        config["routes"] = list(routes)
+    if mode is not None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        config["mode"] = mode
+    if interval_ms is not None:
+        if interval_ms < 1:
+            raise ValueError("interval_ms must be at least 1")
+        config["interval_ms"] = interval_ms
+    return dict(config)
+
+
+def collapsed_stacks(route: Optional[str] = None) -> str:
+    """Collapsed stacks for one route, or all routes prefixed with the route name."""
+    with _lock:
+        routes = [route] if route else sorted(_collapsed)
+        lines = []
+        for r in routes:
+            for stack, count in sorted(_collapsed.get(r, {}).items()):
+                lines.append(f"{stack} {count}" if route else f"{r};{stack} {count}")
+    return "\n".join(lines) + ("\n" if lines else "")
+
+
+def pstats_dump(route: str) -> Optional[bytes]:
+    """Marshalled pstats (the format of Stats.dump_stats) for a route."""
+    with _lock:
+        stats = _pstats.get(route)
+        return marshal.dumps(stats.stats) if stats is not None else None
+
+
+def reset():
+    with _lock:
+        _collapsed.clear()
+        _pstats.clear()
+        _profiled.clear()
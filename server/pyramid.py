@@ -0,0 +1,181 @@
+"""
+Multi-resolution visit aggregates for long-range views.
+
+visit_aggregates holds weekly (Monday-start) and monthly buckets of visit
+counts per (zone, syndrome), so a year of a zone's Fever counts is 53 or 12
+rows instead of 365 daily sums over visit_events. With the daily series
+(timeseries.py) that makes a three-level pyramid: day -> week -> month.
+
+Maintenance mirrors the visit cube (cube.py):
+- The ingestion applier calls add_visits() in the transaction that inserts
+  the visits, adding their counts to both coarser buckets.
+- Bulk loaders call rebuild(); ensure_built() fills an empty pyramid at
+  startup. Compaction only moves counts between tables, so buckets stay
+  valid.
+
+series() answers a range at one level; choose_level() picks the level for a
+point budget: the finest level whose bucket count fits max_points, so the
+points returned (and rows read) stay bounded however long the range.
+Coarse buckets are whole periods: the first and last may include days just
+outside the range.
+"""
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import delete, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models, timeseries
+
+# Params
+LEVELS = ("day", "week", "month")  # Finest first
+MAX_POINTS = 120  # Default point budget for "auto"
+MAX_RANGE_DAYS = 3660  # Longest history the endpoints serve (about ten years)
+REBUILD_CHUNK = 5000
+
+
+def period_start(level: str, d: date) -> date:
+    if level == "week":
+        return d - timedelta(days=d.weekday())
+    if level == "month":
+        return d.replace(day=1)
+    return d
+
+
+def _next_period(level: str, d: date) -> date:
+    if level == "week":
+        return d + timedelta(days=7)
+    if level == "month":
+        return date(d.year + d.month // 12, d.month % 12 + 1, 1)
+    return d + timedelta(days=1)
+
+
+def periods(level: str, start: date, end: date) -> Iterator[date]:
+    """Bucket start dates covering start..end."""
+    current = period_start(level, start)
+    while current <= end:
+        yield current
+        current = _next_period(level, current)
+
+
+def period_count(level: str, start: date, end: date) -> int:
+    """len(list(periods(level, start, end))), without walking the range."""
+    if start > end:
+        return 0
+    if level == "month":
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    step = 7 if level == "week" else 1
+    return (period_start(level, end) - period_start(level, start)).days // step + 1
+
+
+def choose_level(start: date, end: date, granularity: str = "auto", max_points: int = MAX_POINTS) -> str:
+    """Resolves a granularity parameter ("auto" or one of LEVELS) to a level."""
+    if granularity != "auto":
+        if granularity not in LEVELS:
+            raise ValueError(f"Unknown granularity {granularity!r}; use auto, {', '.join(LEVELS)}")
+        return granularity
+    if max_points < 1:
+        raise ValueError("max_points must be at least 1")
+    for level in LEVELS:
+        if period_count(level, start, end) <= max_points:
+            return level
+    return LEVELS[-1]
+
+
+# --- Maintenance ---
+
+def _upsert(db: Session, cells: Dict[tuple, int]):
+    rows = [{"level": l, "period_start": p, "zone_id": z, "syndrome": s, "count": c}
+            for (l, p, z, s), c in cells.items()]
+    table = models.VisitAggregate.__table__
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        stmt = insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["level", "zone_id", "syndrome", "period_start"],
+            set_={"count": table.c.count + stmt.excluded.count}
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Portable fallback
+    for row in rows:
+        existing = db.query(models.VisitAggregate).filter_by(
+            level=row["level"], zone_id=row["zone_id"], syndrome=row["syndrome"],
+            period_start=row["period_start"]).first()
+        if existing:
+            existing.count += row["count"]
+        else:
+            db.add(models.VisitAggregate(**row))
+
+
+def _bucket(rows, cells: Dict[tuple, int]):
+    """Adds (zone_id, syndrome, date, count) rows to weekly and monthly cells."""
+    for zone_id, syndrome, d, count in rows:
+        if zone_id is None or not count:
+            continue
+        for level in LEVELS[1:]:
+            key = (level, period_start(level, d), zone_id, syndrome)
+            cells[key] = cells.get(key, 0) + count
+
+
+def add_visits(db: Session, rows: List[Dict], zones: Dict[int, int]):
+    """Adds visit rows to their buckets; zones maps hospital_id -> zone_id. The caller commits."""
+    cells: Dict[tuple, int] = {}
+    _bucket(((zones.get(r["hospital_id"]), r["syndrome"], r["date"], r["count"]) for r in rows), cells)
+    if cells:
+        _upsert(db, cells)
+
+
+def rebuild(db: Session):
+    """Recomputes every bucket from raw and compacted visits."""
+    v = timeseries.daily_visits()
+    daily = db.query(v.c.zone_id, v.c.syndrome, v.c.date, func.sum(v.c.count))\
+        .group_by(v.c.zone_id, v.c.syndrome, v.c.date)
+    cells: Dict[tuple, int] = {}
+    _bucket(daily, cells)
+
+    db.execute(delete(models.VisitAggregate))
+    items = list(cells.items())
+    for i in range(0, len(items), REBUILD_CHUNK):
+        _upsert(db, dict(items[i:i + REBUILD_CHUNK]))
+    db.commit()
+
+
+def ensure_built(db: Session) -> bool:
+    """Builds an empty pyramid over existing visits. Returns True if it did."""
+    if db.query(models.VisitAggregate.id).first() is not None:
+        return False
+    if db.query(models.VisitEvent.id).first() is None and db.query(models.VisitDailyRollup.id).first() is None:
+        return False
+    rebuild(db)
+    return True
+
+
+# --- Reading ---
+
+def series(db: Session, zone_ids: List[int], start: date, end: date, level: str,
+           syndromes: Optional[List[str]] = None) -> Dict[str, Dict[date, int]]:
+    """syndrome -> {bucket start: count} summed over zone_ids, for buckets covering start..end."""
+    out: Dict[str, Dict[date, int]] = {}
+    if level == "day":
+        rows = timeseries.zone_daily_counts(db, start, end, zone_ids, syndromes)
+        for _, s, d, total in rows:
+            out.setdefault(s, {})
+            out[s][d] = out[s].get(d, 0) + total
+        return out
+
+    a = models.VisitAggregate
+    q = db.query(a.syndrome, a.period_start, func.sum(a.count))\
+        .filter(a.level == level)\
+        .filter(a.zone_id.in_(zone_ids))\
+        .filter(a.period_start >= period_start(level, start))\
+        .filter(a.period_start <= end)
+    if syndromes is not None:
+        q = q.filter(a.syndrome.in_(syndromes))
+    for s, p, total in q.group_by(a.syndrome, a.period_start):
+        out.setdefault(s, {})[p] = total or 0
+    return out
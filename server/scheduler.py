@@ -0,0 +1,68 @@
+"""
+Minimal in-process periodic jobs.
+
+Each PeriodicJob runs its function on a daemon thread every interval_s
+seconds and keeps simple run statistics for the admin endpoints. Jobs are
+started from main.py's startup hook.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    def __init__(self, name: str, interval_s: float, fn: Callable[[], Optional[Dict]]):
+        """fn: Does one unit of work; may return a dict of stats for the last run."""
+        self.name = name
+        self.interval_s = interval_s
+        self.fn = fn
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+
+        self.stats = {
+            "runs": 0,
+            "errors": 0,
+            "last_started_at": None,
+            "last_duration_s": None,
+            "last_result": None,
+            "last_error": None,
+        }
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name=f"job-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_now(self) -> Optional[Dict]:
+        """Runs the job once in the calling thread (serialised with the loop)."""
+        with self._run_lock:
+            started = time.monotonic()
+            self.stats["last_started_at"] = datetime.now().isoformat(timespec="seconds")
+            try:
+                result = self.fn()
+                self.stats["last_result"] = result
+                return result
+            except Exception as e:
+                self.stats["errors"] += 1
+                self.stats["last_error"] = repr(e)
+                raise
+            finally:
+                self.stats["runs"] += 1
+                self.stats["last_duration_s"] = round(time.monotonic() - started, 3)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.run_now()
+            except Exception:
+                logger.exception("Job %s failed", self.name)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from datetime import date, datetime
 
 # --- Visit Event ---
@@ -25,15 +25,34 @@ class BatchVisitCreate(BaseModel):
     hospital_id: int # If authenticating via token, this wouldn't be here, but for MVP it's easier
     visits: List[VisitEventCreate]
 
+# --- Delta Sync ---
+class SyncReport(VisitEventBase):
+    key: str # Client-generated idempotency key
+    age_group: str = "Unknown"
+    hospital_id: Optional[int] = None # Defaults to the batch's hospital_id
+
+class SyncBatch(BaseModel):
+    hospital_id: Optional[int] = None
+    cursor: Optional[int] = None # Last cursor the client was given
+    reports: List[Dict[str, Any]] # Validated one by one (a bad report is rejected, not the sync)
+
 # --- Entities ---
 class ZoneBase(BaseModel):
     name: str
 
 class Zone(ZoneBase):
     id: int
+    district_id: Optional[int] = None
     class Config:
         from_attributes = True
 
+class ZoneNeighbors(BaseModel):
+    neighbor_ids: List[int]
+
+class ZoneGeometry(BaseModel):
+    type: str # GeoJSON "Polygon" or "MultiPolygon", lng/lat
+    coordinates: list
+
 class HospitalBase(BaseModel):
     name: str
     type: str
@@ -59,6 +78,18 @@ class Action(ActionBase):
     class Config:
         from_attributes = True
 
+class BulkActionItem(ActionBase):
+    signal_id: int
+
+class BulkActionRequest(BaseModel):
+    actions: List[BulkActionItem]
+
+class BulkActionResult(BaseModel):
+    signal_id: int
+    ok: bool
+    action_id: Optional[int] = None
+    error: Optional[str] = None
+
 class SignalBase(BaseModel):
     date: date
     syndrome: str
@@ -97,3 +128,25 @@ class DiseaseForecast(BaseModel):
     history: List[ForecastPoint]
     forecast: List[ForecastPoint]
     guidance: List[str]
+
+# --- Diffusion ---
+class DiffusionScenario(BaseModel):
+    model: Optional[str] = None # "sir" (default) or "intensity"
+    beta: Optional[float] = None # SIR transmission rate per day
+    gamma: Optional[float] = None # SIR recovery rate per day
+    coupling: Optional[float] = None # Weight of neighbouring zones (0-1)
+    population: Optional[int] = None # SIR people per zone
+    growth: Optional[float] = None # Intensity multiplier per day
+
+class DiffusionRequest(BaseModel):
+    syndrome: str
+    days: int = 14
+    scenarios: List[DiffusionScenario] = [DiffusionScenario()]
+    encoding: str = "b64" # "b64" or "json"
+    district_id: Optional[int] = None # One district's shard; default: every district
+
+class ProfilingConfigUpdate(BaseModel):
+    sample_rate: Optional[float] = None # Fraction of requests profiled (0-1)
+    routes: Optional[List[str]] = None # Route templates always profiled, e.g. "/analysis/summary"
+    mode: Optional[str] = None # "sampler" or "cprofile"
+    interval_ms: Optional[float] = None # Sampler interval
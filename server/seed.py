@@ -1,9 +1,17 @@
-import models, database
+import models, database, cube, pyramid
 from datetime import date, timedelta
 import random
 
 db = database.SessionLocal()
 
+def get_or_create(model, **fields):
+    obj = db.query(model).filter_by(**fields).first()
+    if obj is None:
+        obj = model(**fields)
+        db.add(obj)
+        db.commit()
+    return obj
+
 def seed():
     # 1. Clear Data (Optional, be careful in prod)
     # db.query(models.VisitEvent).delete()
@@ -12,22 +20,20 @@ def seed():
     # db.query(models.Zone).delete()
     # db.commit()
 
+    # Re-runs reuse existing rows (zone names are unique) instead of failing
     print("Seeding Zones...")
-    z1 = models.Zone(name="North Ward")
-    z2 = models.Zone(name="South Ward")
-    db.add_all([z1, z2])
-    db.commit()
+    z1 = get_or_create(models.Zone, name="North Ward")
+    z2 = get_or_create(models.Zone, name="South Ward")
 
     print("Seeding Hospitals...")
-    h1 = models.Hospital(name="District Hospital A", type="Hospital", zone_id=z1.id)
-    h2 = models.Hospital(name="Community Health Center B", type="CHC", zone_id=z1.id)
-    h3 = models.Hospital(name="Primary Health Center C", type="PHC", zone_id=z2.id)
-    h4 = models.Hospital(name="Private Clinic D", type="Clinic", zone_id=z2.id)
-    db.add_all([h1, h2, h3, h4])
-    db.commit()
-    
-    # Refresh to get IDs
-    db.refresh(h1)
+    h1 = get_or_create(models.Hospital, name="District Hospital A", type="Hospital", zone_id=z1.id)
+    h2 = get_or_create(models.Hospital, name="Community Health Center B", type="CHC", zone_id=z1.id)
+    h3 = get_or_create(models.Hospital, name="Primary Health Center C", type="PHC", zone_id=z2.id)
+    h4 = get_or_create(models.Hospital, name="Private Clinic D", type="Clinic", zone_id=z2.id)
+
+    if db.query(models.VisitEvent.id).filter(models.VisitEvent.hospital_id.in_([h1.id, h2.id, h3.id, h4.id])).first():
+        print("Visit data already seeded; skipping. (Use synthetic_data.py for larger datasets.)")
+        return
 
     print("Seeding Historical Data (Baseline)...")
     # Generate 14 days of baseline data (low numbers)
@@ -59,6 +65,8 @@ def seed():
     
     db.add_all([v_spike1, v_spike2])
     db.commit()
+    cube.rebuild(db)  # Seeded rows bypass the ingestion applier
+    pyramid.rebuild(db)
 
     print("Database Seeded Successfully!")
     print(f"Hospital IDs: {h1.name}={h1.id}, {h2.name}={h2.id}")
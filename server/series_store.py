@@ -0,0 +1,260 @@
+"""
+Memory-mapped daily counts shared by every worker process.
+
+With several uvicorn workers, each one re-queried and re-summed the same
+daily series for forecasts and detection baselines. The series store keeps
+the (zone x syndrome x day) matrix of daily visit counts in one file per
+database that all workers mmap read-only, so those reads are array slices
+with no SQL.
+
+File layout (native byte order, one file per version):
+
+    header    magic, format, axis sizes, window start, ingest seq, axes length
+    axes      JSON {"zones": [...], "syndromes": [...]}: the axis dictionary
+    matrix    int32[zones][syndromes][days], padded to 4-byte alignment
+
+Writes are copy-on-write. The single writer (serialised across processes
+with flock where available, otherwise only within this process) writes a new version file and then atomically replaces the
+CURRENT pointer. Readers keep using the version they mapped and switch on
+their next lookup. The ingestion applier patches the store after each
+committed batch. It rebuilds from SQL instead when the store missed a
+batch, a new zone or syndrome appears, or the day window has moved on.
+
+The store is opt-in (SERIES_STORE_DIR), because it only sees visits that go
+through the ingestion log. Databases written another way must call
+rebuild(). Callers fall back to SQL when no store is registered for their
+database or the range is outside its window.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy.orm import Session
+
+import models, timeseries
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Params
+STORE_DIR = os.getenv("SERIES_STORE_DIR", "")  # Unset: no shared store
+WINDOW_DAYS = int(os.getenv("SERIES_STORE_WINDOW_DAYS", "400"))
+MAGIC = b"CSSERIES"
+FORMAT = 1
+HEADER = struct.Struct("=8sIIIIqqI")  # magic, format, zones, syndromes, days, start ordinal, seq, axes bytes
+CURRENT = "CURRENT"
+KEEP_VERSIONS = 2  # Versions left on disk (older ones may still be mapped by readers)
+
+
+class Snapshot:
+    """One mapped version of the store."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, fmt, n_zones, n_syndromes, n_days, start, seq, axes_len = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or fmt != FORMAT:
+            raise ValueError(f"{path} is not a series store file")
+        axes = json.loads(self._mm[HEADER.size:HEADER.size + axes_len])
+        offset = _matrix_offset(axes_len)
+
+        self.path = path
+        self.start = date.fromordinal(start)
+        self.days = n_days
+        self.end = self.start + timedelta(days=n_days - 1)
+        self.seq = seq
+        self.zones = {z: i for i, z in enumerate(axes["zones"])}
+        self.syndromes = {s: i for i, s in enumerate(axes["syndromes"])}
+        self.counts = memoryview(self._mm)[offset:offset + 4 * n_zones * n_syndromes * n_days].cast("i")
+
+    def covers(self, start: date, end: date) -> bool:
+        return self.start <= start and end <= self.end
+
+    def series(self, zone_id: int, syndrome: str, start: date, end: date) -> Optional[Sequence[int]]:
+        """Daily counts for start..end as a zero-copy view; None if outside the window."""
+        if not self.covers(start, end):
+            return None
+        z, s = self.zones.get(zone_id), self.syndromes.get(syndrome)
+        if z is None or s is None:
+            return array("i", bytes(4 * ((end - start).days + 1)))  # No visits
+        base = (z * len(self.syndromes) + s) * self.days
+        return self.counts[base + (start - self.start).days:base + (end - self.start).days + 1]
+
+    def total(self, zone_id: int, syndrome: Optional[str], start: date, end: date) -> Optional[int]:
+        """Visits in start..end (all syndromes when syndrome is None); None if outside the window."""
+        if not self.covers(start, end):
+            return None
+        names = self.syndromes if syndrome is None else [syndrome]
+        return sum(sum(self.series(zone_id, s, start, end)) for s in names)
+
+
+def _matrix_offset(axes_len: int) -> int:
+    return (HEADER.size + axes_len + 3) // 4 * 4
+
+
+class SeriesStore:
+    def __init__(self, directory: str, window_days: int = WINDOW_DAYS):
+        self.directory = directory
+        self.window_days = window_days
+        os.makedirs(directory, exist_ok=True)
+        self._snapshot: Optional[Snapshot] = None
+        self._current_stat = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Writers in this process; flock covers the others
+
+    # --- Reading ---
+
+    def snapshot(self) -> Optional[Snapshot]:
+        """The current version, remapped if the writer swapped it since the last call."""
+        pointer = os.path.join(self.directory, CURRENT)
+        try:
+            st = os.stat(pointer)
+        except FileNotFoundError:
+            return None
+        stat = (st.st_ino, st.st_mtime_ns)
+        if stat != self._current_stat:
+            with self._lock:
+                with open(pointer) as f:
+                    name = f.read().strip()
+                self._snapshot = Snapshot(os.path.join(self.directory, name))
+                self._current_stat = stat
+        return self._snapshot
+
+    # --- Writing ---
+
+    @contextmanager
+    def _writer(self):
+        with self._write_lock, open(os.path.join(self.directory, "write.lock"), "a") as lock:
+            if fcntl is None:
+                yield
+                return
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def rebuild(self, db: Session, today: Optional[date] = None):
+        """Recomputes the whole matrix from SQL (raw and compacted visits)."""
+        with self._writer():
+            self._rebuild(db, today or date.today())
+
+    def _rebuild(self, db: Session, today: date):
+        import ingest_log  # Imports this module
+        checkpoint = db.get(models.IngestCheckpoint, ingest_log.CHECKPOINT_NAME)
+        seq = checkpoint.last_seq if checkpoint else 0
+        start = today - timedelta(days=self.window_days - 1)
+        rows = timeseries.zone_daily_counts(db, start, today)
+        zones = sorted({z for z, _, _, _ in rows if z is not None})
+        syndromes = sorted({s for _, s, _, _ in rows})
+        counts = array("i", bytes(4 * len(zones) * len(syndromes) * self.window_days))
+        z_index = {z: i for i, z in enumerate(zones)}
+        s_index = {s: i for i, s in enumerate(syndromes)}
+        for z, s, d, total in rows:
+            if z is not None:
+                counts[(z_index[z] * len(syndromes) + s_index[s]) * self.window_days + (d - start).days] = total
+        self._write(zones, syndromes, start, seq, counts)
+
+    def apply(self, db: Session, rows: List[Dict], zones: Dict[int, int], start_seq: int, end_seq: int):
+        """
+        Adds an applied batch (ingest seqs start_seq+1..end_seq) to the store.
+        rows: Visit rows (date, hospital_id, syndrome, count); zones: hospital_id -> zone_id.
+        """
+        today = date.today()
+        with self._writer():
+            snap = self.snapshot()
+            if snap is not None and snap.seq >= end_seq:
+                return  # A rebuild already included this batch
+            cells: Dict[tuple, int] = {}
+            for r in rows:
+                z = zones.get(r["hospital_id"])
+                if z is not None and r["count"] and r["date"] <= today:
+                    cells[(z, r["syndrome"], r["date"])] = cells.get((z, r["syndrome"], r["date"]), 0) + r["count"]
+            if (snap is None or snap.seq != start_seq or snap.end != today
+                    or any(z not in snap.zones or s not in snap.syndromes for z, s, _ in cells)):
+                self._rebuild(db, today)
+                return
+
+            counts = array("i", snap.counts)
+            n_syndromes = len(snap.syndromes)
+            for (z, s, d), n in cells.items():
+                if d >= snap.start:
+                    counts[(snap.zones[z] * n_syndromes + snap.syndromes[s]) * snap.days + (d - snap.start).days] += n
+            self._write(list(snap.zones), list(snap.syndromes), snap.start, end_seq, counts)
+
+    def _write(self, zones: List[int], syndromes: List[str], start: date, seq: int, counts: array):
+        axes = json.dumps({"zones": zones, "syndromes": syndromes}).encode()
+        header = HEADER.pack(MAGIC, FORMAT, len(zones), len(syndromes), self.window_days, start.toordinal(),
+                             seq, len(axes))
+        pad = b"\0" * (_matrix_offset(len(axes)) - HEADER.size - len(axes))
+
+        versions = self._versions()
+        version = (versions[-1] if versions else 0) + 1
+        name = f"series-{version:012d}.bin"
+        path = os.path.join(self.directory, name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(header + axes + pad)
+            f.write(counts.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+        pointer = os.path.join(self.directory, CURRENT)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer + ".tmp", pointer)  # The version swap
+
+        for old in versions[:-(KEEP_VERSIONS - 1) or None]:
+            try:
+                os.remove(os.path.join(self.directory, f"series-{old:012d}.bin"))
+            except FileNotFoundError:
+                pass
+
+    def _versions(self) -> List[int]:
+        return sorted(int(n[7:19]) for n in os.listdir(self.directory)
+                      if n.startswith("series-") and n.endswith(".bin"))
+
+    def ensure_current(self, db: Session) -> bool:
+        """Rebuilds unless the store matches the database's ingest checkpoint and today. Returns True if it did."""
+        import ingest_log
+        checkpoint = db.get(models.IngestCheckpoint, ingest_log.CHECKPOINT_NAME)
+        snap = self.snapshot()
+        if snap is not None and snap.seq == (checkpoint.last_seq if checkpoint else 0) and snap.end == date.today():
+            return False
+        self.rebuild(db)
+        return True
+
+
+# --- Registry ---
+
+_stores: Dict[str, SeriesStore] = {}
+
+
+def register(engine, store: Optional[SeriesStore]):
+    """Serves `engine`'s daily counts from `store` (None unregisters)."""
+    if store is None:
+        _stores.pop(str(engine.url), None)
+    else:
+        _stores[str(engine.url)] = store
+
+
+def store_for(db: Session) -> Optional[SeriesStore]:
+    return _stores.get(str(db.get_bind().url)) if _stores else None
+
+
+def snapshot_for(db: Session) -> Optional[Snapshot]:
+    store = store_for(db)
+    return store.snapshot() if store is not None else None
@@ -0,0 +1,180 @@
+"""
+Multi-district sharding.
+
+One deployment can serve several districts, each with its own database
+(SQLite file or Postgres), so queries only scan that district's rows and
+each district gets its own ingestion log and applier instead of sharing
+one. SHARD_MAP maps district IDs to database URLs:
+
+    SHARD_MAP="1=sqlite:///./district_1.db,2=postgresql://host/district_2"
+
+Districts not listed, and zones without a district, live in the default
+database (DATABASE_URL). With SHARD_MAP unset there is a single shard and
+the router does no extra work.
+
+Requests are routed by the zone or hospital they name. Zone and hospital
+IDs must therefore be unique across shards (they are reference data, seeded
+per district); the router finds their shard through an in-memory directory
+built from every shard's zones table, reloaded on a miss. Rows generated
+inside a shard (visits, signals, actions) have shard-local IDs: cross-
+district listings fan out to all shards concurrently and tag each row with
+its zone's district_id, and signal routes take ?district_id=.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from sqlalchemy.orm import Session, sessionmaker
+
+import models, database, admission, ingest_log
+
+logger = logging.getLogger(__name__)
+
+# Params
+SHARD_MAP = os.getenv("SHARD_MAP", "")
+DEFAULT_SHARD = "default"
+MAX_FAN_OUT = 8  # Shards queried at once
+RELOAD_MIN_S = 5.0  # Unknown IDs reload the directory at most this often
+
+T = TypeVar("T")
+
+
+def parse_shard_map(spec: str) -> Dict[int, str]:
+    """'1=url,2=url' -> {1: url, 2: url}."""
+    shards = {}
+    for entry in filter(None, (e.strip() for e in spec.split(","))):
+        district, sep, url = entry.partition("=")
+        if not sep or not district.strip().isdigit() or not url.strip():
+            raise ValueError(f"Bad SHARD_MAP entry: {entry!r} (expected <district_id>=<database url>)")
+        shards[int(district)] = url.strip()
+    return shards
+
+
+class Shard:
+    def __init__(self, key: str, engine, session_factory=None, log_dir: Optional[str] = None):
+        self.key = key
+        self.engine = engine
+        self.session_factory = session_factory or sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        self.log_dir = log_dir
+        self._ingest = None
+        self._ingest_lock = threading.Lock()
+
+    def ingest(self):
+        """This shard's (IngestLog, LogApplier)."""
+        if self.key == DEFAULT_SHARD:
+            return ingest_log.log, ingest_log.applier  # Looked up per call: tests swap them
+        with self._ingest_lock:
+            if self._ingest is None:
+                log = ingest_log.IngestLog(self.log_dir or os.path.join(ingest_log.LOG_DIR, self.key))
+                self._ingest = (log, ingest_log.LogApplier(log, session_factory=self.session_factory))
+            return self._ingest
+
+
+class ShardRouter:
+    def __init__(self, shard_map: Dict[int, str] = None, default: Shard = None, log_dir: Optional[str] = None):
+        """
+        shard_map: District ID -> database URL. Districts sharing a URL share a shard.
+        default: Shard for everything else (defaults to DATABASE_URL).
+        log_dir: Parent directory for per-shard ingestion logs.
+        """
+        self.default = default or Shard(DEFAULT_SHARD, database.engine, database.SessionLocal)
+        self._districts: Dict[int, Shard] = {}
+        by_url: Dict[str, Shard] = {}
+        for district_id, url in sorted((shard_map or {}).items()):
+            if url not in by_url:
+                key = f"district-{district_id}"
+                by_url[url] = Shard(key, database.make_engine(url),
+                                    log_dir=os.path.join(log_dir, key) if log_dir else None)
+            self._districts[district_id] = by_url[url]
+        self._district_shards = list(by_url.values())
+
+        self._zones: Dict[int, Shard] = {}
+        self._hospitals: Dict[int, Shard] = {}
+        self._lock = threading.Lock()
+        self._loaded_at = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._districts)
+
+    def shards(self) -> List[Shard]:
+        return [self.default] + self._district_shards
+
+    # --- Routing ---
+
+    def for_district(self, district_id: Optional[int]) -> Shard:
+        return self._districts.get(district_id, self.default)
+
+    def for_zone(self, zone_id: int) -> Shard:
+        return self._lookup("_zones", zone_id)
+
+    def for_hospital(self, hospital_id: int) -> Shard:
+        return self._lookup("_hospitals", hospital_id)
+
+    def _lookup(self, directory: str, key: int) -> Shard:
+        if not self.enabled:
+            return self.default
+        shard = getattr(self, directory).get(key)
+        if shard is None and (self._loaded_at is None or time.monotonic() - self._loaded_at >= RELOAD_MIN_S):
+            self.reload()  # Replaces the directories
+            shard = getattr(self, directory).get(key)
+        return shard or self.default  # Unknown IDs 404 in the default shard
+
+    def reload(self):
+        """Rebuilds the zone/hospital -> shard directory from every shard."""
+        zones, hospitals = {}, {}
+        for shard in self.shards():
+            db = shard.session_factory()
+            try:
+                for zone_id, district_id in db.query(models.Zone.id, models.Zone.district_id):
+                    if self.for_district(district_id) is not shard:
+                        logger.warning("Zone %s (district %s) is stored in shard %s", zone_id, district_id, shard.key)
+                    if zone_id in zones:
+                        logger.error("Zone ID %s exists in shards %s and %s", zone_id, zones[zone_id].key, shard.key)
+                        continue
+                    zones[zone_id] = shard
+                for (hospital_id,) in db.query(models.Hospital.id):
+                    hospitals.setdefault(hospital_id, shard)
+            finally:
+                db.close()
+        with self._lock:
+            self._zones, self._hospitals = zones, hospitals
+            self._loaded_at = time.monotonic()
+
+    @contextmanager
+    def session(self, shard: Shard, default_db: Optional[Session] = None):
+        """A session on `shard`; the caller's default_db is reused for the default shard."""
+        if shard is self.default and default_db is not None:
+            yield default_db
+            return
+        db = shard.session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # --- Fan-out ---
+
+    def fan_out(self, fn: Callable[[Session], T], default_db: Optional[Session] = None) -> List[T]:
+        """Runs fn(session) on every shard concurrently; results in shard order."""
+        at = admission.deadline()  # Pool threads don't inherit the request's context
+
+        def run(shard: Shard) -> T:
+            with admission.bound(at), self.session(shard, default_db) as db:
+                return fn(db)
+
+        if not self._district_shards:
+            return [run(self.default)]
+        # The default shard runs on the calling thread, so its SQL stays charged to the
+        # request in /metrics; pool threads don't inherit the request's context.
+        workers = min(MAX_FAN_OUT, len(self._district_shards))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="shard") as pool:
+            futures = [pool.submit(run, shard) for shard in self._district_shards]
+            return [run(self.default)] + [f.result() for f in futures]
+
+
+router = ShardRouter(parse_shard_map(SHARD_MAP))
@@ -1,8 +1,9 @@
 from sqlalchemy.orm import Session
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from datetime import date, timedelta, datetime
 from typing import List, Tuple
-import models
+import models, metrics, series_store
 
 # Params
 BASELINE_DAYS = 14
@@ -24,6 +25,7 @@ SYNDROME_THRESHOLDS = {
 def get_threshold(syndrome: str) -> float:
     return SYNDROME_THRESHOLDS.get(syndrome, DEFAULT_THRESHOLD)
 
+@metrics.timed("detection.hospital")
 def detect_signals_for_hospital(db: Session, hospital: models.Hospital, target_date: date):
     """
     Orchestrator for signal detection.
@@ -52,6 +54,7 @@ def detect_signals_for_hospital(db: Session, hospital: models.Hospital, target_d
     # 2. Check OPD Load (Aggregate of all syndromes)
     check_opd_load(db, zone_id, target_date)
 
+@metrics.timed("detection.disease_surge")
 def check_disease_surge(db: Session, zone_id: int, target_date: date, syndrome: str):
     """
     Detects if a specific disease is spiking in values.
@@ -75,6 +78,7 @@ def check_disease_surge(db: Session, zone_id: int, target_date: date, syndrome:
         save_signal(db, zone_id, target_date, syndrome, current_val, int(baseline), 
                    "Disease Surge", severity, confidence, explanation)
 
+@metrics.timed("detection.opd_load")
 def check_opd_load(db: Session, zone_id: int, target_date: date):
     """
     Detects if total facility visits are abnormally high.
@@ -98,6 +102,10 @@ def check_opd_load(db: Session, zone_id: int, target_date: date):
 # --- Helpers ---
 
 def get_zone_aggregate(db: Session, zone_id: int, target_date: date, syndrome: str = None) -> int:
+    snap = series_store.snapshot_for(db)
+    if snap is not None and snap.covers(target_date, target_date):
+        return snap.total(zone_id, syndrome, target_date, target_date)
+
     query = db.query(func.sum(models.VisitEvent.count))\
             .join(models.Hospital)\
             .filter(models.Hospital.zone_id == zone_id)\
@@ -110,6 +118,9 @@ def get_zone_aggregate(db: Session, zone_id: int, target_date: date, syndrome: s
 
 def calculate_baseline(db: Session, zone_id: int, target_date: date, syndrome: str = None) -> float:
     start_date = target_date - timedelta(days=BASELINE_DAYS)
+    snap = series_store.snapshot_for(db)
+    if snap is not None and snap.covers(start_date, target_date - timedelta(days=1)):
+        return snap.total(zone_id, syndrome, start_date, target_date - timedelta(days=1)) / float(BASELINE_DAYS)
     
     query = db.query(func.sum(models.VisitEvent.count))\
             .join(models.Hospital)\
@@ -147,17 +158,21 @@ def evaluate_metrics(current: int, baseline: float, threshold: float = 1.5) -> T
         
     return severity, confidence
 
-def save_signal(db: Session, zone_id: int, date: date, syndrome: str, value: int, baseline: int, 
-               s_type: str, severity: str, confidence: str, explanation: str):
-    
-    # Check if exists
-    signal = db.query(models.Signal)\
+def _find_signal(db: Session, zone_id: int, date: date, syndrome: str, s_type: str):
+    return db.query(models.Signal)\
             .filter(models.Signal.zone_id == zone_id)\
             .filter(models.Signal.date == date)\
             .filter(models.Signal.syndrome == syndrome)\
             .filter(models.Signal.signal_type == s_type)\
             .first()
 
+@metrics.timed("detection.save_signal")
+def save_signal(db: Session, zone_id: int, date: date, syndrome: str, value: int, baseline: int, 
+               s_type: str, severity: str, confidence: str, explanation: str, _retry: bool = True):
+    
+    # Check if exists
+    signal = _find_signal(db, zone_id, date, syndrome, s_type)
+
     if signal:
         signal.value = value
         signal.is_spike = True
@@ -190,7 +205,21 @@ def save_signal(db: Session, zone_id: int, date: date, syndrome: str, value: int
             assigned_to=assigned_to,
             sla_deadline=sla_deadline
         )
+        # In a savepoint, so a failed insert doesn't discard what the caller has pending
+        savepoint = db.begin_nested()
         db.add(signal)
+        db.add(models.NotificationOutbox(signal=signal, kind="new"))  # Delivered later by notifications.py
+        try:
+            savepoint.commit()
+        except IntegrityError:
+            savepoint.rollback()
+            # Only the unique-key race is retried: a concurrent ingest for the same zone/day inserted
+            # the signal first, so update that row instead (once). Anything else is a real error.
+            if not _retry or _find_signal(db, zone_id, date, syndrome, s_type) is None:
+                raise
+            save_signal(db, zone_id, date, syndrome, value, baseline, s_type, severity, confidence, explanation,
+                        _retry=False)
+            return
     
     db.commit()
 
@@ -0,0 +1,116 @@
+"""
+SLA escalation sweeps.
+
+save_signal assigns every new signal a role and an SLA deadline
+(signal_engine.get_assignment_rules). This job finds open signals whose
+deadline has passed and escalates them one step up the chain
+(Surveillance Nurse -> Medical Officer -> District Health Officer), giving
+them that role's SLA. Signals already with the DHO get a fresh DHO
+deadline, so they keep resurfacing until someone acts.
+
+Sweeps walk the (status, sla_deadline) index in batches: each batch is one
+SELECT, one bulk UPDATE (guarded so a concurrent sweep can't escalate the
+same signal twice) and one bulk INSERT of Action rows.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Dict
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.orm import Session
+
+import models, database, signal_engine, scheduler, sharding
+
+# Params
+OPEN_STATUSES = ["Pending", "Ack", "Investigating"]
+BATCH_SIZE = 500
+SWEEP_INTERVAL_S = float(os.getenv("SLA_SWEEP_INTERVAL_S", "60"))
+ESCALATION_STATUS = "Escalated"  # Action.status recorded for escalations
+
+# Chain follows the severity ladder of get_assignment_rules: [(role, sla_hours), ...]
+CHAIN = [signal_engine.get_assignment_rules(s) for s in ("Low", "Medium", "High")]
+NEXT_STEP = {role: CHAIN[min(i + 1, len(CHAIN) - 1)] for i, (role, _) in enumerate(CHAIN)}
+TOP_ROLE, TOP_HOURS = CHAIN[-1]
+
+# Cumulative counters (exposed via /admin/sla/stats)
+stats = {
+    "sweeps": 0,
+    "escalated_total": 0,
+    "last_escalated": 0,
+    "last_lag_s": 0.0,  # How overdue the oldest breach was when the sweep started
+    "last_duration_s": 0.0,
+    "last_throughput_per_s": 0.0,
+}
+
+
+def sweep(db: Session, now: datetime = None, batch_size: int = BATCH_SIZE) -> Dict:
+    """Escalates every open signal whose SLA deadline is before `now`."""
+    now = now or datetime.now()
+    started = time.monotonic()
+    escalated, lag_s = 0, 0.0
+
+    next_role = case({role: nxt for role, (nxt, _) in NEXT_STEP.items()},
+                     value=models.Signal.assigned_to, else_=TOP_ROLE)
+    next_deadline = case({role: now + timedelta(hours=hours) for role, (_, hours) in NEXT_STEP.items()},
+                         value=models.Signal.assigned_to, else_=now + timedelta(hours=TOP_HOURS))
+
+    while True:
+        batch = db.query(models.Signal.id, models.Signal.assigned_to, models.Signal.sla_deadline)\
+            .filter(models.Signal.status.in_(OPEN_STATUSES))\
+            .filter(models.Signal.sla_deadline < now)\
+            .order_by(models.Signal.sla_deadline)\
+            .limit(batch_size)\
+            .all()
+        if not batch:
+            break
+        if escalated == 0:
+            lag_s = (now - batch[0].sla_deadline).total_seconds()
+
+        previous = {row.id: row.assigned_to for row in batch}
+        updated = db.execute(
+            update(models.Signal)
+            .where(models.Signal.id.in_(list(previous)))
+            .where(models.Signal.sla_deadline < now)  # Not already handled by another sweep
+            .values(assigned_to=next_role, sla_deadline=next_deadline)
+            .returning(models.Signal.id, models.Signal.assigned_to)
+            .execution_options(synchronize_session=False)
+        ).all()
+
+        if updated:
+            db.execute(insert(models.Action), [
+                {
+                    "signal_id": signal_id,
+                    "status": ESCALATION_STATUS,
+                    "notes": f"SLA breached by {previous[signal_id] or 'unassigned'}; escalated to {role}."
+                }
+                for signal_id, role in updated
+            ])
+        db.commit()
+        escalated += len(updated)
+
+        if len(batch) < batch_size:
+            break
+
+    duration = time.monotonic() - started
+    stats["sweeps"] += 1
+    stats["escalated_total"] += escalated
+    stats["last_escalated"] = escalated
+    stats["last_lag_s"] = round(lag_s, 1)
+    stats["last_duration_s"] = round(duration, 3)
+    stats["last_throughput_per_s"] = round(escalated / duration, 1) if duration > 0 else 0.0
+    return {"escalated": escalated, "lag_s": stats["last_lag_s"], "duration_s": stats["last_duration_s"]}
+
+
+def _run_sweep():
+    results = []
+    for shard in sharding.router.shards():  # Every district database
+        db = shard.session_factory()
+        try:
+            results.append(sweep(db))
+        finally:
+            db.close()
+    return results[0] if len(results) == 1 else results
+
+
+job = scheduler.PeriodicJob("sla-escalation", SWEEP_INTERVAL_S, _run_sweep)
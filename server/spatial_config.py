@@ -1,12 +1,224 @@
-# Hardcoded Adjacency Graph for MVP
-# In production, this would be in the database (Table: ZoneAdjacency)
+"""
+Zone adjacency graph.
 
-# Key: Zone ID, Value: List of Adjacent Zone IDs
-ZONE_ADJACENCY = {
+Edges live in the zone_adjacency table (one row per direction). They are
+loaded once into a compressed sparse row (CSR) index: zone i's neighbours
+are indices[indptr[i]:indptr[i+1]]. The 2-hop neighbourhood (everything
+within two steps, excluding the zone itself) is precomputed into a second
+CSR at load time, so lookups never touch SQL.
+
+There is one cached graph per database (shard). It is rebuilt when the
+table changes: on the next lookup after set_neighbors() in this process,
+and otherwise when the table's row in table_versions (bumped by every
+writer in the same transaction) or its row count differs. That is checked
+at most every RELOAD_CHECK_S seconds, which covers edits made by other
+workers.
+"""
+import threading
+import time
+from array import array
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models, database
+
+# Seed graph for fresh installs (previously hardcoded here)
+DEFAULT_ADJACENCY = {
     1: [2],       # Zone 1 is next to Zone 2
     2: [1, 3],    # Zone 2 is between 1 and 3
     3: [2]        # Zone 3 is next to Zone 2
 }
 
-def get_neighbors(zone_id: int):
-    return ZONE_ADJACENCY.get(zone_id, [])
+RELOAD_CHECK_S = 30
+VERSION_NAME = "zone_adjacency"
+SPATIAL_RISK_HOPS = 1  # Neighbourhood used by get_zone_forecast's spatial risk
+SPATIAL_RISK_DAYS = 3
+
+
+class ZoneGraph:
+    def __init__(self, edges: Iterable[Tuple[int, int]]):
+        """edges: (zone_id, neighbor_id) pairs; treated as undirected."""
+        adjacency: Dict[int, set] = {}
+        for a, b in edges:
+            if a == b:
+                continue
+            adjacency.setdefault(a, set()).add(b)
+            adjacency.setdefault(b, set()).add(a)
+
+        self.zone_ids = array('i', sorted(adjacency))
+        self.index = {z: i for i, z in enumerate(self.zone_ids)}
+
+        # 1-hop CSR (indices are positions in zone_ids, sorted per row)
+        self.indptr, self.indices = self._csr(
+            [sorted(self.index[n] for n in adjacency[z]) for z in self.zone_ids]
+        )
+
+        # 2-hop CSR: union of neighbours and neighbours-of-neighbours
+        rows = []
+        for i in range(len(self.zone_ids)):
+            reach = set()
+            for j in self._row(self.indptr, self.indices, i):
+                reach.add(j)
+                reach.update(self._row(self.indptr, self.indices, j))
+            reach.discard(i)
+            rows.append(sorted(reach))
+        self.indptr2, self.indices2 = self._csr(rows)
+
+    def __len__(self):
+        return len(self.zone_ids)
+
+    def neighbor_indices(self, i: int, hops: int = 1) -> array:
+        if hops >= 2:
+            return self._row(self.indptr2, self.indices2, i)
+        return self._row(self.indptr, self.indices, i)
+
+    def neighbors(self, zone_id: int, hops: int = 1) -> List[int]:
+        """Zone IDs within `hops` steps (1 or 2) of zone_id, excluding itself."""
+        i = self.index.get(zone_id)
+        if i is None:
+            return []
+        return [self.zone_ids[j] for j in self.neighbor_indices(i, hops)]
+
+    @staticmethod
+    def _csr(rows: List[List[int]]) -> Tuple[array, array]:
+        indptr, indices = array('i', [0]), array('i')
+        for row in rows:
+            indices.extend(row)
+            indptr.append(len(indices))
+        return indptr, indices
+
+    @staticmethod
+    def _row(indptr: array, indices: array, i: int) -> array:
+        return indices[indptr[i]:indptr[i + 1]]
+
+
+# --- Table Versions ---
+
+def bump_version(db, name: str):
+    """Bumps table_versions[name] in db's transaction (db: Session or Connection)."""
+    table = models.TableVersion.__table__
+    dialect = db.get_bind().dialect.name if isinstance(db, Session) else db.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite.insert if dialect == "sqlite" else postgresql.insert)(table).values(name=name, version=1)
+        db.execute(stmt.on_conflict_do_update(index_elements=["name"], set_={"version": table.c.version + 1}))
+        return
+    # Portable fallback
+    if db.execute(update(table).where(table.c.name == name).values(version=table.c.version + 1)).rowcount == 0:
+        db.execute(insert(table).values(name=name, version=1))
+
+
+def table_version(db: Session, name: str) -> int:
+    return db.query(models.TableVersion.version).filter(models.TableVersion.name == name).scalar() or 0
+
+
+# --- Cached Graph ---
+
+_lock = threading.Lock()
+_graphs: Dict[str, list] = {}  # database URL -> [graph, checksum, checked_at]; one per shard
+
+
+def _table_checksum(db: Session) -> tuple:
+    # The count also catches bulk loads into a fresh database that skipped bump_version()
+    return table_version(db, VERSION_NAME), db.query(func.count(models.ZoneAdjacency.id)).scalar()
+
+
+def get_graph(db: Session = None) -> ZoneGraph:
+    """Returns the cached graph for db's database (default: the main one), reloading it if the table changed."""
+    own_session = db is None
+    if own_session:
+        db = database.SessionLocal()
+    try:
+        url = str(db.get_bind().url)
+        entry = _graphs.get(url)
+        if entry is not None and time.monotonic() - entry[2] < RELOAD_CHECK_S:
+            return entry[0]
+
+        with _lock:
+            checksum = _table_checksum(db)
+            if entry is None or checksum != entry[1]:
+                edges = db.query(models.ZoneAdjacency.zone_id, models.ZoneAdjacency.neighbor_id).all()
+                entry = _graphs[url] = [ZoneGraph(edges), checksum, 0.0]
+            entry[2] = time.monotonic()
+            return entry[0]
+    finally:
+        if own_session:
+            db.close()
+
+
+def invalidate(url: Optional[str] = None):
+    """Forces a reload on the next get_graph() (for one database URL, or all)."""
+    for key, entry in list(_graphs.items()):
+        if url is None or key == url:
+            entry[1] = None
+            entry[2] = 0.0
+
+
+def get_neighbors(zone_id: int, hops: int = 1, db: Session = None) -> List[int]:
+    return get_graph(db).neighbors(zone_id, hops)
+
+
+def set_neighbors(db: Session, zone_id: int, neighbor_ids: List[int]):
+    """Replaces zone_id's edges (both directions) and reloads the graph."""
+    db.query(models.ZoneAdjacency).filter(
+        (models.ZoneAdjacency.zone_id == zone_id) | (models.ZoneAdjacency.neighbor_id == zone_id)
+    ).delete(synchronize_session=False)
+
+    edges = []
+    for n in sorted(set(neighbor_ids) - {zone_id}):
+        edges.append(models.ZoneAdjacency(zone_id=zone_id, neighbor_id=n))
+        edges.append(models.ZoneAdjacency(zone_id=n, neighbor_id=zone_id))
+    db.add_all(edges)
+    bump_version(db, VERSION_NAME)
+    db.commit()
+    invalidate(str(db.get_bind().url))
+
+
+def seed_default_adjacency(db: Session):
+    """Populates an empty adjacency table from DEFAULT_ADJACENCY (existing zones only)."""
+    if db.query(models.ZoneAdjacency.id).first():
+        return
+    existing = {z for (z,) in db.query(models.Zone.id).all()}
+    db.add_all([
+        models.ZoneAdjacency(zone_id=z, neighbor_id=n)
+        for z, neighbors in DEFAULT_ADJACENCY.items()
+        for n in neighbors
+        if z in existing and n in existing
+    ])
+    bump_version(db, VERSION_NAME)
+    db.commit()
+    invalidate(str(db.get_bind().url))
+
+
+# --- Spatial Risk ---
+
+def assess_neighbor_risk(db: Session, zone_id: int, syndromes: List[str], as_of,
+                         hops: int = SPATIAL_RISK_HOPS) -> Dict[str, Tuple[str, str]]:
+    """
+    Spatial risk for every syndrome of a zone from one query over the
+    neighbour set. Returns { syndrome: (risk_level, reason or None) }.
+    """
+    risk = {s: ("Low", None) for s in syndromes}
+    neighbors = get_neighbors(zone_id, hops, db)
+    if not neighbors or not syndromes:
+        return risk
+
+    cutoff = as_of - timedelta(days=SPATIAL_RISK_DAYS)
+    rows = db.query(models.Signal.zone_id, models.Signal.syndrome, models.Signal.severity)\
+        .filter(models.Signal.zone_id.in_(neighbors))\
+        .filter(models.Signal.date >= cutoff)\
+        .filter(models.Signal.syndrome.in_(syndromes))\
+        .all()
+
+    for n_zone, s_name, severity in rows:
+        level, _ = risk[s_name]
+        if level == "High":
+            continue
+        if severity == "High":
+            risk[s_name] = ("High", f"High severity {s_name} surge in neighboring Zone {n_zone}")
+        elif severity == "Medium" and level == "Low":
+            risk[s_name] = ("Medium", f"{s_name} surge in neighboring Zone {n_zone}")
+    return risk
@@ -0,0 +1,140 @@
+"""
+Delta sync for offline clients (POST /sync).
+
+Collection sites upload over 2G links, so a sync is one request carrying
+every pending report, each tagged with a client-generated idempotency key
+(a UUID stored alongside the report in IndexedDB):
+
+- The body may be gzip or deflate encoded (Content-Encoding). It is read
+  with a cap on the wire size (checked against Content-Length first) and
+  inflated with a cap on the inflated size.
+- Reports whose key is already in sync_keys are acked as duplicates and
+  skipped. The rest are appended to the ingestion log as ONE record, so
+  the applier runs detection once per (zone, day) in the sync instead of
+  once per report.
+- The applier inserts the keys in the same transaction as the visits and
+  drops rows whose key is already stored, so a retry sent while the first
+  attempt was still in the log is not counted twice.
+- The response is an ack vector with one character per report, in request
+  order ("a" accepted, "d" duplicate, "r" rejected), and a cursor: the log
+  seq holding the sync. Clients mark "a" and "d" reports as sent and poll
+  GET /sync?cursor= to learn when they have been applied, without
+  re-uploading anything.
+"""
+import json
+import os
+import zlib
+from typing import AsyncIterable, Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+import models, schemas
+
+# Params
+MAX_BODY_BYTES = int(os.getenv("SYNC_MAX_BODY_BYTES", str(4 * 1024 * 1024)))  # After inflation
+MAX_WIRE_BYTES = MAX_BODY_BYTES + MAX_BODY_BYTES // 1000 + 1024  # Before: room for deflate's worst-case growth
+MAX_KEY_CHARS = 64
+LOOKUP_CHUNK = 500  # Keys per IN (...) lookup
+ACCEPTED, DUPLICATE, REJECTED = "a", "d", "r"
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+async def read_body(chunks: AsyncIterable[bytes], content_length: Optional[str] = None) -> bytes:
+    """Reads a raw request body, stopping as soon as it is known to exceed MAX_WIRE_BYTES."""
+    if content_length is not None:
+        try:
+            declared = int(content_length)
+        except ValueError:
+            raise ValueError("Invalid Content-Length")
+        if declared > MAX_WIRE_BYTES:
+            raise BodyTooLarge(f"Body exceeds {MAX_WIRE_BYTES} bytes")
+    raw = bytearray()
+    async for chunk in chunks:
+        raw += chunk
+        if len(raw) > MAX_WIRE_BYTES:
+            raise BodyTooLarge(f"Body exceeds {MAX_WIRE_BYTES} bytes")
+    return bytes(raw)
+
+
+def decode_body(raw: bytes, encoding: Optional[str] = None) -> Dict:
+    """Inflates a gzip/deflate (or plain) body and parses it as JSON."""
+    encoding = (encoding or "identity").strip().lower()
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        wbits = zlib.MAX_WBITS if encoding == "deflate" else 16 + zlib.MAX_WBITS
+        inflater = zlib.decompressobj(wbits)
+        try:
+            raw = inflater.decompress(raw, MAX_BODY_BYTES + 1)
+        except zlib.error:
+            raise ValueError(f"Body is not valid {encoding} data")
+        if inflater.unconsumed_tail:
+            raise BodyTooLarge(f"Inflated body exceeds {MAX_BODY_BYTES} bytes")
+    elif encoding != "identity":
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+    if len(raw) > MAX_BODY_BYTES:
+        raise BodyTooLarge(f"Body exceeds {MAX_BODY_BYTES} bytes")
+
+    try:
+        return json.loads(raw)
+    except ValueError:
+        raise ValueError("Body is not valid JSON")
+
+
+def known_keys(db: Session, keys: Iterable[str]) -> Set[str]:
+    """The subset of keys already recorded in sync_keys."""
+    keys = list(keys)
+    found = set()
+    for i in range(0, len(keys), LOOKUP_CHUNK):
+        chunk = keys[i:i + LOOKUP_CHUNK]
+        found.update(k for (k,) in db.query(models.SyncKey.key).filter(models.SyncKey.key.in_(chunk)))
+    return found
+
+
+def prepare(db: Session, reports: List[Dict], hospital_id: Optional[int] = None) -> Tuple[str, List[Dict]]:
+    """
+    Classifies each report. Returns the ack vector and the visit rows
+    (carrying their key) to append to the ingestion log.
+    """
+    acks, candidates, seen = [], [], set()
+    for i, raw in enumerate(reports):
+        try:
+            report = schemas.SyncReport.model_validate(raw)
+        except ValueError:
+            acks.append(REJECTED)
+            continue
+        target = report.hospital_id or hospital_id
+        if not report.key or len(report.key) > MAX_KEY_CHARS or target is None or report.count < 0:
+            acks.append(REJECTED)
+            continue
+        if report.key in seen:
+            acks.append(DUPLICATE)  # Repeated within the same sync
+            continue
+        seen.add(report.key)
+        acks.append(ACCEPTED)
+        candidates.append((i, {
+            "date": report.date,
+            "syndrome": report.syndrome,
+            "count": report.count,
+            "age_group": report.age_group,
+            "hospital_id": target,
+            "key": report.key,
+        }))
+
+    if not candidates:
+        return "".join(acks), []
+
+    hospital_ids = list({row["hospital_id"] for _, row in candidates})
+    hospitals = {h for (h,) in db.query(models.Hospital.id).filter(models.Hospital.id.in_(hospital_ids))}
+    stored = known_keys(db, seen)
+
+    rows = []
+    for i, row in candidates:
+        if row["hospital_id"] not in hospitals:
+            acks[i] = REJECTED
+        elif row["key"] in stored:
+            acks[i] = DUPLICATE
+        else:
+            rows.append(row)
+    return "".join(acks), rows
@@ -0,0 +1,336 @@
+"""
+Deterministic synthetic surveillance data.
+
+Generates zones on a grid (with zone_adjacency edges), hospitals, and
+daily visit counts per (hospital, syndrome, age group) for a number of
+years. The same arguments and seed always produce the same data.
+
+Expected counts = base rate x weekly factor x annual factor, where the
+annual curve peaks at a syndrome-specific day of year (monsoon fever,
+winter respiratory, summer diarrhoea). Counts are Poisson draws; zero
+counts are not stored.
+
+Outbreaks are injected on top and labelled in a sidecar JSON file
+(ground truth for detection and cluster-scan evaluation). Each one has a
+centre zone, a syndrome, a shape (spike / ramp / bell) over its
+duration, and spreads `spread` hops over the adjacency graph: each hop
+starts SPREAD_DELAY_DAYS later at SPREAD_DECAY of the previous strength.
+
+Rows are bulk-loaded with Core executemany in chunks (or written as
+NDJSON, one {"table": ..., **row} object per line).
+
+    python synthetic_data.py --zones 200 --years 1 --outbreaks 20 --db sqlite:///./synthetic.db --reset
+    python synthetic_data.py --zones 10 --ndjson visits.ndjson
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import create_engine, func, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models, database, spatial_config, cube, dimensions, pyramid
+from cluster_scan import sample_poisson
+
+# Params
+SYNDROMES = ["Fever", "Respiratory Issue", "Diarrhea"]
+AGE_GROUPS = ["0-5", "5-15", "16-50", "60+"]
+AGE_WEIGHTS = {"0-5": 0.25, "5-15": 0.2, "16-50": 0.4, "60+": 0.15}  # Share of a syndrome's visits
+HOSPITAL_TYPES = ["District Hospital", "CHC", "PHC", "Clinic"]
+BASE_RATE = (2.0, 12.0)  # Mean daily visits per hospital and syndrome, drawn uniformly
+WEEKLY = [1.1, 1.05, 1.0, 1.0, 0.95, 0.8, 0.7]  # Mon..Sun
+ANNUAL_AMPLITUDE = 0.35
+SEASON_PEAK_DOY = {"Fever": 220, "Respiratory Issue": 15, "Diarrhea": 170}  # Day of year
+OUTBREAK_SHAPES = ("spike", "ramp", "bell")
+OUTBREAK_DAYS = (5, 14)
+OUTBREAK_MULTIPLIER = (2.5, 5.0)  # Peak expected counts vs normal at the centre
+SPREAD_DECAY = 0.6
+SPREAD_DELAY_DAYS = 2
+CHUNK_ROWS = 50000
+
+
+# --- Model ---
+
+def grid_edges(zone_ids: List[int]) -> List[Tuple[int, int]]:
+    """4-neighbour grid over zone_ids (row-major, width ~ sqrt(n)), one pair per edge."""
+    width = max(1, int(math.sqrt(len(zone_ids))))
+    edges = []
+    for i, z in enumerate(zone_ids):
+        if (i + 1) % width and i + 1 < len(zone_ids):
+            edges.append((z, zone_ids[i + 1]))
+        if i + width < len(zone_ids):
+            edges.append((z, zone_ids[i + width]))
+    return edges
+
+
+def seasonal_factor(d: date, syndrome: str) -> float:
+    weekly = WEEKLY[d.weekday()]
+    peak = SEASON_PEAK_DOY.get(syndrome)
+    if peak is None:
+        return weekly
+    phase = 2 * math.pi * (d.timetuple().tm_yday - peak) / 365.25
+    return weekly * (1 + ANNUAL_AMPLITUDE * math.cos(phase))
+
+
+def outbreak_curve(shape: str, day: int, duration: int) -> float:
+    """Relative strength (0..1] on day 0..duration-1 of an outbreak."""
+    if shape == "spike":
+        return 1.0 if day < max(1, duration // 3) else 0.3
+    if shape == "ramp":
+        return (day + 1) / duration
+    centre = (duration - 1) / 2  # bell
+    width = max(duration / 4, 1)
+    return math.exp(-((day - centre) ** 2) / (2 * width ** 2))
+
+
+def plan_outbreaks(rng: random.Random, graph: spatial_config.ZoneGraph, zone_ids: List[int],
+                   syndromes: List[str], start: date, days: int, count: int,
+                   shape: Optional[str] = None, spread: int = 1) -> List[Dict]:
+    """Labelled outbreaks with the zones they reach (by hop) and their dates."""
+    outbreaks = []
+    for k in range(count):
+        duration = rng.randint(*OUTBREAK_DAYS)
+        if days <= duration:
+            break
+        centre = rng.choice(zone_ids)
+        first = start + timedelta(days=rng.randrange(days - duration))
+
+        # BFS rings over the adjacency graph, `spread` hops out
+        rings, seen, frontier = [[centre]], {centre}, [centre]
+        for _ in range(spread):
+            nxt = sorted({n for z in frontier for n in graph.neighbors(z)} - seen)
+            if not nxt:
+                break
+            seen.update(nxt)
+            rings.append(nxt)
+            frontier = nxt
+
+        outbreaks.append({
+            "id": k + 1,
+            "syndrome": rng.choice(syndromes),
+            "shape": shape or rng.choice(OUTBREAK_SHAPES),
+            "centre_zone_id": centre,
+            "rings": rings,
+            "zone_ids": [z for ring in rings for z in ring],
+            "start": first.isoformat(),
+            "end": (first + timedelta(days=duration - 1 + SPREAD_DELAY_DAYS * (len(rings) - 1))).isoformat(),
+            "duration_days": duration,
+            "peak_multiplier": round(rng.uniform(*OUTBREAK_MULTIPLIER), 2),
+        })
+    return outbreaks
+
+
+def _outbreak_boost(outbreaks: List[Dict]) -> Dict[Tuple[date, int, str], float]:
+    """(date, zone_id, syndrome) -> extra multiple of the normal expectation."""
+    boost: Dict[Tuple[date, int, str], float] = {}
+    for o in outbreaks:
+        first = date.fromisoformat(o["start"])
+        for hop, ring in enumerate(o["rings"]):
+            strength = (o["peak_multiplier"] - 1) * SPREAD_DECAY ** hop
+            for day in range(o["duration_days"]):
+                d = first + timedelta(days=day + SPREAD_DELAY_DAYS * hop)
+                extra = strength * outbreak_curve(o["shape"], day, o["duration_days"])
+                for z in ring:
+                    key = (d, z, o["syndrome"])
+                    boost[key] = boost.get(key, 0.0) + extra
+    return boost
+
+
+class SyntheticDataset:
+    def __init__(self, zones: int = 10, hospitals_per_zone: int = 2, syndromes: List[str] = None,
+                 age_groups: List[str] = None, years: float = 1, end: date = None, seed: int = 0,
+                 outbreaks: int = 5, shape: Optional[str] = None, spread: int = 1):
+        self.syndromes = syndromes or SYNDROMES
+        self.age_groups = age_groups or AGE_GROUPS
+        self.end = end or date.today() - timedelta(days=1)
+        self.days = max(1, int(round(years * 365)))
+        self.start = self.end - timedelta(days=self.days - 1)
+        self.seed = seed
+        rng = random.Random(seed)
+
+        self.zones = [{"id": z, "name": f"Synthetic Ward {z}"} for z in range(1, zones + 1)]
+        zone_ids = [z["id"] for z in self.zones]
+        self.edges = grid_edges(zone_ids)
+        self.graph = spatial_config.ZoneGraph(self.edges)
+
+        self.hospitals = []
+        for z in zone_ids:
+            for k in range(hospitals_per_zone):
+                self.hospitals.append({
+                    "id": len(self.hospitals) + 1, "name": f"Synthetic {HOSPITAL_TYPES[k % len(HOSPITAL_TYPES)]} {z}-{k + 1}",
+                    "type": HOSPITAL_TYPES[k % len(HOSPITAL_TYPES)], "zone_id": z
+                })
+
+        # Mean daily visits per (hospital, syndrome) and the age split
+        self.base = {(h["id"], s): rng.uniform(*BASE_RATE) for h in self.hospitals for s in self.syndromes}
+        weights = [AGE_WEIGHTS.get(a, 1.0) for a in self.age_groups]
+        self.age_shares = [w / sum(weights) for w in weights]
+
+        self.outbreaks = plan_outbreaks(rng, self.graph, zone_ids, self.syndromes, self.start, self.days,
+                                        outbreaks, shape, spread)
+
+    @property
+    def adjacency(self) -> List[Dict]:
+        return [row for a, b in self.edges
+                for row in ({"zone_id": a, "neighbor_id": b}, {"zone_id": b, "neighbor_id": a})]
+
+    def visits(self) -> Iterator[Dict]:
+        """Visit rows in date order (deterministic for a given seed)."""
+        rng = random.Random(self.seed + 1)
+        boost = _outbreak_boost(self.outbreaks)
+        for offset in range(self.days):
+            d = self.start + timedelta(days=offset)
+            season = {s: seasonal_factor(d, s) for s in self.syndromes}
+            for h in self.hospitals:
+                for s in self.syndromes:
+                    lam = self.base[(h["id"], s)] * season[s] * (1 + boost.get((d, h["zone_id"], s), 0.0))
+                    for age_group, share in zip(self.age_groups, self.age_shares):
+                        count = sample_poisson(rng, lam * share)
+                        if count:
+                            yield {"date": d, "hospital_id": h["id"], "syndrome": s,
+                                   "count": count, "age_group": age_group}
+
+    def labels(self) -> Dict:
+        return {
+            "seed": self.seed, "start": self.start.isoformat(), "end": self.end.isoformat(),
+            "zones": len(self.zones), "hospitals": len(self.hospitals),
+            "syndromes": self.syndromes, "age_groups": self.age_groups,
+            "outbreaks": self.outbreaks,
+        }
+
+
+# --- Output ---
+
+def _chunks(rows: Iterator[Dict], size: int) -> Iterator[List[Dict]]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+VISIT_COLUMNS = ("date", "hospital_id", "syndrome", "count", "age_group")
+
+
+def load_into_db(dataset: SyntheticDataset, engine: Engine, reset: bool = False, chunk_rows: int = CHUNK_ROWS) -> int:
+    """
+    Bulk-loads the dataset in one transaction; returns the number of visit
+    rows written. On SQLite the visit_events indexes are dropped for the load
+    and rebuilt at the end, and chunks go straight to the driver's
+    executemany (about twice as fast as Core inserts at this size).
+    """
+    if reset:
+        models.Base.metadata.drop_all(bind=engine)
+    models.Base.metadata.create_all(bind=engine)
+
+    with engine.connect() as conn:
+        if conn.execute(func.count(models.Zone.id).select()).scalar():
+            raise RuntimeError("Target database already has zones; use --reset to replace it")
+
+    sqlite = engine.dialect.name == "sqlite"
+    indexes = list(models.VisitEvent.__table__.indexes) if sqlite else []
+    written = 0
+    with engine.begin() as conn:
+        if sqlite:
+            conn.exec_driver_sql("PRAGMA synchronous=OFF")
+            conn.exec_driver_sql("PRAGMA cache_size=-200000")
+        conn.execute(insert(models.Zone), dataset.zones)
+        conn.execute(insert(models.Hospital), dataset.hospitals)
+        if dataset.edges:
+            conn.execute(insert(models.ZoneAdjacency), dataset.adjacency)
+            spatial_config.bump_version(conn, spatial_config.VERSION_NAME)
+
+        for index in indexes:
+            index.drop(conn)
+        cursor = conn.connection.driver_connection.cursor() if sqlite else None
+        if cursor is not None:  # The driver path skips the column types: intern and encode here
+            dimensions.SYNDROMES.intern(conn, dataset.syndromes)
+            dimensions.AGE_GROUPS.intern(conn, dataset.age_groups)
+            syndrome_keys = {s: dimensions.SYNDROMES.encode(s) for s in dataset.syndromes}
+            age_keys = {a: dimensions.AGE_GROUPS.encode(a) for a in dataset.age_groups}
+        sql = (f"INSERT INTO {models.VisitEvent.__tablename__} ({', '.join(VISIT_COLUMNS)}) "
+               f"VALUES ({', '.join('?' * len(VISIT_COLUMNS))})")
+        for chunk in _chunks(dataset.visits(), chunk_rows):
+            if cursor is not None:
+                cursor.executemany(sql, [(r["date"].isoformat(), r["hospital_id"], syndrome_keys[r["syndrome"]],
+                                          r["count"], age_keys[r["age_group"]]) for r in chunk])
+            else:
+                conn.execute(insert(models.VisitEvent), chunk)
+            written += len(chunk)
+        for index in indexes:
+            index.create(conn)
+    with Session(engine) as db:
+        cube.rebuild(db)  # Bulk loads bypass the applier, which maintains the cube and pyramid
+        pyramid.rebuild(db)
+    spatial_config.invalidate(str(engine.url))
+    return written
+
+
+def write_ndjson(dataset: SyntheticDataset, out) -> int:
+    """Writes zones, hospitals, zone_adjacency then visit_events; returns visit rows written."""
+    for table, rows in (("zones", dataset.zones), ("hospitals", dataset.hospitals),
+                        ("zone_adjacency", dataset.adjacency)):
+        for row in rows:
+            out.write(json.dumps({"table": table, **row}) + "\n")
+    written = 0
+    for row in dataset.visits():
+        out.write(json.dumps({"table": "visit_events", **row, "date": row["date"].isoformat()}) + "\n")
+        written += 1
+    return written
+
+
+def _csv(value: str) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deterministic synthetic data generator")
+    parser.add_argument("--zones", type=int, default=10)
+    parser.add_argument("--hospitals-per-zone", type=int, default=2)
+    parser.add_argument("--syndromes", type=_csv, default=SYNDROMES)
+    parser.add_argument("--age-groups", type=_csv, default=AGE_GROUPS)
+    parser.add_argument("--years", type=float, default=1)
+    parser.add_argument("--end", type=date.fromisoformat, default=None, help="Last day of data (default: yesterday)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--outbreaks", type=int, default=5)
+    parser.add_argument("--shape", choices=OUTBREAK_SHAPES, default=None, help="Outbreak shape (default: mixed)")
+    parser.add_argument("--spread", type=int, default=1, help="Adjacency hops an outbreak spreads")
+    parser.add_argument("--db", default=None, help="Database URL (default: DATABASE_URL)")
+    parser.add_argument("--reset", action="store_true", help="Drop and recreate all tables first")
+    parser.add_argument("--ndjson", default=None, help="Write NDJSON to this path ('-' = stdout) instead of a DB")
+    parser.add_argument("--labels", default=None, help="Outbreak label file (default: <output>.labels.json)")
+    args = parser.parse_args()
+
+    dataset = SyntheticDataset(args.zones, args.hospitals_per_zone, args.syndromes, args.age_groups,
+                               args.years, args.end, args.seed, args.outbreaks, args.shape, args.spread)
+    t0 = time.monotonic()
+
+    if args.ndjson:
+        if args.ndjson == "-":
+            rows = write_ndjson(dataset, sys.stdout)
+        else:
+            with open(args.ndjson, "w") as f:
+                rows = write_ndjson(dataset, f)
+        labels_path = args.labels or (None if args.ndjson == "-" else f"{args.ndjson}.labels.json")
+    else:
+        engine = create_engine(args.db) if args.db else database.engine
+        rows = load_into_db(dataset, engine, reset=args.reset)
+        labels_path = args.labels or (f"{engine.url.database}.labels.json" if engine.url.database else None)
+
+    if labels_path:
+        with open(labels_path, "w") as f:
+            json.dump(dataset.labels(), f, indent=2)
+
+    print(f"{rows} visit rows for {len(dataset.zones)} zones / {len(dataset.hospitals)} hospitals "
+          f"({dataset.start} to {dataset.end}), {len(dataset.outbreaks)} outbreaks, "
+          f"in {time.monotonic() - t0:.1f}s" + (f"; labels: {labels_path}" if labels_path else ""),
+          file=sys.stderr)
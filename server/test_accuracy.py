@@ -0,0 +1,147 @@
+import time
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import models, accuracy, forecasting, pipeline, profiling
+from conftest import scratch_db
+from main import app, get_db
+
+TODAY = date.today()
+
+
+def _make_db(days=60):
+    Session = scratch_db("accuracy")
+
+    db = Session()
+    zones = [models.Zone(name="Accuracy North"), models.Zone(name="Accuracy South")]
+    db.add_all(zones)
+    db.commit()
+    hospitals = [models.Hospital(name=f"Accuracy PHC {i}", type="PHC", zone_id=zones[i].id) for i in range(2)]
+    db.add_all(hospitals)
+    db.commit()
+    rows = []
+    for i in range(days, -1, -1):
+        d = TODAY - timedelta(days=i)
+        rows.append({"date": d, "hospital_id": hospitals[0].id, "syndrome": "Fever", "count": 5 + i % 4 + (i < 10) * 6})
+        if i % 3:
+            rows.append({"date": d, "hospital_id": hospitals[1].id, "syndrome": "Dengue", "count": i % 5})
+    db.execute(insert(models.VisitEvent), rows)
+    db.commit()
+    ids = [z.id for z in zones]
+    db.close()
+    return Session, ids
+
+
+def _series(db, zone_id, syndrome, start, end):
+    totals = accuracy._actuals(db, start, end, [zone_id])
+    return [totals.get((zone_id, syndrome, start + timedelta(days=i)), 0) for i in range((end - start).days + 1)]
+
+
+def test_live_scoring():
+    print("--- Live Forecast Scoring ---")
+    Session, zone_ids = _make_db()
+    db = Session()
+    as_of = TODAY - timedelta(days=10)
+    pipeline.run(db, as_of=as_of)
+    assert db.query(models.Forecast).filter(models.Forecast.actual.isnot(None)).count() == 0  # Nothing in the past yet
+
+    # 1. A later run scores every forecast day that has ended, once
+    result = accuracy.score(db)
+    assert result["scored"] == 2 * pipeline.FORECAST_DAYS
+    assert accuracy.score(db)["scored"] == 0
+
+    points = db.query(models.Forecast).filter(models.Forecast.zone_id == zone_ids[0])\
+        .order_by(models.Forecast.date).all()
+    actuals = _series(db, zone_ids[0], "Fever", points[0].date, points[-1].date)
+    assert [p.actual for p in points] == actuals
+    cell = {c["horizon"]: c for c in accuracy.cells(db, "live", zone_ids[0], "Fever")}
+    assert sorted(cell) == list(range(1, pipeline.FORECAST_DAYS + 1))
+    assert abs(cell[2]["abs_error"] - abs(points[1].value - actuals[1])) < 1e-9
+    assert cell[2]["n"] == 1 and cell[2]["last_date"] == as_of + timedelta(days=2)
+    db.close()
+    print("SUCCESS: Materialised forecasts are scored once their day is over.")
+
+
+def test_backtest_matches_forecaster():
+    print("--- Rolling-Origin Backtest ---")
+    Session, zone_ids = _make_db()
+    db = Session()
+    end = TODAY - timedelta(days=1)
+    result = accuracy.backtest(db, days=15, horizon=3, fit_days=30, end=end)
+    assert result["series"] == 2
+
+    # Replay one series origin by origin with the scalar Forecaster
+    start = end - timedelta(days=45)
+    values = _series(db, zone_ids[0], "Fever", start, end)
+    errors, covered = [], 0
+    for o in range(30, len(values) - 1):
+        f = forecasting.Forecaster()
+        f.fit(values[o - 30:o + 1])
+        for p in f.predict(days=min(3, len(values) - 1 - o)):
+            if p["day"] == 1:
+                actual = values[o + 1]
+                errors.append(abs(p["value"] - actual))
+                covered += p["lower_bound"] <= actual <= p["upper_bound"]
+    cell = [c for c in accuracy.cells(db, "backtest", zone_ids[0], "Fever") if c["horizon"] == 1][0]
+    assert cell["n"] == len(errors) == 15
+    assert abs(cell["abs_error"] - sum(errors)) < 1e-6 and cell["covered"] == covered
+
+    # Rerunning replaces rather than adds
+    accuracy.backtest(db, days=15, horizon=3, fit_days=30, end=end)
+    assert [c for c in accuracy.cells(db, "backtest", zone_ids[0], "Fever") if c["horizon"] == 1][0]["n"] == 15
+    db.close()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        body = client.get("/analysis/forecast-accuracy", params={"source": "backtest"}).json()
+        h1 = [c for c in body["cells"] if c["zone_id"] == zone_ids[0] and c["horizon"] == 1][0]
+        assert h1["mae"] == round(sum(errors) / 15, 3) and h1["coverage"] == round(covered / 15, 3)
+        assert {(r["syndrome"], r["horizon"]) for r in body["by_syndrome"]} == \
+            {(s, h) for s in ("Dengue", "Fever") for h in (1, 2, 3)}
+        assert client.get("/analysis/forecast-accuracy", params={"source": "nope"}).status_code == 400
+        print("SUCCESS: The batched backtest scores exactly what the forecaster would have predicted.")
+    finally:
+        app.dependency_overrides.clear()
+
+
+def test_backtest_runs_in_background():
+    print("--- Backtest Endpoint ---")
+    token, profiling.ADMIN_TOKEN = profiling.ADMIN_TOKEN, "test-token"
+    admin = {"X-Admin-Token": "test-token"}
+    client = TestClient(app)
+    try:
+        for params in ({"days": 10 ** 9}, {"days": 0}, {"horizon": 31}):
+            assert client.post("/admin/forecast-accuracy/backtest", params=params, headers=admin).status_code == 422
+
+        # 1. Accepted at once; the state moves from running to done
+        res = client.post("/admin/forecast-accuracy/backtest", params={"days": 3, "horizon": 2}, headers=admin)
+        assert res.status_code == 202 and res.json()["days"] == 3
+        deadline = time.monotonic() + 60
+        while client.get("/admin/forecast-accuracy/backtest", headers=admin).json()["state"] == "running":
+            assert time.monotonic() < deadline, "backtest did not finish"
+            time.sleep(0.05)
+        run = client.get("/admin/forecast-accuracy/backtest", headers=admin).json()
+        assert run["state"] == "done" and run["result"][0]["origins"] == 3 and run["duration_s"] is not None
+
+        # 2. Only one at a time
+        with accuracy._backtest_lock:
+            assert client.post("/admin/forecast-accuracy/backtest", headers=admin).status_code == 409
+        print("SUCCESS: Backtests run in the background with bounded days and a status endpoint.")
+    finally:
+        profiling.ADMIN_TOKEN = token
+
+
+if __name__ == "__main__":
+    test_live_scoring()
+    test_backtest_matches_forecaster()
+    test_backtest_runs_in_background()
@@ -0,0 +1,144 @@
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+
+import admission, database
+from main import app
+
+client = TestClient(app)
+
+
+def _saturate(name, n):
+    with admission._lock:
+        admission.stats[name]["in_flight"] += n
+
+
+def test_shedding_and_reserved_ingest():
+    print("--- Admission Control ---")
+    assert admission.classify("POST", "/ingest/batch") == "ingest"
+    assert admission.classify("POST", "/sync") == "ingest" and admission.classify("GET", "/sync") == "interactive"
+    assert admission.classify("GET", "/zones/{zone_id}/forecast") == "analytics"
+    assert admission.classify("GET", "/export/{dataset}") == "export"
+    assert admission.classify("GET", "/admin/admission/stats") == "control"
+
+    waits = {name: c["queue_wait_s"] for name, c in admission.CLASSES.items()}
+    for c in admission.CLASSES.values():
+        c["queue_wait_s"] = 0.0
+    admission.clear_stale()
+    shared = admission.CAPACITY - admission.INGEST_RESERVED
+    try:
+        # 1. A fresh answer is kept as the stale copy
+        fresh = client.get("/analysis/forecast-accuracy", params={"source": "backtest"})
+        assert fresh.status_code == 200 and "x-admission" not in fresh.headers
+
+        # 2. Analytics at its limit: the copy is served, otherwise 503 + Retry-After
+        _saturate("analytics", admission.ANALYTICS_LIMIT)
+        try:
+            stale = client.get("/analysis/forecast-accuracy", params={"source": "backtest"})
+            assert stale.status_code == 200 and stale.headers["x-admission"] == "stale"
+            assert stale.json() == fresh.json() and stale.headers["warning"].startswith("110")
+            shed = client.get("/analysis/forecast-accuracy", params={"source": "live"})
+            assert shed.status_code == 503 and shed.headers["retry-after"] == "10"
+            assert client.get("/zones").status_code == 200  # Other classes are unaffected
+        finally:
+            _saturate("analytics", -admission.ANALYTICS_LIMIT)
+
+        # 3. Shared slots full: dashboards are shed, ingestion still gets its reserved slots
+        _saturate("interactive", shared)
+        try:
+            assert client.get("/zones").status_code == 503
+            assert client.post("/ingest/batch", json={"events": []}).status_code != 503
+            assert client.get("/admin/admission/stats").status_code == 200  # Control is never limited
+        finally:
+            _saturate("interactive", -shared)
+
+        # 4. No class jumps the queue past a waiting higher-priority one
+        with admission._lock:
+            admission.stats["ingest"]["waiting"] += 1
+        try:
+            assert not admission._try_acquire("interactive")
+        finally:
+            with admission._lock:
+                admission.stats["ingest"]["waiting"] -= 1
+
+        classes = client.get("/admin/admission/stats").json()["classes"]
+        assert classes["analytics"]["stale_served"] >= 1 and classes["interactive"]["shed"] >= 1
+        assert all(c["in_flight"] == 0 for name, c in classes.items() if name != "control")
+    finally:
+        for name, wait in waits.items():
+            admission.CLASSES[name]["queue_wait_s"] = wait
+    print("SUCCESS: Overloaded analytics are shed (stale copy or 503); ingestion keeps its slots.")
+
+
+def test_deadlines_are_cooperative():
+    print("--- Request Deadlines ---")
+    # 1. check() and every SQL statement stop once the deadline passes
+    with admission.bound(time.monotonic() - 1):
+        try:
+            admission.check()
+            assert False, "expected DeadlineExceeded"
+        except admission.DeadlineExceeded:
+            pass
+        with database.engine.connect() as conn:
+            try:
+                conn.execute(text("SELECT 1"))
+                assert False, "expected DeadlineExceeded"
+            except admission.DeadlineExceeded:
+                pass
+    with database.engine.connect() as conn:  # No deadline outside a request
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+
+    # 2. An analytics request past its deadline is cut off
+    config = admission.CLASSES["analytics"]
+    original = config["deadline_s"]
+    config["deadline_s"] = 1e-6
+    admission.clear_stale()
+    before = admission.stats["analytics"]["deadline_exceeded"]
+    try:
+        res = client.get("/analysis/summary")
+        assert res.status_code == 503 and "retry-after" in res.headers
+        assert admission.stats["analytics"]["deadline_exceeded"] == before + 1
+        assert admission.stats["analytics"]["in_flight"] == 0
+    finally:
+        config["deadline_s"] = original
+    assert client.get("/analysis/summary").status_code == 200
+    print("SUCCESS: Analytics past their deadline stop at the next check and are shed.")
+
+
+def test_exports_outlive_the_analytics_deadline():
+    print("--- Export Admission ---")
+    params = {"format": "ndjson", "start": "2000-01-01"}
+    expected = client.get("/export/visits", params=params).text
+
+    def slow_statement(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(0.3)  # After the deadline check: the next statement starts past the deadline
+
+    # Raw rows then rollups: the second statement starts after an analytics deadline would have passed
+    config = admission.CLASSES["analytics"]
+    original = config["deadline_s"]
+    config["deadline_s"] = 0.2
+    event.listen(database.engine, "before_cursor_execute", slow_statement)
+    before = admission.stats["export"]["deadline_exceeded"]
+    try:
+        res = client.get("/export/visits", params=params)
+        assert res.status_code == 200 and res.text == expected
+        assert admission.stats["export"]["deadline_exceeded"] == before
+    finally:
+        event.remove(database.engine, "before_cursor_execute", slow_statement)
+        config["deadline_s"] = original
+
+    # Exports have their own small slot limit
+    _saturate("export", admission.EXPORT_LIMIT)
+    try:
+        assert client.get("/export/visits", params=params).status_code == 503
+        assert client.get("/analysis/forecast-accuracy").status_code == 200
+    finally:
+        _saturate("export", -admission.EXPORT_LIMIT)
+    print("SUCCESS: Exports stream to the end with no deadline, limited to EXPORT_LIMIT at once.")
+
+
+if __name__ == "__main__":
+    test_shedding_and_reserved_ingest()
+    test_deadlines_are_cooperative()
+    test_exports_outlive_the_analytics_deadline()
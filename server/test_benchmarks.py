@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+
+import bench_endpoints
+
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_budgets.json")
+
+
+def test_bench_smoke():
+    print("--- Endpoint Benchmark Smoke Test ---")
+    original = bench_endpoints.DATA_DIR
+    bench_endpoints.DATA_DIR = tempfile.mkdtemp()
+    try:
+        report = bench_endpoints.run_suite(["tiny"], iterations=3, warmup=1)
+    finally:
+        bench_endpoints.DATA_DIR = original
+
+    endpoints = report["tiers"]["tiny"]["endpoints"]
+    for case in ("POST /ingest/batch", "ingest apply", "detection", "GET /signals/{id}/history",
+                 "GET /zones/{id}/forecast", "GET /analysis/summary"):
+        assert case in endpoints, case
+        assert endpoints[case]["n"] == 3
+        assert endpoints[case]["p50_ms"] <= endpoints[case]["p95_ms"] <= endpoints[case]["max_ms"]
+        print(f"{case}: p95 {endpoints[case]['p95_ms']}ms, {endpoints[case]['sql_max']} statements")
+
+    # Statement counts are deterministic, so the committed budgets must hold (latency is machine-dependent)
+    with open(BUDGETS) as f:
+        budgets = json.load(f)
+    sql_only = {tier: {case: {"sql": b["sql"]} for case, b in cases.items()} for tier, cases in budgets.items()}
+    regressions = bench_endpoints.check_budgets(report, sql_only)
+    assert regressions == [], regressions
+
+    # A tightened budget is reported as a regression
+    tight = {"tiny": {"GET /zones": {"p95_ms": 0.001, "sql": 0}}}
+    assert len(bench_endpoints.check_budgets(report, tight, tolerance=0)) == 2
+    print("SUCCESS: Report complete and within query budgets.")
+
+
+if __name__ == "__main__":
+    test_bench_smoke()
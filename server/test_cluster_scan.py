@@ -0,0 +1,122 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+
+import cluster_scan, models
+from conftest import scratch_db
+from spatial_config import ZoneGraph
+
+TODAY = date.today()
+
+
+def _surge_counts(seed=7):
+    """Six wards in a row; a surge straddles wards 3 and 4 over the last 3 days."""
+    rng = random.Random(seed)
+    counts = [[cluster_scan.sample_poisson(rng, 6) for _ in range(30)] for _ in range(6)]
+    for z in (2, 3):  # positions of wards 3 and 4
+        for d in range(27, 30):
+            counts[z][d] += 7  # Each ward alone stays under 1.5x
+    return counts
+
+
+def _make_db(counts):
+    Session = scratch_db("cluster")
+
+    db = Session()
+    for z in range(1, len(counts) + 1):
+        db.add(models.Zone(id=z, name=f"Cluster Ward {z}"))
+        db.add(models.Hospital(id=z, name=f"Cluster Hospital {z}", type="PHC", zone_id=z))
+    db.add_all([models.ZoneAdjacency(zone_id=z, neighbor_id=z + 1) for z in range(1, len(counts))])
+    db.add_all([
+        models.VisitEvent(date=TODAY - timedelta(days=len(row) - 1 - d), hospital_id=z, syndrome="Cholera",
+                          count=n, age_group="16-50")
+        for z, row in enumerate(counts, start=1) for d, n in enumerate(row) if n
+    ])
+    db.commit()
+    return db
+
+
+def test_cross_boundary_cluster():
+    print("--- Space-Time Cluster Scan ---")
+    zone_ids = [1, 2, 3, 4, 5, 6]
+    graph = ZoneGraph([(1, 2), (2, 3), (3, 4), (4, 5), (5, 6)])
+    counts = _surge_counts()
+
+    candidates = cluster_scan.build_candidates(graph, zone_ids, max_zones=4)
+    started = time.perf_counter()
+    clusters = cluster_scan.scan_syndrome(counts, candidates, replications=199, seed=1)
+    print(f"Scan + 199 replications: {time.perf_counter() - started:.2f}s")
+
+    assert clusters, "No cluster found"
+    top = clusters[0]
+    members = sorted(zone_ids[m] for m in top["members"])
+    print(f"Top cluster: zones {members}, {top['window_days']}d, "
+          f"{top['observed']:.0f} vs {top['expected']:.1f}, p={top['p_value']:.3f}")
+
+    assert {3, 4} <= set(members)
+    assert top["p_value"] <= 0.05
+    print("SUCCESS: Cross-boundary surge detected as one cluster.")
+
+
+def test_null_is_quiet():
+    rng = random.Random(11)
+    zone_ids = list(range(1, 9))
+    graph = ZoneGraph([(z, z + 1) for z in zone_ids[:-1]])
+    counts = [[cluster_scan.sample_poisson(rng, 10) for _ in range(30)] for _ in zone_ids]
+
+    candidates = cluster_scan.build_candidates(graph, zone_ids, max_zones=4)
+    clusters = cluster_scan.scan_syndrome(counts, candidates, replications=99, seed=3, alpha=0.01)
+    print(f"Clusters under the null: {len(clusters)}")
+    assert len(clusters) == 0
+
+
+def test_process_pool_and_time_budget():
+    print("--- Cluster Scan Pool / Budget ---")
+    counts = _surge_counts()
+    candidates = cluster_scan.build_candidates(ZoneGraph([(z, z + 1) for z in range(1, 6)]), range(1, 7), 4)
+
+    # 1. The pool runs the same seeded chunks as the serial loop
+    serial = cluster_scan.scan_syndrome(counts, candidates, replications=199, seed=1)
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        pooled = cluster_scan.scan_syndrome(counts, candidates, replications=199, pool=pool, seed=1)
+    assert pooled == serial and serial[0]["replications"] == 199
+
+    # 2. A spent budget stops after the first chunk and says so
+    cut = cluster_scan.scan_syndrome(counts, candidates, replications=999, time_budget_s=0, seed=1)
+    print(f"Budget cut: {cut[0]['replications']} of {cut[0]['replications_requested']} replications")
+    assert cut[0]["replications"] == cluster_scan.CHUNK_REPLICATIONS
+    assert cut[0]["replications_requested"] == 999
+    print("SUCCESS: Pooled replications match the serial run; a budget cut is reported.")
+
+
+def test_run_cluster_scan_saves_signals():
+    print("--- Cluster Scan Storage ---")
+    db = _make_db(_surge_counts())
+    try:
+        # 1. Full run through the process pool: stored on the cluster's centre zone
+        clusters = cluster_scan.run_cluster_scan(db, TODAY, replications=99, workers=2, time_budget_s=60)
+        assert clusters and {3, 4} <= set(clusters[0]["zone_ids"])
+        signals = db.query(models.Signal).filter(models.Signal.signal_type == cluster_scan.SIGNAL_TYPE).all()
+        assert len(signals) == len(clusters)
+        stored = next(s for s in signals if s.zone_id == clusters[0]["zone_id"])
+        print(f"Stored: {stored.explanation}")
+        assert stored.date == TODAY and stored.syndrome == "Cholera"
+        assert "(99 replications)" in stored.explanation
+
+        # 2. Out of budget: the stored explanation admits the shorter run
+        cluster_scan.run_cluster_scan(db, TODAY, replications=999, workers=1, time_budget_s=0)
+        db.refresh(stored)
+        print(f"After a budget cut: {stored.explanation}")
+        assert f"({cluster_scan.CHUNK_REPLICATIONS} of 999 replications, time budget spent)" in stored.explanation
+    finally:
+        db.close()
+    print("SUCCESS: Clusters are stored as signals with the replications actually run.")
+
+
+if __name__ == "__main__":
+    test_cross_boundary_cluster()
+    test_null_is_quiet()
+    test_process_pool_and_time_budget()
+    test_run_cluster_scan_saves_signals()
@@ -0,0 +1,114 @@
+import gzip
+import os
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+
+import models, compaction, cube, signal_engine, timeseries
+from conftest import scratch_db
+from main import app, get_db
+
+TODAY = date.today()
+DAYS = 120
+HORIZON = 60
+
+
+def _make_db():
+    Session = scratch_db("compaction")
+
+    db = Session()
+    zone = models.Zone(name="Compaction Ward")
+    db.add(zone)
+    db.commit()
+    hospitals = [models.Hospital(name=f"Compaction Hospital {i}", type="PHC", zone_id=zone.id) for i in range(2)]
+    db.add_all(hospitals)
+    db.commit()
+    for offset in range(DAYS):
+        d = TODAY - timedelta(days=offset)
+        for h in hospitals:
+            for age_group, count in (("0-5", 1 + offset % 3), ("16-50", 2)):
+                db.add(models.VisitEvent(date=d, hospital_id=h.id, syndrome="Fever", count=count, age_group=age_group))
+    db.commit()
+    cube.rebuild(db)
+    old_day = TODAY - timedelta(days=HORIZON + 10)
+    signal_engine.save_signal(db, zone.id, old_day, "Fever", 10, 5, "Disease Surge", "High", "High", "Old surge")
+    signal_id = db.query(models.Signal.id).scalar()
+    zone_id = zone.id
+    db.close()
+    return Session, zone_id, signal_id
+
+
+def _snapshot(client, db, zone_id, signal_id):
+    return (
+        client.get(f"/signals/{signal_id}/history", params={"days": 30}).json(),
+        client.get(f"/signals/{signal_id}/breakdown").json()["breakdown"],
+        sorted(timeseries.zone_daily_counts(db, TODAY - timedelta(days=DAYS), TODAY, [zone_id])),
+    )
+
+
+def test_compaction_preserves_totals():
+    print("--- visit_events Compaction ---")
+    Session, zone_id, signal_id = _make_db()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    archive_dir = tempfile.mkdtemp()
+    db = Session()
+    try:
+        before = _snapshot(client, db, zone_id, signal_id)
+        raw_before = db.query(func.count(models.VisitEvent.id)).scalar()
+
+        result = compaction.compact(db, horizon_days=HORIZON, archive_dir=archive_dir, batch_size=7)
+        cutoff = date.fromisoformat(result["cutoff"])
+        print(f"Compacted {result['compacted']} of {raw_before} rows in {result['batches']} batches")
+
+        assert result["batches"] > 1
+        assert db.query(func.count(models.VisitEvent.id)).filter(models.VisitEvent.date < cutoff).scalar() == 0
+        assert db.query(func.count(models.VisitEvent.id)).scalar() == raw_before - result["compacted"]
+        # 2 hospitals x 1 syndrome per compacted day
+        assert db.query(func.count(models.VisitDailyRollup.id)).scalar() == 2 * (DAYS - HORIZON - 1)
+
+        after = _snapshot(client, db, zone_id, signal_id)
+        assert after == before, "Totals changed across the compaction boundary"
+
+        archived = 0
+        for name in os.listdir(archive_dir):
+            with gzip.open(os.path.join(archive_dir, name), "rt") as f:
+                archived += sum(1 for _ in f)
+        assert archived == result["compacted"]
+
+        # Nothing left to do; a late-arriving old row is folded into the existing rollup
+        assert compaction.compact(db, horizon_days=HORIZON)["compacted"] == 0
+        old_day = cutoff - timedelta(days=1)
+        hospital_id = db.query(models.Hospital.id).first()[0]
+        db.add(models.VisitEvent(date=old_day, hospital_id=hospital_id, syndrome="Fever", count=5, age_group="60+"))
+        db.commit()
+        expected = db.query(models.VisitDailyRollup.count).filter_by(date=old_day, hospital_id=hospital_id).scalar() + 5
+        assert compaction.compact(db, horizon_days=HORIZON)["compacted"] == 1
+        assert db.query(models.VisitDailyRollup.count).filter_by(date=old_day, hospital_id=hospital_id).scalar() == expected
+        print("SUCCESS: History, breakdown and daily counts unchanged after compaction.")
+    finally:
+        db.close()
+        app.dependency_overrides.pop(get_db, None)
+
+
+def test_min_horizon():
+    try:
+        compaction.compact(None, horizon_days=compaction.MIN_HORIZON_DAYS - 1)
+    except ValueError:
+        return
+    raise AssertionError("Horizon below the hot-path lookback was accepted")
+
+
+if __name__ == "__main__":
+    test_compaction_preserves_totals()
+    test_min_horizon()
@@ -0,0 +1,153 @@
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+import models, cube, signal_engine
+from conftest import scratch_db
+from ingest_log import IngestLog, LogApplier
+from main import app, get_db
+
+TODAY = date.today()
+WEEK_START = TODAY - timedelta(days=6)
+
+
+def _make_db():
+    Session = scratch_db("cube")
+
+    db = Session()
+    zones = [models.Zone(name="Cube North"), models.Zone(name="Cube South")]
+    db.add_all(zones)
+    db.commit()
+    hospitals = [models.Hospital(name=f"Cube Hospital {i}", type="PHC", zone_id=zones[i % 2].id) for i in range(4)]
+    db.add_all(hospitals)
+    db.commit()
+    ids = [z.id for z in zones], [h.id for h in hospitals]
+    db.close()
+    return Session, ids
+
+
+def _visits(hospital_ids, days):
+    """Diarrhea: 2 under-5s and 1 adult per hospital per day; Fever: 3 adults."""
+    rows = []
+    for offset in range(days):
+        d = str(TODAY - timedelta(days=offset))
+        for h in hospital_ids:
+            rows += [
+                {"date": d, "hospital_id": h, "syndrome": "Diarrhea", "count": 2, "age_group": "0-5"},
+                {"date": d, "hospital_id": h, "syndrome": "Diarrhea", "count": 1, "age_group": "16-50"},
+                {"date": d, "hospital_id": h, "syndrome": "Fever", "count": 3, "age_group": "16-50"},
+            ]
+    return rows
+
+
+def test_cube_slices_and_maintenance():
+    print("--- Visit Cube ---")
+    Session, (zone_ids, hospital_ids) = _make_db()
+    log = IngestLog(tempfile.mkdtemp())
+    applier = LogApplier(log, session_factory=Session, autostart=False)
+    log.append(_visits(hospital_ids, 10))
+    log.append(_visits(hospital_ids[:1], 1))  # Same cells again: counts add up
+    while applier.apply_pending():
+        pass
+
+    db = Session()
+    try:
+        # 1. "Diarrhea in under-5s across the district this week"
+        week = cube.query(db, [], {"syndrome": ["Diarrhea"], "age_group": ["0-5"]}, WEEK_START, TODAY)
+        print(f"Under-5 diarrhea this week: {week['total']}")
+        assert week["total"] == 7 * 4 * 2 + 2
+
+        # 2. Drill down by zone, then roll back up: totals agree
+        by_zone = cube.query(db, ["zone_id"], {"syndrome": ["Diarrhea"], "age_group": ["0-5"]}, WEEK_START, TODAY)
+        assert [c["zone_id"] for c in by_zone["cells"]] == zone_ids
+        assert by_zone["total"] == week["total"]
+        by_age = cube.query(db, ["age_group", "syndrome"], {}, TODAY, TODAY)
+        assert {(c["age_group"], c["syndrome"]): c["count"] for c in by_age["cells"]} == {
+            ("0-5", "Diarrhea"): 10, ("16-50", "Diarrhea"): 5, ("16-50", "Fever"): 15}
+
+        # 3. Repeated slices come from the cache until the cube changes
+        hits = cube.cache_stats["hits"]
+        assert cube.query(db, ["zone_id"], {"age_group": ["0-5"], "syndrome": ["Diarrhea"]}, WEEK_START, TODAY) \
+            is by_zone
+        assert cube.cache_stats["hits"] == hits + 1
+        log.append(_visits(hospital_ids[:1], 1))
+        applier.apply_pending()
+        fresh = cube.query(db, [], {"syndrome": ["Diarrhea"], "age_group": ["0-5"]}, WEEK_START, TODAY)
+        assert fresh["total"] == week["total"] + 2
+
+        # 4. A query that runs across an invalidate() isn't cached as current
+        slice_args = (["hospital_id"], {"syndrome": ["Fever"]}, WEEK_START, TODAY)
+        fired = []
+
+        def invalidate_mid_query(conn, cursor, statement, parameters, context, executemany):
+            if "visit_cube" in statement and not fired:
+                fired.append(True)
+                cube.invalidate()
+
+        event.listen(db.get_bind(), "before_cursor_execute", invalidate_mid_query)
+        try:
+            cube.query(db, *slice_args)
+        finally:
+            event.remove(db.get_bind(), "before_cursor_execute", invalidate_mid_query)
+        misses = cube.cache_stats["misses"]
+        cube.query(db, *slice_args)
+        assert fired and cube.cache_stats["misses"] == misses + 1
+
+        # 5. A full rebuild matches the incrementally maintained cube
+        before = cube.query(db, list(cube.DIMENSIONS))["cells"]
+        cube.rebuild(db)
+        assert cube.query(db, list(cube.DIMENSIONS))["cells"] == before
+
+        try:
+            cube.query(db, ["colour"])
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    finally:
+        db.close()
+    print("SUCCESS: Cube answers drill-down and roll-up slices and stays in step with ingestion.")
+
+
+def test_cube_api_and_breakdown():
+    print("--- Cube API ---")
+    Session, (zone_ids, hospital_ids) = _make_db()
+    log = IngestLog(tempfile.mkdtemp())
+    applier = LogApplier(log, session_factory=Session, autostart=False)
+    log.append(_visits(hospital_ids, 3))
+    applier.apply_pending()
+
+    db = Session()
+    signal_engine.save_signal(db, zone_ids[0], TODAY, "Diarrhea", 6, 2, "Disease Surge", "High", "High", "Test")
+    signal_id = db.query(models.Signal.id).scalar()
+    db.close()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        res = client.get("/cube", params={"syndrome": "Diarrhea", "age_group": ["0-5", "16-50"],
+                                          "group_by": "age_group", "start": str(TODAY - timedelta(days=1))})
+        assert res.status_code == 200, res.text
+        assert res.json()["cells"] == [{"age_group": "0-5", "count": 16}, {"age_group": "16-50", "count": 8}]
+        assert client.get("/cube", params={"group_by": "colour"}).status_code == 400
+
+        breakdown = client.get(f"/signals/{signal_id}/breakdown").json()
+        assert sum(b["count"] for b in breakdown["breakdown"]) == 6
+        assert breakdown["age_groups"] == [{"age_group": "0-5", "count": 4}, {"age_group": "16-50", "count": 2}]
+        print(f"Summary: {breakdown['summary']}")
+        print("SUCCESS: /cube slices and signal breakdowns by age group.")
+    finally:
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_cube_slices_and_maintenance()
+    test_cube_api_and_breakdown()
@@ -0,0 +1,117 @@
+import base64
+from array import array
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import models, diffusion, spatial_config
+from conftest import scratch_db
+from main import app, get_db
+
+TODAY = date.today()
+
+
+def _make_db():
+    """Three zones in a chain (A - B - C) with cases only in A."""
+    Session = scratch_db("diffusion")
+
+    db = Session()
+    zones = [models.Zone(name=f"Chain {c}") for c in "ABC"]
+    db.add_all(zones)
+    db.commit()
+    hospital = models.Hospital(name="Chain PHC", type="PHC", zone_id=zones[0].id)
+    db.add(hospital)
+    db.commit()
+    db.execute(insert(models.VisitEvent), [{"date": TODAY - timedelta(days=i), "hospital_id": hospital.id,
+                                            "syndrome": "Cholera", "count": 20} for i in range(10)])
+    db.commit()
+    spatial_config.set_neighbors(db, zones[1].id, [zones[0].id, zones[2].id])
+    ids = [z.id for z in zones]
+    db.close()
+    return Session, ids
+
+
+def _frames(scenario, days, n_zones):
+    frames = scenario["frames"]
+    return [list(frames[d * n_zones:(d + 1) * n_zones]) for d in range(days)]
+
+
+def test_spread_over_graph():
+    print("--- Diffusion Engine ---")
+    Session, (a, b, c) = _make_db()
+    diffusion.clear_cache()
+    db = Session()
+    try:
+        # 1. SIR: cases spread A -> B -> C; without coupling they stay in A
+        result = diffusion.run(db, "Cholera", [{"model": "sir"}, {"model": "sir", "coupling": 0.0},
+                                               {"model": "intensity", "coupling": 0.5}], days=10)
+        assert result["zones"] == [a, b, c] and result["layout"] == ["day", "zone"]
+        sir, isolated, intensity = (_frames(s, 10, 3) for s in result["scenarios"])
+        assert sir[0][0] > 0 and sir[0][1] > 0 and sir[0][2] == 0  # C is two hops away on day 1
+        assert sir[1][2] > 0 and all(day[1] > day[2] for day in sir)
+        assert all(day[1] == 0 and day[2] == 0 for day in isolated)
+        assert all(0 <= v <= 1 for day in intensity for v in day) and intensity[0][2] == 0 < intensity[1][2]
+        assert not any(s["cached"] for s in result["scenarios"])
+
+        # 2. Same data and parameters: served from the cache (new parameters are simulated)
+        again = diffusion.run(db, "Cholera", [{"model": "sir"}, {"model": "sir", "beta": 0.5}], days=10)
+        assert [s["cached"] for s in again["scenarios"]] == [True, False]
+        assert list(again["scenarios"][0]["frames"]) == list(result["scenarios"][0]["frames"])
+
+        # 3. A batch split across the process pool matches running inline
+        batch = [{"model": "sir", "beta": 0.1 * k} for k in range(1, 6)]
+        diffusion.clear_cache()
+        inline = diffusion.run(db, "Cholera", batch, days=5, workers=1)
+        diffusion.clear_cache()
+        pooled = diffusion.run(db, "Cholera", batch, days=5, workers=2)
+        assert [list(s["frames"]) for s in pooled["scenarios"]] == [list(s["frames"]) for s in inline["scenarios"]]
+        assert pooled["scenarios"][4]["peak_total"] >= pooled["scenarios"][0]["peak_total"]
+
+        try:
+            diffusion.run(db, "Cholera", [{"model": "sir", "coupling": 2}])
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+    finally:
+        diffusion.shutdown()
+        db.close()
+        spatial_config.invalidate()  # The graph cache is process-wide; don't leak this chain to other tests
+    print("SUCCESS: Cases spread along graph edges; results are cached and pool runs match.")
+
+
+def test_diffusion_endpoint():
+    print("--- Diffusion Endpoint ---")
+    Session, zone_ids = _make_db()
+    diffusion.clear_cache()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        res = client.post("/analysis/diffusion", json={"syndrome": "Cholera", "days": 7})
+        assert res.status_code == 200
+        body = res.json()
+        frames = array('f')
+        frames.frombytes(base64.b64decode(body["scenarios"][0]["frames"]))
+        assert len(frames) == 7 * len(zone_ids) and body["dtype"] == "float32"
+        assert body["scenarios"][0]["params"]["model"] == "sir"
+
+        bad = client.post("/analysis/diffusion", json={"syndrome": "Cholera", "scenarios": [{"model": "seir"}]})
+        assert bad.status_code == 400
+        assert client.post("/analysis/diffusion", json={"syndrome": "Cholera", "days": 0}).status_code == 400
+        print("SUCCESS: /analysis/diffusion returns compact float32 frames.")
+    finally:
+        app.dependency_overrides.clear()
+        spatial_config.invalidate()
+
+
+if __name__ == "__main__":
+    test_spread_over_graph()
+    test_diffusion_endpoint()
@@ -0,0 +1,105 @@
+import os
+import tempfile
+from datetime import date
+
+from sqlalchemy import create_engine, func, inspect, insert, text
+from sqlalchemy.orm import sessionmaker
+
+import models, migrations, dimensions
+
+DAY = date(2024, 7, 1)
+
+
+def _legacy_db():
+    """A database from before dictionary encoding: names stored as text."""
+    path = os.path.join(tempfile.mkdtemp(), "legacy.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE zones (id INTEGER PRIMARY KEY, name VARCHAR)")
+        conn.exec_driver_sql("CREATE TABLE hospitals (id INTEGER PRIMARY KEY, name VARCHAR, zone_id INTEGER, type VARCHAR)")
+        conn.exec_driver_sql("CREATE TABLE visit_events (id INTEGER PRIMARY KEY, date DATE, hospital_id INTEGER, "
+                             "syndrome VARCHAR, count INTEGER, age_group VARCHAR)")
+        conn.exec_driver_sql("CREATE INDEX ix_visit_events_syndrome ON visit_events (syndrome)")
+        conn.exec_driver_sql("CREATE TABLE signals (id INTEGER PRIMARY KEY, date DATE, zone_id INTEGER, "
+                             "syndrome VARCHAR, value INTEGER, signal_type VARCHAR, status VARCHAR)")
+        conn.exec_driver_sql("INSERT INTO zones VALUES (1, 'Legacy Ward')")
+        conn.exec_driver_sql("INSERT INTO hospitals VALUES (1, 'Legacy PHC', 1, 'PHC')")
+        conn.exec_driver_sql("INSERT INTO visit_events (date, hospital_id, syndrome, count, age_group) VALUES "
+                             "('2024-07-01', 1, 'Fever', 4, '0-5'), ('2024-07-01', 1, 'Typhoid', 2, NULL)")
+        conn.exec_driver_sql("INSERT INTO signals (date, zone_id, syndrome, value, signal_type, status) VALUES "
+                             "('2024-07-01', 1, 'ALL', 6, 'OPD Load Increase', 'Pending')")
+    return engine
+
+
+def test_migration_reencodes_names():
+    print("--- Dimension Migration ---")
+    engine = _legacy_db()
+    migrations.upgrade(engine)
+
+    inspector = inspect(engine)
+    types = {c["name"]: str(c["type"]) for c in inspector.get_columns("visit_events")}
+    assert types["syndrome"] == "INTEGER" and types["age_group"] == "INTEGER"
+    assert {i["name"] for i in inspector.get_indexes("visit_events")} >= {"ix_visit_events_syndrome",
+                                                                         "ix_visit_events_syndrome_date"}
+    with engine.connect() as conn:
+        raw = conn.execute(text("SELECT syndrome FROM visit_events ORDER BY id")).scalars().all()
+        assert raw == [dimensions.key_for("Fever"), dimensions.key_for("Typhoid")]
+        stored = set(conn.execute(text("SELECT name FROM syndromes")).scalars())
+        assert stored >= {"Fever", "Typhoid", "ALL"}
+
+    db = sessionmaker(bind=engine)()
+    rows = db.query(models.VisitEvent.syndrome, models.VisitEvent.age_group).order_by(models.VisitEvent.id).all()
+    assert [tuple(r) for r in rows] == [("Fever", "0-5"), ("Typhoid", None)]
+    assert db.query(models.Signal).filter(models.Signal.syndrome == "ALL").one().value == 6
+    db.close()
+
+    assert migrations.encode_dimensions(engine) == 0  # Nothing left to re-encode
+    print("SUCCESS: Text dimensions re-encoded as integer keys; reads still return names.")
+
+
+def test_interning_follows_the_transaction():
+    print("--- Interning ---")
+    path = os.path.join(tempfile.mkdtemp(), "intern.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+
+    def stored(name):
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT count(*) FROM syndromes WHERE name = :n"), {"n": name}).scalar()
+
+    # 1. A rolled-back insert takes its new name with it; the retry interns it again
+    db = Session()
+    db.execute(insert(models.VisitEvent), [{"date": DAY, "hospital_id": 1, "syndrome": "Leptospirosis", "count": 1}])
+    db.rollback()
+    assert stored("Leptospirosis") == 0
+    db.add(models.VisitEvent(date=DAY, hospital_id=1, syndrome="Leptospirosis", count=2, age_group="60+"))
+    db.commit()
+    assert stored("Leptospirosis") == 1
+
+    # 2. Another process (empty cache) decodes from the table
+    dimensions.SYNDROMES._names.pop(dimensions.key_for("Leptospirosis"))
+    assert db.query(models.VisitEvent.syndrome).scalar() == "Leptospirosis"
+    assert db.query(func.count(models.VisitEvent.id)).filter(models.VisitEvent.syndrome == "Leptospirosis").scalar() == 1
+
+    # 3. A name only used in a filter is not remembered, so it can't claim a key
+    assert dimensions.key_for("S3985819") == dimensions.key_for("S4420602")
+    cached = len(dimensions.SYNDROMES._names)
+    assert db.query(models.VisitEvent).filter(models.VisitEvent.syndrome == "S4420602").count() == 0
+    assert len(dimensions.SYNDROMES._names) == cached
+
+    # 4. Once one of two colliding names is written, the other is rejected
+    db.add(models.VisitEvent(date=DAY, hospital_id=1, syndrome="S3985819", count=1, age_group="60+"))
+    db.commit()
+    try:
+        dimensions.SYNDROMES.encode("S4420602")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+    db.close()
+    print("SUCCESS: Names are interned with the rows that use them.")
+
+
+if __name__ == "__main__":
+    test_migration_reencodes_names()
+    test_interning_follows_the_transaction()
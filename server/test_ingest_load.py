@@ -0,0 +1,142 @@
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+
+import models, ingest_queue, ingest_log
+from conftest import scratch_db
+from main import app, get_db
+
+CLIENTS = 16
+REQUESTS_PER_CLIENT = 10
+VISITS_PER_REQUEST = 5
+
+
+def _make_db():
+    """Fresh on-disk SQLite DB with 1 zone / 4 hospitals."""
+    Session = scratch_db("load")
+
+    db = Session()
+    zone = models.Zone(name="Load Ward")
+    db.add(zone)
+    db.commit()
+    db.add_all([models.Hospital(name=f"Load Hospital {i}", type="PHC", zone_id=zone.id) for i in range(4)])
+    db.commit()
+    hospital_ids = [h.id for h in db.query(models.Hospital).all()]
+    db.close()
+    return Session, hospital_ids
+
+
+def _run_load(max_rows=ingest_queue.MAX_GROUP_ROWS, max_wait_ms=ingest_queue.MAX_GROUP_WAIT_MS):
+    Session, hospital_ids = _make_db()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    log = ingest_log.IngestLog(tempfile.mkdtemp())
+    log.queue = ingest_queue.GroupCommitQueue(writer=log._append_group, max_rows=max_rows, max_wait_ms=max_wait_ms)
+    applier = ingest_log.LogApplier(log, session_factory=Session)
+
+    app.dependency_overrides[get_db] = override_get_db
+    original = ingest_log.log, ingest_log.applier
+    ingest_log.log, ingest_log.applier = log, applier
+    client = TestClient(app)
+    day = date.today() - timedelta(days=1)
+    seqs = []
+
+    def worker(n):
+        hospital_id = hospital_ids[n % len(hospital_ids)]
+        for _ in range(REQUESTS_PER_CLIENT):
+            res = client.post("/ingest/batch", json={
+                "hospital_id": hospital_id,
+                "visits": [
+                    {"date": str(day), "syndrome": "Fever", "count": 1, "age_group": "16-50"}
+                    for _ in range(VISITS_PER_REQUEST)
+                ]
+            })
+            assert res.status_code == 202, res.text
+            seqs.append(res.json()["seq"])
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=CLIENTS) as pool:
+            list(pool.map(worker, range(CLIENTS)))
+        elapsed = time.perf_counter() - started
+        assert applier.wait_for(max(seqs))
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+        ingest_log.log, ingest_log.applier = original
+
+    db = Session()
+    stored = db.query(func.count(models.VisitEvent.id)).scalar()
+    db.close()
+    return elapsed, stored, log.queue.stats
+
+
+def test_group_commit_load():
+    print("--- Concurrent Ingest Load Test ---")
+    total_requests = CLIENTS * REQUESTS_PER_CLIENT
+    expected_rows = total_requests * VISITS_PER_REQUEST
+
+    # Baseline: every request gets its own fsync
+    solo_time, solo_rows, solo = _run_load(max_rows=1, max_wait_ms=0)
+
+    # Group commit with default triggers
+    group_time, group_rows, grouped = _run_load()
+
+    print(f"Per-request fsync: {total_requests / solo_time:.0f} req/s, {solo['groups']} fsyncs")
+    print(f"Group commit:      {total_requests / group_time:.0f} req/s, {grouped['groups']} fsyncs")
+
+    assert solo_rows == expected_rows
+    assert group_rows == expected_rows
+    assert grouped["requests"] == total_requests
+
+    if grouped["groups"] < solo["groups"]:
+        print("SUCCESS: Concurrent batches shared fsyncs.")
+    else:
+        print("FAILURE: Group commit did not reduce the number of fsyncs.")
+    assert grouped["groups"] < total_requests
+
+
+def test_timed_out_submit_is_withdrawn():
+    print("--- Group Commit Submit Timeout ---")
+    release, written = threading.Event(), []
+
+    def stalled_writer(group):
+        release.wait(5)  # A slow disk: the first group holds the writer
+        written.extend(group)
+        return list(range(len(group)))
+
+    queue = ingest_queue.GroupCommitQueue(writer=stalled_writer, max_rows=1, max_wait_ms=0)
+    original = ingest_queue.SUBMIT_TIMEOUT_S
+    ingest_queue.SUBMIT_TIMEOUT_S = 0.2
+    try:
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            in_flight = pool.submit(queue.submit, [{"n": 1}])
+            time.sleep(0.05)  # Taken into the stalled group
+            try:
+                queue.submit([{"n": 2}])
+                assert False, "expected SubmitTimeout"
+            except ingest_queue.SubmitTimeout:
+                pass
+            release.set()
+            assert in_flight.result(timeout=5) == 0  # Past the timeout, but its write finished
+        time.sleep(0.1)
+    finally:
+        ingest_queue.SUBMIT_TIMEOUT_S = original
+    print(f"Written: {written}")
+    assert written == [[{"n": 1}]] and queue._pending_rows == 0
+    print("SUCCESS: A submit that timed out while queued was never written.")
+
+
+if __name__ == "__main__":
+    test_group_commit_load()
+    test_timed_out_submit_is_withdrawn()
@@ -0,0 +1,185 @@
+import os
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import func
+
+import ingest_log, models
+from conftest import scratch_db
+from ingest_log import IngestLog, LogApplier
+
+
+def _make_db():
+    Session = scratch_db("log")
+
+    db = Session()
+    zone = models.Zone(name="Log Ward")
+    db.add(zone)
+    db.commit()
+    hospital = models.Hospital(name="Log Hospital", type="PHC", zone_id=zone.id)
+    db.add(hospital)
+    db.commit()
+    hospital_id = hospital.id
+    db.close()
+    return Session, hospital_id
+
+
+def _visits(hospital_id, n):
+    day = str(date.today() - timedelta(days=1))
+    return [{"date": day, "syndrome": "Fever", "count": 1, "age_group": "16-50", "hospital_id": hospital_id}] * n
+
+
+def _stored(Session):
+    db = Session()
+    try:
+        return db.query(func.count(models.VisitEvent.id)).scalar()
+    finally:
+        db.close()
+
+
+def test_crash_recovery():
+    print("--- Ingestion Log Crash Recovery ---")
+    Session, hospital_id = _make_db()
+    log_dir = tempfile.mkdtemp()
+
+    # 1. Small segments so the log rotates; apply only part of it
+    log = IngestLog(log_dir, segment_bytes=512)
+    seqs = [log.append(_visits(hospital_id, 2)) for _ in range(10)]
+    assert seqs == list(range(1, 11))
+
+    applier = LogApplier(log, session_factory=Session, batch_size=4)
+    applier.apply_pending()
+    assert _stored(Session) == 8
+
+    # 2. "Crash": torn half-record at the tail, fresh process objects
+    segments = sorted(n for n in os.listdir(log_dir) if n.endswith(".ndjson"))
+    with open(os.path.join(log_dir, segments[-1]), "ab") as f:
+        f.write(b'{"seq": 11, "visits": [')
+
+    log = IngestLog(log_dir, segment_bytes=512)
+    applier = LogApplier(log, session_factory=Session, batch_size=4)
+    while applier.apply_pending():
+        pass
+    print(f"Rows after recovery: {_stored(Session)} (expected 20)")
+    assert _stored(Session) == 20
+
+    # 3. Replaying again is a no-op; new appends continue the sequence
+    assert applier.apply_pending() == 0
+    assert log.append(_visits(hospital_id, 1)) == 11
+    applier.apply_pending()
+    assert _stored(Session) == 21
+
+    # 4. Applied segments are truncated
+    remaining = [n for n in os.listdir(log_dir) if n.endswith(".ndjson")]
+    assert len(remaining) < len(segments)
+    print("SUCCESS: Log replay is idempotent and resumes from its checkpoint.")
+
+
+
+def test_failed_fsync_is_not_duplicated():
+    print("--- Ingestion Log Failed fsync ---")
+    log_dir = tempfile.mkdtemp()
+    log = IngestLog(log_dir)
+    real_fsync, failures = os.fsync, [1]
+
+    def flaky_fsync(fd):
+        if failures:  # The data reached the file; only the fsync fails
+            failures.pop()
+            raise OSError("EIO")
+        real_fsync(fd)
+
+    ingest_log.os.fsync = flaky_fsync
+    try:
+        assert log.append(_visits(1, 2)) == 1  # Retried by the group-commit queue
+    finally:
+        ingest_log.os.fsync = real_fsync
+    records = list(IngestLog(log_dir).read_from(0, 10))
+    assert [r["seq"] for r in records] == [1]
+    print("SUCCESS: A retried append leaves exactly one record.")
+
+
+def test_poison_record_quarantined():
+    print("--- Ingestion Log Quarantine ---")
+    Session, hospital_id = _make_db()
+    log = IngestLog(tempfile.mkdtemp())
+    log.append(_visits(hospital_id, 2))
+    log.append([{**_visits(hospital_id, 1)[0], "date": "not-a-date"}])
+    log.append(_visits(hospital_id, 3))
+
+    # 1. The bad record is retried alone, then set aside; the records after it still apply
+    applier = LogApplier(log, session_factory=Session, batch_size=10)
+    for _ in range(ingest_log.QUARANTINE_AFTER - 1):
+        try:
+            applier.apply_pending()
+            assert False, "expected the record to fail"
+        except ValueError:
+            pass
+    assert _stored(Session) == 2 and applier.applied_seq == 1
+    assert applier.apply_pending() == 2
+    assert _stored(Session) == 5 and applier.applied_seq == 3
+    assert applier.stats["quarantined"] == 1 and applier.stats["failed_attempts"] == ingest_log.QUARANTINE_AFTER
+
+    db = Session()
+    try:
+        [row] = db.query(models.IngestQuarantine).all()
+        assert row.seq == 2 and "not-a-date" in row.record
+        assert db.get(models.IngestCheckpoint, ingest_log.DETECTION_CHECKPOINT_NAME).last_seq == 3
+
+        # 2. Detection cut off by a crash after the commit catches up on the next pass
+        db.get(models.IngestCheckpoint, ingest_log.DETECTION_CHECKPOINT_NAME).last_seq = 1
+        db.commit()
+    finally:
+        db.close()
+    detected = []
+    applier._detect = lambda db, records: detected.extend(r["seq"] for r in records)
+    assert applier.apply_pending() == 0 and detected == [2, 3]
+    db = Session()
+    try:
+        assert db.get(models.IngestCheckpoint, ingest_log.DETECTION_CHECKPOINT_NAME).last_seq == 3
+    finally:
+        db.close()
+    print("SUCCESS: A record that keeps failing is quarantined without blocking later uploads.")
+
+
+def test_reads_resume_where_the_last_batch_stopped():
+    print("--- Ingestion Log Read Cursor ---")
+    log_dir = tempfile.mkdtemp()
+    log = IngestLog(log_dir, segment_bytes=4096)
+    for _ in range(60):
+        log.append(_visits(1, 1))
+    assert len(log._segments()) > 1
+
+    real_json, parsed = ingest_log.json, [0]
+
+    class CountingJson:
+        dumps = staticmethod(real_json.dumps)
+
+        @staticmethod
+        def loads(data):
+            parsed[0] += 1
+            return real_json.loads(data)
+
+    ingest_log.json = CountingJson
+    try:
+        # Batches of 7, as the applier reads them: every line is parsed once
+        seqs, after = [], 0
+        while True:
+            batch = [r["seq"] for r in log.read_from(after, 7, up_to=60)]
+            if not batch:
+                break
+            seqs += batch
+            after = batch[-1]
+        assert seqs == list(range(1, 61)) and parsed[0] == 60
+
+        # A reader with no cursor (a restart) still finds its place
+        assert [r["seq"] for r in IngestLog(log_dir).read_from(41, 3)] == [42, 43, 44]
+    finally:
+        ingest_log.json = real_json
+    print(f"SUCCESS: 60 records read in batches with {parsed[0]} parses.")
+
+
+if __name__ == "__main__":
+    test_crash_recovery()
+    test_failed_fsync_is_not_duplicated()
+    test_poison_record_quarantined()
+    test_reads_resume_where_the_last_batch_stopped()
@@ -0,0 +1,100 @@
+import re
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event, text
+
+import metrics, forecasting, database, models
+from main import app
+
+client = TestClient(app)
+
+
+def _value(text, pattern):
+    match = re.search(pattern + r" ([0-9.e+-]+)$", text, re.M)
+    return float(match.group(1)) if match else None
+
+
+def test_metrics_endpoint():
+    print("--- /metrics Instrumentation ---")
+    metrics.reset()
+    for zone_id in (1, 2):
+        assert client.get(f"/zones/{zone_id}/forecast").status_code == 200
+    assert client.get("/no/such/route").status_code == 404
+
+    res = client.get("/metrics")
+    assert res.status_code == 200
+    assert res.headers["content-type"].startswith("text/plain")
+    text = res.text
+
+    route = r'route="/zones/\{zone_id\}/forecast",method="GET"'
+    assert _value(text, r'caresignal_http_requests_total\{' + route + r',status="200"\}') == 2
+    assert _value(text, r'caresignal_http_request_duration_seconds_count\{' + route + r'\}') == 2
+    sql = _value(text, r'caresignal_sql_statements_total\{' + route + r'\}')
+    assert sql and sql >= 2, "SQL statements were not charged to the route"
+    assert re.search(r'caresignal_sql_slowest_seconds\{' + route + r',statement="SELECT', text)
+    assert 'route="unmatched"' in text
+    assert "/zones/1/forecast" not in text
+    print(f"Forecast route: {int(sql)} statements over 2 requests")
+
+
+
+def test_stage_timers_and_background_sql():
+    metrics.reset()
+    forecasting.Forecaster().fit([3, 4, 5, 6])
+    db = database.SessionLocal()
+    db.query(models.Zone).count()
+    db.close()
+
+    text = metrics.render()
+    assert _value(text, r'caresignal_stage_duration_seconds_count\{stage="forecast.fit"\}') == 1
+    assert _value(text, r'caresignal_sql_statements_total\{route="background",method="-"\}') >= 1
+
+
+def test_fingerprint():
+    fp = metrics.fingerprint("SELECT a FROM t\n WHERE id IN (?, ?, ?) AND name = 'x' AND n > 42")
+    assert fp == "SELECT a FROM t WHERE id IN (...) AND name = ? AND n > ?"
+
+
+def test_failed_statements_leave_no_timer():
+    engine = create_engine("sqlite://")
+    metrics.instrument_engine(engine)
+    failures = [1, 1, 1]
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def interrupt(conn, cursor, statement, parameters, context, executemany):
+        if failures:  # Like admission's deadline check, after metrics has started the clock
+            failures.pop()
+            raise RuntimeError("deadline")
+
+    current = metrics._RequestMetrics()
+    token = metrics._current.set(current)
+    try:
+        with engine.connect() as conn:
+            for _ in range(3):
+                try:
+                    conn.execute(text("SELECT 1"))
+                    assert False, "expected the listener to stop the statement"
+                except RuntimeError:
+                    pass
+            try:
+                conn.execute(text("SELECT * FROM no_such_table"))
+            except Exception:
+                pass
+            time.sleep(0.2)
+            conn.execute(text("SELECT 2"))
+            assert not conn.info.get("metrics_started")  # No start times piling up on a pooled connection
+    finally:
+        metrics._current.reset(token)
+
+    # Only the statement that ran is charged, with its own (short) duration
+    assert current.statements == 1 and current.slow[0][1] == "SELECT 2"
+    assert current.db_seconds < 0.1, current.db_seconds
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    test_metrics_endpoint()
+    test_stage_timers_and_background_sql()
+    test_fingerprint()
+    test_failed_statements_leave_no_timer()
@@ -0,0 +1,227 @@
+import email
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy.exc import IntegrityError
+
+import models, notifications, signal_engine
+from conftest import scratch_db
+from main import app
+
+TODAY = date.today()
+
+
+class FlakyTransport:
+    def __init__(self, failures):
+        self.failures, self.sent = failures, []
+
+    def send(self, recipient, subject, body):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("relay down")
+        self.sent.append((recipient, subject, body))
+
+
+def _make_db():
+    Session = scratch_db("notify")
+
+    db = Session()
+    zone = models.Zone(name="Notify Ward")
+    db.add(zone)
+    db.commit()
+    db.add_all([
+        models.Responsibility(zone_id=zone.id, role="DHO", name="Dr. Rao", contact="dho@district.example"),
+        models.Responsibility(zone_id=zone.id, role="MO", name="Dr. Iyer", contact="+91 98450 12345"),
+        models.Responsibility(zone_id=zone.id, role="MO", name="Dr. Iyer", contact="+91 98450 12345"),  # Listed twice
+        models.Responsibility(zone_id=zone.id, role="Clerk", name="Front desk", contact="ask at desk"),
+    ])
+    db.commit()
+    zone_id = zone.id
+    db.close()
+    return Session, zone_id
+
+
+def _signal(db, zone_id, syndrome, value=40):
+    signal_engine.save_signal(db, zone_id, TODAY, syndrome, value, 10, "Disease Surge", "High", "High",
+                              f"{syndrome} count {value} > 2x baseline (10)")
+
+
+def test_outbox_fan_out_and_delivery():
+    print("--- Notification Outbox ---")
+    Session, zone_id = _make_db()
+    outdir = tempfile.mkdtemp()
+    notifications.register("email", notifications.FileTransport(outdir))
+    sms = FlakyTransport(failures=0)
+    notifications.register("sms", sms)
+    db = Session()
+    try:
+        # 1. New signals enqueue in their own transaction; updates don't
+        _signal(db, zone_id, "Fever")
+        _signal(db, zone_id, "Cholera")
+        _signal(db, zone_id, "Fever", value=45)
+        assert db.query(models.NotificationOutbox).count() == 2
+        assert db.query(models.NotificationDelivery).count() == 0  # Nothing is sent inline
+
+        # 2. One pass fans out (deduped per recipient, unroutable contacts dropped) and sends per recipient
+        result = notifications.dispatch(db)
+        assert result == {"fanned_out": 2, "sent": 4, "retried": 0, "failed": 0}
+        rows = db.query(models.NotificationDelivery).all()
+        assert sorted({(r.role, r.channel) for r in rows}) == [("DHO", "email"), ("MO", "sms")]
+        assert all(r.status == "sent" and r.claimed_by is None for r in rows)
+
+        files = os.listdir(outdir)
+        assert len(files) == 1  # Both signals batched into one message
+        with open(os.path.join(outdir, files[0]), "rb") as f:
+            msg = email.message_from_bytes(f.read())
+        assert msg["To"] == "dho@district.example" and msg["Subject"] == "[CareSignal] 2 new signals"
+        assert "Cholera" in msg.get_payload() and "45 vs baseline 10" in msg.get_payload()
+        assert len(sms.sent) == 1 and sms.sent[0][0] == "+91 98450 12345"
+
+        # 3. Re-running fans out nothing and sends nothing
+        assert notifications.dispatch(db) == {"fanned_out": 0, "sent": 0, "retried": 0, "failed": 0}
+    finally:
+        notifications.register("email", None)
+        notifications.register("sms", None)
+        db.close()
+    print("SUCCESS: Signals are fanned out once per officer and batched per recipient.")
+
+
+def test_retries_with_backoff():
+    print("--- Notification Retries ---")
+    Session, zone_id = _make_db()
+    flaky = FlakyTransport(failures=2)
+    notifications.register("email", flaky)
+    db = Session()
+    try:
+        _signal(db, zone_id, "Dengue")
+        now = datetime.now()
+        assert notifications.dispatch(db, now)["retried"] == 1
+        row = db.query(models.NotificationDelivery).filter_by(channel="email").one()
+        assert row.attempts == 1 and row.next_attempt_at == now + notifications.backoff(1)
+        assert "relay down" in row.last_error
+
+        # Not due yet: nothing is attempted
+        assert notifications.deliver(db, now + timedelta(seconds=1))["retried"] == 0
+        assert notifications.deliver(db, now + notifications.backoff(1))["retried"] == 1
+        later = now + notifications.backoff(1) + notifications.backoff(2)
+        assert notifications.deliver(db, later)["sent"] == 1
+        db.refresh(row)
+        assert row.status == "sent" and row.attempts == 3 and len(flaky.sent) == 1
+
+        # A transport that never recovers gives up after MAX_ATTEMPTS
+        _signal(db, zone_id, "Malaria")
+        notifications.register("email", FlakyTransport(failures=100))
+        t = datetime.now()
+        notifications.fan_out(db, t)
+        for _ in range(notifications.MAX_ATTEMPTS):
+            notifications.deliver(db, t)
+            t += notifications.BACKOFF_MAX_S * timedelta(seconds=1)
+        failed = db.query(models.NotificationDelivery).filter_by(channel="email", status="failed").one()
+        assert failed.attempts == notifications.MAX_ATTEMPTS
+        assert notifications.backoff(50) == timedelta(seconds=notifications.BACKOFF_MAX_S)
+        # SMS has no transport here, so its rows wait as pending
+        assert db.query(models.NotificationDelivery).filter_by(channel="sms", status="pending").count() == 2
+    finally:
+        notifications.register("email", None)
+        db.close()
+
+    client = TestClient(app)
+    body = client.get("/admin/notifications/stats").json()
+    assert body["retried_total"] >= 2 and "queue" in body and "runs" in body["job"]
+    print("SUCCESS: Failed sends back off exponentially and give up after MAX_ATTEMPTS.")
+
+
+def test_slow_pass_keeps_its_claim():
+    print("--- Notification Claims ---")
+    Session, zone_id = _make_db()
+    renew = notifications.CLAIM_RENEW_S
+    notifications.CLAIM_RENEW_S = 0  # Renew before every recipient
+    db = Session()
+    try:
+        _signal(db, zone_id, "Typhoid")
+        now = datetime.now()
+        notifications.fan_out(db, now)
+
+        # 1. A long pass re-stamps its claim, so a second dispatcher finds nothing to take over
+        seen = []
+
+        class Watcher:
+            def send(self, recipient, subject, body):
+                other = Session()
+                d = models.NotificationDelivery
+                claims = [r.claimed_at for r in other.query(d).filter(d.claimed_by.isnot(None))]
+                seen.append(bool(claims) and all(c > now for c in claims))
+                other.close()
+
+        notifications.register("email", Watcher())
+        notifications.register("sms", Watcher())
+        assert notifications.deliver(db, now)["sent"] == 2 and seen[-1]
+
+        # 2. Rows taken over mid-pass are left to the dispatcher that took them
+        _signal(db, zone_id, "Measles")
+        notifications.fan_out(db, now)
+        sms = FlakyTransport(failures=0)
+
+        class Hijacker:
+            def send(self, recipient, subject, body):
+                other = Session()
+                d = models.NotificationDelivery
+                other.query(d).filter(d.status == "pending", d.claimed_by.isnot(None))\
+                    .update({"claimed_by": "other"}, synchronize_session=False)
+                other.commit()
+                other.close()
+
+        notifications.register("email", Hijacker())
+        notifications.register("sms", sms)
+        result = notifications.deliver(db, now)
+        assert result["sent"] == 1 and sms.sent == []
+        d = models.NotificationDelivery
+        assert db.query(d).filter(d.claimed_by == "other", d.status == "pending").count() == 1
+    finally:
+        notifications.CLAIM_RENEW_S = renew
+        notifications.register("email", None)
+        notifications.register("sms", None)
+        db.close()
+    print("SUCCESS: Slow passes renew their claim and stop when it has been taken over.")
+
+
+def test_signal_insert_race():
+    print("--- Signal Insert Race ---")
+    Session, zone_id = _make_db()
+    db = Session()
+    real_find = signal_engine._find_signal
+    try:
+        _signal(db, zone_id, "Fever")
+
+        # 1. Another ingest inserted the signal after our lookup: retried once as an update,
+        #    and the caller's pending work survives the failed insert
+        misses = [1]
+        signal_engine._find_signal = lambda *a: None if misses and misses.pop() else real_find(*a)
+        db.add(models.Zone(name="Pending Ward"))
+        _signal(db, zone_id, "Fever", value=50)
+        assert [s.value for s in db.query(models.Signal)] == [50]
+        assert db.query(models.NotificationOutbox).count() == 1
+        assert db.query(models.Zone).filter_by(name="Pending Ward").count() == 1
+
+        # 2. A failure the retry can't fix is raised, not retried again
+        calls = []
+        signal_engine._find_signal = lambda *a: calls.append(a) or None
+        try:
+            _signal(db, zone_id, "Fever", value=60)
+            assert False, "expected IntegrityError"
+        except IntegrityError:
+            pass
+        assert len(calls) == 2  # The lookup, then the check after the failed insert
+    finally:
+        signal_engine._find_signal = real_find
+        db.close()
+    print("SUCCESS: Only the unique-key race is retried, once, inside a savepoint.")
+
+
+if __name__ == "__main__":
+    test_outbox_fan_out_and_delivery()
+    test_retries_with_backoff()
+    test_slow_pass_keeps_its_claim()
+    test_signal_insert_race()
@@ -0,0 +1,97 @@
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+import models, pipeline
+from conftest import scratch_db
+from ingest_log import IngestLog, LogApplier
+from main import app, get_db
+
+TODAY = date.today()
+
+
+def _make_db():
+    Session = scratch_db("pipeline")
+
+    db = Session()
+    zones = [models.Zone(name="Pipeline East"), models.Zone(name="Pipeline West")]
+    db.add_all(zones)
+    db.commit()
+    db.add_all([models.Hospital(name=f"Pipeline PHC {i}", type="PHC", zone_id=zones[i % 2].id) for i in range(4)])
+    db.commit()
+    ids = [z.id for z in zones], [h.id for h in db.query(models.Hospital).order_by(models.Hospital.id)]
+    db.close()
+    return Session, ids
+
+
+def _visits(hospital_ids, offset, syndrome, count):
+    d = str(TODAY - timedelta(days=offset))
+    return [{"date": d, "hospital_id": h, "syndrome": syndrome, "count": count, "age_group": "16-50"}
+            for h in hospital_ids]
+
+
+def test_materialised_matches_live():
+    print("--- Precompute Pipeline ---")
+    Session, (zone_ids, hospital_ids) = _make_db()
+    log = IngestLog(tempfile.mkdtemp())
+    applier = LogApplier(log, session_factory=Session, autostart=False)
+    for offset in range(35, 0, -1):
+        log.append(_visits(hospital_ids, offset, "Fever", offset % 5 + (12 if offset < 4 else 1)))
+        if offset % 2:
+            log.append(_visits(hospital_ids[:2], offset, "Dengue", 2))
+    applier.apply_pending()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        forecast_url = f"/zones/{zone_ids[0]}/forecast"
+        live = client.get(forecast_url)
+        assert live.headers["X-Forecast-Source"] == "live"
+        live_summary = client.get("/analysis/summary").json()
+
+        # 1. First run of the day: every stage, every zone
+        db = Session()
+        result = pipeline.run(db)
+        assert list(result["stages"]) == ["rollups", "detection", "forecasts", "risk", "accuracy"]
+        assert result["stages"]["forecasts"]["pairs"] == 4
+        stored = client.get(forecast_url)
+        assert stored.headers["X-Forecast-Source"] == "materialised"
+        assert stored.json() == live.json()
+        assert client.get("/analysis/summary").json() == live_summary
+        assert client.get(forecast_url, params={"days": 3}).headers["X-Forecast-Source"] == "live"
+
+        # 2. Nothing new: nothing to do
+        assert set(pipeline.run(db)["stages"].values()) == {"up to date"}
+
+        # 3. New visits in one zone: it is served live until the next run, which redoes only that zone
+        log.append(_visits(hospital_ids[:1], 0, "Fever", 30))
+        applier.apply_pending()
+        live = client.get(forecast_url)
+        assert live.headers["X-Forecast-Source"] == "live"
+        assert client.get(f"/zones/{zone_ids[1]}/forecast").headers["X-Forecast-Source"] == "materialised"
+        live_summary = client.get("/analysis/summary").json()
+
+        result = pipeline.run(db)
+        assert result["stages"]["detection"] == "up to date"
+        assert result["stages"]["forecasts"]["zones"] == 1
+        stored = client.get(forecast_url)
+        assert stored.headers["X-Forecast-Source"] == "materialised"
+        assert stored.json() == live.json()
+        assert client.get("/analysis/summary").json() == live_summary
+        assert db.query(models.Forecast).filter(models.Forecast.as_of == TODAY).count() == 4 * pipeline.FORECAST_DAYS
+        db.close()
+        print("SUCCESS: Materialised forecasts and risk match live results and rerun incrementally.")
+    finally:
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_materialised_matches_live()
@@ -0,0 +1,85 @@
+import marshal
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import profiling
+from main import app
+
+client = TestClient(app)
+TOKEN = "test-admin-token"
+ADMIN = {"X-Admin-Token": TOKEN}
+
+
+def _setup():
+    profiling.ADMIN_TOKEN = TOKEN
+    profiling.reset()
+    profiling.update_config(sample_rate=0, routes=[], mode="sampler", interval_ms=5)
+
+
+def test_admin_gate():
+    print("--- Profiling Admin Gate ---")
+    _setup()
+    assert client.get("/admin/profiling").status_code == 403
+    assert client.get("/admin/profiling", headers={"X-Admin-Token": "wrong"}).status_code == 403
+    assert client.get("/admin/profiling", headers=ADMIN).status_code == 200
+
+    # X-Profile without the admin token is ignored
+    client.get("/zones/1/forecast", headers={"X-Profile": "1"})
+    assert profiling.summary()["routes"] == {}
+    print("SUCCESS: Profiling requires the admin token.")
+
+
+def test_cprofile_header_and_pstats():
+    print("--- cProfile via X-Profile header ---")
+    _setup()
+    assert client.put("/admin/profiling", json={"mode": "cprofile"}, headers=ADMIN).status_code == 200
+    for _ in range(2):
+        assert client.get("/zones/1/forecast", headers={"X-Profile": "1", **ADMIN}).status_code == 200
+    client.get("/zones", headers=ADMIN)  # Not profiled
+
+    routes = client.get("/admin/profiling", headers=ADMIN).json()["routes"]
+    assert routes == {"/zones/{zone_id}/forecast": {"profiled_requests": 2, "samples": 0, "cprofile": True}}
+
+    res = client.get("/admin/profiling/pstats", params={"route": "/zones/{zone_id}/forecast"}, headers=ADMIN)
+    assert res.status_code == 200
+    stats = marshal.loads(res.content)
+    assert any(name == "get_zone_forecast" for (_, _, name) in stats)
+
+    # While another request holds the profiler, the next one is sampled instead
+    with profiling._cprofile_lock:
+        assert client.get("/zones", headers={"X-Profile": "1", **ADMIN}).status_code == 200
+    assert profiling.summary()["routes"]["/zones"]["cprofile"] is False
+    print(f"SUCCESS: pstats dump with {len(stats)} functions.")
+
+
+def test_route_rule_and_sampler():
+    print("--- Sampler via route rule ---")
+    _setup()
+    profiling.update_config(routes=["/analysis/summary"], interval_ms=1)
+    assert client.get("/analysis/summary").status_code == 200
+    assert profiling.summary()["routes"]["/analysis/summary"]["profiled_requests"] == 1
+
+    # Sampler on a busy thread produces collapsed stacks
+    def busy():
+        profiling.sampler.register(threading.get_ident(), "busy")
+        deadline = time.monotonic() + 0.1
+        while time.monotonic() < deadline:
+            sum(range(1000))
+        profiling.sampler.unregister(threading.get_ident())
+
+    t = threading.Thread(target=busy)
+    t.start()
+    t.join()
+    text = profiling.collapsed_stacks("busy")
+    assert "test_profiling.py:busy" in text
+    stack, count = text.splitlines()[0].rsplit(" ", 1)
+    assert int(count) >= 1
+    print(f"SUCCESS: {len(text.splitlines())} distinct sampled stacks.")
+
+
+if __name__ == "__main__":
+    test_admin_gate()
+    test_cprofile_header_and_pstats()
+    test_route_rule_and_sampler()
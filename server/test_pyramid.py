@@ -0,0 +1,132 @@
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+import models, pyramid, signal_engine
+from conftest import scratch_db
+from ingest_log import IngestLog, LogApplier
+from main import app, get_db
+
+TODAY = date.today()
+DAYS = 400
+
+
+def _make_db():
+    Session = scratch_db("pyramid")
+
+    db = Session()
+    zone = models.Zone(name="Pyramid Ward")
+    db.add(zone)
+    db.commit()
+    db.add_all([models.Hospital(name=f"Pyramid PHC {i}", type="PHC", zone_id=zone.id) for i in range(2)])
+    db.commit()
+    ids = zone.id, [h.id for h in db.query(models.Hospital).order_by(models.Hospital.id)]
+    db.close()
+    return Session, ids
+
+
+def _count(offset):
+    return 1 + offset % 5
+
+
+def _ingest(Session, hospital_ids):
+    log = IngestLog(tempfile.mkdtemp())
+    applier = LogApplier(log, session_factory=Session, batch_size=50, autostart=False)
+    for offset in range(DAYS):
+        d = str(TODAY - timedelta(days=offset))
+        log.append([{"date": d, "hospital_id": h, "syndrome": "Fever", "count": _count(offset), "age_group": "0-5"}
+                    for h in hospital_ids])
+    while applier.apply_pending():
+        pass
+
+
+def test_buckets_follow_ingest():
+    print("--- Aggregate Pyramid ---")
+    Session, (zone_id, hospital_ids) = _make_db()
+    _ingest(Session, hospital_ids)
+
+    db = Session()
+    try:
+        start = TODAY - timedelta(days=DAYS - 1)
+        daily = pyramid.series(db, [zone_id], start, TODAY, "day")["Fever"]
+        assert sum(daily.values()) == 2 * sum(_count(o) for o in range(DAYS))
+        for level in ("week", "month"):
+            buckets = pyramid.series(db, [zone_id], start, TODAY, level)["Fever"]
+            expected = {}
+            for d, n in daily.items():
+                p = pyramid.period_start(level, d)
+                expected[p] = expected.get(p, 0) + n
+            assert buckets == expected, level
+            print(f"{level}: {len(buckets)} buckets")
+
+        # A full rebuild matches the incrementally maintained buckets
+        before = sorted((a.level, a.period_start, a.syndrome, a.count) for a in db.query(models.VisitAggregate))
+        pyramid.rebuild(db)
+        after = sorted((a.level, a.period_start, a.syndrome, a.count) for a in db.query(models.VisitAggregate))
+        assert after == before
+
+        # Level selection: the finest level within the point budget
+        assert pyramid.choose_level(TODAY - timedelta(days=14), TODAY) == "day"
+        assert pyramid.choose_level(TODAY - timedelta(days=365), TODAY) == "week"
+        assert pyramid.choose_level(TODAY - timedelta(days=365), TODAY, max_points=20) == "month"
+        assert pyramid.choose_level(TODAY - timedelta(days=365), TODAY, "day") == "day"
+        assert [d.day for d in pyramid.periods("month", date(2024, 11, 15), date(2025, 2, 1))] == [1, 1, 1, 1]
+        for level in pyramid.LEVELS:
+            for start in (date(2024, 11, 15), date(2024, 12, 30), date(2025, 1, 31)):
+                end = date(2025, 3, 2)
+                assert pyramid.period_count(level, start, end) == len(list(pyramid.periods(level, start, end)))
+    finally:
+        db.close()
+    print("SUCCESS: Weekly and monthly buckets stay in step with daily ingests.")
+
+
+def test_granularity_parameter():
+    print("--- Granularity API ---")
+    Session, (zone_id, hospital_ids) = _make_db()
+    _ingest(Session, hospital_ids)
+    db = Session()
+    signal_engine.save_signal(db, zone_id, TODAY, "Fever", 10, 4, "Disease Surge", "High", "High", "Test")
+    signal_id = db.query(models.Signal.id).scalar()
+    db.close()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        res = client.get(f"/signals/{signal_id}/history")
+        assert res.headers["X-Granularity"] == "day" and len(res.json()) == 15
+
+        res = client.get(f"/signals/{signal_id}/history", params={"days": 365})
+        weekly = res.json()
+        assert res.headers["X-Granularity"] == "week" and len(weekly) <= 54
+        assert all(date.fromisoformat(p["date"]).weekday() == 0 for p in weekly)
+
+        res = client.get(f"/signals/{signal_id}/history", params={"days": 365, "granularity": "month"})
+        assert len(res.json()) in (12, 13)
+        assert sum(p["count"] for p in res.json()) >= sum(p["count"] for p in weekly[1:])
+        assert client.get(f"/signals/{signal_id}/history", params={"granularity": "hour"}).status_code == 400
+        assert client.get(f"/signals/{signal_id}/history", params={"days": 10 ** 9}).status_code == 422
+
+        res = client.get(f"/zones/{zone_id}/forecast", params={"history_days": 365, "max_points": 20})
+        assert res.status_code == 200, res.text
+        assert res.headers["X-Granularity"] == "month"
+        forecast = res.json()[0]
+        assert forecast["disease"] == "Fever" and len(forecast["history"]) in (12, 13)
+        assert len(forecast["forecast"]) == 7  # Still daily
+        for params in ({"days": 10 ** 9}, {"days": 0}, {"history_days": 10 ** 9}):
+            assert client.get(f"/zones/{zone_id}/forecast", params=params).status_code == 422
+        print("SUCCESS: History and forecast pick their level from the point budget.")
+    finally:
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_buckets_follow_ingest()
+    test_granularity_parameter()
@@ -0,0 +1,129 @@
+import os
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+
+import models, series_store, signal_engine, timeseries
+from conftest import scratch_db
+from ingest_log import IngestLog, LogApplier
+from main import app, get_db
+
+TODAY = date.today()
+
+
+def _make_db():
+    Session = scratch_db("series")
+    engine = Session.kw["bind"]
+
+    db = Session()
+    zones = [models.Zone(name="Series North"), models.Zone(name="Series South")]
+    db.add_all(zones)
+    db.commit()
+    db.add_all([models.Hospital(name=f"Series PHC {i}", type="PHC", zone_id=zones[i % 2].id) for i in range(4)])
+    db.commit()
+    ids = [z.id for z in zones], [h.id for h in db.query(models.Hospital).order_by(models.Hospital.id)]
+    db.close()
+    return engine, Session, ids
+
+
+def _visits(hospital_ids, offset, syndrome="Fever", count=3):
+    d = str(TODAY - timedelta(days=offset))
+    return [{"date": d, "hospital_id": h, "syndrome": syndrome, "count": count, "age_group": "16-50"}
+            for h in hospital_ids]
+
+
+def _sql_series(db, zone_id, syndrome, start, end):
+    totals = {d: n for z, s, d, n in timeseries.zone_daily_counts(db, start, end, [zone_id], [syndrome])}
+    return [totals.get(start + timedelta(days=i), 0) for i in range((end - start).days + 1)]
+
+
+def test_store_tracks_ingest():
+    print("--- Series Store ---")
+    engine, Session, (zone_ids, hospital_ids) = _make_db()
+    directory = tempfile.mkdtemp()
+    store = series_store.SeriesStore(directory, window_days=60)
+    series_store.register(engine, store)
+    try:
+        log = IngestLog(tempfile.mkdtemp())
+        applier = LogApplier(log, session_factory=Session, autostart=False)
+        for offset in range(30, 0, -1):
+            log.append(_visits(hospital_ids, offset))
+        applier.apply_pending()  # First batch: no store yet, built from SQL
+
+        db = Session()
+        first = store.snapshot()
+        assert first.seq == 30 and first.end == TODAY
+
+        # 1. Later batches patch the store copy-on-write; readers of the old version are unaffected
+        log.append(_visits(hospital_ids, 0, count=40))
+        log.append(_visits(hospital_ids[:1], 0, syndrome="Cholera", count=2))  # New syndrome: rebuild
+        applier.apply_pending()
+        snap = store.snapshot()
+        assert snap is not first and snap.seq == 32
+        assert list(first.series(zone_ids[0], "Fever", TODAY, TODAY)) == [0]
+        start = TODAY - timedelta(days=20)
+        for z in zone_ids:
+            for s in ("Fever", "Cholera"):
+                assert list(snap.series(z, s, start, TODAY)) == _sql_series(db, z, s, start, TODAY), (z, s)
+
+        # 2. Another worker maps the same files
+        other = series_store.SeriesStore(directory, window_days=60).snapshot()
+        assert other.total(zone_ids[0], None, TODAY, TODAY) == 2 * 40 + 2
+        assert other.series(zone_ids[0], "Fever", TODAY - timedelta(days=90), TODAY) is None  # Outside the window
+
+        # 3. Detection reads the store and agrees with SQL
+        assert signal_engine.get_zone_aggregate(db, zone_ids[0], TODAY, "Fever") == 80
+        assert signal_engine.calculate_baseline(db, zone_ids[0], TODAY, "Fever") == 6.0
+        assert db.query(models.Signal).filter(models.Signal.syndrome == "Fever").count() == 2
+
+        # 4. A store that missed a batch is rebuilt rather than patched
+        assert not store.ensure_current(db)
+        series_store.register(engine, None)
+        log.append(_visits(hospital_ids, 0, count=1))
+        applier.apply_pending()
+        series_store.register(engine, store)
+        assert store.ensure_current(db) and store.snapshot().seq == 33
+        assert store.snapshot().total(zone_ids[1], "Fever", TODAY, TODAY) == 82
+        assert len([n for n in os.listdir(directory) if n.endswith(".bin")]) == series_store.KEEP_VERSIONS
+        db.close()
+        print("SUCCESS: The shared store follows ingestion with atomic version swaps.")
+    finally:
+        series_store.register(engine, None)
+
+
+def test_forecast_reads_store():
+    print("--- Forecast From Store ---")
+    engine, Session, (zone_ids, hospital_ids) = _make_db()
+    log = IngestLog(tempfile.mkdtemp())
+    applier = LogApplier(log, session_factory=Session, autostart=False)
+    for offset in range(40, -1, -1):
+        log.append(_visits(hospital_ids, offset, count=offset % 7))
+    applier.apply_pending()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        from_sql = client.get(f"/zones/{zone_ids[0]}/forecast").json()
+        series_store.register(engine, series_store.SeriesStore(tempfile.mkdtemp(), window_days=60))
+        db = Session()
+        series_store.store_for(db).rebuild(db)
+        db.close()
+        from_store = client.get(f"/zones/{zone_ids[0]}/forecast").json()
+        assert from_store == from_sql
+        print("SUCCESS: Forecasts from the store match forecasts from SQL.")
+    finally:
+        app.dependency_overrides.clear()
+        series_store.register(engine, None)
+
+
+if __name__ == "__main__":
+    test_store_tracks_ingest()
+    test_forecast_reads_store()
@@ -0,0 +1,147 @@
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func
+
+import models, migrations, sharding, signal_engine
+from main import app, get_db
+
+TODAY = date.today()
+
+
+def _seed(url, zone_id, district_id=None, rising=False):
+    engine = create_engine(url, connect_args={"check_same_thread": False})
+    migrations.upgrade(engine)
+    with engine.begin() as conn:
+        if district_id is not None:
+            conn.execute(models.District.__table__.insert(), {"id": district_id, "name": f"District {district_id}"})
+        conn.execute(models.Zone.__table__.insert(),
+                     {"id": zone_id, "name": f"Shard Zone {zone_id}", "district_id": district_id})
+        conn.execute(models.Hospital.__table__.insert(),
+                     {"id": zone_id, "name": f"Shard Hospital {zone_id}", "type": "PHC", "zone_id": zone_id})
+        if rising:
+            conn.execute(models.VisitEvent.__table__.insert(), [
+                {"date": TODAY - timedelta(days=9 - i), "hospital_id": zone_id, "syndrome": "Cholera",
+                 "count": 3 * (i + 1), "age_group": "16-50"} for i in range(10)])
+    engine.dispose()
+
+
+def _make_router():
+    root = tempfile.mkdtemp()
+    urls = {name: f"sqlite:///{os.path.join(root, name + '.db')}" for name in ("default", "d1", "d2")}
+    _seed(urls["default"], 1)
+    _seed(urls["d1"], 101, district_id=1, rising=True)
+    _seed(urls["d2"], 201, district_id=2, rising=True)
+
+    engine = create_engine(urls["default"], connect_args={"check_same_thread": False})
+    default = sharding.Shard(sharding.DEFAULT_SHARD, engine)
+    router = sharding.ShardRouter({1: urls["d1"], 2: urls["d2"]}, default=default,
+                                  log_dir=os.path.join(root, "logs"))
+    for shard, zone_id, day in ((router.default, 1, 0), (router.for_district(1), 101, 1), (router.for_district(2), 201, 2)):
+        db = shard.session_factory()
+        signal_engine.save_signal(db, zone_id, TODAY - timedelta(days=day), "Cholera", 30, 10,
+                                  "Disease Surge", "High", "High", f"Zone {zone_id}")
+        db.close()
+    return router
+
+
+def test_sharded_routing_and_fan_out():
+    print("--- District Sharding ---")
+    router = _make_router()
+    d1, d2 = router.for_district(1), router.for_district(2)
+    assert router.for_zone(101) is d1 and router.for_hospital(201) is d2
+    assert router.for_zone(1) is router.default and router.for_zone(999) is router.default
+
+    def override_get_db():
+        db = router.default.session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    original = sharding.router
+    sharding.router = router
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        # 1. Fan-out: every district's signals, merged newest first, tagged with the district
+        signals = client.get("/signals").json()
+        assert [s["zone_id"] for s in signals] == [1, 101, 201]
+        assert [s["zone"]["district_id"] for s in signals] == [None, 1, 2]
+        assert len(client.get("/zones").json()) == 3
+
+        summary = client.get("/analysis/summary").json()
+        print(f"Summary: {summary}")
+        assert summary["high_risk_diseases"].get("Cholera") == 2
+        assert summary["total_high_risk_zones"] == 2
+
+        # 2. Signal routes resolve the shard from ?district_id=
+        signal_id = signals[2]["id"]
+        history = client.get(f"/signals/{signal_id}/history", params={"district_id": 2}).json()
+        assert history[-1]["count"] == 24  # District 2's Cholera two days ago
+        assert client.get(f"/signals/{signal_id}/history", params={"district_id": 0}).json()[-1]["count"] == 0
+        assert client.get(f"/signals/{signal_id}/history").status_code == 400  # Would hit the default shard's signal
+        bulk = {"actions": [{"signal_id": signal_id, "status": "Investigating"}]}
+        assert client.post("/signals/actions/bulk", json=bulk).status_code == 400
+        assert client.post("/signals/actions/bulk", params={"district_id": 2}, json=bulk).json()[0]["ok"]
+        check = d2.session_factory()
+        assert check.get(models.Signal, signal_id).status == "Investigating"
+        check.close()
+
+        # 3. Zone routes resolve it from the zone
+        assert client.get("/zones/201/forecast", params={"syndrome": "Cholera"}).status_code == 200
+
+        # 4. Each shard has its own zone graph
+        db = d1.session_factory()
+        db.add(models.Zone(id=102, name="Shard Zone 102", district_id=1))
+        db.commit()
+        db.close()
+        assert client.put("/zones/101/neighbors", json={"neighbor_ids": [102]}).json() == [102]
+        assert client.get("/zones/101/neighbors").json() == [102]
+        assert client.get("/zones/1/neighbors").json() == []
+
+        # 5. Time cube, diffusion and exports cover every shard (or the one asked for)
+        timecube = client.get("/analysis/timecube", params={"encoding": "json", "horizon": 0}).json()
+        assert timecube["zones"] == [1, 101, 102, 201] and timecube["syndromes"] == ["Cholera"]
+        assert sum(timecube["counts"]) == 2 * sum(3 * (i + 1) for i in range(10))
+        assert client.get("/analysis/timecube", params={"district_id": 2}).json()["zones"] == [201]
+        spread = client.post("/analysis/diffusion", json={"syndrome": "Cholera", "days": 3, "encoding": "json"}).json()
+        assert spread["zones"] == [1, 101, 102, 201] and len(spread["scenarios"][0]["frames"]) == 3 * 4
+        visits = client.get("/export/visits", params={"format": "ndjson"}).text.splitlines()
+        assert {json.loads(v)["zone_id"] for v in visits} == {101, 201}
+        assert {json.loads(v)["zone_id"] for v in client.get(
+            "/export/visits", params={"format": "ndjson", "district_id": 1}).text.splitlines()} == {101}
+
+        # 6. Ingest goes to the hospital's shard (its own log and applier)
+        res = client.post("/ingest/batch", json={"hospital_id": 201, "visits": [
+            {"date": str(TODAY), "syndrome": "Fever", "count": 4, "age_group": "0-5"}]})
+        assert res.status_code == 202
+        assert d2.ingest()[1].wait_for(res.json()["seq"], timeout=10)
+        for shard, expected in ((d2, 4), (d1, 0), (router.default, 0)):
+            db = shard.session_factory()
+            fever = db.query(func.coalesce(func.sum(models.VisitEvent.count), 0))\
+                .filter(models.VisitEvent.syndrome == "Fever").scalar()
+            db.close()
+            assert fever == expected, (shard.key, fever)
+        print("SUCCESS: Requests are routed per district and cross-district views merge all shards.")
+    finally:
+        app.dependency_overrides.clear()
+        sharding.router = original
+
+
+def test_parse_shard_map():
+    assert sharding.parse_shard_map("") == {}
+    assert sharding.parse_shard_map("1=sqlite:///a.db, 2=sqlite:///b.db") == {1: "sqlite:///a.db", 2: "sqlite:///b.db"}
+    try:
+        sharding.parse_shard_map("north=sqlite:///a.db")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+
+if __name__ == "__main__":
+    test_sharded_routing_and_fan_out()
+    test_parse_shard_map()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+import models, sla_escalation
+
+
+def test_sla_sweep():
+    print("--- SLA Escalation Sweep ---")
+    path = os.path.join(tempfile.mkdtemp(), "sla.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    zone = models.Zone(name="SLA Ward")
+    db.add(zone)
+    db.commit()
+
+    now = datetime(2026, 5, 1, 12, 0)
+    cases = [
+        # (status, assigned_to, hours until deadline)
+        ("Pending", "Surveillance Nurse", -5),       # -> Medical Officer
+        ("Investigating", "Medical Officer", -1),    # -> District Health Officer
+        ("Pending", "District Health Officer", -2),  # stays DHO, new deadline
+        ("Resolved", "Surveillance Nurse", -50),     # closed: untouched
+        ("Pending", "Surveillance Nurse", 10),       # not yet due
+    ]
+    for i, (status, role, hours) in enumerate(cases):
+        db.add(models.Signal(date=date(2026, 4, 30), zone_id=zone.id, syndrome=f"S{i}", signal_type="Disease Surge",
+                             status=status, assigned_to=role, sla_deadline=now + timedelta(hours=hours),
+                             is_spike=True, value=10, baseline=2))
+    db.commit()
+
+    result = sla_escalation.sweep(db, now=now, batch_size=2)
+    print(f"Sweep result: {result}")
+    assert result["escalated"] == 3
+    assert result["lag_s"] == 5 * 3600
+
+    roles = [s.assigned_to for s in db.query(models.Signal).order_by(models.Signal.id)]
+    assert roles == ["Medical Officer", "District Health Officer", "District Health Officer",
+                     "Surveillance Nurse", "Surveillance Nurse"]
+    assert db.query(models.Action).filter(models.Action.status == "Escalated").count() == 3
+
+    # Nothing left to do
+    assert sla_escalation.sweep(db, now=now)["escalated"] == 0
+
+    # The sweep query is served by the (status, sla_deadline) index
+    plan = db.execute(text(
+        "EXPLAIN QUERY PLAN SELECT id FROM signals "
+        "WHERE status IN ('Pending', 'Ack', 'Investigating') AND sla_deadline < :now"
+    ), {"now": now}).all()
+    print(f"Plan: {[row[-1] for row in plan]}")
+    assert any("ix_signals_status_sla_deadline" in row[-1] for row in plan)
+    db.close()
+    print("SUCCESS: Breached signals escalated once, in bulk.")
+
+
+if __name__ == "__main__":
+    test_sla_sweep()
@@ -0,0 +1,122 @@
+import gzip
+import json
+import tempfile
+import zlib
+from datetime import date, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import func
+
+import models, ingest_log, sync
+from conftest import scratch_db
+from main import app, get_db
+
+DAY = date.today() - timedelta(days=1)
+
+
+def _make_db():
+    Session = scratch_db("sync")
+
+    db = Session()
+    zone = models.Zone(name="Sync Ward")
+    db.add(zone)
+    db.commit()
+    db.add_all([models.Hospital(name=f"Sync Hospital {i}", type="PHC", zone_id=zone.id) for i in range(2)])
+    db.commit()
+    hospital_ids = [h.id for h in db.query(models.Hospital).order_by(models.Hospital.id)]
+    db.close()
+    return Session, hospital_ids
+
+
+def _report(key, offset=0, count=3, **extra):
+    return {"key": key, "date": str(DAY - timedelta(days=offset)), "syndrome": "Fever",
+            "count": count, "age_group": "16-50", **extra}
+
+
+def _post(client, body, encoding="gzip"):
+    raw = json.dumps(body).encode()
+    if encoding == "gzip":
+        raw = gzip.compress(raw)
+    elif encoding == "deflate":
+        raw = zlib.compress(raw)
+    headers = {"Content-Type": "application/json"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return client.post("/sync", content=raw, headers=headers)
+
+
+def _stored(Session):
+    db = Session()
+    try:
+        return (db.query(func.coalesce(func.sum(models.VisitEvent.count), 0)).scalar(),
+                db.query(func.count(models.SyncKey.id)).scalar())
+    finally:
+        db.close()
+
+
+def test_sync_dedup_and_acks():
+    print("--- Delta Sync ---")
+    Session, (h1, h2) = _make_db()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    log = ingest_log.IngestLog(tempfile.mkdtemp())
+    applier = ingest_log.LogApplier(log, session_factory=Session, autostart=False)
+    original = ingest_log.log, ingest_log.applier
+    ingest_log.log, ingest_log.applier = log, applier
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    detections = []
+    original_detect = applier._detect
+    applier._detect = lambda db, records: detections.append(len(records)) or original_detect(db, records)
+    try:
+        # 1. Gzipped sync: valid, repeated key, unknown hospital, bad row, other hospital, other day
+        body = {"hospital_id": h1, "reports": [
+            _report("k1"), _report("k1"), _report("k2", hospital_id=9999),
+            {"key": "k3", "date": "not-a-date"}, _report("k4", hospital_id=h2), _report("k5", offset=1),
+        ]}
+        res = _post(client, body)
+        assert res.status_code == 200, res.text
+        first = res.json()
+        print(f"Acks: {first['acks']}, cursor {first['cursor']}")
+        assert first["acks"] == "adrraa"
+        assert first["cursor"] == 1 and not first["applied"]
+
+        # 2. Retry before the applier ran: accepted again, deduplicated on apply
+        res = _post(client, {"hospital_id": h1, "cursor": 1, "reports": [_report("k1"), _report("k6")]}, "deflate")
+        assert res.json()["acks"] == "aa" and res.json()["cursor"] == 2
+
+        while applier.apply_pending():
+            pass
+        assert _stored(Session) == (12, 4)  # k1, k4, k5, k6 once each
+        assert detections == [2]  # One detection pass for both syncs
+        assert client.get("/sync", params={"cursor": 2}).json()["applied"]
+
+        # 3. Retry after apply: duplicates, nothing appended, cursor echoed
+        res = _post(client, {"hospital_id": h1, "cursor": 2, "reports": [_report("k1"), _report("k4", hospital_id=h2)]},
+                    encoding=None)
+        assert res.json() == {"acks": "dd", "cursor": 2, "applied": True}
+        assert log.durable_seq() == 2
+
+        # 4. Malformed and oversized bodies
+        bad = client.post("/sync", content=b"not gzip", headers={"Content-Encoding": "gzip"})
+        assert bad.status_code == 400
+        bomb = gzip.compress(b" " * (sync.MAX_BODY_BYTES + 10))
+        assert client.post("/sync", content=bomb, headers={"Content-Encoding": "gzip"}).status_code == 413
+        huge = {"Content-Length": str(sync.MAX_WIRE_BYTES + 1)}
+        assert client.post("/sync", content=b"{}", headers=huge).status_code == 413  # Before reading the body
+        chunks = (b" " * 65536 for _ in range(sync.MAX_WIRE_BYTES // 65536 + 2))  # Chunked: no Content-Length
+        assert client.post("/sync", content=chunks).status_code == 413
+        print("SUCCESS: Sync is idempotent, acked per report and detected once per sync.")
+    finally:
+        app.dependency_overrides.clear()
+        ingest_log.log, ingest_log.applier = original
+
+
+if __name__ == "__main__":
+    test_sync_dedup_and_acks()
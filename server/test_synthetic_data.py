@@ -0,0 +1,72 @@
+import io
+import json
+import os
+import tempfile
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+import models, synthetic_data
+
+END = date(2026, 3, 31)
+
+
+def _dataset(**kwargs):
+    params = dict(zones=9, hospitals_per_zone=2, years=0.5, end=END, seed=7, outbreaks=3, shape="bell", spread=1)
+    params.update(kwargs)
+    return synthetic_data.SyntheticDataset(**params)
+
+
+def test_deterministic():
+    print("--- Synthetic Data Determinism ---")
+    a, b = _dataset(), _dataset()
+    assert a.labels() == b.labels()
+    assert list(a.visits()) == list(b.visits())
+    assert list(_dataset(seed=8).visits()) != list(a.visits())
+    print("SUCCESS: Same seed, same data.")
+
+
+def test_outbreak_injected():
+    print("--- Synthetic Outbreak Injection ---")
+    dataset = _dataset(outbreaks=1)
+    outbreak = dataset.outbreaks[0]
+    zone_of = {h["id"]: h["zone_id"] for h in dataset.hospitals}
+    first = date.fromisoformat(outbreak["start"])
+    peak = first + timedelta(days=outbreak["duration_days"] // 2)
+
+    def centre_total(d):
+        return sum(r["count"] for r in dataset.visits()
+                   if r["date"] == d and r["syndrome"] == outbreak["syndrome"]
+                   and zone_of[r["hospital_id"]] == outbreak["centre_zone_id"])
+
+    baseline = sum(centre_total(peak - timedelta(days=k)) for k in range(21, 28)) / 7
+    print(f"Outbreak {outbreak['syndrome']} in zone {outbreak['centre_zone_id']}: "
+          f"{centre_total(peak)} at peak vs {baseline:.1f} baseline")
+    assert centre_total(peak) > 1.5 * baseline
+    assert set(outbreak["rings"][1]) == set(dataset.graph.neighbors(outbreak["centre_zone_id"]))
+
+
+def test_load_and_ndjson():
+    print("--- Synthetic Bulk Load / NDJSON ---")
+    dataset = _dataset(years=0.1)
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'syn.db')}")
+    written = synthetic_data.load_into_db(dataset, engine)
+
+    db = sessionmaker(bind=engine)()
+    assert db.query(func.count(models.VisitEvent.id)).scalar() == written
+    assert db.query(func.sum(models.VisitEvent.count)).scalar() == sum(r["count"] for r in dataset.visits())
+    assert db.query(func.count(models.ZoneAdjacency.id)).scalar() == 2 * len(dataset.edges)
+    db.close()
+
+    out = io.StringIO()
+    assert synthetic_data.write_ndjson(dataset, out) == written
+    tables = [json.loads(line)["table"] for line in out.getvalue().splitlines()]
+    assert tables.count("zones") == 9 and tables.count("visit_events") == written
+    print(f"SUCCESS: {written} rows loaded and streamed.")
+
+
+if __name__ == "__main__":
+    test_deterministic()
+    test_outbreak_injected()
+    test_load_and_ndjson()
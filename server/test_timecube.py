@@ -0,0 +1,59 @@
+import os
+import tempfile
+from array import array
+import base64
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models, forecasting, timecube
+
+
+def test_time_cube_matches_per_zone_forecast():
+    print("--- Time Cube ---")
+    path = os.path.join(tempfile.mkdtemp(), "cube.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+
+    zones = [models.Zone(name="Cube A"), models.Zone(name="Cube B")]
+    db.add_all(zones)
+    db.commit()
+    hospitals = [models.Hospital(name=f"H{z.id}", type="PHC", zone_id=z.id) for z in zones]
+    db.add_all(hospitals)
+    db.commit()
+
+    end = date(2026, 3, 31)
+    series = []
+    for t in range(40):
+        d = end - timedelta(days=39 - t)
+        db.add(models.VisitEvent(date=d, hospital_id=hospitals[0].id, syndrome="Fever", count=t, age_group="16-50"))
+        db.add(models.VisitEvent(date=d, hospital_id=hospitals[1].id, syndrome="Rash", count=2, age_group="0-5"))
+        series.append(t)
+    db.commit()
+
+    cube = timecube.build_time_cube(db, end - timedelta(days=6), end, horizon=3)
+    assert cube["syndromes"] == ["Fever", "Rash"]
+    assert len(cube["counts"]) == 2 * 7 * 2
+
+    # Zone A / Fever history is the last 7 days of the series
+    fever_a = [cube["counts"][(0 * 7 + t) * 2 + 0] for t in range(7)]
+    assert fever_a == series[-7:]
+
+    # Forecast uses the same 31-day window as get_zone_forecast
+    f = forecasting.Forecaster()
+    f.fit(series[-31:])
+    expected = [p["value"] for p in f.predict(days=3)]
+    got = [round(cube["forecast"][(0 * 3 + h) * 2 + 0], 1) for h in range(3)]
+    print(f"Cube forecast {got} vs Forecaster {expected}")
+    assert got == expected
+
+    encoded = timecube.encode_cube(cube)
+    assert array('i', base64.b64decode(encoded["counts"])).tolist() == cube["counts"].tolist()
+    db.close()
+    print("SUCCESS: Cube matches the per-zone forecast path.")
+
+
+if __name__ == "__main__":
+    test_time_cube_matches_per_zone_forecast()
@@ -0,0 +1,163 @@
+import math
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+import models, spatial_config, zone_geometry
+from conftest import scratch_db
+from main import app, get_db
+
+TODAY = date.today()
+SIDE = 20  # Wards per side of the test district
+STEP = 0.01  # Degrees between ward centres
+
+
+def _circle(lng, lat, r, n=64):
+    return [[lng + r * math.cos(2 * math.pi * k / n), lat + r * math.sin(2 * math.pi * k / n)] for k in range(n)]
+
+
+def _make_db():
+    """SIDE x SIDE round wards (64 vertices each) on a grid near Pune."""
+    Session = scratch_db("geometry")
+
+    db = Session()
+    zones = [models.Zone(name=f"Ward {i}") for i in range(SIDE * SIDE)]
+    db.add_all(zones)
+    db.commit()
+    for i, z in enumerate(zones):
+        lng, lat = 73.7 + STEP * (i % SIDE), 18.4 + STEP * (i // SIDE)
+        zone_geometry.set_geometry(db, z.id, {"type": "Polygon", "coordinates": [_circle(lng, lat, 0.004)]})
+    db.add(models.PipelineCheckpoint(stage="risk", as_of=TODAY, source_seq=0))
+    db.add_all([
+        models.ZoneRisk(as_of=TODAY, zone_id=zones[0].id, syndrome="Fever", risk_level="Medium", intensity=0.9),
+        models.ZoneRisk(as_of=TODAY, zone_id=zones[0].id, syndrome="Cholera", risk_level="High", intensity=0.6),
+    ])
+    db.commit()
+    ids = [z.id for z in zones]
+    db.close()
+    return Session, ids
+
+
+def test_geometry_helpers():
+    print("--- Zone Geometry Helpers ---")
+    square = [[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]]
+    hole = [[0, 0], [2, 0], [2, 2], [0, 2]]  # Unclosed: closed on parse
+    polygons = zone_geometry.parse({"type": "Polygon", "coordinates": [square, hole]})
+    bbox, (cx, cy) = zone_geometry.bbox_and_centroid(polygons)
+    assert bbox == (0, 0, 4, 4)
+    assert abs(cx - 7 / 3) < 1e-9 and abs(cy - 7 / 3) < 1e-9  # (16 * 2 - 4 * 1) / 12
+
+    ring = [tuple(p) for p in _circle(73.8, 18.5, 0.004)] + [tuple(_circle(73.8, 18.5, 0.004)[0])]
+    coarse = zone_geometry.simplify_ring(ring, zone_geometry.tolerance_for(14))
+    fine = zone_geometry.simplify_ring(ring, zone_geometry.tolerance_for(18))
+    assert coarse[0] == coarse[-1] and 4 <= len(coarse) < len(fine) <= len(ring)
+    assert zone_geometry.simplify_ring(ring, zone_geometry.tolerance_for(5)) is None  # Sub-pixel at zoom 5
+
+    for bad in ({"type": "Point", "coordinates": [0, 0]}, {"type": "Polygon", "coordinates": [[[0, 0], [1, 1]]]},
+                {"type": "Polygon", "coordinates": [[[0, 0], [200, 0], [0, 1], [0, 0]]]}):
+        try:
+            zone_geometry.parse(bad)
+            assert False, "expected ValueError"
+        except ValueError:
+            pass
+
+    # Tiles cover the bbox and agree with their own bounds
+    z, x, y = zone_geometry.tiles_for((73.85, 18.52, 73.85, 18.52), 12)[0]
+    tb = zone_geometry.tile_bbox(z, x, y)
+    assert tb[0] <= 73.85 <= tb[2] and tb[1] <= 18.52 <= tb[3]
+    print("SUCCESS: Centroids, simplification and tile maths check out.")
+
+
+def test_viewport_index():
+    print("--- Viewport Queries ---")
+    Session, ids = _make_db()
+    zone_geometry.clear_cache()
+    db = Session()
+    try:
+        index = zone_geometry.get_index(db)
+        assert len(index) == SIDE * SIDE
+
+        # 1. The grid returns exactly what a scan of every bounding box would
+        box = (73.745, 18.455, 73.8, 18.5)
+        expected = [ids[i] for i in range(len(ids)) if zone_geometry._intersects(index.bbox(i), box)]
+        result = zone_geometry.viewport(db, box, 15)
+        assert [z["id"] for z in result["zones"]] == expected and 0 < len(expected) < len(ids)
+        assert [index.zone_ids[i] for i in index.query(box)] == expected
+
+        # 2. Fewer vertices when zoomed out; the tiles are reused on the next request
+        detail = zone_geometry.viewport(db, box, 16)["zones"][0]["geometry"]["coordinates"][0][0]
+        overview = zone_geometry.viewport(db, box, 13)["zones"][0]["geometry"]["coordinates"][0][0]
+        assert len(overview) < len(detail) <= 65
+        cached = len(zone_geometry._tiles)
+        zone_geometry.viewport(db, box, 13)
+        assert len(zone_geometry._tiles) == cached
+
+        # 3. The latest risk is joined: highest level wins, with its syndrome
+        first = zone_geometry.viewport(db, (73.69, 18.39, 73.71, 18.41), 14)["zones"][0]
+        assert first["id"] == ids[0] and first["risk_level"] == "High" and first["syndrome"] == "Cholera"
+        assert first["intensity"] == 0.6 and abs(first["centroid"][0] - 73.7) < 1e-6
+
+        # 4. A wide viewport at a deep zoom falls back to coarser tiles
+        wide = zone_geometry.viewport(db, (73.6, 18.3, 74.0, 18.7), 18)
+        assert wide["tiles"] <= zone_geometry.MAX_TILES and len(wide["zones"]) == len(ids)
+
+        # 5. Moving a ward shows up immediately
+        zone_geometry.set_geometry(db, ids[0], {"type": "Polygon", "coordinates": [_circle(74.5, 19.0, 0.004)]})
+        assert ids[0] not in [z["id"] for z in zone_geometry.viewport(db, (73.69, 18.39, 73.71, 18.41), 14)["zones"]]
+
+        # 6. Another worker swaps two outlines (same sums); noticed at the next check. Renames show at once.
+        a, b = db.get(models.ZoneGeometry, ids[1]), db.get(models.ZoneGeometry, ids[2])
+        for column in ("geojson", "min_lng", "max_lng", "centroid_lng"):
+            va, vb = getattr(a, column), getattr(b, column)
+            setattr(a, column, vb)
+            setattr(b, column, va)
+        db.get(models.Zone, ids[1]).name = "Renamed Ward"
+        spatial_config.bump_version(db, zone_geometry.VERSION_NAME)
+        db.commit()
+        for entry in zone_geometry._indexes.values():
+            entry[2] = 0.0
+        second = zone_geometry.viewport(db, (73.705, 18.395, 73.715, 18.405), 14)["zones"]
+        assert [(z["id"], z["name"]) for z in second] == [(ids[2], "Ward 2")]
+        assert zone_geometry.viewport(db, (73.715, 18.395, 73.725, 18.405), 14)["zones"][0]["name"] == "Renamed Ward"
+    finally:
+        db.close()
+    print("SUCCESS: Viewports return only intersecting zones, simplified per zoom, with risk.")
+
+
+def test_geometry_endpoints():
+    print("--- Zone Geometry Endpoints ---")
+    Session, ids = _make_db()
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    client = TestClient(app)
+    try:
+        res = client.get("/zones/geometry", params={"bbox": "73.69,18.39,73.725,18.425", "zoom": 14})
+        assert res.status_code == 200
+        body = res.json()
+        assert [z["id"] for z in body["zones"]] == [ids[0], ids[1], ids[2], ids[SIDE], ids[SIDE + 1], ids[SIDE + 2],
+                                                    ids[2 * SIDE], ids[2 * SIDE + 1], ids[2 * SIDE + 2]]
+        assert body["zones"][0]["geometry"]["type"] == "MultiPolygon" and body["risk_as_of"] == TODAY.isoformat()
+        assert client.get("/zones/geometry", params={"bbox": "1,2,3"}).status_code == 400
+        assert client.get("/zones/geometry", params={"bbox": "0,0,1,1", "zoom": 40}).status_code == 400
+
+        square = {"type": "Polygon", "coordinates": [[[73.0, 18.0], [73.1, 18.0], [73.1, 18.1], [73.0, 18.1]]]}
+        put = client.put(f"/zones/{ids[5]}/geometry", json=square)
+        assert put.status_code == 200 and put.json()["bbox"] == [73.0, 18.0, 73.1, 18.1]
+        assert client.put(f"/zones/{ids[5]}/geometry", json={"type": "Line", "coordinates": []}).status_code == 400
+        assert client.put("/zones/999999/geometry", json=square).status_code == 404
+        print("SUCCESS: /zones/geometry serves the viewport in one response.")
+    finally:
+        app.dependency_overrides.clear()
+
+
+if __name__ == "__main__":
+    test_geometry_helpers()
+    test_viewport_index()
+    test_geometry_endpoints()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models, spatial_config
+from spatial_config import ZoneGraph
+
+
+def test_zone_graph_hops():
+    print("--- Zone Graph (CSR) ---")
+    # A path 10 - 20 - 30 - 40 plus an isolated edge 50 - 60
+    g = ZoneGraph([(10, 20), (20, 30), (30, 40), (60, 50), (20, 10)])
+
+    print(f"1-hop of 20: {g.neighbors(20)}")
+    print(f"2-hop of 20: {g.neighbors(20, hops=2)}")
+
+    assert g.neighbors(20) == [10, 30]
+    assert g.neighbors(20, hops=2) == [10, 30, 40]
+    assert g.neighbors(10, hops=2) == [20, 30]
+    assert g.neighbors(50, hops=2) == [60]
+    assert g.neighbors(99) == []
+    assert len(g.indices) == 8  # 4 undirected edges, stored both ways
+    print("SUCCESS: k-hop neighbourhoods match the graph.")
+
+
+
+def test_cached_graph_reloads_on_edits():
+    print("--- Zone Graph Reload ---")
+    path = os.path.join(tempfile.mkdtemp(), "graph.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        db.add_all([models.Zone(id=i, name=f"Ward {i}") for i in range(1, 5)])
+        db.commit()
+
+        # 1. set_neighbors rebuilds this process's graph straight away
+        spatial_config.set_neighbors(db, 1, [4])
+        assert spatial_config.get_neighbors(1, db=db) == [4]
+
+        # 2. Another worker swaps 1-4 for 2-3: same row count and the same id sums
+        db.query(models.ZoneAdjacency).delete()
+        db.add_all([models.ZoneAdjacency(zone_id=2, neighbor_id=3), models.ZoneAdjacency(zone_id=3, neighbor_id=2)])
+        spatial_config.bump_version(db, spatial_config.VERSION_NAME)
+        db.commit()
+        assert spatial_config.get_neighbors(1, db=db) == [4]  # Not re-checked before RELOAD_CHECK_S
+        spatial_config._graphs[str(engine.url)][2] = 0.0
+        assert spatial_config.get_neighbors(1, db=db) == [] and spatial_config.get_neighbors(2, db=db) == [3]
+    finally:
+        db.close()
+        spatial_config.invalidate()  # The graph cache is process-wide
+    print("SUCCESS: Edits from this and other workers rebuild the cached graph.")
+
+
+if __name__ == "__main__":
+    test_zone_graph_hops()
+    test_cached_graph_reloads_on_edits()
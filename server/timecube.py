@@ -0,0 +1,131 @@
+"""
+Dense zone x date x syndrome time cube for map playback.
+
+DiffusionPage used to call /zones/{id}/forecast for every zone and stitch
+the histories together client-side. The cube is built server-side from
+one grouped aggregate (timeseries.zone_daily_counts) plus one batch
+forecast (forecasting.forecast_batch) over every (zone, syndrome) series.
+
+Matrices are row-major over (zone, day, syndrome), with the axes listed
+once in the response:
+- counts:    int32,   history days start..end
+- forecast:  float32, predicted counts for end+1..end+horizon
+- intensity: uint8,   forecast intensity (0-255 = calculate_intensity 0.0-1.0)
+
+encoding="b64" ships each matrix as base64 of its little-endian bytes;
+encoding="json" ships flat lists for simple clients. Each shard builds its
+own cube; merge() lays them out on the union of the zone and syndrome axes.
+"""
+import base64
+import sys
+from array import array
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import models, forecasting, timeseries
+
+FIT_DAYS = 31  # Same lookback as get_zone_forecast (30 days + today)
+MAX_RANGE_DAYS = 731
+
+
+def build_time_cube(db: Session, start: date, end: date, horizon: int = 7,
+                    syndromes: Optional[List[str]] = None) -> Dict:
+    n_days = (end - start).days + 1
+    fit_start = min(start, end - timedelta(days=FIT_DAYS - 1))
+    offset = (start - fit_start).days  # Position of `start` within the fetched range
+    n_fetched = (end - fit_start).days + 1
+
+    zones = db.query(models.Zone.id, models.Zone.name).order_by(models.Zone.id).all()
+    zone_pos = {z: i for i, (z, _) in enumerate(zones)}
+
+    rows = timeseries.zone_daily_counts(db, fit_start, end, syndromes=syndromes)
+    syndrome_axis = sorted({s for _, s, _, _ in rows if s})
+    syn_pos = {s: i for i, s in enumerate(syndrome_axis)}
+
+    # Dense series per (zone, syndrome) over the fetched range
+    n_zones, n_syn = len(zones), len(syndrome_axis)
+    series = [[0] * n_fetched for _ in range(n_zones * n_syn)]
+    for zone_id, syndrome, d, total in rows:
+        if zone_id in zone_pos and syndrome in syn_pos:
+            series[zone_pos[zone_id] * n_syn + syn_pos[syndrome]][(d - fit_start).days] += total
+
+    # History counts for the requested range
+    counts = array('i', bytes(4 * n_zones * n_days * n_syn))
+    for z in range(n_zones):
+        for s in range(n_syn):
+            row = series[z * n_syn + s]
+            for t in range(n_days):
+                counts[(z * n_days + t) * n_syn + s] = row[offset + t]
+
+    # One batch forecast over the fit window of every series
+    forecast = array('f', bytes(4 * n_zones * horizon * n_syn))
+    intensity = array('B', bytes(n_zones * horizon * n_syn))
+    if series and horizon > 0:
+        fit_window = [row[-FIT_DAYS:] for row in series]
+        fitted = forecasting.forecast_batch(fit_window, days=horizon)
+        for k, (window, result) in enumerate(zip(fit_window, fitted)):
+            z, s = divmod(k, n_syn)
+            hist_max = max(window)
+            for p in result["predictions"]:
+                idx = (z * horizon + p["day"] - 1) * n_syn + s
+                forecast[idx] = p["value"]
+                intensity[idx] = int(round(forecasting.calculate_intensity(p["value"], hist_max) * 255))
+
+    return {
+        "zones": [z for z, _ in zones],
+        "zone_names": [name for _, name in zones],
+        "syndromes": syndrome_axis,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "history_days": n_days,
+        "forecast_days": horizon,
+        "layout": ["zone", "day", "syndrome"],
+        "counts": counts,
+        "forecast": forecast,
+        "intensity": intensity,
+    }
+
+
+def merge(cubes: List[Dict]) -> Dict:
+    """Combines build_time_cube() results for the same range from several shards (disjoint zones)."""
+    if len(cubes) == 1:
+        return cubes[0]
+    syndrome_axis = sorted({s for c in cubes for s in c["syndromes"]})
+    syn_pos = {s: i for i, s in enumerate(syndrome_axis)}
+    zones = sorted(((z, name, c, i) for c in cubes for i, (z, name) in enumerate(zip(c["zones"], c["zone_names"]))),
+                   key=lambda e: e[0])
+    n_syn, n_days, horizon = len(syndrome_axis), cubes[0]["history_days"], cubes[0]["forecast_days"]
+
+    out = {**cubes[0], "zones": [z for z, _, _, _ in zones], "zone_names": [name for _, name, _, _ in zones],
+           "syndromes": syndrome_axis}
+    for key, typecode, steps in (("counts", 'i', n_days), ("forecast", 'f', horizon), ("intensity", 'B', horizon)):
+        matrix = array(typecode, bytes(array(typecode).itemsize * len(zones) * steps * n_syn))
+        for z, (_, _, c, i) in enumerate(zones):
+            source, width = c[key], len(c["syndromes"])
+            columns = [syn_pos[s] for s in c["syndromes"]]
+            for t in range(steps):
+                row = (i * steps + t) * width
+                base = (z * steps + t) * n_syn
+                for k, pos in enumerate(columns):
+                    matrix[base + pos] = source[row + k]
+        out[key] = matrix
+    return out
+
+
+def encode_cube(cube: Dict, encoding: str = "b64") -> Dict:
+    """Replaces the matrices with base64 (little-endian) strings or flat lists."""
+    out = dict(cube)
+    for key in ("counts", "forecast", "intensity"):
+        matrix = cube[key]
+        if encoding == "json":
+            out[key] = [round(v, 1) for v in matrix] if matrix.typecode == 'f' else matrix.tolist()
+            continue
+        if sys.byteorder != "little" and matrix.itemsize > 1:
+            matrix = array(matrix.typecode, matrix)
+            matrix.byteswap()
+        out[key] = base64.b64encode(matrix.tobytes()).decode("ascii")
+    out["encoding"] = encoding
+    out["dtypes"] = {"counts": "int32", "forecast": "float32", "intensity": "uint8"}
+    return out
@@ -0,0 +1,53 @@
+"""
+Shared daily-series queries.
+
+Analytics paths (forecasts, cluster scan, the time cube) all need visit
+counts summed per (zone, syndrome, day). Keeping that grouped aggregate in
+one place means callers issue one GROUP BY over the range instead of a
+query per zone, syndrome or day.
+
+Visits older than the compaction horizon live in visit_daily_rollups
+instead of visit_events (compaction.py), so range queries read
+daily_visits(): both tables unioned, with the date filter pushed into
+each side so both use their date index.
+"""
+from datetime import date
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select, union_all
+from sqlalchemy.orm import Session
+
+import models
+
+
+def daily_visits(start: Optional[date] = None, end: Optional[date] = None, zone_ids: Optional[List[int]] = None,
+                 syndromes: Optional[List[str]] = None):
+    """
+    Subquery of (zone_id, hospital_id, syndrome, date, count) over raw and
+    compacted visits. Filters are applied inside each branch: SQLite
+    materialises the union, so filtering outside it would read every zone.
+    """
+    parts = []
+    for table in (models.VisitEvent, models.VisitDailyRollup):
+        q = select(models.Hospital.zone_id, table.hospital_id, table.syndrome, table.date, table.count)\
+            .join(models.Hospital, models.Hospital.id == table.hospital_id)
+        if start is not None:
+            q = q.where(table.date >= start)
+        if end is not None:
+            q = q.where(table.date <= end)
+        if zone_ids is not None:
+            q = q.where(models.Hospital.zone_id.in_(zone_ids))
+        if syndromes is not None:
+            q = q.where(table.syndrome.in_(syndromes))
+        parts.append(q)
+    return union_all(*parts).subquery("daily_visits")
+
+
+def zone_daily_counts(db: Session, start: date, end: date, zone_ids: Optional[List[int]] = None,
+                      syndromes: Optional[List[str]] = None) -> List[Tuple[int, str, date, int]]:
+    """Rows of (zone_id, syndrome, date, total) for start <= date <= end."""
+    v = daily_visits(start, end, zone_ids, syndromes)
+    rows = db.query(v.c.zone_id, v.c.syndrome, v.c.date, func.sum(v.c.count))\
+        .group_by(v.c.zone_id, v.c.syndrome, v.c.date)\
+        .all()
+    return [(z, s, d, total or 0) for z, s, d, total in rows]
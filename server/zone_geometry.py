@@ -0,0 +1,408 @@
+"""
+Zone polygons for map viewports.
+
+Each zone's outline is stored in zone_geometries as GeoJSON (Polygon or
+MultiPolygon, lng/lat), along with its bounding box and area-weighted
+centroid. A uniform grid index over the bounding boxes (GRID_DEG cells) is
+built once per database and reloaded the same way as spatial_config's
+graph: immediately after set_geometry() in this process, otherwise when
+the table's row in table_versions or its row count changes (checked at
+most every RELOAD_CHECK_S).
+
+viewport() answers a map's bbox + zoom through the XYZ tiles covering it.
+Each tile's features are computed once, Douglas-Peucker simplified to
+TOLERANCE_PX at that zoom with coordinates rounded to match, and cached.
+The visible zones are the union over the tiles, filtered to the viewport.
+Only the joins run per request: zone names (so renames show up at once)
+and the pipeline's latest zone_risks rows.
+"""
+import json
+import math
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+import models, spatial_config
+
+# Params
+RELOAD_CHECK_S = 30
+VERSION_NAME = "zone_geometries"
+GRID_DEG = 0.01  # Index cell size (about 1 km)
+MAX_CELLS_PER_ZONE = 256  # Zones covering more cells are checked on every query instead
+MAX_VERTICES = 20000  # Per geometry
+MAX_ZOOM = 22
+MAX_TILE_ZOOM = 16  # Deeper zooms reuse these tiles (1 px is ~2 m here)
+MAX_TILES = 64  # Viewports needing more tiles are served from a coarser zoom
+TOLERANCE_PX = 1.0
+TILE_CACHE_SIZE = 4096
+MAX_LAT = 85.0511  # Web Mercator's limit
+RISK_RANK = {"Low": 0, "Medium": 1, "High": 2}
+
+# Seed outlines for fresh installs: squares around the demo zones' map presets
+DEFAULT_CENTERS = {
+    1: (73.8446, 18.5314),
+    2: (73.8500, 18.5000),
+    3: (73.9100, 18.5600),
+    4: (73.8000, 18.4500),
+    5: (73.9300, 18.5204),
+}
+DEFAULT_HALF_SIZE_DEG = 0.012
+
+
+# --- Geometry ---
+
+Ring = List[Tuple[float, float]]
+
+
+def parse(geometry: Dict) -> List[List[Ring]]:
+    """Validates a GeoJSON Polygon/MultiPolygon; returns polygons of rings (outer first), closed."""
+    kind = geometry.get("type") if isinstance(geometry, dict) else None
+    if kind not in ("Polygon", "MultiPolygon"):
+        raise ValueError("Geometry must be a GeoJSON Polygon or MultiPolygon")
+    coords = geometry.get("coordinates")
+    polygons = [coords] if kind == "Polygon" else coords
+    if not isinstance(polygons, list) or not polygons:
+        raise ValueError("Geometry has no coordinates")
+
+    out, vertices = [], 0
+    for polygon in polygons:
+        if not isinstance(polygon, list) or not polygon:
+            raise ValueError("Each polygon needs an outer ring")
+        rings = []
+        for ring in polygon:
+            try:
+                points = [(float(p[0]), float(p[1])) for p in ring]
+            except (TypeError, ValueError, IndexError):
+                raise ValueError("Positions must be [lng, lat] numbers")
+            if points and points[0] != points[-1]:
+                points.append(points[0])
+            if len(points) < 4:
+                raise ValueError("Rings need at least three distinct positions")
+            if any(not (-180 <= lng <= 180 and -90 <= lat <= 90) for lng, lat in points):
+                raise ValueError("Positions must be [lng, lat] within -180..180, -90..90")
+            vertices += len(points)
+            rings.append(points)
+        out.append(rings)
+    if vertices > MAX_VERTICES:
+        raise ValueError(f"Geometry has {vertices} vertices; simplify it below {MAX_VERTICES}")
+    return out
+
+
+def _ring_moments(ring: Ring) -> Tuple[float, float, float]:
+    """Signed area and first moments (shoelace) of a closed ring."""
+    a = cx = cy = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:]):
+        cross = x0 * y1 - x1 * y0
+        a += cross
+        cx += (x0 + x1) * cross
+        cy += (y0 + y1) * cross
+    return a / 2, cx / 6, cy / 6
+
+
+def bbox_and_centroid(polygons: List[List[Ring]]) -> Tuple[Tuple[float, ...], Tuple[float, float]]:
+    """(min_lng, min_lat, max_lng, max_lat) and the area-weighted centroid (holes subtracted)."""
+    xs = [x for polygon in polygons for x, _ in polygon[0]]
+    ys = [y for polygon in polygons for _, y in polygon[0]]
+    area = mx = my = 0.0
+    for polygon in polygons:
+        for k, ring in enumerate(polygon):
+            a, cx, cy = _ring_moments(ring)
+            sign = (1 if k == 0 else -1) * (1 if a >= 0 else -1)  # Outer rings add, holes subtract
+            area += sign * a
+            mx += sign * cx
+            my += sign * cy
+    if abs(area) < 1e-15:  # Degenerate: fall back to the mean vertex
+        centroid = (sum(xs) / len(xs), sum(ys) / len(ys))
+    else:
+        centroid = (mx / area, my / area)
+    return (min(xs), min(ys), max(xs), max(ys)), centroid
+
+
+def _segment_distance(p, a, b) -> float:
+    (px, py), (ax, ay), (bx, by) = p, a, b
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(px - ax - t * dx, py - ay - t * dy)
+
+
+def _douglas_peucker(points: Ring, tolerance: float) -> Ring:
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        i, j = stack.pop()
+        worst, k = 0.0, None
+        for m in range(i + 1, j):
+            d = _segment_distance(points[m], points[i], points[j])
+            if d > worst:
+                worst, k = d, m
+        if k is not None and worst > tolerance:
+            keep[k] = True
+            stack += [(i, k), (k, j)]
+    return [p for p, kept in zip(points, keep) if kept]
+
+
+def simplify_ring(ring: Ring, tolerance: float) -> Optional[Ring]:
+    """Douglas-Peucker for a closed ring; None when it collapses below a triangle at this tolerance."""
+    if len(ring) <= 4:
+        return ring
+    # A closed ring's ends coincide, so split it at the vertex farthest from its start
+    far = max(range(len(ring)), key=lambda m: math.hypot(ring[m][0] - ring[0][0], ring[m][1] - ring[0][1]))
+    out = _douglas_peucker(ring[:far + 1], tolerance)[:-1] + _douglas_peucker(ring[far:], tolerance)
+    return out if len(out) >= 4 else None
+
+
+def _intersects(a: Sequence[float], b: Sequence[float]) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+# --- Tiles ---
+
+def _tile_x(lng: float, z: int) -> int:
+    n = 1 << z
+    return min(n - 1, max(0, int((lng + 180) / 360 * n)))
+
+
+def _tile_y(lat: float, z: int) -> int:
+    n = 1 << z
+    r = math.radians(max(-MAX_LAT, min(MAX_LAT, lat)))
+    return min(n - 1, max(0, int((1 - math.log(math.tan(r) + 1 / math.cos(r)) / math.pi) / 2 * n)))
+
+
+def tile_bbox(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    n = 1 << z
+    lat = lambda t: math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * t / n))))
+    return (x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y))
+
+
+def tiles_for(bbox: Sequence[float], z: int, limit: Optional[int] = None) -> Optional[List[Tuple[int, int, int]]]:
+    """XYZ tiles covering bbox at zoom z (None if there are more than limit)."""
+    x0, x1 = _tile_x(bbox[0], z), _tile_x(bbox[2], z)
+    y0, y1 = _tile_y(bbox[3], z), _tile_y(bbox[1], z)  # Tile rows count down from the north
+    if limit is not None and (x1 - x0 + 1) * (y1 - y0 + 1) > limit:
+        return None
+    return [(z, x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def tolerance_for(z: int) -> float:
+    """TOLERANCE_PX in degrees of longitude at zoom z (256 px tiles)."""
+    return TOLERANCE_PX * 360 / (256 * (1 << z))
+
+
+# --- Index ---
+
+class GeometryIndex:
+    def __init__(self, rows, version: int):
+        """rows: (zone_id, geojson, min_lng, min_lat, max_lng, max_lat, centroid_lng, centroid_lat)."""
+        self.version = version
+        self.zone_ids = array('i')
+        self.bboxes = array('d')  # 4 per zone
+        self.centroids = array('d')  # 2 per zone
+        self.polygons: List[List[List[Ring]]] = []
+        self.cells: Dict[Tuple[int, int], List[int]] = {}
+        self.large: List[int] = []
+
+        for i, (zone_id, geojson, x0, y0, x1, y1, cx, cy) in enumerate(sorted(rows)):
+            self.zone_ids.append(zone_id)
+            self.bboxes.extend((x0, y0, x1, y1))
+            self.centroids.extend((cx, cy))
+            self.polygons.append(parse(json.loads(geojson)))
+            cells = self._cell_range((x0, y0, x1, y1))
+            if len(cells[0]) * len(cells[1]) > MAX_CELLS_PER_ZONE:
+                self.large.append(i)
+                continue
+            for gx in cells[0]:
+                for gy in cells[1]:
+                    self.cells.setdefault((gx, gy), []).append(i)
+
+    def __len__(self):
+        return len(self.zone_ids)
+
+    @staticmethod
+    def _cell_range(bbox: Sequence[float]) -> Tuple[range, range]:
+        return (range(math.floor(bbox[0] / GRID_DEG), math.floor(bbox[2] / GRID_DEG) + 1),
+                range(math.floor(bbox[1] / GRID_DEG), math.floor(bbox[3] / GRID_DEG) + 1))
+
+    def bbox(self, i: int) -> Tuple[float, ...]:
+        return tuple(self.bboxes[4 * i:4 * i + 4])
+
+    def query(self, bbox: Sequence[float]) -> List[int]:
+        """Positions of zones whose bounding box intersects bbox, in zone ID order."""
+        xs, ys = self._cell_range(bbox)
+        if len(xs) * len(ys) > len(self):
+            candidates = range(len(self))  # Scanning is cheaper than visiting the cells
+        else:
+            candidates = set(self.large)
+            for gx in xs:
+                for gy in ys:
+                    candidates.update(self.cells.get((gx, gy), ()))
+        return sorted(i for i in candidates if _intersects(self.bbox(i), bbox))
+
+
+_lock = threading.Lock()
+_indexes: Dict[str, list] = {}  # database URL -> [index, checksum, checked_at]
+_versions = [0]
+
+
+def _table_checksum(db: Session) -> tuple:
+    return (spatial_config.table_version(db, VERSION_NAME),
+            db.query(func.count(models.ZoneGeometry.zone_id)).scalar())
+
+
+def get_index(db: Session) -> GeometryIndex:
+    """The cached index for db's database, reloaded if the table changed."""
+    url = str(db.get_bind().url)
+    entry = _indexes.get(url)
+    if entry is not None and time.monotonic() - entry[2] < RELOAD_CHECK_S:
+        return entry[0]
+
+    with _lock:
+        checksum = _table_checksum(db)
+        if entry is None or checksum != entry[1]:
+            g = models.ZoneGeometry
+            rows = db.query(g.zone_id, g.geojson, g.min_lng, g.min_lat, g.max_lng, g.max_lat,
+                            g.centroid_lng, g.centroid_lat).all()
+            _versions[0] += 1
+            entry = _indexes[url] = [GeometryIndex(rows, _versions[0]), checksum, 0.0]
+        entry[2] = time.monotonic()
+        return entry[0]
+
+
+def invalidate(url: Optional[str] = None):
+    """Forces a reload on the next get_index() (for one database URL, or all)."""
+    for key, entry in list(_indexes.items()):
+        if url is None or key == url:
+            entry[1] = None
+            entry[2] = 0.0
+
+
+def set_geometry(db: Session, zone_id: int, geometry: Dict) -> models.ZoneGeometry:
+    """Stores (or replaces) a zone's outline; this database's index is rebuilt on its next use."""
+    polygons = parse(geometry)
+    (x0, y0, x1, y1), (cx, cy) = bbox_and_centroid(polygons)
+    row = db.merge(models.ZoneGeometry(
+        zone_id=zone_id,
+        geojson=json.dumps({"type": "MultiPolygon", "coordinates": polygons}, separators=(",", ":")),
+        min_lng=x0, min_lat=y0, max_lng=x1, max_lat=y1, centroid_lng=cx, centroid_lat=cy,
+    ))
+    spatial_config.bump_version(db, VERSION_NAME)
+    db.commit()
+    invalidate(str(db.get_bind().url))
+    return row
+
+
+def seed_default_geometry(db: Session):
+    """Populates an empty geometry table from DEFAULT_CENTERS (existing zones only)."""
+    if db.query(models.ZoneGeometry.zone_id).first():
+        return
+    existing = {z for (z,) in db.query(models.Zone.id).all()}
+    h = DEFAULT_HALF_SIZE_DEG
+    for zone_id, (lng, lat) in DEFAULT_CENTERS.items():
+        if zone_id in existing:
+            set_geometry(db, zone_id, {"type": "Polygon", "coordinates": [
+                [[lng - h, lat - h], [lng + h, lat - h], [lng + h, lat + h], [lng - h, lat + h], [lng - h, lat - h]]]})
+
+
+# --- Viewport ---
+
+_tile_lock = threading.Lock()
+_tiles: "OrderedDict[tuple, List[Dict]]" = OrderedDict()  # (url, index version, z, x, y) -> features
+
+
+def _tile_features(index: GeometryIndex, key: tuple) -> List[Dict]:
+    with _tile_lock:
+        features = _tiles.get(key)
+        if features is not None:
+            _tiles.move_to_end(key)
+            return features
+
+    z, x, y = key[2:]
+    tolerance = tolerance_for(z)
+    digits = max(0, min(6, math.ceil(-math.log10(tolerance))))
+    features = []
+    for i in index.query(tile_bbox(z, x, y)):
+        polygons = []
+        for polygon in index.polygons[i]:
+            rings = [simplify_ring(ring, tolerance) for ring in polygon]
+            if rings[0] is not None:  # Outer ring still visible; drop holes that aren't
+                polygons.append([[[round(lng, digits), round(lat, digits)] for lng, lat in ring]
+                                 for ring in rings if ring is not None])
+        features.append({
+            "id": index.zone_ids[i],
+            "centroid": [round(index.centroids[2 * i], 6), round(index.centroids[2 * i + 1], 6)],
+            "bbox": [round(v, 6) for v in index.bbox(i)],
+            "geometry": {"type": "MultiPolygon", "coordinates": polygons} if polygons else None,
+        })
+
+    with _tile_lock:
+        _tiles[key] = features
+        while len(_tiles) > TILE_CACHE_SIZE:
+            _tiles.popitem(last=False)
+    return features
+
+
+def clear_cache():
+    with _tile_lock:
+        _tiles.clear()
+
+
+def _latest_risk(db: Session, zone_ids: List[int]):
+    """(as_of, {zone: (risk_level, intensity, dominant syndrome)}) from the pipeline's last risk stage."""
+    checkpoint = db.get(models.PipelineCheckpoint, "risk")
+    if checkpoint is None or not zone_ids:
+        return None, {}
+    r = models.ZoneRisk
+    best: Dict[int, tuple] = {}
+    for zone_id, syndrome, level, intensity in db.query(r.zone_id, r.syndrome, r.risk_level, r.intensity)\
+            .filter(r.as_of == checkpoint.as_of, r.zone_id.in_(zone_ids)):
+        rank = (RISK_RANK.get(level, 0), intensity or 0.0)
+        if zone_id not in best or rank > best[zone_id][0]:
+            best[zone_id] = (rank, level, intensity or 0.0, syndrome)
+    return checkpoint.as_of, {z: (level, intensity, syndrome) for z, (_, level, intensity, syndrome) in best.items()}
+
+
+def parse_bbox(value: str) -> Tuple[float, float, float, float]:
+    """Parses the ?bbox= query value (min_lng,min_lat,max_lng,max_lat)."""
+    try:
+        box = tuple(float(v) for v in value.split(","))
+    except ValueError:
+        box = ()
+    if len(box) != 4 or not (-180 <= box[0] <= box[2] <= 180 and -90 <= box[1] <= box[3] <= 90):
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat within -180..180, -90..90")
+    return box
+
+
+def viewport(db: Session, bbox: Sequence[float], zoom: int) -> Dict:
+    """Zones intersecting bbox, simplified for zoom, with the latest risk and intensity."""
+    if not 0 <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be 0-{MAX_ZOOM}")
+    z = min(zoom, MAX_TILE_ZOOM)
+    tiles = tiles_for(bbox, z, MAX_TILES)
+    while tiles is None:  # Zoom 0 is a single tile
+        z -= 1
+        tiles = tiles_for(bbox, z, MAX_TILES)
+
+    index = get_index(db)
+    url = str(db.get_bind().url)
+    zones: Dict[int, Dict] = {}
+    for tile in tiles:
+        for feature in _tile_features(index, (url, index.version) + tile):
+            if feature["id"] not in zones and _intersects(feature["bbox"], bbox):
+                zones[feature["id"]] = feature
+
+    ids = sorted(zones)
+    names = dict(db.query(models.Zone.id, models.Zone.name).filter(models.Zone.id.in_(ids))) if ids else {}
+    as_of, risk = _latest_risk(db, ids)
+    out = []
+    for zone_id in ids:
+        level, intensity, syndrome = risk.get(zone_id, (None, None, None))
+        out.append({"id": zone_id, "name": names.get(zone_id), **zones[zone_id],
+                    "risk_level": level, "intensity": intensity, "syndrome": syndrome})
+    return {"zoom": zoom, "tile_zoom": z, "tiles": len(tiles), "risk_as_of": as_of, "zones": out}